@@ -18,18 +18,23 @@ import configparser
 import sqlite3
 import logging
 import logging.handlers
+import os
 import sys
+import time
 import datetime
-from arcgis.apps import workforce
 from arcgis.gis import GIS
 from arcgis.network import RouteLayer
 import requests
 import inspect
 
+# The helpers shared with the scripts are in the scripts folder of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "scripts"))
+from utils import (DEFAULT_METRICS_HOST, PollMetrics, get_project, instrument_requests, start_metrics_server,  # noqa: E402
+                   write_metrics)
 
-def assign_worker(assignment):
+
+def assign_worker(assignment, workers):
     project = assignment.project
-    workers = assignment.project.workers.search(where="status in (1,2)")
     for worker in workers:
         distance = calculate_route_distance(worker.geometry, assignment.geometry, project)
         worker.feature.attributes["score"] = distance
@@ -63,7 +68,7 @@ def post_to_slack(slack_webhook, assignment):
     Posts a message to slack
     :param slack_webhook: (string) The url of the slack webhook
     :param assignment: (Feature) The feature to use
-    :return:
+    :return: (Response) The response of the webhook
     """
     # create the message to send
     message = f"""
@@ -78,6 +83,7 @@ def post_to_slack(slack_webhook, assignment):
     logging.getLogger().info("Posting: {} to slack".format(inspect.cleandoc(message)))
     response = requests.post(slack_webhook, json={"text": inspect.cleandoc(message)})
     logging.getLogger().info("Status code: {}".format(response.status_code))
+    return response
 
 
 def initialize_logging(log_file):
@@ -153,24 +159,14 @@ def is_assignment_processed(db, assignment):
     return bool(global_ids)
 
 
-if __name__ == "__main__":
-    # parse the config file
-    config = configparser.ConfigParser()
-    config.read("my_config.ini")
-
-    logger = initialize_logging(config["LOG"]["LOGFILE"])
-    initialize_db(config["DB"]["DATABASE"])
-
-    # Authenticate and get data
-    logger.info("Authenticating with ArcGIS Online...")
-    gis = GIS(config["AGOL"]["ORG"],
-              username=config["AGOL"]["USERNAME"],
-              password=config["AGOL"]["PASSWORD"],
-              verify_cert=False)
-
-    logger.info("Getting project info...")
-    project = workforce.Project(gis.content.get(config["WORKFORCE"]["PROJECT"]))
-
+def poll(config, project, metrics):
+    """
+    Assigns the unassigned assignments created in the last hour that were not assigned yet
+    :param config: (ConfigParser) The configuration
+    :param project: (Project) The project
+    :param metrics: (PollMetrics) The metrics of the run
+    """
+    logger = logging.getLogger()
     logger.info("Querying assignments...")
     timestamp_last_minute = (datetime.datetime.utcnow() - datetime.timedelta(minutes=60)).strftime(
         "%Y-%m-%d %H:%M:%S")
@@ -179,15 +175,60 @@ if __name__ == "__main__":
         project._assignment_schema.creation_date,
         timestamp_last_minute
     ))
+    metrics.assignments_seen.set(len(assignments))
+    # The available workers are queried once per run rather than for every assignment
+    workers = project.workers.search(where="status in (1,2)")
     logger.info("Processing assignments...")
     for assignment in assignments:
         if not is_assignment_processed(config["DB"]["DATABASE"], assignment):
             logger.info("Assigning new assignment...")
-            assign_worker(assignment)
+            assign_worker(assignment, workers)
             logger.info("Adding new assignment to sqlite database...")
             # append the global id to the csv file (in-case we need to restart script)
             add_assignment_to_db(config["DB"]["DATABASE"], assignment)
+            metrics.assignments_processed.inc()
+            metrics.observe_detection(assignment.creation_date)
             # post message to slack, if configured
             if config.has_section("SLACK") and config.has_option("SLACK", "WEBHOOK"):
                 logger.info("Posting assignment to slack...")
-                post_to_slack(config["SLACK"]["WEBHOOK"], assignment)
+                with metrics.notify("slack"):
+                    response = post_to_slack(config["SLACK"]["WEBHOOK"], assignment)
+                if not response.ok:
+                    metrics.notification_failures.inc(channel="slack")
+
+
+if __name__ == "__main__":
+    # parse the config file
+    config = configparser.ConfigParser()
+    config.read("my_config.ini")
+
+    logger = initialize_logging(config["LOG"]["LOGFILE"])
+    initialize_db(config["DB"]["DATABASE"])
+    # Optionally serve the metrics of the run to Prometheus, or write them for the textfile collector
+    metrics = PollMetrics()
+    if config.has_section("METRICS"):
+        instrument_requests()
+        if config.has_option("METRICS", "PORT"):
+            start_metrics_server(config.getint("METRICS", "PORT"), config["METRICS"].get("HOST", DEFAULT_METRICS_HOST))
+
+    # Authenticate and get data
+    logger.info("Authenticating with ArcGIS Online...")
+    gis = GIS(config["AGOL"]["ORG"],
+              username=config["AGOL"]["USERNAME"],
+              password=config["AGOL"]["PASSWORD"],
+              verify_cert=False)
+
+    logger.info("Getting project info...")
+    project = get_project(gis.content.get(config["WORKFORCE"]["PROJECT"]))
+
+    try:
+        with metrics.poll_duration.time():
+            poll(config, project, metrics)
+        metrics.last_poll.set(time.time())
+    except Exception:
+        metrics.poll_failures.inc()
+        raise
+    finally:
+        metrics.observe_state_store(config["DB"]["DATABASE"])
+        if config.has_option("METRICS", "FILE"):
+            write_metrics(config["METRICS"]["FILE"])
@@ -23,20 +23,31 @@ Copyright 2020 Esri
 A script to monitor Workforce Assignments for completion.
 
 When an assignment is completed a message is posted to slack
+
+Run it with --once to poll a single time, e.g. from a task scheduler
 """
 
+import argparse
 import configparser
 import sqlite3
 import logging
-import logging.handlers
+import os
 import sys
 import time
 import datetime
-from arcgis.apps import workforce
-from arcgis.gis import GIS
 import requests
 import inspect
-import yagmail
+
+# The helpers shared by the scripts are in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import (DEFAULT_METRICS_HOST, PollMetrics, RateLimitedLogger, add_diagnostic_arguments, get_gis,  # noqa: E402
+                   get_project, initialize_logging, instrument_requests, refresh_gis, run, start_metrics_server,
+                   write_metrics)
+
+# The messages of every poll are logged once a minute, the notifications every time
+POLL_LOG_INTERVAL = 60
+_poll_logger = RateLimitedLogger(interval=POLL_LOG_INTERVAL)
+_metrics = PollMetrics()
 
 
 def post_to_slack(slack_webhook, assignment):
@@ -44,7 +55,7 @@ def post_to_slack(slack_webhook, assignment):
     Posts a message to slack
     :param slack_webhook: (string) The url of the slack webhook
     :param assignment: (Feature) The feature to use
-    :return:
+    :return: (Response) The response of the webhook
     """
     # create the message to send
     message = """
@@ -71,34 +82,7 @@ def post_to_slack(slack_webhook, assignment):
     logging.getLogger().info("Posting: {} to slack".format(inspect.cleandoc(message)))
     response = requests.post(slack_webhook, json={"text": inspect.cleandoc(message)})
     logging.getLogger().info("Status code: {}".format(response.status_code))
-
-
-def initialize_logging(log_file=None):
-    """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
-    """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+    return response
 
 
 def initialize_db(db):
@@ -148,6 +132,7 @@ def is_assignment_processed(db, assignment):
 
 
 def send_email(gmail_username, recipient_emails, assignment):
+    import yagmail
     client = yagmail.SMTP(gmail_username)
     recipient_emails = recipient_emails.replace(" ", "").split(",")
     subject = str(assignment) + " has been completed"
@@ -175,47 +160,113 @@ def send_email(gmail_username, recipient_emails, assignment):
     client.send(to=recipient_emails, subject=subject, contents=body)
 
 
-if __name__ == "__main__":
+def poll(config, project, metrics_file=None):
+    """
+    Polls the project once for the assignments completed in the last minute and notifies about the new ones
+    :param config: (ConfigParser) The configuration
+    :param project: (Project) The project to poll
+    :param metrics_file: (string) The file to write the metrics to after the poll, if any
+    """
+    try:
+        with _metrics.poll_duration.time():
+            _poll(config, project)
+        _metrics.last_poll.set(time.time())
+    except Exception:
+        _metrics.poll_failures.inc()
+        raise
+    finally:
+        _metrics.observe_state_store(config["DB"]["DATABASE"])
+        if metrics_file:
+            write_metrics(metrics_file)
+
+
+def _poll(config, project):
+    logger = logging.getLogger()
+    _poll_logger.info("Querying assignments...")
+    timestamp_last_minute = (datetime.datetime.utcnow() - datetime.timedelta(minutes=1)).strftime(
+        "%Y-%m-%d %H:%M:%S")
+    assignments = project.assignments.search("{} = 3 AND {} >= timestamp '{}'".format(
+        project._assignment_schema.status,
+        project._assignment_schema.completed_date,
+        timestamp_last_minute
+    ))
+    _metrics.assignments_seen.set(len(assignments))
+    _poll_logger.info("Processing assignments...")
+    for assignment in assignments:
+        if not is_assignment_processed(config["DB"]["DATABASE"], assignment):
+            logger.info("Adding new assignment to sqlite database...")
+            # append the global id to the csv file (in-case we need to restart script)
+            add_assignment_to_db(config["DB"]["DATABASE"], assignment)
+            _metrics.assignments_processed.inc()
+            _metrics.observe_detection(assignment.completed_date)
+            if config.has_section("EMAIL") and config.has_option("EMAIL", "GMAIL_USERNAME") and config["EMAIL"]["SEND_EMAIL"]:
+                with _metrics.notify("email"):
+                    send_email(config["EMAIL"]["GMAIL_USERNAME"], config["EMAIL"]["RECIPIENT_EMAILS"], assignment)
+                logger.info("Email sent")
+            # post message to slack, if configured
+            if config.has_section("SLACK") and config.has_option("SLACK", "WEBHOOK"):
+                logger.info("Posting assignment to slack...")
+                with _metrics.notify("slack"):
+                    response = post_to_slack(config["SLACK"]["WEBHOOK"], assignment)
+                if not response.ok:
+                    _metrics.notification_failures.inc(channel="slack")
+
+
+def main(arguments):
     # parse the config file
     config = configparser.ConfigParser()
-    config.read("config.ini")
+    config.read(arguments.config_file)
 
-    logger = initialize_logging(config["LOG"]["LOGFILE"])
+    logger = initialize_logging(config["LOG"]["LOGFILE"], config["LOG"].get("FORMAT", None))
     initialize_db(config["DB"]["DATABASE"])
+    if arguments.metrics_port or arguments.metrics_file:
+        instrument_requests()
+    if arguments.metrics_port:
+        start_metrics_server(arguments.metrics_port, arguments.metrics_host)
+        logger.info("Serving metrics at http://{}:{}/metrics".format(arguments.metrics_host, arguments.metrics_port))
 
     # Authenticate and get data
     logger.info("Authenticating with ArcGIS Online...")
-    gis = GIS(config["AGOL"]["ORG"],
-              username=config["AGOL"]["USERNAME"],
-              password=config["AGOL"]["PASSWORD"],
-              verify_cert=False)
+    credentials = dict(org_url=config["AGOL"]["ORG"],
+                       username=config["AGOL"]["USERNAME"],
+                       password=config["AGOL"]["PASSWORD"],
+                       verify_cert=False)
+    gis = get_gis(**credentials)
 
     logger.info("Getting project info...")
-    project = workforce.Project(gis.content.get(config["WORKFORCE"]["PROJECT"]))
+    project = get_project(gis.content.get(config["WORKFORCE"]["PROJECT"]))
+    if arguments.once:
+        poll(config, project, arguments.metrics_file)
+        return
 
     # Loop indefinitely
     while True:
-        logger.info("Querying assignments...")
-        timestamp_last_minute = (datetime.datetime.utcnow() - datetime.timedelta(minutes=1)).strftime(
-            "%Y-%m-%d %H:%M:%S")
-        assignments = project.assignments.search("{} = 3 AND {} >= timestamp '{}'".format(
-            project._assignment_schema.status,
-            project._assignment_schema.completed_date,
-            timestamp_last_minute
-        ))
-        logger.info("Processing assignments...")
-        for assignment in assignments:
-            if not is_assignment_processed(config["DB"]["DATABASE"], assignment):
-                logger.info("Adding new assignment to sqlite database...")
-                # append the global id to the csv file (in-case we need to restart script)
-                add_assignment_to_db(config["DB"]["DATABASE"], assignment)
-                if config.has_section("EMAIL") and config.has_option("EMAIL", "GMAIL_USERNAME") and config["EMAIL"]["SEND_EMAIL"]:
-                    send_email(config["EMAIL"]["GMAIL_USERNAME"], config["EMAIL"]["RECIPIENT_EMAILS"], assignment)
-                    logger.info("Email sent")
-                # post message to slack, if configured
-                if config.has_section("SLACK") and config.has_option("SLACK", "WEBHOOK"):
-                    logger.info("Posting assignment to slack...")
-                    post_to_slack(config["SLACK"]["WEBHOOK"], assignment)
+        # With the token cache enabled, replace the connection shortly before its token expires
+        refreshed_gis = refresh_gis(gis, **credentials)
+        if refreshed_gis is not gis:
+            gis = refreshed_gis
+            project = get_project(gis.content.get(config["WORKFORCE"]["PROJECT"]))
+        poll(config, project, arguments.metrics_file)
         # sleep for 5 seconds before polling again
-        logger.info("Sleeping for 5 seconds...")
+        _poll_logger.info("Sleeping for 5 seconds...")
         time.sleep(5)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Monitor a Workforce project for completed assignments")
+    parser.add_argument('-config-file', dest='config_file', default="config.ini", help="The configuration file to use")
+    parser.add_argument('--once', dest='once', action='store_true', default=False,
+                        help="Poll for completed assignments once, then exit")
+    parser.add_argument('-metrics-port', dest='metrics_port', type=int, default=None,
+                        help="Serve the metrics of the polls in the Prometheus format on this port, at /metrics")
+    parser.add_argument('-metrics-host', dest='metrics_host', default=DEFAULT_METRICS_HOST,
+                        help="The address to serve the metrics on, only this computer by default")
+    parser.add_argument('-metrics-file', dest='metrics_file', default=None,
+                        help="Write the metrics in the Prometheus format to this file after each poll, e.g. for the "
+                             "textfile collector of the node exporter")
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
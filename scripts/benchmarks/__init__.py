@@ -0,0 +1,434 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Benchmarks the main scripts against generated projects of increasing size, and fails when they regress
+
+   For each size, a version 1 project is generated (see local_server/generator.py) with the fixtures the scripts need
+   (see fixtures.py). Each script then runs as its own process against a local server serving a fresh copy of that
+   project, so that the scripts that edit the project do not change what the next ones find. The wall time, number of
+   requests, bytes sent and received (recorded with -trace-json) and peak resident memory of each script are compared
+   to a baseline, and a metric more than -threshold percent above its baseline is a regression.
+
+       python workforce_scripts.py benchmark
+       python workforce_scripts.py benchmark -sizes 1000 5000 50000 --update-baseline
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# The helpers shared by the scripts are in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import initialize_logging  # noqa: E402
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKFORCE_SCRIPTS = os.path.join(SCRIPTS_DIR, "workforce_scripts.py")
+ASSIGNMENT_MONITOR = os.path.join(SCRIPTS_DIR, "assignment_monitor", "assignment_monitor.py")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+METRICS = ["wall_time", "requests", "request_bytes", "response_bytes", "peak_rss"]
+# A metric only regresses when it grows by more than the threshold and by more than these amounts, so that the
+# noise of short runs is not reported
+MIN_DELTAS = {"wall_time": 0.5, "requests": 0, "request_bytes": 1024, "response_bytes": 1024,
+              "peak_rss": 16 * 1024 * 1024}
+# The seconds to wait for the local server to accept connections
+SERVER_START_TIMEOUT = 30
+
+
+def _workforce_command(context, command, *arguments):
+    return [sys.executable, WORKFORCE_SCRIPTS, command, "-org", context["org_url"], "-u", context["username"], "-p",
+            context["password"], "--skip-ssl-verification", "-project-id", context["project_id"]] + list(arguments)
+
+
+def _create_assignments_from_csv(context):
+    return _workforce_command(context, "create-assignments-from-csv", "-csv-file", context["csv_file"],
+                              "-x-field", "xField", "-y-field", "yField", "-assignment-type-field", "Type",
+                              "-location-field", "Location", "-description-field", "Description",
+                              "-priority-field", "Priority", "-work-order-id-field", "Work Order Id",
+                              "-due-date-field", "Due Date", "-worker-field", "Worker")
+
+
+def _export_assignments_to_csv(context):
+    return _workforce_command(context, "export-assignments-to-csv",
+                              "-csv-file", os.path.join(context["run_directory"], "assignments.csv"))
+
+
+def _copy_assignments_to_fs(context):
+    return _workforce_command(context, "copy-assignments-to-fs", "-target-fl", context["target_url"],
+                              "-config-file", context["config_file"])
+
+
+def _migrate_to_v2(context):
+    return _workforce_command(context, "migrate-to-v2", "-new-title", "Benchmark Migration")
+
+
+def _check_completion_location(context):
+    return _workforce_command(context, "check-completion-location", "-target-fl", context["target_url"],
+                              "-config-file", context["config_file"])
+
+
+def _report_complete_assignments_without_work_orders(context):
+    return _workforce_command(context, "report-complete-assignments-without-work-orders",
+                              "-layer-url", context["work_orders_url"])
+
+
+def _report_incomplete_assignments_with_work_orders(context):
+    return _workforce_command(context, "report-incomplete-assignments-with-work-orders",
+                              "-layer-url", context["work_orders_url"])
+
+
+def _assignment_monitor(context):
+    return [sys.executable, ASSIGNMENT_MONITOR, "-config-file", context["monitor_config_file"], "--once"]
+
+
+# The name of each benchmark and the function building its command line, to which -trace-json is added
+CASES = [
+    ("create_assignments_from_csv", _create_assignments_from_csv),
+    ("export_assignments_to_csv", _export_assignments_to_csv),
+    ("copy_assignments_to_fs", _copy_assignments_to_fs),
+    ("migrate_to_v2", _migrate_to_v2),
+    ("check_completion_location", _check_completion_location),
+    ("report_complete_assignments_without_work_orders", _report_complete_assignments_without_work_orders),
+    ("report_incomplete_assignments_with_work_orders", _report_incomplete_assignments_with_work_orders),
+    ("assignment_monitor", _assignment_monitor),
+]
+
+
+def get_run_environment(cache_directory):
+    """
+    Gets the environment of a benchmarked script, with caches of its own so that its requests do not depend on the
+    projects and tokens cached by earlier runs or by the user
+    :param cache_directory: (string) The empty directory for the caches of the run
+    :return: (Dict) The environment variables
+    """
+    env = dict(os.environ, WORKFORCE_SCRIPTS_CACHE_DIR=cache_directory)
+    for name in ("WORKFORCE_SCRIPTS_PROJECT_CACHE", "WORKFORCE_SCRIPTS_GEOCODE_CACHE", "WORKFORCE_SCRIPTS_TOKEN_CACHE"):
+        env.pop(name, None)
+    return env
+
+
+def run_process(command, log_file, cwd=SCRIPTS_DIR, env=None):
+    """
+    Runs a command and measures it
+    :param command: (List<string>) The command line
+    :param log_file: (string) The file to write the output of the command to
+    :param cwd: (string) The working directory of the command
+    :param env: (Dict) The environment of the command, the environment of this process by default
+    :return: (int, float, int) The exit code, the wall time in seconds and the peak resident memory in bytes (None
+        where the operating system does not report it)
+    """
+    with open(log_file, "ab") as log:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, env=env)
+        if not hasattr(os, "wait4"):
+            return process.wait(), time.perf_counter() - started, None
+        # wait4 reports the resources of this process only, not of the server also started by the benchmarks
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - started
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    # ru_maxrss is in kilobytes, except on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return process.returncode, wall_time, peak_rss
+
+
+def _wait_for_port(host, port, process):
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception("The local server exited with code {}".format(process.returncode))
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise Exception("The local server did not start within {} seconds".format(SERVER_START_TIMEOUT))
+
+
+def _start_server(arguments, database, log):
+    process = subprocess.Popen([sys.executable, WORKFORCE_SCRIPTS, "local-server", "-db", database,
+                                "-host", arguments.host, "-port", str(arguments.port),
+                                "-cert", arguments.cert_file, "-key", arguments.key_file],
+                               cwd=SCRIPTS_DIR, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        _wait_for_port(arguments.host, arguments.port, process)
+    except Exception:
+        process.kill()
+        raise
+    return process
+
+
+def _stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def prepare_size(arguments, size, directory, logger):
+    """
+    Generates the project of a size and adds the fixtures, unless they exist from a previous run in the same directory
+    :param arguments: (Namespace) The parsed arguments
+    :param size: (int) The number of assignments of the project
+    :param directory: (string) The directory of the project
+    :return: (Dict) The context of the benchmarks: the database, project_id, org_url, username and password, and
+        the fixtures (see fixtures.add_fixtures)
+    """
+    from local_server.store import Store
+    from .fixtures import add_fixtures
+    database = os.path.join(directory, "project.sqlite")
+    context_file = os.path.join(directory, "context.json")
+    if os.path.exists(context_file) and os.path.exists(database):
+        logger.info("Reusing the project of size {} in {}".format(size, directory))
+        with open(context_file) as f:
+            return json.load(f)
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(database):
+        os.remove(database)
+    logger.info("Generating a project of size {}".format(size))
+    result = subprocess.run([sys.executable, WORKFORCE_SCRIPTS, "generate-project", "-db", database,
+                             "-u", arguments.username, "-p", arguments.password, "-title", "Benchmark {}".format(size),
+                             "-project-version", "1", "-assignments", str(size),
+                             "-workers", str(max(size // arguments.assignments_per_worker, 1)),
+                             "-start-date", arguments.start_date, "-seed", str(arguments.seed),
+                             "-log-file", os.path.join(directory, "generate.log")],
+                            cwd=SCRIPTS_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    lines = [line for line in result.stdout.splitlines() if line.strip()]
+    if result.returncode != 0 or not lines:
+        raise Exception("Generating the project of size {} failed, see {}".format(
+            size, os.path.join(directory, "generate.log")))
+    context = {"database": database, "project_id": lines[-1].strip(), "size": size,
+               "org_url": "https://{}:{}/portal".format(arguments.host, arguments.port),
+               "username": arguments.username, "password": arguments.password}
+    store = Store(database)
+    try:
+        context.update(add_fixtures(store, context["project_id"], directory, context["org_url"], arguments.username,
+                                    arguments.password, arguments.csv_ratio, arguments.seed))
+    finally:
+        store.close()
+    with open(context_file, "w") as f:
+        json.dump(context, f, indent=2)
+    return context
+
+
+def run_case(arguments, context, name, build_command, logger):
+    """
+    Runs the benchmark of a script -repeat times, each time against a fresh copy of the project
+    :param arguments: (Namespace) The parsed arguments
+    :param context: (Dict) The context returned by prepare_size
+    :param name: (string) The name of the benchmark
+    :param build_command: (Function) Builds the command line of the script from the context
+    :return: (Dict) The metrics of the fastest run, and its exit code
+    """
+    directory = os.path.join(os.path.dirname(context["database"]), name)
+    os.makedirs(directory, exist_ok=True)
+    best = None
+    for i in range(arguments.repeat):
+        run_context = dict(context, run_directory=directory)
+        database = os.path.join(directory, "project.sqlite")
+        shutil.copyfile(context["database"], database)
+        trace_file = os.path.join(directory, "trace.json")
+        if os.path.exists(trace_file):
+            os.remove(trace_file)
+        log_file = os.path.join(directory, "run.log")
+        # Every run starts with empty caches
+        cache_directory = os.path.join(directory, "cache")
+        shutil.rmtree(cache_directory, ignore_errors=True)
+        with open(os.path.join(directory, "server.log"), "ab") as server_log:
+            server = _start_server(arguments, database, server_log)
+            try:
+                command = build_command(run_context) + ["-trace-json", trace_file]
+                exit_code, wall_time, peak_rss = run_process(command, log_file, env=get_run_environment(cache_directory))
+            finally:
+                _stop_server(server)
+        metrics = {"exit_code": exit_code, "wall_time": round(wall_time, 3), "peak_rss": peak_rss}
+        metrics.update(read_trace(trace_file))
+        logger.info("{} (size {}, run {}/{}): {:.2f} s, {} requests, exit code {}".format(
+            name, context["size"], i + 1, arguments.repeat, wall_time, metrics["requests"], exit_code))
+        if best is None or (metrics["exit_code"], metrics["wall_time"]) < (best["exit_code"], best["wall_time"]):
+            best = metrics
+    os.remove(os.path.join(directory, "project.sqlite"))
+    shutil.rmtree(os.path.join(directory, "cache"), ignore_errors=True)
+    return best
+
+
+def read_trace(trace_file):
+    """
+    :param trace_file: (string) The JSON file written by a script run with -trace-json
+    :return: (Dict) The number of requests and the bytes sent and received, None if the script wrote no trace
+    """
+    if not os.path.exists(trace_file):
+        return {"requests": None, "request_bytes": None, "response_bytes": None}
+    with open(trace_file) as f:
+        summary = json.load(f)["summary"]
+    return {"requests": sum(row["calls"] for row in summary),
+            "request_bytes": sum(row["request_bytes"] for row in summary),
+            "response_bytes": sum(row["response_bytes"] for row in summary)}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares results to a baseline
+    :param results: (Dict) The metrics of each benchmark, by size then name
+    :param baseline: (Dict) The baseline metrics, in the same layout
+    :param threshold: (float) The percentage a metric may grow by before it is a regression
+    :return: (List<string>) The regressions
+    """
+    regressions = []
+    for size, cases in results.items():
+        for name, metrics in cases.items():
+            expected = baseline.get(size, {}).get(name, None)
+            if expected is None:
+                continue
+            for metric in METRICS:
+                value, limit = metrics.get(metric, None), expected.get(metric, None)
+                if value is None or limit is None:
+                    continue
+                if value > limit * (1 + threshold / 100) and value - limit > MIN_DELTAS[metric]:
+                    regressions.append("{} (size {}): {} is {} against {} in the baseline (+{:.0f}%)".format(
+                        name, size, metric, value, limit, (value - limit) * 100 / limit if limit else float("inf")))
+    return regressions
+
+
+def format_results(results, baseline):
+    """
+    Formats the results as a table, with the change from the baseline of each metric
+    :return: (string) The table
+    """
+    header = "{:<48} {:>8} {:>18} {:>16} {:>16} {:>16} {:>16}".format(
+        "benchmark", "size", "wall time s", "requests", "sent KB", "received KB", "peak RSS MB")
+    lines = [header, "-" * len(header)]
+    scales = {"wall_time": 1, "requests": 1, "request_bytes": 1024, "response_bytes": 1024,
+              "peak_rss": 1024 * 1024}
+    for size, cases in results.items():
+        for name, metrics in cases.items():
+            expected = baseline.get(size, {}).get(name, {})
+            cells = []
+            for metric in METRICS:
+                value = metrics.get(metric, None)
+                if value is None:
+                    cells.append("-")
+                    continue
+                cell = "{:.1f}".format(value / scales[metric])
+                if expected.get(metric, None):
+                    cell += " ({:+.0f}%)".format((value - expected[metric]) * 100 / expected[metric])
+                cells.append(cell)
+            name = name if metrics["exit_code"] == 0 else "{} (exit code {})".format(name, metrics["exit_code"])
+            lines.append("{:<48} {:>8} {:>18} {:>16} {:>16} {:>16} {:>16}".format(name[:48], size, *cells))
+    return "\n".join(lines)
+
+
+def main(arguments):
+    logger = initialize_logging(arguments.log_file)
+    names = [name for name, _ in CASES]
+    for name in arguments.cases or []:
+        if name not in names:
+            raise ValueError("Unknown benchmark '{}', the benchmarks are {}".format(name, ", ".join(names)))
+    cases = [(name, build_command) for name, build_command in CASES if not arguments.cases or name in arguments.cases]
+
+    baseline = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as f:
+            baseline = json.load(f).get("sizes", {})
+
+    work_dir = arguments.work_dir or tempfile.mkdtemp(prefix="workforce-benchmarks-")
+    os.makedirs(work_dir, exist_ok=True)
+    if not arguments.cert_file:
+        from local_server.server import create_certificate
+        arguments.cert_file = os.path.join(work_dir, "cert.pem")
+        arguments.key_file = os.path.join(work_dir, "key.pem")
+        if not os.path.exists(arguments.cert_file):
+            create_certificate(arguments.cert_file, arguments.key_file, arguments.host)
+
+    results = {}
+    try:
+        for size in arguments.sizes:
+            context = prepare_size(arguments, size, os.path.join(work_dir, str(size)), logger)
+            results[str(size)] = {}
+            for name, build_command in cases:
+                results[str(size)][name] = run_case(arguments, context, name, build_command, logger)
+    finally:
+        if not arguments.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(format_results(results, baseline))
+    output = {"created": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+              "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                              "processor": platform.processor() or platform.machine()},
+              "sizes": results}
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    failed = ["{} (size {})".format(name, size) for size, cases in results.items() for name, metrics in cases.items()
+              if metrics["exit_code"] != 0]
+    if arguments.update_baseline:
+        if failed:
+            raise Exception("Not updating the baseline, these benchmarks failed: {}".format(", ".join(failed)))
+        for size, cases in results.items():
+            baseline.setdefault(size, {}).update(cases)
+        with open(arguments.baseline, "w") as f:
+            json.dump(dict(output, sizes=baseline), f, indent=2)
+        logger.info("Updated the baseline {}".format(arguments.baseline))
+        return
+    regressions = compare(results, baseline, arguments.threshold)
+    for regression in regressions:
+        logger.warning("Regression: {}".format(regression))
+    if failed or regressions:
+        raise Exception("{} benchmarks failed and {} metrics regressed by more than {}%".format(
+            len(failed), len(regressions), arguments.threshold))
+    logger.info("No regressions")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Benchmark the scripts against generated projects and compare to a baseline")
+    parser.add_argument('-sizes', dest='sizes', type=int, nargs="+", default=[1000, 5000],
+                        help="The number of assignments of the generated projects")
+    parser.add_argument('-cases', dest='cases', nargs="+",
+                        help="The benchmarks to run, all of them by default: {}".format(
+                            ", ".join(name for name, _ in CASES)))
+    parser.add_argument('-repeat', dest='repeat', type=int, default=1,
+                        help="The number of runs of each benchmark, the fastest one is kept")
+    parser.add_argument('-baseline', dest='baseline', default=DEFAULT_BASELINE,
+                        help="The JSON file of the baseline to compare to")
+    parser.add_argument('--update-baseline', dest='update_baseline', action='store_true', default=False,
+                        help="Write the results to the baseline instead of comparing them")
+    parser.add_argument('-threshold', dest='threshold', type=float, default=20,
+                        help="The percentage a metric may grow by before it is a regression")
+    parser.add_argument('-output', dest='output', help="Also write the results to this JSON file")
+    parser.add_argument('-work-dir', dest='work_dir',
+                        help="The directory of the generated projects, kept and reused by later runs. A temporary "
+                             "directory by default.")
+    parser.add_argument('-assignments-per-worker', dest='assignments_per_worker', type=int, default=100,
+                        help="The number of assignments per worker of the generated projects")
+    parser.add_argument('-csv-ratio', dest='csv_ratio', type=float, default=0.1,
+                        help="The number of assignments create_assignments_from_csv adds, relative to the size")
+    parser.add_argument('-start-date', dest='start_date', default="2021-01-04",
+                        help="The first day of the generated assignments, fixed so that the projects are the same")
+    parser.add_argument('-seed', dest='seed', type=int, default=1, help="The seed of the generated projects")
+    parser.add_argument('-host', dest='host', default="127.0.0.1", help="The host of the local server")
+    parser.add_argument('-port', dest='port', type=int, default=8463, help="The port of the local server")
+    parser.add_argument('-cert', dest='cert_file', help="The TLS certificate of the local server (PEM)")
+    parser.add_argument('-key', dest='key_file', help="The private key of the certificate (PEM)")
+    parser.add_argument('-u', dest='username', default="admin", help="The owner of the generated projects")
+    parser.add_argument('-p', dest='password', default="benchmark", help="The password of the generated users")
+    parser.add_argument('-log-file', dest='log_file', help="The log file to use")
+    return parser
@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   The inputs the benchmarked scripts need besides a project, added to the database of a generated project:
+   - a layer to copy assignments to, and the field mappings config file of copy_assignments_to_fs.py and
+     check_completion_location.py
+   - a table of work orders for the two report scripts, with the work orders of most completed assignments and of a
+     few incomplete ones
+   - a CSV file of new assignments for create_assignments_from_csv.py
+   - the config.ini of the assignment monitor
+"""
+
+import configparser
+import csv
+import json
+import os
+import random
+
+from local_server.generator import get_project_layers, random_global_id
+from local_server.project import get_service_url
+
+# The service of the layers the scripts write to or read from, besides the project
+FIXTURES_SERVICE = "benchmark_fixtures"
+# The prefix of the copied fields in the target layer, as in sample_data/fieldMappings.json
+COPY_PREFIX = "Original_"
+# The ratio of completed assignments with a work order, and of incomplete assignments with one
+COMPLETED_WORK_ORDER_RATIO = 0.95
+INCOMPLETE_WORK_ORDER_RATIO = 0.05
+# The fields of the new assignments, as in sample_data/assignments.csv
+CSV_FIELDS = ["xField", "yField", "Type", "Location", "Description", "Priority", "Work Order Id", "Due Date", "Worker"]
+_OBJECT_ID_FIELD = {"name": "OBJECTID", "type": "esriFieldTypeOID", "alias": "OBJECTID", "sqlType": "sqlTypeOther",
+                    "nullable": False, "editable": False, "domain": None, "defaultValue": None}
+_GLOBAL_ID_FIELD = {"name": "GlobalID", "type": "esriFieldTypeGlobalID", "alias": "GlobalID", "sqlType": "sqlTypeOther",
+                    "length": 38, "nullable": False, "editable": False, "domain": None, "defaultValue": None}
+# Object ids and global ids are copied to plain fields
+_COPIED_TYPES = {"esriFieldTypeOID": "esriFieldTypeInteger", "esriFieldTypeGlobalID": "esriFieldTypeGUID"}
+
+
+def _select(store, layer, field_names):
+    names = ", ".join('"{}"'.format(layer.get_field(name)["name"]) for name in field_names)
+    with store.lock:
+        return store.connection.execute('SELECT {} FROM "{}" ORDER BY 1'.format(names, layer.table_name)).fetchall()
+
+
+def _get_layer_definition(layer_id, name, fields, geometry_type=None):
+    definition = {"id": layer_id, "name": name, "type": "Feature Layer" if geometry_type else "Table",
+                  "fields": [dict(_OBJECT_ID_FIELD), dict(_GLOBAL_ID_FIELD)] + fields, "objectIdField": "OBJECTID",
+                  "globalIdField": "GlobalID", "hasAttachments": True, "capabilities": "Query,Editing,Create,Update,Delete",
+                  "maxRecordCount": 2000, "supportsPagination": True, "supportedQueryFormats": "JSON",
+                  "advancedQueryCapabilities": {"supportsPagination": True, "supportsOrderBy": True,
+                                                "supportsQueryWithResultType": True, "supportsStatistics": True}}
+    if geometry_type:
+        definition.update({"geometryType": geometry_type, "extent": {
+            "xmin": -20037508.34, "ymin": -20037508.34, "xmax": 20037508.34, "ymax": 20037508.34,
+            "spatialReference": {"wkid": 102100, "latestWkid": 3857}}})
+    return definition
+
+
+def _get_copy_fields(assignments):
+    """
+    Gets the fields of the copy of every assignment field
+    :param assignments: (Layer) The assignments layer
+    :return: (Dict, List<Dict>) The field mappings and the fields of the target layer
+    """
+    mappings = {}
+    fields = []
+    for field in assignments.definition["fields"]:
+        if field["type"] == "esriFieldTypeGeometry":
+            continue
+        mappings[field["name"]] = COPY_PREFIX + field["name"]
+        fields.append(dict(field, name=COPY_PREFIX + field["name"], alias=COPY_PREFIX + field["name"],
+                           type=_COPIED_TYPES.get(field["type"], field["type"]), editable=True, nullable=True,
+                           domain=None))
+    return mappings, fields
+
+
+def add_fixtures(store, project_id, directory, org_url, username, password, csv_ratio=0.1, seed=1):
+    """
+    Adds the fixtures of the benchmarks for a generated version 1 project
+    :param store: (Store) The store of the generated project
+    :param project_id: (string) The id of the project
+    :param directory: (string) The directory to write the files to
+    :param org_url: (string) The url the local server will be served at
+    :param username: (string) The owner of the project
+    :param password: (string) The password of the owner
+    :param csv_ratio: (float) The number of new assignments in the CSV file, relative to the existing ones
+    :param seed: (int) The seed of the random work orders and new assignments
+    :return: (Dict) The urls and files of the fixtures: target_url, config_file, work_orders_url, csv_file and
+        monitor_config_file
+    """
+    generator = random.Random(seed)
+    layers = get_project_layers(store, store.get_item(project_id))
+    assignments = layers["assignments"]
+
+    mappings, copy_fields = _get_copy_fields(assignments)
+    work_order_field = {"name": "work_order_id", "type": "esriFieldTypeString", "alias": "Work Order ID", "length": 255,
+                        "sqlType": "sqlTypeOther", "nullable": True, "editable": True, "domain": None,
+                        "defaultValue": None}
+    store.add_service(FIXTURES_SERVICE,
+                      [_get_layer_definition(0, "Copied Assignments", copy_fields, "esriGeometryPoint")],
+                      [_get_layer_definition(1, "Work Orders", [work_order_field])])
+    config_file = os.path.join(directory, "fieldMappings.json")
+    with open(config_file, "w") as f:
+        json.dump(mappings, f, indent=4)
+
+    work_orders = store.get_layer(FIXTURES_SERVICE, 1)
+    rows = []
+    for work_order_id, status in _select(store, assignments, ["workOrderId", "status"]):
+        ratio = COMPLETED_WORK_ORDER_RATIO if status == 3 else INCOMPLETE_WORK_ORDER_RATIO
+        if work_order_id and generator.random() < ratio:
+            rows.append((random_global_id(generator), work_order_id))
+    store.insert_rows(work_orders.table_name, ["GlobalID", "work_order_id"], rows)
+    store.add_index(work_orders, ["work_order_id"])
+
+    count = max(int(store.get_max_object_id(assignments) * csv_ratio), 1)
+    csv_file = _write_csv(store, layers, os.path.join(directory, "assignments.csv"), count, generator)
+    monitor_config_file = _write_monitor_config(os.path.join(directory, "config.ini"), project_id, org_url, username,
+                                                password, directory)
+    base_url = org_url[:-len("/portal")] if org_url.endswith("/portal") else org_url
+    return {"target_url": "{}{}/0".format(base_url, get_service_url(FIXTURES_SERVICE)),
+            "work_orders_url": "{}{}/1".format(base_url, get_service_url(FIXTURES_SERVICE)),
+            "config_file": config_file, "csv_file": csv_file, "monitor_config_file": monitor_config_file}
+
+
+def _write_csv(store, layers, csv_file, count, generator):
+    """
+    Writes new assignments of the existing types, half of them assigned to the existing workers
+    :return: (string) The CSV file
+    """
+    domain = layers["assignments"].get_field("assignmentType")["domain"]
+    type_names = [value["name"] for value in domain["codedValues"]]
+    workers = [row[0] for row in _select(store, layers["workers"], ["userId"])]
+    with open(csv_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, CSV_FIELDS)
+        writer.writeheader()
+        for i in range(count):
+            x = -117.19 + generator.uniform(-0.5, 0.5)
+            y = 34.06 + generator.uniform(-0.5, 0.5)
+            writer.writerow({"xField": round(x, 6), "yField": round(y, 6), "Type": generator.choice(type_names),
+                             "Location": "{:.5f}, {:.5f}".format(y, x), "Description": "Benchmark assignment {}".format(i),
+                             "Priority": generator.choice(["none", "low", "medium", "high", "critical"]),
+                             "Work Order Id": "BM-{:07d}".format(i),
+                             "Due Date": "{}/{}/2021 23:59:59".format(generator.randint(1, 12), generator.randint(1, 28)),
+                             "Worker": generator.choice(workers) if workers and generator.random() < 0.5 else ""})
+    return csv_file
+
+
+def _write_monitor_config(config_file, project_id, org_url, username, password, directory):
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config["WORKFORCE"] = {"PROJECT": project_id}
+    config["AGOL"] = {"ORG": org_url, "USERNAME": username, "PASSWORD": password}
+    config["LOG"] = {"LOGFILE": os.path.join(directory, "assignment_monitor.log")}
+    config["DB"] = {"DATABASE": os.path.join(directory, "assignment_monitor.sqlite")}
+    with open(config_file, "w") as f:
+        config.write(f)
+    return config_file
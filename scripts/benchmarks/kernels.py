@@ -0,0 +1,369 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Times the per-row transformations of the scripts on synthetic rows, without a server or a network
+
+   Each kernel is the function a script calls once per assignment (or per page of assignments): building the version 2
+   attributes in migrate_to_v2.py and migrate_assignments.py, building the CSV row in export_assignments_to_csv.py,
+   mapping the fields in copy_assignments_to_fs.py, checking the completion location in check_completion_location.py and
+   parsing the due dates of a chunk of rows in create_assignments_from_csv.py. A pool of synthetic rows is built once and
+   cycled through until the requested number of rows is reached, so the memory used does not grow with the number of
+   rows.
+
+       python workforce_scripts.py benchmark-kernels
+       python workforce_scripts.py benchmark-kernels -rows 1000000 -kernels export-row export-columns -repeat 3
+"""
+
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+# The helpers shared by the scripts and the scripts themselves are in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import initialize_logging  # noqa: E402
+
+# The number of distinct synthetic rows, cycled through to reach the requested number of rows
+DEFAULT_POOL_SIZE = 10000
+# The number of rows in each page of the kernels that work on pages, like the pages of a query
+PAGE_SIZE = 2000
+# The assignments completed by each worker in check-invalid, and the tracks around each of them
+ASSIGNMENTS_PER_WORKER = 100
+TRACKS_PER_ASSIGNMENT = 10
+NUMBER_OF_WORKERS = 100
+NUMBER_OF_DISPATCHERS = 10
+NUMBER_OF_ASSIGNMENT_TYPES = 10
+START_DATE = datetime.datetime(2021, 1, 4, tzinfo=datetime.timezone.utc)
+
+# The attributes of the assignment schemas, and the fields of the layers they name
+SCHEMA_FIELDS = {"object_id": "OBJECTID", "global_id": "GlobalID", "status": "status", "notes": "notes",
+                 "priority": "priority", "assignment_type": "assignmentType", "work_order_id": "workOrderId",
+                 "due_date": "dueDate", "description": "description", "worker_id": "workerId", "location": "location",
+                 "declined_comment": "declinedComment", "assigned_date": "assignedDate",
+                 "in_progress_date": "inProgressDate", "completed_date": "completedDate",
+                 "declined_date": "declinedDate", "paused_date": "pausedDate", "dispatcher_id": "dispatcherId",
+                 "creation_date": "CreationDate", "creator": "Creator", "edit_date": "EditDate", "editor": "Editor",
+                 "assignment_read": "assignmentRead"}
+DATE_ATTRIBUTES = ["assigned_date", "due_date", "creation_date", "declined_date", "paused_date", "completed_date",
+                   "edit_date", "in_progress_date"]
+CUSTOM_FIELDS = [{"name": "inspectionCode"}, {"name": "zone"}]
+
+
+def _global_id(rng):
+    return "{{{:08X}-{:04X}-{:04X}-{:04X}-{:012X}}}".format(
+        rng.getrandbits(32), rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(48))
+
+
+def _date(rng):
+    return START_DATE + datetime.timedelta(seconds=rng.randrange(0, 365 * 24 * 3600))
+
+
+def _timestamp(date):
+    return int(date.timestamp() * 1000) if date else None
+
+
+def _get_reference_data(rng):
+    assignment_types = [SimpleNamespace(code=i + 1, name="Type {}".format(i + 1), global_id=_global_id(rng))
+                        for i in range(NUMBER_OF_ASSIGNMENT_TYPES)]
+    workers = [SimpleNamespace(object_id=i + 1, user_id="worker{}".format(i + 1), global_id=_global_id(rng))
+               for i in range(NUMBER_OF_WORKERS)]
+    dispatchers = [SimpleNamespace(object_id=i + 1, user_id="dispatcher{}".format(i + 1), global_id=_global_id(rng))
+                   for i in range(NUMBER_OF_DISPATCHERS)]
+    return assignment_types, workers, dispatchers
+
+
+def _get_attributes(rng, object_id, assignment_types, workers, dispatchers):
+    """
+    :return: (Dict) The attributes of a synthetic version 1 assignment, by field name
+    """
+    status = rng.randrange(0, 7)
+    attributes = {SCHEMA_FIELDS[name]: None for name in SCHEMA_FIELDS}
+    attributes.update({
+        "OBJECTID": object_id,
+        "GlobalID": _global_id(rng),
+        "status": status,
+        "notes": "Notes of assignment {}".format(object_id) if rng.random() < 0.3 else None,
+        "priority": rng.choice([None, 0, 1, 2, 3, 4]),
+        "assignmentType": rng.choice(assignment_types).code,
+        "workOrderId": "WO-{:07d}".format(object_id),
+        "dueDate": _date(rng),
+        "description": "Inspect the hydrant at site {}".format(object_id),
+        "workerId": rng.choice(workers).object_id if status else None,
+        "location": None if rng.random() < 0.1 else "{} Main Street".format(object_id),
+        "dispatcherId": rng.choice(dispatchers).object_id,
+        "assignedDate": _date(rng) if status else None,
+        "inProgressDate": _date(rng) if status in (2, 3) else None,
+        "completedDate": _date(rng) if status == 3 else None,
+        "CreationDate": _date(rng),
+        "Creator": "dispatcher1",
+        "EditDate": _date(rng),
+        "Editor": "worker1",
+        "assignmentRead": rng.choice([None, 1]),
+        "inspectionCode": rng.randrange(0, 1000),
+        "zone": rng.choice(["north", "south", "east", "west"])
+    })
+    return attributes
+
+
+def _get_geometry(rng):
+    return {"x": rng.uniform(-13050000, -13030000), "y": rng.uniform(4020000, 4040000)}
+
+
+def _get_rows(rng, pool_size):
+    assignment_types, workers, dispatchers = _get_reference_data(rng)
+    rows = [(_get_attributes(rng, i + 1, assignment_types, workers, dispatchers), _get_geometry(rng))
+            for i in range(pool_size)]
+    return rows, assignment_types, workers, dispatchers
+
+
+def _prepare_migrate_to_v2(rng, pool_size):
+    from migrate_to_v2 import get_v2_attributes
+    from utils import get_assignment_type_global_ids
+    rows, assignment_types, workers, dispatchers = _get_rows(rng, pool_size)
+    schema = SimpleNamespace(**SCHEMA_FIELDS)
+    new_assignment_types = [SimpleNamespace(name=at.name, global_id=_global_id(rng)) for at in assignment_types]
+    # The script maps the references once before migrating, so the kernel only looks them up
+    assignment_type_global_ids = get_assignment_type_global_ids(assignment_types, new_assignment_types)
+    worker_global_ids = {worker.object_id: worker.global_id for worker in workers}
+    dispatcher_global_ids = {dispatcher.object_id: dispatcher.global_id for dispatcher in dispatchers}
+
+    def kernel(row):
+        attributes, geometry = row
+        return get_v2_attributes(attributes, geometry, schema, schema, assignment_type_global_ids, worker_global_ids,
+                                 dispatcher_global_ids, CUSTOM_FIELDS)
+    return rows, kernel
+
+
+def _prepare_migrate_assignments(rng, pool_size):
+    from migrate_assignments import get_user_global_ids, get_v2_attributes
+    from utils import get_assignment_type_global_ids
+    rows, assignment_types, workers, dispatchers = _get_rows(rng, pool_size)
+    schema = SimpleNamespace(**SCHEMA_FIELDS)
+    new_assignment_types = [SimpleNamespace(name=at.name, global_id=_global_id(rng)) for at in assignment_types]
+    new_workers = {w.user_id: SimpleNamespace(user_id=w.user_id, global_id=_global_id(rng)) for w in workers}
+    new_dispatchers = {d.user_id: SimpleNamespace(user_id=d.user_id, global_id=_global_id(rng)) for d in dispatchers}
+    # The script maps the references once before migrating, so the kernel only looks them up
+    assignment_type_global_ids = get_assignment_type_global_ids(assignment_types, new_assignment_types)
+    worker_global_ids = get_user_global_ids(workers, new_workers.get)
+    dispatcher_global_ids = get_user_global_ids(dispatchers, new_dispatchers.get)
+    default_dispatcher_global_id = new_dispatchers[dispatchers[0].user_id].global_id
+
+    def kernel(row):
+        attributes, geometry = row
+        return get_v2_attributes(attributes, geometry, schema, schema, assignment_type_global_ids, worker_global_ids,
+                                 dispatcher_global_ids, default_dispatcher_global_id, CUSTOM_FIELDS)
+    return rows, kernel
+
+
+def _prepare_export_row(rng, pool_size):
+    from export_assignments_to_csv import get_row
+    rows, assignment_types, _, _ = _get_rows(rng, pool_size)
+    types_by_code = {at.code: at for at in assignment_types}
+    # The properties of the Assignment objects the script gets, already converted from the attributes
+    assignments = []
+    for attributes, geometry in rows:
+        assignment = SimpleNamespace(geometry=geometry, **{name: attributes[field] for name, field in SCHEMA_FIELDS.items()})
+        assignment.assignment_type = types_by_code[attributes["assignmentType"]]
+        assignments.append(assignment)
+    return assignments, lambda assignment: get_row(assignment, "America/Los_Angeles", "%m/%d/%Y %H:%M:%S")
+
+
+def _prepare_export_columns(rng, pool_size):
+    from export_assignments_to_csv import get_rows_from_columns
+    rows, assignment_types, _, _ = _get_rows(rng, pool_size)
+    project = SimpleNamespace(_assignment_schema=SimpleNamespace(**SCHEMA_FIELDS))
+    assignment_type_names = {at.code: at.name for at in assignment_types}
+    dates = {SCHEMA_FIELDS[name] for name in DATE_ATTRIBUTES}
+    pages = []
+    for i in range(0, len(rows), PAGE_SIZE):
+        page_rows = rows[i:i + PAGE_SIZE]
+        # The pages of iter_column_pages hold the dates as milliseconds since the epoch
+        columns = {field: [_timestamp(a[field]) if field in dates else a[field] for a, _ in page_rows]
+                   for field in SCHEMA_FIELDS.values()}
+        pages.append({"object_id_field": "OBJECTID", "columns": columns,
+                      "x": [g["x"] for _, g in page_rows], "y": [g["y"] for _, g in page_rows]})
+
+    def kernel(page):
+        for _ in get_rows_from_columns(project, page, assignment_type_names, "America/Los_Angeles", "%m/%d/%Y %H:%M:%S"):
+            pass
+        return len(page["x"])
+    return pages, kernel
+
+
+def _prepare_copy_fields(rng, pool_size):
+    from copy_assignments_to_fs import map_attributes
+    rows, _, _, _ = _get_rows(rng, pool_size)
+    field_mappings = {field: "target_{}".format(field) for field in list(SCHEMA_FIELDS.values())[:12]}
+    return [attributes for attributes, _ in rows], lambda attributes: map_attributes(attributes, field_mappings)
+
+
+def _prepare_import_due_dates(rng, pool_size):
+    from create_assignments_from_csv import get_due_dates
+    # Mostly days without a time, as in the sample data, some with a time and some rows without a due date
+    values = []
+    for _ in range(pool_size):
+        date = _date(rng)
+        kind = rng.random()
+        if kind < 0.8:
+            values.append(date.strftime("%m/%d/%Y 00:00:00"))
+        elif kind < 0.95:
+            values.append(date.strftime("%m/%d/%Y %H:%M:%S"))
+        else:
+            values.append("")
+    pages = [values[i:i + PAGE_SIZE] for i in range(0, len(values), PAGE_SIZE)]
+
+    def kernel(page):
+        # Each chunk starts without the dates of the earlier chunks, the slowest case
+        get_due_dates(page, "%m/%d/%Y %H:%M:%S", "America/Los_Angeles")
+        return len(page)
+    return pages, kernel
+
+
+def _prepare_check_distance(rng, pool_size):
+    from check_completion_location import get_simple_distance
+    pairs = [((rng.uniform(0, 1000), rng.uniform(0, 1000)), (rng.uniform(0, 1000), rng.uniform(0, 1000)))
+             for _ in range(pool_size)]
+    return pairs, lambda pair: get_simple_distance(*pair)
+
+
+def _prepare_check_invalid(rng, pool_size):
+    from check_completion_location import get_invalid_global_ids
+    batches = []
+    for _ in range(max(pool_size // ASSIGNMENTS_PER_WORKER, 1)):
+        assignments = []
+        tracks = []
+        for _ in range(ASSIGNMENTS_PER_WORKER):
+            completed_date = _date(rng)
+            geometry = _get_geometry(rng)
+            assignments.append(SimpleNamespace(global_id=_global_id(rng), editor="worker1", completed_date=completed_date,
+                                               geometry=geometry))
+            # Tracks around the completion, some of them close enough to the assignment
+            for _ in range(TRACKS_PER_ASSIGNMENT):
+                date = completed_date.replace(tzinfo=None) + datetime.timedelta(seconds=rng.uniform(-900, 900))
+                tracks.append((date, geometry["x"] + rng.uniform(-300, 300), geometry["y"] + rng.uniform(-300, 300),
+                               rng.uniform(0, 50)))
+        tracks.sort(key=lambda track: track[0])
+        batches.append((assignments, tracks))
+
+    def kernel(batch):
+        assignments, tracks = batch
+        get_invalid_global_ids(assignments, tracks, 5, 100)
+        return len(assignments)
+    return batches, kernel
+
+
+# The name of each kernel, how it is prepared, whether it takes a batch of rows and what it times
+KERNELS = [
+    ("migrate-to-v2", _prepare_migrate_to_v2, False, "migrate_to_v2.get_v2_attributes"),
+    ("migrate-assignments", _prepare_migrate_assignments, False, "migrate_assignments.get_v2_attributes"),
+    ("export-row", _prepare_export_row, False, "export_assignments_to_csv.get_row"),
+    ("export-columns", _prepare_export_columns, True, "export_assignments_to_csv.get_rows_from_columns (--use-pbf)"),
+    ("copy-fields", _prepare_copy_fields, False, "copy_assignments_to_fs.map_attributes"),
+    ("check-distance", _prepare_check_distance, False, "check_completion_location.get_simple_distance"),
+    ("check-invalid", _prepare_check_invalid, True, "check_completion_location.get_invalid_global_ids"),
+    ("import-due-dates", _prepare_import_due_dates, True, "create_assignments_from_csv.get_due_dates"),
+]
+
+
+def time_kernel(items, kernel, batched, rows):
+    """
+    Runs a kernel over the items, cycling through them until it processed the number of rows
+    :param items: (List) The rows, or the batches of rows, to run the kernel on
+    :param kernel: (Function) The kernel, which returns the number of rows of a batch when it takes batches
+    :param batched: (bool) Whether the kernel takes batches of rows
+    :param rows: (int) The number of rows to process
+    :return: (Tuple<float, int>) The seconds it took and the number of rows processed
+    """
+    gc.collect()
+    processed = 0
+    started = time.perf_counter()
+    if batched:
+        for batch in itertools.cycle(items):
+            processed += kernel(batch)
+            if processed >= rows:
+                break
+    else:
+        for row in itertools.islice(itertools.cycle(items), rows):
+            kernel(row)
+        processed = rows
+    return time.perf_counter() - started, processed
+
+
+def format_results(results):
+    """
+    Formats the results as a table
+    :param results: (List<Dict>) The result of each kernel and number of rows
+    :return: (string) The table
+    """
+    header = "{:<24} {:>10} {:>12} {:>12} {:>14}".format("kernel", "rows", "seconds", "us per row", "rows per s")
+    lines = [header, "-" * len(header)]
+    for result in results:
+        lines.append("{:<24} {:>10} {:>12.3f} {:>12.2f} {:>14.0f}".format(
+            result["kernel"], result["rows"], result["seconds"], result["seconds"] * 1e6 / result["rows"],
+            result["rows"] / result["seconds"] if result["seconds"] else float("inf")))
+    return "\n".join(lines)
+
+
+def main(arguments):
+    logger = initialize_logging(arguments.log_file)
+    names = [name for name, _, _, _ in KERNELS]
+    for name in arguments.kernels or []:
+        if name not in names:
+            raise ValueError("Unknown kernel '{}', the kernels are {}".format(name, ", ".join(names)))
+    results = []
+    for name, prepare, batched, description in KERNELS:
+        if arguments.kernels and name not in arguments.kernels:
+            continue
+        logger.info("Preparing {} ({})...".format(name, description))
+        items, kernel = prepare(random.Random(arguments.seed), arguments.pool_size)
+        for rows in arguments.rows:
+            timings = [time_kernel(items, kernel, batched, rows) for _ in range(arguments.repeat)]
+            seconds, processed = min(timings)
+            results.append({"kernel": name, "rows": processed, "seconds": seconds})
+            logger.info("{}: {} rows in {:.3f} s".format(name, processed, seconds))
+    print(format_results(results))
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump({"created": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                       "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                                       "processor": platform.processor() or platform.machine()},
+                       "results": results}, f, indent=2)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Time the per-row transformations of the scripts on synthetic rows")
+    parser.add_argument('-rows', dest='rows', type=int, nargs="+", default=[100000, 1000000],
+                        help="The number of rows to run each kernel over")
+    parser.add_argument('-kernels', dest='kernels', nargs="+",
+                        help="The kernels to time, all of them by default: {}".format(
+                            ", ".join(name for name, _, _, _ in KERNELS)))
+    parser.add_argument('-repeat', dest='repeat', type=int, default=1,
+                        help="The number of runs of each kernel, the fastest one is kept")
+    parser.add_argument('-pool-size', dest='pool_size', type=int, default=DEFAULT_POOL_SIZE,
+                        help="The number of distinct synthetic rows, cycled through to reach the number of rows")
+    parser.add_argument('-seed', dest='seed', type=int, default=1, help="The seed of the synthetic rows")
+    parser.add_argument('-output', dest='output', help="Also write the results to this JSON file")
+    parser.add_argument('-log-file', dest='log_file', help="The log file to use")
+    return parser
+
+
+if __name__ == "__main__":
+    from utils import run
+    sys.exit(run(main, get_parser().parse_args()))
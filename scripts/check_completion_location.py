@@ -24,44 +24,21 @@
     were not completed properly
 """
 import argparse
+import bisect
+import collections
 import datetime
 import json
 import logging
-import logging.handlers
 import math
-import traceback
 import sys
-import arcgis
-from arcgis.apps import workforce
-from arcgis.gis import GIS
+from utils import (DEFAULT_MAX_WORKERS, add_diagnostic_arguments, apply_edits, connect, get_assignment_projection,
+                   get_project, initialize_logging, iter_column_pages, iter_features, log_edit_results, query_in, run,
+                   set_phase)
 
-
-def initialize_logging(log_file=None):
-    """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
-    """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+# The number of completion time windows to combine into a single tracks query
+TRACK_WINDOWS_PER_QUERY = 50
+# The assignment columns read to validate the completion location
+ASSIGNMENT_COLUMNS = ["editor", "completed_date", "global_id", "geometry"]
 
 
 def get_simple_distance(coords1, coords2):
@@ -74,29 +51,154 @@ def get_simple_distance(coords1, coords2):
     return math.sqrt((coords1[0] - coords2[0]) ** 2 + (coords1[1] - coords2[1]) ** 2)
 
 
-def get_completed_assignments(project, workers):
+def get_completed_assignments(project, workers, max_workers=DEFAULT_MAX_WORKERS, columns=None):
     """
     Get's the completed assignments
     :param project: (Project) The project to use
     :param workers: (List<String>) The list of worker usernames to get completed assignments for
+    :param max_workers: (int) The number of concurrent requests to use when querying
+    :param columns: (List<string>) The assignment columns to query, defaults to all of them
     :return: List<Assignment> The list of completed assignments
     """
-    if not workers:
-        workers = project.workers.search()
-
-    worker_query = "{} in ({})".format(project._worker_schema.user_id,
-                                       ",".join(["'{}'".format(w) for w in workers]))
-    worker_ids = [w.object_id for w in
-                  project.workers.search(where=worker_query)]
+    from arcgis.apps import workforce
+    worker_schema = project._worker_schema
+    # Assignments reference their worker by GlobalID in version 2 projects and by OBJECTID in version 1 projects
+    id_field = worker_schema.global_id if getattr(project, "_is_v2_project", False) else worker_schema.object_id
+    if workers:
+        worker_features = query_in(project.workers_layer, worker_schema.user_id, workers, out_fields=id_field,
+                                   return_geometry=False)
+    else:
+        worker_features = iter_features(project.workers_layer, out_fields=id_field, return_geometry=False)
+    worker_ids = [w.attributes[id_field] for w in worker_features]
     if not worker_ids:
         logging.getLogger().info("No assignments completed by specified workers")
         return []
     logging.getLogger().info("Querying source features...")
-    assignment_query = "{} in ({}) AND {} is not NULL".format(project._assignment_schema.worker_id,
-                                                              ",".join(["'{}'".format(w) for w in worker_ids]),
-                                                              project._assignment_schema.completed_date)
-    completed_assignments = project.assignments.search(assignment_query)
-    return completed_assignments
+    projection = get_assignment_projection(project, columns) if columns is not None else {}
+    features = query_in(project.assignments_layer, project._assignment_schema.worker_id, worker_ids,
+                        where="{} is not NULL".format(project._assignment_schema.completed_date),
+                        max_workers=max_workers, **projection)
+    return [workforce.Assignment(project, feature) for feature in features]
+
+
+def get_completion_date(assignment):
+    """
+    Gets when an assignment was completed, in UTC without a time zone like the dates of the tracks
+    :param assignment: (Assignment) The completed assignment
+    :return: (datetime) The completion date
+    """
+    completion_date = assignment.completed_date
+    if completion_date.tzinfo is not None:
+        completion_date = completion_date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return completion_date
+
+
+def get_track_windows(assignments, time_tolerance):
+    """
+    Gets the time windows around the completion of each assignment, merging the ones that overlap
+    :param assignments: (List<Assignment>) The assignments completed by a single worker
+    :param time_tolerance: (int) The time tolerance (in minutes) to use when evaluating assignments
+    :return: List<Tuple<datetime, datetime>> The sorted, non-overlapping windows
+    """
+    windows = []
+    tolerance = datetime.timedelta(minutes=time_tolerance)
+    for completion_date in sorted(get_completion_date(assignment) for assignment in assignments):
+        start_date = (completion_date - tolerance).replace(microsecond=0)
+        end_date = (completion_date + tolerance).replace(microsecond=0)
+        if windows and start_date <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end_date))
+        else:
+            windows.append((start_date, end_date))
+    return windows
+
+
+def get_tracks(project, editor, windows, min_accuracy, accuracy_field, max_workers=DEFAULT_MAX_WORKERS, use_pbf=False):
+    """
+    Gets the locations tracked for a worker during the given time windows
+    :param project: (Project) The workforce project containing the tracks
+    :param editor: (string) The username of the worker
+    :param windows: List<Tuple<datetime, datetime>> The time windows to get the tracks for
+    :param min_accuracy: (int) The minimum accuracy to consider
+    :param accuracy_field: (string) The name of the accuracy field
+    :param max_workers: (int) The number of concurrent requests to use when querying
+    :param use_pbf: (bool) Request the tracks as protocol buffers
+    :return: List<Tuple<datetime, float, float, float>> The time, x, y and accuracy of each track, sorted by time
+    """
+    tracks = []
+    creation_date_field = project._track_schema.creation_date
+    # Keep the where clauses at a reasonable length when a worker completed many assignments
+    for i in range(0, len(windows), TRACK_WINDOWS_PER_QUERY):
+        time_query = " OR ".join("({} >= '{}' AND {} <= '{}')".format(creation_date_field, start_date.strftime('%Y-%m-%d %H:%M:%S'),
+                                                                      creation_date_field, end_date.strftime('%Y-%m-%d %H:%M:%S'))
+                                 for start_date, end_date in windows[i:i + TRACK_WINDOWS_PER_QUERY])
+        loc_query_string = "{} = '{}' AND {} <= {} AND ({})".format(project._track_schema.editor, editor,
+                                                                    accuracy_field, min_accuracy, time_query)
+        if use_pbf:
+            for page in iter_column_pages(project.tracks_layer, where=loc_query_string,
+                                          out_fields=[creation_date_field, accuracy_field], max_workers=max_workers):
+                tracks.extend((datetime.datetime.utcfromtimestamp(creation_date / 1000), x, y, float(accuracy))
+                              for creation_date, x, y, accuracy in zip(page["columns"][creation_date_field], page["x"], page["y"],
+                                                                       page["columns"][accuracy_field]))
+            continue
+        for location in iter_features(project.tracks_layer, where=loc_query_string,
+                                      out_fields=[creation_date_field, accuracy_field], max_workers=max_workers):
+            tracks.append((datetime.datetime.utcfromtimestamp(location.attributes[creation_date_field] / 1000),
+                           location.geometry["x"],
+                           location.geometry["y"],
+                           float(location.attributes[accuracy_field])))
+    tracks.sort(key=lambda track: track[0])
+    return tracks
+
+
+def is_assignment_valid(assignment, tracks, track_dates, time_tolerance, dist_tolerance):
+    """
+    Checks if the worker was close enough to the assignment around the time it was completed
+    :param assignment: (Assignment) The completed assignment
+    :param tracks: List<Tuple<datetime, float, float, float>> The tracks of the worker, sorted by time
+    :param track_dates: List<datetime> The time of each track
+    :param time_tolerance: (int) The time tolerance to use when evaluating assignments
+    :param dist_tolerance: (int) The distance tolerance to use when evaluating assignments
+    :return: (bool) True if the assignment is valid
+    """
+    # The coordinates of the assignment
+    start_coords = (assignment.geometry["x"], assignment.geometry["y"])
+    # When the assignment was completed
+    completion_date = get_completion_date(assignment)
+    # Add/Subtract some minutes to give a little leeway
+    start_date = (completion_date - datetime.timedelta(minutes=time_tolerance)).replace(microsecond=0)
+    end_date = (completion_date + datetime.timedelta(minutes=time_tolerance)).replace(microsecond=0)
+    for _, x, y, accuracy in tracks[bisect.bisect_left(track_dates, start_date):bisect.bisect_right(track_dates, end_date)]:
+        # Make a list of coordinate pairs to get the distance of
+        coords = [(x, y)]
+        # If we include the accuracy, we need to make four variations (+- the accuracy)
+        coords.append((x + accuracy, y + accuracy))
+        coords.append((x + accuracy, y - accuracy))
+        coords.append((x - accuracy, y + accuracy))
+        coords.append((x - accuracy, y - accuracy))
+        distances = [get_simple_distance(start_coords, coordinates) for coordinates in coords]
+        # if any of the distances is less than the threshold then this assignment is valid
+        if any(distance < dist_tolerance for distance in distances):
+            return True
+    return False
+
+
+def get_invalid_global_ids(assignments, tracks, time_tolerance, dist_tolerance):
+    """
+    Finds the assignments of a worker that were completed away from the locations tracked for the worker
+    :param assignments: (List<Assignment>) The assignments completed by a single worker
+    :param tracks: List<Tuple<datetime, float, float, float>> The tracks of the worker, sorted by time
+    :param time_tolerance: (int) The time tolerance to use when evaluating assignments
+    :param dist_tolerance: (int) The distance tolerance to use when evaluating assignments
+    :return: (Set<string>) The GlobalIDs of the invalid assignments
+    """
+    invalid_global_ids = set()
+    track_dates = [track[0] for track in tracks]
+    for assignment in assignments:
+        if not is_assignment_valid(assignment, tracks, track_dates, time_tolerance, dist_tolerance):
+            logging.debug("No valid location found for {} completed by {} at {}".format(
+                assignment.global_id, assignment.editor, assignment.completed_date))
+            invalid_global_ids.add(assignment.global_id)
+    return invalid_global_ids
 
 
 def copy_assignments(project, assignments, target_fl, field_mappings):
@@ -108,9 +210,10 @@ def copy_assignments(project, assignments, target_fl, field_mappings):
     :param field_mappings: (Dict) The dictionary containing the field mappings between the project and target layer
     :return:
     """
+    import arcgis
     # Query the archived assignments to get all of the currently archived/invalid ones
     logging.getLogger().info("Querying target features")
-    archived_assignments = target_fl.query(out_fields=field_mappings[project._assignment_schema.global_id])
+    archived_assignments = target_fl.query(out_fields=field_mappings[project._assignment_schema.global_id], return_geometry=False)
     # Create a list of GlobalIDs - These should be unique
     global_ids = [feature.attributes[field_mappings[project._assignment_schema.global_id]] for feature in archived_assignments.features]
     # Iterate through the the assignments returned and only add those that don't exist in the Feature Layer
@@ -132,14 +235,14 @@ def copy_assignments(project, assignments, target_fl, field_mappings):
             arcgis.features.Feature(geometry=assignment.geometry, attributes=assignment_attributes))
     if assignments_to_submit:
         logging.getLogger().info("Adding invalid assignments to target Feature Service...")
-        response = target_fl.edit_features(adds=assignments_to_submit)
-        logging.getLogger().info(response)
+        log_edit_results(apply_edits(target_fl, adds=assignments_to_submit))
     else:
         logging.getLogger().info("No invalid completed assignments detected")
     logging.getLogger().info("Completed")
 
 
-def get_invalid_assignments(project, time_tolerance, dist_tolerance, min_accuracy, workers):
+def get_invalid_assignments(project, time_tolerance, dist_tolerance, min_accuracy, workers, max_workers=DEFAULT_MAX_WORKERS,
+                            use_pbf=False, columns=None):
     """
     Finds all invalid assignments completed by the specified workers
     :param project: (Project) The workforce project containing the assignments
@@ -147,60 +250,35 @@ def get_invalid_assignments(project, time_tolerance, dist_tolerance, min_accurac
     :param dist_tolerance: (int) The distance tolerance to use when evaluating assignments
     :param min_accuracy: (int) The minimum accuracy to consider
     :param workers: (List<String>) The list of worker username to consider
+    :param max_workers: (int) The number of concurrent requests to use when querying
+    :param use_pbf: (bool) Request the tracks as protocol buffers
+    :param columns: (List<string>) The assignment columns to query in addition to the ones needed to validate them,
+        defaults to all of them
     :return:
     """
-    completed_assignments = get_completed_assignments(project, workers)
-    # Find invalid assignments
-    invalid_assignments = []
+    if columns is not None:
+        columns = ASSIGNMENT_COLUMNS + list(columns)
+    completed_assignments = get_completed_assignments(project, workers, max_workers, columns)
     # Bug in the Workforce module at 1.4.1 causes accuracy to not be an available property on the schema
     if "Accuracy" in [field["name"] for field in project.tracks_layer.properties.fields]:
         accuracy_field = "Accuracy"
     else:
         accuracy_field = "accuracy"
+    # Group the assignments by the worker who completed them so each worker's tracks are pulled in bulk
+    assignments_by_editor = collections.OrderedDict()
     for assignment in completed_assignments:
-        # The coordinates of the assignment
-        start_coords = (assignment.geometry["x"], assignment.geometry["y"])
-        # When the assignment was completed
-        completion_date = assignment.completed_date
-        # Add/Subtract some minutes to give a little leeway
-        start_date = completion_date - datetime.timedelta(minutes=time_tolerance)
-        end_date = completion_date + datetime.timedelta(minutes=time_tolerance)
-        # Make a query string to select location by the worker during the time period
-        loc_query_string = "{} = '{}' AND {} >= '{}' AND {} <= '{}' AND {} <= {}" \
-            .format(project._track_schema.editor, assignment.editor,
-                    project._track_schema.creation_date,
-                    start_date.strftime('%Y-%m-%d %H:%M:%S'), project._track_schema.creation_date,
-                    end_date.strftime('%Y-%m-%d %H:%M:%S'), accuracy_field,
-                    min_accuracy)
-        # Query the feature layer
-        locations_to_check = project.tracks.search(where=loc_query_string)
-        # Bool to see if this assignment is valid or not
-        is_valid = False
-        for location in locations_to_check:
-            # Make a list of coordinate pairs to get the distance of
-            coords = [(location.geometry["x"], location.geometry["y"])]
-            accuracy = float(location.feature.attributes[accuracy_field])
-            # If we include the accuracy, we need to make four variations (+- the accuracy)
-            coords.append((location.geometry["x"] + accuracy,
-                           location.geometry["y"] + accuracy))
-            coords.append((location.geometry["x"] + accuracy,
-                           location.geometry["y"] - accuracy))
-            coords.append((location.geometry["x"] - accuracy,
-                           location.geometry["y"] + accuracy))
-            coords.append((location.geometry["x"] - accuracy,
-                           location.geometry["y"] - accuracy))
-            distances = [get_simple_distance(start_coords, coordinates) for coordinates in coords]
-            # if any of the distances is less than the threshold then this assignment is valid
-            if any(distance < dist_tolerance for distance in distances):
-                is_valid = True
-                break
-        if not is_valid:
-            logging.debug("Location Query: {}".format(loc_query_string))
-            invalid_assignments.append(assignment)
-    return invalid_assignments
+        assignments_by_editor.setdefault(assignment.editor, []).append(assignment)
+    # Find invalid assignments
+    invalid_global_ids = set()
+    for editor, assignments in assignments_by_editor.items():
+        windows = get_track_windows(assignments, time_tolerance)
+        tracks = get_tracks(project, editor, windows, min_accuracy, accuracy_field, max_workers, use_pbf)
+        invalid_global_ids.update(get_invalid_global_ids(assignments, tracks, time_tolerance, dist_tolerance))
+    return [assignment for assignment in completed_assignments if assignment.global_id in invalid_global_ids]
 
 
 def main(arguments):
+    import arcgis
     # initialize logger
     logger = initialize_logging(arguments.log_file)
 
@@ -208,22 +286,24 @@ def main(arguments):
     logger.info("Authenticating...")
 
     # First step is to get authenticate and get a valid token
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
 
     # Get the project
+    set_phase("project")
     item = gis.content.get(arguments.project_id)
-    project = workforce.Project(item)
+    project = get_project(item)
+    with open(arguments.config_file, 'r') as f:
+        field_mappings = json.load(f)
+    set_phase("check locations")
     invalid_assignments = get_invalid_assignments(project,
                                                   arguments.time_tolerance,
                                                   arguments.distance_tolerance,
                                                   arguments.min_accuracy,
-                                                  arguments.workers)
-
-    with open(arguments.config_file, 'r') as f:
-        field_mappings = json.load(f)
+                                                  arguments.workers,
+                                                  arguments.threads,
+                                                  arguments.use_pbf,
+                                                  field_mappings.keys())
+    set_phase("copy assignments")
     target_fl = arcgis.features.FeatureLayer(arguments.target_fl, gis)
     # Check if layer exists
     try:
@@ -235,7 +315,7 @@ def main(arguments):
     copy_assignments(project, invalid_assignments, target_fl, field_mappings)
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Export assignments from Workforce Project")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -256,14 +336,17 @@ if __name__ == "__main__":
                         help='The distance tolerance to use (meters- based on SR of Assignments FL)')
     parser.add_argument('-min-accuracy', dest='min_accuracy', default=50,
                         help="The minimum accuracy to use (meters - based on SR of Assignments FL)")
+    parser.add_argument('-threads', dest='threads', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="The number of concurrent requests to use when querying assignments and tracks")
+    parser.add_argument('--use-pbf', dest='use_pbf', action='store_true',
+                        help="Request the worker locations as protocol buffers, which are smaller and faster to decode than JSON")
     parser.add_argument('--skip-ssl-verification',
                         dest='skip_ssl_verification',
                         action='store_true',
                         help="Verify the SSL Certificate of the server")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
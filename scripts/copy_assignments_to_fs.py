@@ -25,44 +25,44 @@
 import argparse
 import json
 import logging
-import logging.handlers
 import tempfile
-import traceback
 import sys
-import arcgis
-from arcgis.apps import workforce
-from arcgis.gis import GIS
+from utils import (DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND, ThrottledExecutor, add_diagnostic_arguments,
+                   apply_edits, connect, get_assignment_projection, get_project, initialize_logging, iter_features,
+                   iter_pages, log_edit_results, run)
 
 
-def initialize_logging(log_file=None):
+def map_attributes(attributes, field_mappings):
     """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
+    Maps the attributes of an assignment to the fields of the target layer
+    :param attributes: (Dict) The attributes of the assignment
+    :param field_mappings: (Dict) The field mappings from the config file
+    :return: (Dict) The attributes of the copy
     """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+    return {value: attributes[key] for key, value in field_mappings.items()}
+
+
+def copy_attachments(executor, target_fl, field_mappings, project, assignment):
+    """
+    Copies the attachments of an assignment to the feature it was copied to
+    :param executor: (ThrottledExecutor) The executor to make the requests through
+    :param target_fl: (FeatureLayer) The layer the assignment was copied to
+    :param field_mappings: (Dict) The field mappings from the config file
+    :param project: (Project) The workforce project
+    :param assignment: (Assignment) The assignment
+    """
+    with tempfile.TemporaryDirectory() as d:
+        attachments = executor.call(assignment.attachments.download, out_folder=d)
+        if attachments:
+            where = "{} = {}".format(field_mappings[project._assignment_schema.object_id], assignment.object_id)
+            feature = executor.call(target_fl.query, where=where).features[0]
+            for attachment in attachments:
+                executor.call(target_fl.attachments.add, feature.attributes[target_fl.properties["objectIdField"]], attachment)
 
 
 def main(arguments):
+    import arcgis
+    from arcgis.apps import workforce
     # initialize logging
     logger = initialize_logging(arguments.log_file)
 
@@ -70,10 +70,7 @@ def main(arguments):
     logger.info("Authenticating...")
 
     # First step is to authenticate
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
 
     # Get the target feature layer
     target_fl = arcgis.features.FeatureLayer(arguments.target_fl, gis)
@@ -88,7 +85,7 @@ def main(arguments):
 
     # Get the project info
     item = gis.content.get(arguments.project_id)
-    project = workforce.Project(item)
+    project = get_project(item)
 
     # Open the field mappings config file
     logging.getLogger().info("Reading field mappings...")
@@ -96,56 +93,51 @@ def main(arguments):
         field_mappings = json.load(f)
     logging.getLogger().info("Validating field mappings...")
 
-    # Query the source to get the features specified by the query string
-    logger.info("Querying source features...")
-    current_assignments = project.assignments.search(where=arguments.where)
-
     # Query the archived assignments to get all of the currently archived ones
     logger.info("Querying target features")
-    archived_assignments = target_fl.query(out_fields=field_mappings[project._assignment_schema.global_id])
-
-    # Create a list of GlobalIDs - These should be unique
-    global_ids = [feature.attributes[field_mappings[project._assignment_schema.global_id]] for feature in archived_assignments.features]
-
-    # Iterate through the the assignments returned and only add those that don't exist in the Feature Layer
-    assignments_to_copy = []
-    # Updated loop to get the global_id and only copy if it doesn't already exist in global_ids
-    for assignment in current_assignments:
-        if assignment.global_id not in global_ids:
-            assignments_to_copy.append(assignment)
-
-    # Create a new list to store the updated feature-dictionaries
-    assignments_to_submit = []
-    # Loop over all assignments that we want to add,
-    for assignment in assignments_to_copy:
-        # map the field names appropriately
-        assignment_attributes = {}
-        for key, value in field_mappings.items():
-            # Updated the feature.attributes to call the correct field mapping items
-            assignment_attributes[value] = assignment.feature.attributes[key]
-        # create the new feature object to send to server
-        assignments_to_submit.append(
-            arcgis.features.Feature(geometry=assignment.geometry, attributes=assignment_attributes))
+    global_id_field = field_mappings[project._assignment_schema.global_id]
+    # Create a set of GlobalIDs - These should be unique
+    global_ids = set(feature.attributes[global_id_field] for feature in
+                     iter_features(target_fl, out_fields=global_id_field, return_geometry=False))
+
+    should_copy_attachments = arguments.copy_attachments
+    if should_copy_attachments and not target_fl.properties.get("hasAttachments", None):
+        logger.warning("Attachments not supported on the target layer")
+        should_copy_attachments = False
+
+    # Query the source one page at a time and copy the assignments in that page that don't exist in the Feature Layer
     logger.info("Copying assignments...")
-    response = target_fl.edit_features(adds=arcgis.features.FeatureSet(assignments_to_submit))
-    logger.info(response)
-    if arguments.copy_attachments:
-        if target_fl.properties.get("hasAttachments", None):
-            logger.info("Copying Attachments...")
+    # Only request the fields that are copied, and the ones needed to check for existing copies and attachments
+    columns = list(field_mappings.keys()) + ["object_id", "global_id", "geometry"]
+    projection = get_assignment_projection(project, columns)
+    with ThrottledExecutor(max_workers=arguments.threads, requests_per_second=arguments.requests_per_second) as executor:
+        for page in iter_pages(project.assignments_layer, where=arguments.where, **projection):
+            assignments_to_copy = []
+            # Updated loop to get the global_id and only copy if it doesn't already exist in global_ids
+            for feature in page:
+                assignment = workforce.Assignment(project, feature)
+                if assignment.global_id not in global_ids:
+                    assignments_to_copy.append(assignment)
+            if not assignments_to_copy:
+                continue
+
+            # Create a new list to store the updated feature-dictionaries
+            assignments_to_submit = []
+            # Loop over all assignments that we want to add,
             for assignment in assignments_to_copy:
-                with tempfile.TemporaryDirectory() as d:
-                    attachments = assignment.attachments.download(out_folder=d)
-                    if attachments:
-                        feature = target_fl.query(where="{} = {}".format(field_mappings[project._assignment_schema.object_id],
-                                                                         assignment.object_id)).features[0]
-                        for attachment in attachments:
-                            target_fl.attachments.add(feature.attributes[target_fl.properties["objectIdField"]], attachment)
-        else:
-            logger.warning("Attachments not supported on the target layer")
+                # create the new feature object to send to server
+                assignments_to_submit.append(
+                    arcgis.features.Feature(geometry=assignment.geometry,
+                                            attributes=map_attributes(assignment.feature.attributes, field_mappings)))
+            log_edit_results(apply_edits(target_fl, adds=assignments_to_submit))
+            if should_copy_attachments:
+                logger.info("Copying Attachments...")
+                for _ in executor.map_tasks(lambda a: copy_attachments(executor, target_fl, field_mappings, project, a), assignments_to_copy):
+                    pass
     logger.info("Completed")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Export assignments from Workforce Project")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -162,10 +154,13 @@ if __name__ == "__main__":
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
     parser.add_argument('--copy-attachments', dest="copy_attachments", action="store_true", default=False)
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    parser.add_argument('-threads', dest='threads', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="The number of concurrent requests to use when copying attachments")
+    parser.add_argument('-requests-per-second', dest='requests_per_second', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="The maximum number of requests to start per second when running concurrently")
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
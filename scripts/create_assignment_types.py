@@ -26,40 +26,9 @@
 import argparse
 import csv
 import logging
-import logging.handlers
 import os
 import sys
-import traceback
-from arcgis.gis import GIS
-from arcgis.apps import workforce
-
-
-def initialize_logging(log_file=None):
-    """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
-    """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+from utils import add_diagnostic_arguments, connect, get_project, initialize_logging, run
 
 
 def get_assignment_types_from_csv(csv_file):
@@ -80,6 +49,7 @@ def get_assignment_types_from_csv(csv_file):
 
 
 def main(arguments):
+    from arcgis.apps import workforce
     # initialize logging
     logger = initialize_logging(arguments.log_file)
 
@@ -87,12 +57,9 @@ def main(arguments):
     logger.info("Authenticating...")
 
     # Get the project and data
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
     item = gis.content.get(arguments.project_id)
-    project = workforce.Project(item)
+    project = get_project(item)
 
     logger.info("Reading CSV...")
     # Next we want to parse the CSV file and create a list of assignment types
@@ -105,7 +72,7 @@ def main(arguments):
     logger.info("Completed")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Add Assignments to Workforce Project")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -117,10 +84,9 @@ if __name__ == "__main__":
     parser.add_argument('-log-file', dest='log_file', help='The log file to use')
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
@@ -26,15 +26,19 @@
 import argparse
 import csv
 import logging
-import logging.handlers
-import traceback
 import sys
-import pendulum
 import datetime
+import itertools
 import types
-from arcgis.apps import workforce
-from arcgis.geocoding import batch_geocode, Geocoder
-from arcgis.gis import GIS
+from utils import (DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND, ThrottledExecutor, add_diagnostic_arguments,
+                   apply_in_batches, batch_geocode_in_chunks, connect, geocode_addresses, get_project, get_reference_cache,
+                   initialize_logging, is_matched, run)
+
+
+# The number of rows read, geocoded and added at a time
+DEFAULT_CHUNK_SIZE = 1000
+# The number of distinct due dates kept parsed between chunks
+DUE_DATE_CACHE_SIZE = 10000
 
 
 def log_critical_and_raise_exception(message):
@@ -42,169 +46,235 @@ def log_critical_and_raise_exception(message):
     raise Exception(message)
 
 
-def initialize_logging(log_file=None):
+def read_csv_in_chunks(csv_file, chunk_size):
     """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
+    Reads the rows of a CSV file a chunk at a time, so that a large file is never held in memory at once
+    :param csv_file: (string) The CSV file to read
+    :param chunk_size: (int) The number of rows per chunk
+    :return: (Generator<List<Dict>>) The rows of each chunk
     """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
-
-
-def main(arguments):  # noqa: C901
-    # initialize logging
-    logger = initialize_logging(arguments.log_file)
-
-    # Create the GIS
-    logger.info("Authenticating...")
-
-    # First step is to get authenticate and get a valid token
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
-
-    # Get the project and data
-    item = gis.content.get(arguments.project_id)
-    project = workforce.Project(item)
-    dispatcher = project.dispatchers.search(where="{}='{}'".format(project._dispatcher_schema.user_id, arguments.username))
-    if not dispatcher:
-        log_critical_and_raise_exception("{} is not a dispatcher".format(args.username))
-
-    # Read the csv file
-    logger.info("Reading CSV file: {}...".format(arguments.csv_file))
-    assignments_in_csv = []
-    locations = []
-    with open(arguments.csv_file, 'r') as file:
+    with open(csv_file, 'r') as file:
         reader = csv.DictReader(file)
-        for row in reader:
-            locations.append(row[args.location_field])
-            assignments_in_csv.append(row)
+        while True:
+            chunk = list(itertools.islice(reader, chunk_size))
+            if not chunk:
+                return
+            yield chunk
 
-    # Fetch assignment types
-    assignment_types = project.assignment_types.search()
-    assignment_type_dict = {}
-    for assignment_type in assignment_types:
-        assignment_type_dict[assignment_type.name] = assignment_type
 
-    # Fetch dispatchers
-    dispatchers = project.dispatchers.search()
-    dispatchers_dict = {}
-    for dispatcher in dispatchers:
-        dispatchers_dict[dispatcher.user_id] = dispatcher
+def geocode_locations(executor, locations, geocoder, out_sr, batch_size=None):
+    """
+    Geocodes the locations of a chunk of rows. The locations geocoded by earlier runs are read from the geocode cache,
+    and the others are geocoded once each, in batches sent in parallel.
+    :param executor: (ThrottledExecutor) The executor to make the requests through
+    :param locations: (List<string>) The locations to geocode
+    :param geocoder: (Geocoder) The geocoder to use
+    :param out_sr: (int) The wkid of the spatial reference to return the locations in
+    :param batch_size: (int) The number of locations per request, the batch size the geocoder suggests by default
+    :return: (List<Dict>) The result of each location, in the same order
+    """
+    return geocode_addresses(locations, geocoder, out_sr,
+                             geocode=lambda missing: batch_geocode_in_chunks(missing, geocoder, out_sr, executor, batch_size))
 
-    # Fetch the workers
-    workers = project.workers.search()
-    workers_dict = {}
-    for worker in workers:
-        workers_dict[worker.user_id] = worker
 
-    if not (args.x_field and args.y_field):
-        geocoder = None
-        if args.custom_geocoder:
-            geocoder = Geocoder.fromitem(gis.content.get(args.custom_geocoder))
-        addresses = batch_geocode(locations, geocoder=geocoder, out_sr=args.wkid)
+def get_due_dates(values, date_format, timezone, parsed=None):
+    """
+    Parses the due dates of a chunk of rows. Imports repeat the same few due dates over many rows, so each distinct
+    date is parsed, moved to the end of the day when it has no time and converted to UTC once, and the other rows reuse
+    it.
+    :param values: (List<string>) The due date of each row, empty when the row has none
+    :param date_format: (string) The format of the dates
+    :param timezone: (string) The timezone of the dates
+    :param parsed: (Dict) The dates parsed for the earlier chunks, by value, updated with the new ones
+    :return: (List<datetime>) The due date of each row, in local time like the other dates of the API, or None
+    """
+    import pendulum
+    if parsed is None:
+        parsed = {}
+    elif len(parsed) > DUE_DATE_CACHE_SIZE:
+        parsed.clear()
+    for value in set(values) - parsed.keys():
+        if not value:
+            parsed[value] = None
+            continue
+        d = datetime.datetime.strptime(value, date_format)
+        p_date = pendulum.instance(d, tz=timezone)
+        # If no time is provided, make the due date all day
+        if p_date.second == 0 and p_date.hour == 0 and p_date.minute == 0:
+            p_date = p_date.at(hour=23, minute=59, second=59)
+        # Convert date to UTC time
+        parsed[value] = datetime.datetime.fromtimestamp(p_date.in_tz('UTC').timestamp())
+    return [parsed[value] for value in values]
+
+
+def build_assignments(project, arguments, rows, addresses, assignment_type_dict, dispatchers_dict, workers_dict, dispatcher,
+                      parsed_due_dates=None):
+    """
+    Builds the assignments of a chunk of rows
+    :param project: (Project) The workforce project
+    :param arguments: (Namespace) The arguments of the script, naming the fields of the CSV file
+    :param rows: (List<Dict>) The rows of the chunk
+    :param addresses: (List<Dict>) The geocoded location of each row, or None when the rows have coordinates
+    :param assignment_type_dict: (Dict) The assignment types by name
+    :param dispatchers_dict: (Dict) The dispatchers by user id
+    :param workers_dict: (Dict) The workers by user id
+    :param dispatcher: (Dispatcher) The dispatcher of the rows that do not name one
+    :param parsed_due_dates: (Dict) The due dates parsed for the earlier chunks, see get_due_dates
+    :return: (List<Assignment>) The assignments to add
+    """
+    import pendulum
+    from arcgis.apps import workforce
+    logger = logging.getLogger()
     assignments_to_add = []
-    for i, assignment in enumerate(assignments_in_csv):
+    due_dates = None
+    if arguments.due_date_field:
+        due_dates = get_due_dates([row[arguments.due_date_field] for row in rows], arguments.date_format, arguments.timezone,
+                                  parsed_due_dates)
+    # The assignments of a chunk are assigned at the same time
+    assigned_date = datetime.datetime.fromtimestamp(pendulum.now('UTC').timestamp())
+    for i, assignment in enumerate(rows):
         assignment_to_add = workforce.Assignment(project,
-                                                 assignment_type=assignment_type_dict[assignment[args.assignment_type_field]],
+                                                 assignment_type=assignment_type_dict[assignment[arguments.assignment_type_field]],
                                                  status="unassigned"
                                                  )
 
         # Create the geometry
-        if args.x_field and args.y_field:
-            geometry = dict(x=float(assignment[args.x_field]),
-                            y=float(assignment[args.y_field]),
-                            spatialReference=dict(wkid=int(args.wkid)))
+        if addresses is None:
+            geometry = dict(x=float(assignment[arguments.x_field]),
+                            y=float(assignment[arguments.y_field]),
+                            spatialReference=dict(wkid=int(arguments.wkid)))
         else:
-            try:
-                location_geometry = addresses[i]['location']
-            except Exception as e:
-                logger.info(e)
+            if not is_matched(addresses[i]):
                 logger.info("Geocoding did not work for the assignment with location {}. "
-                            "Please check your addresses again".format(assignment[args.location_field]))
+                            "Please check your addresses again".format(assignment[arguments.location_field]))
                 logger.info("Continuing on to the next assignment")
                 continue
-            location_geometry['spatialReference'] = dict(wkid=int(args.wkid))
-            geometry = location_geometry
+            # Repeated locations share their result, so the geometry is copied
+            geometry = dict(addresses[i]['location'], spatialReference=dict(wkid=int(arguments.wkid)))
         assignment_to_add.geometry = geometry
 
-        # Determine the assignment due date, and if no time is provided, make the due date all day
-        if args.due_date_field and assignment[args.due_date_field]:
-            d = datetime.datetime.strptime(assignment[args.due_date_field], args.date_format)
-            p_date = pendulum.instance(d, tz=args.timezone)
-            if p_date.second == 0 and p_date.hour == 0 and p_date.minute == 0:
-                p_date = p_date.at(hour=23, minute=59, second=59)
-            # Convert date to UTC time
-            assignment_to_add.due_date = datetime.datetime.fromtimestamp(p_date.in_tz('UTC').timestamp())
+        # Set the due date
+        if due_dates and due_dates[i]:
+            assignment_to_add.due_date = due_dates[i]
 
         # Set the location
-        assignment_to_add.location = assignment[args.location_field]
+        assignment_to_add.location = assignment[arguments.location_field]
 
         # Set the dispatcher
-        if args.dispatcher_field and assignment[args.dispatcher_field]:
-            assignment_to_add.dispatcher = dispatchers_dict[assignment[args.dispatcher_field]]
+        if arguments.dispatcher_field and assignment[arguments.dispatcher_field]:
+            assignment_to_add.dispatcher = dispatchers_dict[assignment[arguments.dispatcher_field]]
         else:
             assignment_to_add.dispatcher = dispatcher
 
         # Fetch workers and assign the worker to the assignment
-        if args.worker_field and assignment[args.worker_field]:
-            assignment_to_add.worker = workers_dict[assignment[args.worker_field]]
-            assignment_to_add.assigned_date = datetime.datetime.fromtimestamp(pendulum.now('UTC').timestamp())
+        if arguments.worker_field and assignment[arguments.worker_field]:
+            assignment_to_add.worker = workers_dict[assignment[arguments.worker_field]]
+            assignment_to_add.assigned_date = assigned_date
             assignment_to_add.status = "assigned"
         else:
             assignment_to_add.status = "unassigned"
 
         # Set the priority
-        if args.priority_field and assignment[args.priority_field]:
-            assignment_to_add.priority = assignment[args.priority_field]
+        if arguments.priority_field and assignment[arguments.priority_field]:
+            assignment_to_add.priority = assignment[arguments.priority_field]
 
         # Set the description
-        if args.description_field and assignment[args.description_field]:
-            assignment_to_add.description = assignment[args.description_field]
+        if arguments.description_field and assignment[arguments.description_field]:
+            assignment_to_add.description = assignment[arguments.description_field]
 
         # Set the work order id
-        if args.work_order_id_field and assignment[args.work_order_id_field]:
-            assignment_to_add.work_order_id = assignment[args.work_order_id_field]
+        if arguments.work_order_id_field and assignment[arguments.work_order_id_field]:
+            assignment_to_add.work_order_id = assignment[arguments.work_order_id_field]
 
         # Set attachment
-        if args.attachment_file_field and assignment[args.attachment_file_field]:
+        if arguments.attachment_file_field and assignment[arguments.attachment_file_field]:
             assignment_to_add.attachment_file = types.SimpleNamespace()
-            assignment_to_add.attachment_file = assignment[args.attachment_file_field]
+            assignment_to_add.attachment_file = assignment[arguments.attachment_file_field]
 
         # Add all assignments to the list created
         assignments_to_add.append(assignment_to_add)
+    return assignments_to_add
+
+
+def main(arguments):
+    from arcgis.geocoding import Geocoder, get_geocoders
+    # initialize logging
+    logger = initialize_logging(arguments.log_file)
+    if arguments.chunk_size < 1:
+        log_critical_and_raise_exception("The chunk size must be at least 1")
+
+    # Create the GIS
+    logger.info("Authenticating...")
+
+    # First step is to get authenticate and get a valid token
+    gis = connect(arguments)
+
+    # Get the project and data
+    item = gis.content.get(arguments.project_id)
+    project = get_project(item)
+    reference_cache = get_reference_cache(project)
+    dispatcher = reference_cache.get_dispatcher(user_id=arguments.username)
+    if not dispatcher:
+        log_critical_and_raise_exception("{} is not a dispatcher".format(arguments.username))
 
-    # Batch add all assignments to the project
-    logger.info("Adding Assignments...")
-    assignments = project.assignments.batch_add(assignments_to_add)
-    logger.info("Adding Attachments...")
-    for assignment in assignments:
-        if hasattr(assignment, "attachment_file"):
-            assignment.attachments.add(assignment.attachment_file)
+    # Index the assignment types, dispatchers and workers loaded with the project
+    assignment_type_dict = {}
+    for assignment_type in reference_cache.assignment_types:
+        assignment_type_dict[assignment_type.name] = assignment_type
+
+    dispatchers_dict = {}
+    for project_dispatcher in reference_cache.dispatchers:
+        dispatchers_dict[project_dispatcher.user_id] = project_dispatcher
+
+    workers_dict = {}
+    for worker in reference_cache.workers:
+        workers_dict[worker.user_id] = worker
+
+    executor = ThrottledExecutor(max_workers=arguments.threads, requests_per_second=arguments.requests_per_second)
+    geocode = not (arguments.x_field and arguments.y_field)
+    geocoder = None
+    if geocode:
+        if arguments.custom_geocoder:
+            geocoder = Geocoder.fromitem(gis.content.get(arguments.custom_geocoder))
+        else:
+            geocoder = get_geocoders(gis)[0]
+    # The chunks are prepared one at a time, on the same thread
+    parsed_due_dates = {}
+
+    def prepare_chunk(rows):
+        addresses = None
+        if geocode:
+            addresses = geocode_locations(executor, [row[arguments.location_field] for row in rows], geocoder, arguments.wkid,
+                                          arguments.geocode_batch_size)
+        return build_assignments(project, arguments, rows, addresses, assignment_type_dict, dispatchers_dict, workers_dict,
+                                 dispatcher, parsed_due_dates)
+
+    # Read, geocode and build the next chunks on a background thread while the current chunk is added, so that the
+    # first assignments are added right away and only a few chunks are in memory at once
+    logger.info("Reading CSV file: {}...".format(arguments.csv_file))
+    pipeline = ThrottledExecutor(max_workers=1, requests_per_second=None)
+    added = 0
+    failed_count = 0
+    for assignments_to_add in pipeline.map_tasks(prepare_chunk, read_csv_in_chunks(arguments.csv_file, arguments.chunk_size)):
+        # Batch add the assignments of the chunk to the project
+        logger.info("Adding {} assignments...".format(len(assignments_to_add)))
+        assignments, failed = apply_in_batches(project.assignments.batch_add, assignments_to_add)
+        added += len(assignments)
+        failed_count += len(failed)
+        assignments_with_attachments = [assignment for assignment in assignments if hasattr(assignment, "attachment_file")]
+        if assignments_with_attachments:
+            logger.info("Adding Attachments...")
+        for _ in executor.map(lambda assignment: assignment.attachments.add(assignment.attachment_file), assignments_with_attachments):
+            pass
+    pipeline.shutdown()
+    executor.shutdown()
+    logger.info("{} assignments added".format(added))
+    if failed_count:
+        logger.info("{} assignments could not be added".format(failed_count))
     logger.info("Completed")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Add Assignments to Workforce Project")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -231,17 +301,25 @@ if __name__ == "__main__":
     parser.add_argument('-attachment-file-field', dest='attachment_file_field',
                         help="The field that contains the file path to the attachment to upload")
     parser.add_argument('-date-format', dest='date_format', default="%m/%d/%Y %H:%M:%S",
-                        help="The format to use for the date (eg. '%m/%d/%Y %H:%M:%S')")
+                        help="The format to use for the date (eg. '%%m/%%d/%%Y %%H:%%M:%%S')")
     parser.add_argument('-timezone', dest='timezone', default="UTC", help="The timezone for the assignments")
     parser.add_argument('-csv-file', dest='csv_file', help="The path/name of the csv file to read")
     parser.add_argument('-wkid', dest='wkid', help='The wkid that the x,y values are use', type=int, default=4326)
+    parser.add_argument('-chunk-size', dest='chunk_size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="The number of rows to read, geocode and add at a time")
+    parser.add_argument('-geocode-batch-size', dest='geocode_batch_size', type=int, default=None,
+                        help="The number of locations to geocode per request, the batch size the geocoder suggests by "
+                             "default (never more than its maximum)")
+    parser.add_argument('-threads', dest='threads', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="The number of concurrent requests to use when uploading attachments")
+    parser.add_argument('-requests-per-second', dest='requests_per_second', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="The maximum number of requests to start per second when running concurrently")
     parser.add_argument('-log-file', dest='log_file', help='The log file to use')
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
@@ -25,16 +25,9 @@
 
 import argparse
 import datetime
-import logging
-import logging.handlers
 import sys
-import traceback
 import re
-import arcgis
-from arcgis.gis import GIS
-from arcgis.apps.workforce.project import Project
-from arcgis.features import FeatureLayerCollection
-from arcgis.mapping import WebMap
+from utils import add_diagnostic_arguments, connect, initialize_logging, run, set_phase
 
 # Define the set of fields to include for each layer in the joined layer
 
@@ -195,6 +188,7 @@ def create_joined_view(gis, source_layer, join_layer, primary_key_field, foreign
     :param join_fields: The list of field configuration objects in the join layer to keep in the resulting joined layer
     :return: The new item
     """
+    from arcgis.features import FeatureLayerCollection
     name = re.sub(r'[^A-Za-z0-9 _]+', '', name)
     new_item = gis.content.create_service(
         name=name,
@@ -305,31 +299,18 @@ def generate_layer_definition(source_layer, join_layer, primary_key_field, forei
 
 
 def main(args):
-    # initialize logging
-    formatter = logging.Formatter("[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()]\
-                [%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if args.log_file:
-        rh = logging.handlers.RotatingFileHandler(args.log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
+    import arcgis
+    from arcgis.gis import GIS
+    from arcgis.apps.workforce.project import Project
+    from arcgis.mapping import WebMap
+    logger = initialize_logging(args.log_file)
 
     # Create the GIS
     logger.info("Authenticating...")
-    gis = GIS(args.org, args.username, args.password, verify_cert=not args.skip_ssl_verification)
+    gis = connect(args)
     if gis.properties["isPortal"]:
         raise RuntimeError("This script only works with ArcGIS Online")
+    set_phase("project")
     logger.info("Getting Workforce Project...")
     item = gis.content.get(args.project_id)
     if item is None:
@@ -343,6 +324,7 @@ def main(args):
         raise Exception(
             "Cannot find the attribute is v2 project. Are you sure you have the API version 1.8.3 or greater installed? "
             "Check with `arcgis.__version__` in your Python console")
+    set_phase("Phase 1: assignment types")
     logger.info("Phase 1: Joining assignments to assignment types...")
     d = int(datetime.datetime.now().timestamp())
     assignments_to_types = create_joined_view(gis,
@@ -353,6 +335,7 @@ def main(args):
                                               f"{project.title} Intermediate View 0 {d}",
                                               assignment_fields,
                                               assignment_type_fields)
+    set_phase("Phase 2: workers")
     logger.info("Phase 2: Joining assignments to workers...")
     assignments_to_workers = create_joined_view(gis,
                                                 project.assignments_layer,
@@ -363,6 +346,7 @@ def main(args):
                                                 assignment_fields,
                                                 worker_fields,
                                                 )
+    set_phase("Phase 3: dispatchers")
     logger.info("Phase 3: Joining assignments to dispatchers...")
     assignments_to_dispatchers = create_joined_view(gis,
                                                     project.assignments_layer,
@@ -375,6 +359,7 @@ def main(args):
     change_source_field_name_to_joined_field_name(assignment_type_fields)
     change_source_field_name_to_joined_field_name(worker_fields)
     change_source_field_name_to_joined_field_name(dispatcher_fields)
+    set_phase("Phase 4: types and workers")
     logger.info("Phase 4: Joining assignments and assignment types to assignments and workers...")
     assignments_types_workers = create_joined_view(gis,
                                                    assignments_to_types.layers[0],
@@ -384,6 +369,7 @@ def main(args):
                                                    f"{project.title} Intermediate View 3 {d}",
                                                    assignment_type_fields + assignment_fields,
                                                    worker_fields)
+    set_phase("Phase 5: final view")
     logger.info("Phase 5: Joining assignments and types and workers to  assignments and workers...")
     if args.name:
         name = args.name
@@ -400,6 +386,7 @@ def main(args):
     final_item.update({'title': name})
     logger.info(f"Final Item: {final_item.title}")
     if args.create_dashboard:
+        set_phase("dashboard")
         logger.info("Creating dashboard")
 
         # create new webmap
@@ -436,11 +423,11 @@ def main(args):
     logger.info("Script completed")
 
 
-if __name__ == "__main__":
+def get_parser():
     parser = argparse.ArgumentParser("Creates a hosted view layer that joins the 4 offline-enabled Workforce layers/tables together")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
     parser.add_argument('-p', dest='password', help="The password to authenticate with", required=True)
-    parser.add_argument('-org', dest='org', help="The url of the org/portal to use", required=True)
+    parser.add_argument('-org', dest='org_url', help="The url of the org/portal to use", required=True)
     parser.add_argument('-project-id', dest='project_id', help="The id of the project to create the view from",
                         required=True)
     parser.add_argument('--create-dashboard', dest='create_dashboard', action='store_true', help="Create a dashboard using the joined view in AGOL")
@@ -448,10 +435,9 @@ if __name__ == "__main__":
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
     parser.add_argument('-name', dest='name', help="The name of the resulting joined view")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
@@ -24,44 +24,13 @@
 """
 
 import argparse
-import logging
-import logging.handlers
 import sys
-import traceback
-import arcgis
-from arcgis.apps import workforce
-from arcgis.gis import GIS
-
-
-def initialize_logging(log_file=None):
-    """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
-    """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+from utils import add_diagnostic_arguments, connect, get_project, initialize_logging, run
 
 
 def main(arguments):
+    import arcgis
+    from arcgis.gis import GIS
     # Initialize logging
     logger = initialize_logging(arguments.log_file)
 
@@ -69,17 +38,14 @@ def main(arguments):
     logger.info("Authenticating...")
 
     # First step is to get authenticate and get a valid token
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
 
     logger.info("Getting workforce project")
 
     # Get your workforce project
     item = gis.content.get(arguments.project_id)
     try:
-        project = workforce.Project(item)
+        project = get_project(item)
     except Exception as e:
         logger.info(e)
         logger.info("Invalid project id")
@@ -125,7 +91,7 @@ def main(arguments):
     logger.info("Completed")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Create an Ops dashboard given a Workforce project")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -140,10 +106,9 @@ if __name__ == "__main__":
     parser.add_argument('-log-file', dest='log_file', help='The log file to use')
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
@@ -23,47 +23,22 @@
     This sample deletes assignments from a workforce project based on the supplied query
 """
 import argparse
-import logging
-import logging.handlers
-import traceback
 import sys
-from arcgis.apps import workforce
-from arcgis.gis import GIS
+from utils import add_diagnostic_arguments, connect, get_project, initialize_logging, run
 
 
 def main(arguments):
-    # initialize logging
-    formatter = logging.Formatter("[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()]\
-             [%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if arguments.log_file:
-        rh = logging.handlers.RotatingFileHandler(arguments.log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
+    logger = initialize_logging(arguments.log_file)
 
     # Create the GIS
     logger.info("Authenticating...")
 
     # First step is to get authenticate and get a valid token
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
 
     # Get the project
     item = gis.content.get(arguments.project_id)
-    project = workforce.Project(item)
+    project = get_project(item)
 
     # Call delete features on the layer
     logger.info("Deleting assignments...")
@@ -73,7 +48,7 @@ def main(arguments):
     logger.info("Completed")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Delete Assignments to Workforce Project")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -88,10 +63,9 @@ if __name__ == "__main__":
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
 
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
@@ -24,41 +24,112 @@
 """
 import argparse
 import csv
-import logging
-import logging.handlers
-import traceback
 import sys
-import pendulum
-from arcgis.apps import workforce
-from arcgis.gis import GIS
+from utils import (DEFAULT_MAX_WORKERS, add_diagnostic_arguments, connect, get_project, get_reference_cache,
+                   initialize_logging, iter_assignments, iter_column_pages, page_length, run, set_phase)
+
+# The CSV columns holding dates, and the assignment schema attribute each one is read from
+DATE_FIELDS = [("AssignedDate", "assigned_date"),
+               ("DueDate", "due_date"),
+               ("CreationDate", "creation_date"),
+               ("DeclinedDate", "declined_date"),
+               ("PausedDate", "paused_date"),
+               ("CompletedDate", "completed_date"),
+               ("EditDate", "edit_date"),
+               ("InProgressDate", "in_progress_date")]
+# The remaining CSV columns that are copied as is
+VALUE_FIELDS = [("DispatcherId", "dispatcher_id"),
+                ("WorkOrderId", "work_order_id"),
+                ("Description", "description"),
+                ("Notes", "notes"),
+                ("WorkerId", "worker_id"),
+                ("GlobalID", "global_id"),
+                ("Location", "location"),
+                ("Creator", "creator"),
+                ("Editor", "editor"),
+                ("DeclinedComment", "declined_comment"),
+                ("OBJECTID", "object_id"),
+                ("AssignmentRead", "assignment_read")]
+STATUSES = {0: "unassigned", 1: "assigned", 2: "in_progress", 3: "completed", 4: "declined", 5: "paused", 6: "canceled"}
+PRIORITIES = {0: "none", 1: "low", 2: "medium", 3: "high", 4: "critical"}
+
+
+def get_assignment_type_names(project):
+    """
+    Gets the name of each assignment type, keyed by the value stored in the assignments layer
+    :param project: (Project) The workforce project
+    :return: (Dict) The assignment type names by code (version 1) or GlobalID (version 2)
+    """
+    is_v2_project = getattr(project, "_is_v2_project", False)
+    return {(at.global_id if is_v2_project else at.code): at.name for at in get_reference_cache(project).assignment_types}
 
 
-def initialize_logging(log_file=None):
+def get_rows_from_columns(project, page, assignment_type_names, timezone, date_format):
     """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
+    Builds the CSV rows for a columnar page of assignments
+    :param project: (Project) The workforce project
+    :param page: (Dict) The columnar page of assignments
+    :param assignment_type_names: (Dict) The assignment type names from get_assignment_type_names
+    :param timezone: (string) The timezone to convert the dates to
+    :param date_format: (string) The date format to use
+    :return: (Generator<Dict>) The rows to write
     """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+    import pendulum
+    schema = project._assignment_schema
+    count = page_length(page)
+
+    def column(name):
+        field = getattr(schema, name, None)
+        return page["columns"].get(field, None) or [None] * count
+
+    dates = [(csv_field, column(name)) for csv_field, name in DATE_FIELDS]
+    values = [(csv_field, column(name)) for csv_field, name in VALUE_FIELDS]
+    statuses = column("status")
+    priorities = column("priority")
+    assignment_types = column("assignment_type")
+    # Like Assignment.assignment_read, which is a bool when the project has the field
+    has_assignment_read = bool(getattr(schema, "assignment_read", None))
+    assignment_read = column("assignment_read")
+    for i in range(count):
+        row = {"AssignedDate": None}
+        for csv_field, dates_column in dates:
+            if dates_column[i]:
+                row[csv_field] = pendulum.from_timestamp(dates_column[i] / 1000).in_tz(tz=timezone).strftime(date_format)
+        for csv_field, values_column in values:
+            row[csv_field] = values_column[i]
+        if has_assignment_read:
+            row["AssignmentRead"] = bool(assignment_read[i])
+        row["X"] = page["x"][i]
+        row["Y"] = page["y"][i]
+        row["Status"] = STATUSES.get(statuses[i], None)
+        row["Priority"] = PRIORITIES.get(priorities[i], None)
+        row["AssignmentType"] = assignment_type_names.get(assignment_types[i], None)
+        yield row
+
+
+def get_row(assignment, timezone, date_format):
+    """
+    Builds the CSV row of an assignment
+    :param assignment: (Assignment) The assignment
+    :param timezone: (string) The timezone to convert the dates to
+    :param date_format: (string) The date format to use
+    :return: (Dict) The row to write
+    """
+    import pendulum
+    # Take the assignment data, format it correctly if necessary, and assign it to the dict
+    assignment_to_export = {"AssignedDate": assignment.assigned_date}
+    for csv_field, name in DATE_FIELDS:
+        date = getattr(assignment, name)
+        if date:
+            assignment_to_export[csv_field] = pendulum.instance(date).in_tz(tz=timezone).strftime(date_format)
+    for csv_field, name in VALUE_FIELDS:
+        assignment_to_export[csv_field] = getattr(assignment, name)
+    assignment_to_export["X"] = assignment.geometry["x"]
+    assignment_to_export["Y"] = assignment.geometry["y"]
+    assignment_to_export["Status"] = assignment.status
+    assignment_to_export["Priority"] = assignment.priority
+    assignment_to_export["AssignmentType"] = assignment.assignment_type.name
+    return assignment_to_export
 
 
 def main(arguments):
@@ -72,61 +143,16 @@ def main(arguments):
     # Create the GIS
     logger.info("Authenticating...")
     # First step is to get authenticate
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
 
     # Get the project and data
+    set_phase("project")
     item = gis.content.get(arguments.project_id)
-    project = workforce.Project(item)
+    project = get_project(item)
 
-    # Query features
-    logger.info("Querying features...")
-    assignments = project.assignments.search(where=arguments.where)
-    assignments_to_export = []
-    # Take the assignment data, format it correctly if necessary, and assign it to the dict
-    for assignment in assignments:
-        assignment_to_export = {}
-        assignment_to_export["AssignedDate"] = assignment.assigned_date
-        if assignment.assigned_date:
-            assignment_to_export["AssignedDate"] = pendulum.instance(assignment.assigned_date).in_tz(tz=timezone).strftime(date_format)
-        if assignment.due_date:
-            assignment_to_export["DueDate"] = pendulum.instance(assignment.due_date).in_tz(tz=timezone).strftime(date_format)
-        if assignment.creation_date:
-            assignment_to_export["CreationDate"] = pendulum.instance(assignment.creation_date).in_tz(tz=timezone).strftime(date_format)
-        if assignment.declined_date:
-            assignment_to_export["DeclinedDate"] = pendulum.instance(assignment.declined_date).in_tz(tz=timezone).strftime(date_format)
-        if assignment.paused_date:
-            assignment_to_export["PausedDate"] = pendulum.instance(assignment.paused_date).in_tz(tz=timezone).strftime(date_format)
-        if assignment.completed_date:
-            assignment_to_export["CompletedDate"] = pendulum.instance(assignment.completed_date).in_tz(tz=timezone).strftime(date_format)
-        if assignment.edit_date:
-            assignment_to_export["EditDate"] = \
-                pendulum.instance(assignment.edit_date).in_tz(tz=timezone).strftime(date_format)
-        if assignment.in_progress_date:
-            assignment_to_export["InProgressDate"] = pendulum.instance(assignment.in_progress_date).in_tz(tz=timezone).strftime(date_format)
-        assignment_to_export["X"] = assignment.geometry["x"]
-        assignment_to_export["Y"] = assignment.geometry["y"]
-        assignment_to_export["DispatcherId"] = assignment.dispatcher_id
-        assignment_to_export["WorkOrderId"] = assignment.work_order_id
-        assignment_to_export["Status"] = assignment.status
-        assignment_to_export["Description"] = assignment.description
-        assignment_to_export["Notes"] = assignment.notes
-        assignment_to_export["Priority"] = assignment.priority
-        assignment_to_export["AssignmentType"] = assignment.assignment_type.name
-        assignment_to_export["WorkerId"] = assignment.worker_id
-        assignment_to_export["GlobalID"] = assignment.global_id
-        assignment_to_export["Location"] = assignment.location
-        assignment_to_export["Creator"] = assignment.creator
-        assignment_to_export["Editor"] = assignment.editor
-        assignment_to_export["DeclinedComment"] = assignment.declined_comment
-        assignment_to_export["OBJECTID"] = assignment.object_id
-        assignment_to_export["AssignmentRead"] = assignment.assignment_read
-        # Append each field to the assignments to be exported
-        assignments_to_export.append(assignment_to_export)
-    logger.info("Writing to CSV...")
-    # Create the CSV
+    # Query features and write them to the CSV one page at a time
+    set_phase("export")
+    logger.info("Querying features and writing to CSV...")
     with open(arguments.csv_file, 'w', newline='', encoding='utf-8') as csv_file:
         fieldnames = ["OBJECTID",
                       "X",
@@ -155,11 +181,20 @@ def main(arguments):
                       "Editor"]
         writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
         writer.writeheader()
-        writer.writerows(assignments_to_export)
+        if arguments.use_pbf:
+            # Decode the pages as protocol buffers straight into columns and build the rows from them
+            assignment_type_names = get_assignment_type_names(project)
+            for page in iter_column_pages(project.assignments_layer, where=arguments.where, max_workers=arguments.threads):
+                writer.writerows(get_rows_from_columns(project, page, assignment_type_names, timezone, date_format))
+        else:
+            # Take the assignment data, format it correctly if necessary, and assign it to the dict
+            for assignment in iter_assignments(project, where=arguments.where, max_workers=arguments.threads):
+                # Write each assignment as soon as its page arrives
+                writer.writerow(get_row(assignment, timezone, date_format))
     logger.info("Completed")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Export assignments from Workforce Project")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -173,12 +208,15 @@ if __name__ == "__main__":
     parser.add_argument('-log-file', dest="log_file", help="The file to log to")
     parser.add_argument('-date-format', dest='date_format', help="The date format to use", default="%m/%d/%Y %H:%M:%S")
     parser.add_argument('-timezone', dest='timezone', default="UTC", help="The timezone to export to")
+    parser.add_argument('-threads', dest='threads', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="The number of concurrent requests to use when querying large layers")
+    parser.add_argument('--use-pbf', dest='use_pbf', action='store_true',
+                        help="Request the assignments as protocol buffers, which are smaller and faster to decode than JSON")
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   A local stand-in for an ArcGIS organization, to run the scripts offline against a project of any size
+
+   The server implements the part of the portal and feature service REST API the scripts use, backed by a SQLite
+   database: signing in, getting items, groups and users, querying layers, applying edits and attachments, geocoding
+   addresses in batches and creating the feature services of a version 2 project. Views, dashboards, spatial queries
+   and protocol buffer queries are not supported.
+
+       python workforce_scripts.py local-server -db local.sqlite -u admin -p password -create-project "Local Project"
+       python workforce_scripts.py reset-stale-workers -org https://127.0.0.1:8443/portal -u admin -p password
+           --skip-ssl-verification -project-id <the id printed by the server> -cutoff-date 10
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+# The helpers shared by the scripts are in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import initialize_logging  # noqa: E402
+
+
+def main(arguments):
+    from .project import create_project
+    from .server import LocalServer, create_certificate
+    from .store import Store
+    logger = initialize_logging(arguments.log_file)
+    if arguments.verbose:
+        # Every request is logged at the debug level
+        logging.getLogger().handlers[-1].setLevel(logging.DEBUG)
+    if arguments.project_title and not arguments.username:
+        raise ValueError("-create-project needs the owner of the project (-u)")
+
+    store = Store(arguments.database)
+    if arguments.username:
+        logger.info("Adding user {}".format(arguments.username))
+        store.add_user(arguments.username, arguments.password)
+    for username in arguments.users.split(",") if arguments.users else []:
+        logger.info("Adding user {}".format(username.strip()))
+        store.add_user(username.strip(), arguments.password, role="org_user")
+    if arguments.project_title:
+        item = create_project(store, arguments.project_title, arguments.username,
+                              major_version=arguments.project_version)
+        logger.info("Created project '{}' with id {}".format(arguments.project_title, item["id"]))
+        print(item["id"])
+    if not arguments.serve:
+        store.close()
+        return
+
+    cert_file = arguments.cert_file or "{}.cert.pem".format(arguments.database)
+    key_file = arguments.key_file or "{}.key.pem".format(arguments.database)
+    if not os.path.exists(cert_file):
+        if arguments.cert_file:
+            raise FileNotFoundError(cert_file)
+        logger.info("Creating a self-signed certificate {}".format(cert_file))
+        create_certificate(cert_file, key_file, arguments.host)
+    server = LocalServer((arguments.host, arguments.port), store, cert_file, key_file)
+    logger.info("Serving {} from {}, connect with --skip-ssl-verification".format(server.url, arguments.database))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping")
+    finally:
+        server.server_close()
+        store.close()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Serve a local stand-in for an ArcGIS organization with Workforce projects")
+    parser.add_argument('-db', dest='database', help="The SQLite database to serve, created if it does not exist",
+                        required=True)
+    parser.add_argument('-host', dest='host', default="127.0.0.1", help="The host to listen on")
+    parser.add_argument('-port', dest='port', type=int, default=8443, help="The port to listen on")
+    parser.add_argument('-cert', dest='cert_file',
+                        help="The TLS certificate (PEM). A self-signed certificate is created next to the database by "
+                             "default")
+    parser.add_argument('-key', dest='key_file', help="The private key of the certificate (PEM)")
+    parser.add_argument('-u', dest='username', help="Add (or reset the password of) this administrator")
+    parser.add_argument('-p', dest='password', help="The password of the users that are added")
+    parser.add_argument('-users', dest='users',
+                        help="A comma separated list of named users to add, e.g. the workers of the projects")
+    parser.add_argument('-create-project', dest='project_title',
+                        help="Create a project with this title, owned by -u, and print its id")
+    parser.add_argument('-project-version', dest='project_version', type=int, choices=[1, 2], default=2,
+                        help="The major version of the project to create")
+    parser.add_argument('--no-serve', dest='serve', action='store_false',
+                        help="Only add the users and project, do not start the server")
+    parser.add_argument('--verbose', dest='verbose', action='store_true', help="Log every request")
+    parser.add_argument('-log-file', dest='log_file', help="The log file to use")
+    return parser
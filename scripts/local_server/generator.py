@@ -0,0 +1,705 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Generates a synthetic Workforce project of production size in a local server database
+
+   The project is created like local-server -create-project does, then its layers are filled directly in the SQLite
+   database, in large transactions, with assignment types, dispatchers, workers (who are also added as users),
+   assignments with attachments and, for version 1 projects, the locations tracked for the workers. The fields are
+   found with the schemas of the ArcGIS API for Python (project._assignment_schema, ...), so the same code fills both
+   versions, and every field create_joined_view.py joins is filled.
+
+   The data is random but shaped like a real project, and reproducible with -seed:
+   - assignments are spread over spatial clusters around a center, larger clusters first, and are mostly given to the
+     workers based in their cluster
+   - the status of the assignments follows -status-weights, and their dates follow from the status: created during
+     working hours within the date range, then assigned, started, completed (or declined, paused, canceled) later on
+   - workers are tracked -tracks-per-hour times per hour during working hours. They travel between the assignments
+     they work on and stay at each one from its in progress date to its completed date, so check_completion_location.py
+     finds the completions that are -invalid-completion-ratio of them.
+   - the attachments of the assignments have a log-normal size
+
+       python workforce_scripts.py generate-project -db local.sqlite -u admin -p password -title "Large Project"
+           -project-version 1 -assignments 1000000 -workers 2000 -assignment-types 50
+       python workforce_scripts.py local-server -db local.sqlite
+"""
+
+import argparse
+import bisect
+import datetime
+import json
+import logging
+import math
+import os
+import random
+import sys
+import types
+import uuid
+
+# The helpers shared by the scripts are in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import ASSIGNMENT_STATUSES, WORKER_STATUSES, initialize_logging  # noqa: E402
+from .project import create_project  # noqa: E402
+from .store import GEOMETRY_COLUMN, Store  # noqa: E402
+
+DEFAULT_STATUS_WEIGHTS = "unassigned=10,assigned=15,in_progress=5,completed=60,declined=3,paused=2,canceled=5"
+# The attributes of AssignmentSchema that are generated. assignment_read is only in version 1 projects.
+ASSIGNMENT_ATTRIBUTES = ["object_id", "global_id", "description", "status", "notes", "priority", "assignment_type",
+                         "work_order_id", "due_date", "worker_id", "location", "declined_comment", "assigned_date",
+                         "in_progress_date", "completed_date", "declined_date", "paused_date", "dispatcher_id",
+                         "assignment_read", "creation_date", "creator", "edit_date", "editor"]
+# The weight of each worker status and priority
+WORKER_STATUS_WEIGHTS = {"not_working": 50, "working": 40, "on_break": 10}
+PRIORITY_WEIGHTS = [30, 30, 25, 10, 5]
+# The mean time from one status to the next
+MEAN_MINUTES_TO_ASSIGN = 120
+MEAN_MINUTES_TO_START = 24 * 60
+MEAN_MINUTES_ON_SITE = 45
+# How long workers travel to the next assignment
+TRAVEL_MINUTES = 30
+# Names to build the assignment types, workers and addresses from
+TYPE_NAMES = ["Inspection", "Repair", "Maintenance", "Installation", "Survey", "Cleanup", "Meter Reading", "Delivery",
+              "Pickup", "Permit Check", "Tree Trimming", "Hydrant Flushing", "Leak Detection", "Sign Replacement",
+              "Pothole Repair", "Graffiti Removal", "Valve Exercise", "Pole Inspection", "Code Enforcement", "Audit"]
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn", "Drew",
+               "Robin", "Kim", "Lee", "Pat", "Chris", "Dana", "Jesse", "Kerry", "Reese"]
+LAST_NAMES = ["Smith", "Garcia", "Nguyen", "Johnson", "Brown", "Lopez", "Miller", "Davis", "Wilson", "Martin",
+              "Clark", "Lewis", "Walker", "Young", "Allen", "King", "Wright", "Scott", "Hill", "Green"]
+STREETS = ["Main St", "Oak Ave", "Pine St", "Maple Ave", "Cedar St", "Elm St", "Washington Blvd", "Lake Dr",
+           "Hill Rd", "Park Ave", "Orange St", "Redlands Blvd", "Church St", "Center St", "State St"]
+TITLES = ["Technician", "Senior Technician", "Inspector", "Field Crew", "Crew Lead", "Surveyor"]
+DECLINED_COMMENTS = ["Not enough time", "Missing equipment", "Site not accessible", "Wrong assignment type"]
+# The size of the random bytes the attachments are cut from
+ATTACHMENT_POOL_SIZE = 16 * 1024 * 1024
+MAX_ATTACHMENT_SIZE = 10 * 1024 * 1024
+# Flush the attachments well before the batch size when they are large
+MAX_ATTACHMENT_BATCH_BYTES = 64 * 1024 * 1024
+EARTH_RADIUS = 6378137
+
+
+def to_web_mercator(longitude, latitude):
+    """
+    :param longitude: (float) The longitude in degrees
+    :param latitude: (float) The latitude in degrees
+    :return: (float, float) The x and y in Web Mercator (102100) meters
+    """
+    x = math.radians(longitude) * EARTH_RADIUS
+    y = math.log(math.tan(math.pi / 4 + math.radians(latitude) / 2)) * EARTH_RADIUS
+    return x, y
+
+
+def parse_weights(value, names):
+    """
+    Parses weights such as "completed=60,assigned=15"
+    :param value: (string) The comma separated name=weight pairs
+    :param names: (Dict) The valid names
+    :return: (Dict) The weight of each name, 0 for the names that are not given
+    """
+    weights = dict.fromkeys(names, 0.0)
+    for pair in value.split(","):
+        name, _, weight = pair.partition("=")
+        if name.strip() not in weights:
+            raise ValueError("Invalid status '{}', use one of {}".format(name.strip(), ", ".join(names)))
+        weights[name.strip()] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise ValueError("At least one weight must be positive: '{}'".format(value))
+    return weights
+
+
+def zipf_weights(count, exponent):
+    """
+    :param count: (int) The number of values
+    :param exponent: (float) How skewed the weights are, 0 for uniform weights
+    :return: (List<float>) The cumulative weights of values 1 to count, the first being the largest
+    """
+    cumulative = []
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+    return cumulative
+
+
+def _get_schema(schema_class, layer):
+    """
+    Gets the schema of a layer of the local server, which only needs the fields and editor tracking fields
+    :param schema_class: (type) The schema class, e.g. AssignmentSchema
+    :param layer: (Layer) The layer
+    :return: (FeatureSchema) The schema
+    """
+    properties = types.SimpleNamespace(fields=layer.fields, editFieldsInfo=layer.edit_fields)
+    return schema_class(types.SimpleNamespace(properties=properties))
+
+
+def get_project_layers(store, item):
+    """
+    Gets the layers of a project of the local server
+    :param store: (Store) The store of the local server
+    :param item: (Dict) The project item
+    :return: (Dict) The assignments, workers, dispatchers and assignment types (version 2) or tracks (version 1) layers
+    """
+    if item["type"] == "Feature Service":
+        layers = store.get_layers(item["name"])
+        return {"assignments": layers[0], "workers": layers[1], "dispatchers": layers[2], "assignment_types": layers[3]}
+    data = json.loads(store.get_item_data(item["id"]))
+    # The urls are /server/rest/services/<service>/FeatureServer/0
+    return {key: store.get_layer(data[key]["url"].split("/")[-3], 0)
+            for key in ("assignments", "workers", "dispatchers", "tracks")}
+
+
+class _Generator(object):
+    """
+    Fills the layers of a project, keeping what the later layers refer to: the assignment types, dispatchers and
+    workers, and the stops of each worker
+    """
+
+    def __init__(self, store, layers, owner, arguments):
+        from arcgis.apps.workforce._schemas import (AssignmentSchema, AssignmentTypeSchema, DispatcherSchema, TrackSchema,
+                                                    WorkerSchema)
+        self.store = store
+        self.layers = layers
+        self.owner = owner
+        self.arguments = arguments
+        self.random = random.Random(arguments.seed)
+        self.assignment_schema = _get_schema(AssignmentSchema, layers["assignments"])
+        self.worker_schema = _get_schema(WorkerSchema, layers["workers"])
+        self.dispatcher_schema = _get_schema(DispatcherSchema, layers["dispatchers"])
+        self.track_schema = _get_schema(TrackSchema, layers["tracks"]) if "tracks" in layers else None
+        self.assignment_type_schema = _get_schema(AssignmentTypeSchema, layers["assignment_types"]) \
+            if "assignment_types" in layers else None
+        start = datetime.datetime.strptime(arguments.start_date, "%Y-%m-%d") if arguments.start_date else \
+            datetime.datetime.utcnow() - datetime.timedelta(days=arguments.days)
+        self.start_date = int(start.replace(hour=0, minute=0, second=0, microsecond=0,
+                                            tzinfo=datetime.timezone.utc).timestamp() * 1000)
+        self.clusters = []
+        self.cluster_weights = zipf_weights(arguments.clusters, arguments.cluster_skew)
+        self.assignment_types = []
+        self.type_weights = []
+        self.dispatchers = []
+        self.workers = []
+        self.workers_by_cluster = {}
+        # The (arrival, departure, x, y) of each assignment a worker worked on, by worker index
+        self.stops = {}
+        self.status_weights = {}
+        self.assignment_ids = range(0)
+
+    def _choose(self, cumulative_weights):
+        return bisect.bisect(cumulative_weights, self.random.random() * cumulative_weights[-1])
+
+    def _insert(self, layer, columns, rows, name):
+        """
+        Inserts rows in batches
+        :param layer: (Layer) The layer
+        :param columns: (List<string>) The columns of the rows
+        :param rows: (Iterable<tuple>) The rows, generated lazily
+        :param name: (string) What is inserted, for logging
+        :return: (int) The number of rows inserted
+        """
+        batch = []
+        count = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.arguments.batch_size:
+                count += self.store.insert_rows(layer.table_name, columns, batch)
+                batch = []
+                logging.getLogger().info("Added {} {}".format(count, name))
+        if batch:
+            count += self.store.insert_rows(layer.table_name, columns, batch)
+        if batch or not count:
+            logging.getLogger().info("Added {} {}".format(count, name))
+        return count
+
+    def _editor_columns(self, schema):
+        return [schema.creation_date, schema.creator, schema.edit_date, schema.editor]
+
+    def _random_point(self, cluster, spread):
+        x, y = cluster
+        return self.random.gauss(x, spread), self.random.gauss(y, spread)
+
+    @staticmethod
+    def _geometry(x, y):
+        return '{{"x": {:.2f}, "y": {:.2f}}}'.format(x, y)
+
+    def add_clusters(self):
+        center_x, center_y = to_web_mercator(*self.arguments.center)
+        radius = self.arguments.region_radius * 1000
+        for _ in range(self.arguments.clusters):
+            # Uniform in the disk of the region
+            distance = radius * math.sqrt(self.random.random())
+            angle = self.random.uniform(0, 2 * math.pi)
+            self.clusters.append((center_x + distance * math.cos(angle), center_y + distance * math.sin(angle)))
+
+    def add_assignment_types(self):
+        count = self.arguments.assignment_types
+        names = [TYPE_NAMES[i % len(TYPE_NAMES)] + ("" if i < len(TYPE_NAMES) else " {}".format(i // len(TYPE_NAMES) + 1))
+                 for i in range(count)]
+        self.type_weights = zipf_weights(count, 1.0)
+        if "assignment_types" not in self.layers:
+            # Version 1 assignment types are the coded values of the assignment type field
+            self.assignment_types = [{"object_id": code, "global_id": None, "name": name}
+                                     for code, name in enumerate(names, 1)]
+            layer = self.layers["assignments"]
+            fields = json.loads(json.dumps(layer.fields))
+            for field in fields:
+                if field["name"] == self.assignment_schema.assignment_type:
+                    field["domain"]["codedValues"] = [{"name": name, "code": code} for code, name in enumerate(names, 1)]
+            self.layers["assignments"] = self.store.update_layer_definition(layer.service, layer.definition["id"],
+                                                                            {"fields": fields})
+            logging.getLogger().info("Added {} assignment types".format(count))
+            return
+        layer = self.layers["assignment_types"]
+        start = self.store.get_max_object_id(layer) + 1
+        self.assignment_types = [{"object_id": start + i, "global_id": random_global_id(self.random), "name": name}
+                                 for i, name in enumerate(names)]
+        schema = self.assignment_type_schema
+        self._insert(layer, [schema.object_id, schema.description, schema.global_id] + self._editor_columns(schema),
+                     [(t["object_id"], t["name"], t["global_id"], self.start_date, self.owner, self.start_date, self.owner)
+                      for t in self.assignment_types], "assignment types")
+
+    def _add_users(self, prefix, count, role_name):
+        """
+        Adds the users of the dispatchers or workers, with the password of the owner, and adds them to the group
+        :return: (List<(string, string)>) The username and full name of each user
+        """
+        users = []
+        for i in range(count):
+            full_name = "{} {}".format(self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES))
+            users.append(("{}_{:05d}".format(prefix, i + 1), full_name))
+        self.store.add_users(users, self.arguments.password, role="org_user")
+        if self.arguments.group_id:
+            self.store.add_group_users(self.arguments.group_id, [username for username, _ in users])
+        logging.getLogger().info("Added {} {} users".format(count, role_name))
+        return users
+
+    def add_dispatchers(self):
+        layer = self.layers["dispatchers"]
+        schema = self.dispatcher_schema
+        # The owner was added as a dispatcher when the project was created
+        owner = layer.query({"where": "{} = '{}'".format(schema.user_id, self.owner),
+                             "outFields": "{},{}".format(layer.object_id_field, layer.global_id_field)})["features"]
+        self.dispatchers = [{"object_id": f["attributes"][layer.object_id_field],
+                             "global_id": f["attributes"][layer.global_id_field], "username": self.owner}
+                            for f in owner]
+        start = self.store.get_max_object_id(layer) + 1
+        rows = []
+        for i, (username, full_name) in enumerate(self._add_users("dispatcher", self.arguments.dispatchers, "dispatcher")):
+            dispatcher = {"object_id": start + i, "global_id": random_global_id(self.random), "username": username}
+            self.dispatchers.append(dispatcher)
+            row = (dispatcher["object_id"], dispatcher["global_id"], full_name, username,
+                   "555-{:04d}".format(self.random.randrange(10000)), self.start_date, self.owner, self.start_date,
+                   self.owner)
+            # Version 1 dispatchers are a layer, version 2 dispatchers a table
+            rows.append(row + (self._geometry(*self.clusters[0]),) if layer.has_geometry else row)
+        self._insert(layer, [schema.object_id, schema.global_id, schema.name, schema.user_id, schema.contact_number] +
+                     self._editor_columns(schema) + ([GEOMETRY_COLUMN] if layer.has_geometry else []), rows,
+                     "dispatchers")
+
+    def add_workers(self):
+        layer = self.layers["workers"]
+        schema = self.worker_schema
+        statuses = [WORKER_STATUSES[name] for name in WORKER_STATUS_WEIGHTS]
+        status_weights = list(WORKER_STATUS_WEIGHTS.values())
+        start = self.store.get_max_object_id(layer) + 1
+        rows = []
+        for i, (username, full_name) in enumerate(self._add_users("worker", self.arguments.workers, "worker")):
+            cluster = self._choose(self.cluster_weights)
+            worker = {"object_id": start + i, "global_id": random_global_id(self.random), "username": username,
+                      "cluster": cluster, "index": i}
+            self.workers.append(worker)
+            self.workers_by_cluster.setdefault(cluster, []).append(worker)
+            x, y = self._random_point(self.clusters[cluster], self.arguments.cluster_spread * 1000)
+            rows.append((worker["object_id"], worker["global_id"], full_name, username,
+                         self.random.choices(statuses, status_weights)[0], self.random.choice(TITLES),
+                         "555-{:04d}".format(self.random.randrange(10000)),
+                         "Based in area {}".format(cluster + 1) if self.random.random() < 0.2 else None,
+                         self.start_date, self.owner, self.start_date, self.owner, self._geometry(x, y)))
+        self._insert(layer, [schema.object_id, schema.global_id, schema.name, schema.user_id, schema.status,
+                             schema.title, schema.contact_number, schema.notes] + self._editor_columns(schema) +
+                     [GEOMETRY_COLUMN], rows, "workers")
+
+    def _later(self, date, mean_minutes):
+        """
+        Gets a time during working hours after a date, when the next status of an assignment is reached
+        :param date: (int) The date of the current status, in epoch milliseconds
+        :param mean_minutes: (int) The mean time to the next status
+        :return: (int) The date of the next status
+        """
+        date += int(self.random.expovariate(1.0 / mean_minutes) * 60000)
+        if self._working_time(date) == date:
+            return date
+        # Outside of working hours, the status is reached at some point of the next working hours
+        return self._working_time(date) + int(self.random.random() * self.arguments.working_hours * 3600000)
+
+    def _working_time(self, date):
+        """
+        :param date: (int) A date, in epoch milliseconds
+        :return: (int) The date if it is during working hours, otherwise when the next working hours start
+        """
+        day = (date - self.start_date) // 86400000
+        begin = self.start_date + day * 86400000 + self.arguments.work_start_hour * 3600000
+        if begin <= date < begin + self.arguments.working_hours * 3600000:
+            return date
+        return begin if date < begin else begin + 86400000
+
+    def _schedule(self, stops, arrival, departure):
+        """
+        Gets when a worker can start an assignment during working hours, after the ones they work on around the same
+        time and the travel to it
+        :param stops: (List<(int, int, float, float)>) The stops of the worker, sorted by arrival
+        :param arrival: (int) The in progress date of the assignment
+        :param departure: (int) When the worker leaves the assignment
+        :return: (int) The in progress date without overlapping the other stops
+        """
+        duration = departure - arrival
+        travel = TRAVEL_MINUTES * 60000
+        while True:
+            i = bisect.bisect(stops, (arrival, ))
+            if i > 0 and stops[i - 1][1] + travel > arrival:
+                arrival = stops[i - 1][1] + travel
+            elif i < len(stops) and arrival + duration + travel > stops[i][0]:
+                arrival = stops[i][1] + travel
+            elif self._working_time(arrival) != arrival:
+                arrival = self._working_time(arrival)
+            else:
+                return arrival
+
+    def _get_dates(self, status):
+        """
+        Gets the dates of an assignment that follow from its status
+        :param status: (string) The name of the status
+        :return: (Dict) The creation, assigned, in progress, completed, declined and paused dates, None if not reached
+        """
+        arguments = self.arguments
+        day = self.random.randrange(arguments.days)
+        created = self.start_date + (day * 24 + arguments.work_start_hour) * 3600000 + \
+            int(self.random.random() * arguments.working_hours * 3600000)
+        dates = dict.fromkeys(("created", "assigned", "in_progress", "completed", "declined", "paused"))
+        dates["created"] = created
+        if status in ("unassigned", "canceled"):
+            return dates
+        dates["assigned"] = self._later(created, MEAN_MINUTES_TO_ASSIGN)
+        if status == "assigned":
+            return dates
+        if status == "declined":
+            dates["declined"] = self._later(dates["assigned"], MEAN_MINUTES_TO_START)
+            return dates
+        dates["in_progress"] = self._later(dates["assigned"], MEAN_MINUTES_TO_START)
+        on_site = int(self.random.expovariate(1.0 / MEAN_MINUTES_ON_SITE) * 60000) + 60000
+        if status == "paused":
+            dates["paused"] = dates["in_progress"] + on_site
+        elif status == "completed":
+            dates["completed"] = dates["in_progress"] + on_site
+        return dates
+
+    def _iter_assignments(self, attributes, start):
+        """
+        Generates the assignments
+        :param attributes: (List<string>) The schema attributes of the columns, e.g. status
+        :param start: (int) The object id of the first assignment
+        :return: (Iterable<tuple>) The rows
+        """
+        arguments = self.arguments
+        layer = self.layers["assignments"]
+        status_names = list(self.status_weights)
+        status_weights = [self.status_weights[name] for name in status_names]
+        statuses = self.random.choices(status_names, status_weights, k=arguments.assignments)
+        # The key referring to the assignment type, worker and dispatcher
+        type_key, worker_key, dispatcher_key = [
+            "global_id" if layer.get_field(getattr(self.assignment_schema, attribute))["type"] == "esriFieldTypeGUID"
+            else "object_id" for attribute in ("assignment_type", "worker_id", "dispatcher_id")]
+        invalid_ratio = arguments.invalid_completion_ratio
+        for i, status in enumerate(statuses):
+            cluster = self._choose(self.cluster_weights)
+            x, y = self._random_point(self.clusters[cluster], arguments.cluster_spread * 1000)
+            assignment_type = self.assignment_types[self._choose(self.type_weights)]
+            dispatcher = self.random.choice(self.dispatchers)
+            dates = self._get_dates(status)
+            worker = None
+            if dates["assigned"] is not None and self.workers:
+                # Mostly the workers of the cluster, sometimes someone from elsewhere
+                candidates = self.workers_by_cluster.get(cluster, None)
+                if not candidates or self.random.random() < 0.1:
+                    candidates = self.workers
+                worker = self.random.choice(candidates)
+            if worker is not None and dates["in_progress"] is not None:
+                stops = self.stops.setdefault(worker["index"], [])
+                # Assignments in progress are still being worked on
+                departure = dates["completed"] or dates["paused"] or dates["in_progress"] + MEAN_MINUTES_ON_SITE * 60000
+                delay = self._schedule(stops, dates["in_progress"], departure) - dates["in_progress"]
+                for name in ("in_progress", "completed", "paused"):
+                    dates[name] = dates[name] + delay if dates[name] is not None else None
+                # The worker was elsewhere when some completions were recorded
+                stop_x, stop_y = x, y
+                if dates["completed"] and self.random.random() < invalid_ratio:
+                    angle = self.random.uniform(0, 2 * math.pi)
+                    distance = self.random.uniform(1000, 5000)
+                    stop_x, stop_y = x + distance * math.cos(angle), y + distance * math.sin(angle)
+                bisect.insort(stops, (dates["in_progress"], departure + delay, stop_x, stop_y))
+            location = "{} {}".format(self.random.randrange(1, 10000), self.random.choice(STREETS))
+            worker_edited = worker is not None and (dates["in_progress"] or dates["declined"])
+            row = {
+                "object_id": start + i,
+                "global_id": random_global_id(self.random),
+                "description": "{} at {}".format(assignment_type["name"], location),
+                "status": ASSIGNMENT_STATUSES[status],
+                "notes": "Call before arriving" if self.random.random() < 0.1 else None,
+                "priority": self.random.choices(range(len(PRIORITY_WEIGHTS)), PRIORITY_WEIGHTS)[0],
+                "assignment_type": assignment_type[type_key],
+                "work_order_id": "WO-{:07d}".format(start + i),
+                "due_date": dates["created"] + self.random.randrange(1, 15) * 24 * 3600000
+                if self.random.random() < arguments.due_date_ratio else None,
+                "worker_id": worker[worker_key] if worker else None,
+                "location": location,
+                "declined_comment": self.random.choice(DECLINED_COMMENTS) if dates["declined"] else None,
+                "assigned_date": dates["assigned"],
+                "in_progress_date": dates["in_progress"],
+                "completed_date": dates["completed"],
+                "declined_date": dates["declined"],
+                "paused_date": dates["paused"],
+                "dispatcher_id": dispatcher[dispatcher_key],
+                "assignment_read": 1 if worker_edited else None,
+                "creation_date": dates["created"],
+                "creator": dispatcher["username"],
+                "edit_date": max(date for date in dates.values() if date is not None),
+                "editor": worker["username"] if worker_edited else dispatcher["username"],
+                "geometry": self._geometry(x, y)
+            }
+            yield tuple(row[attribute] for attribute in attributes)
+
+    def add_assignments(self):
+        schema = self.assignment_schema
+        # The schema finds fields by name, so look the names up once rather than for each assignment
+        attributes = [attribute for attribute in ASSIGNMENT_ATTRIBUTES if getattr(schema, attribute) is not None]
+        columns = [getattr(schema, attribute) for attribute in attributes] + [GEOMETRY_COLUMN]
+        self.status_weights = parse_weights(self.arguments.status_weights, ASSIGNMENT_STATUSES)
+        start = self.store.get_max_object_id(self.layers["assignments"]) + 1
+        count = self._insert(self.layers["assignments"], columns,
+                             self._iter_assignments(attributes + ["geometry"], start), "assignments")
+        self.assignment_ids = range(start, start + count)
+
+    def _iter_attachments(self, layer):
+        arguments = self.arguments
+        pool = self.random.getrandbits(ATTACHMENT_POOL_SIZE * 8).to_bytes(ATTACHMENT_POOL_SIZE, "little")
+        median = arguments.attachment_size * 1024
+        for object_id in self.assignment_ids:
+            if self.random.random() >= arguments.attachment_ratio:
+                continue
+            for n in range(1 + min(int(self.random.expovariate(1.0)), 4)):
+                size = min(int(self.random.lognormvariate(math.log(median), arguments.attachment_size_sigma)),
+                           MAX_ATTACHMENT_SIZE, ATTACHMENT_POOL_SIZE)
+                offset = self.random.randrange(ATTACHMENT_POOL_SIZE - size + 1)
+                # A JPEG header, for the clients that look at the content
+                data = b"\xff\xd8\xff\xe0" + pool[offset:offset + max(size - 4, 0)]
+                yield (layer.table_name, object_id, random_global_id(self.random), "photo_{}_{}.jpg".format(object_id, n + 1),
+                       "image/jpeg", None, data)
+
+    def add_attachments(self):
+        if self.arguments.attachment_ratio <= 0:
+            return
+        layer = self.layers["assignments"]
+        columns = ["table_name", "parent_id", "global_id", "name", "content_type", "keywords", "data"]
+        batch = []
+        batch_bytes = 0
+        count = 0
+        total_bytes = 0
+        for row in self._iter_attachments(layer):
+            batch.append(row)
+            batch_bytes += len(row[-1])
+            if len(batch) >= self.arguments.batch_size or batch_bytes >= MAX_ATTACHMENT_BATCH_BYTES:
+                count += self.store.insert_rows("attachments", columns, batch)
+                total_bytes += batch_bytes
+                batch, batch_bytes = [], 0
+        if batch:
+            count += self.store.insert_rows("attachments", columns, batch)
+            total_bytes += batch_bytes
+        logging.getLogger().info("Added {} attachments ({:.1f} MB)".format(count, total_bytes / 1024.0 / 1024.0))
+
+    @staticmethod
+    def _position(stops, home, time):
+        """
+        Gets where a worker was: at an assignment between its in progress and completed dates, on the way to the next
+        one during the TRAVEL_MINUTES before its in progress date, otherwise where they last were that day
+        :param stops: (List<(int, int, float, float)>) The arrival, departure, x and y of the stops of the worker,
+                      sorted by arrival
+        :param home: (float, float) Where the worker starts the day
+        :param time: (int) The time, in epoch milliseconds
+        :return: (float, float) The x and y
+        """
+        i = bisect.bisect(stops, (time, ))
+        previous = stops[i - 1] if i > 0 and stops[i - 1][1] >= time - 12 * 3600000 else None
+        if previous is not None and time <= previous[1]:
+            return previous[2], previous[3]
+        x, y = (previous[2], previous[3]) if previous else home
+        following = stops[i] if i < len(stops) else None
+        if following is None or following[0] - time > TRAVEL_MINUTES * 60000:
+            return x, y
+        departure = max(following[0] - TRAVEL_MINUTES * 60000, previous[1] if previous else 0)
+        progress = (time - departure) / float(max(following[0] - departure, 1))
+        return x + (following[2] - x) * progress, y + (following[3] - y) * progress
+
+    def _iter_tracks(self):
+        arguments = self.arguments
+        interval = 3600000 / arguments.tracks_per_hour
+        day_length = 24 * 3600000
+        for worker in self.workers:
+            stops = sorted(self.stops.get(worker["index"], []))
+            home = self._random_point(self.clusters[worker["cluster"]], arguments.cluster_spread * 1000)
+            stops_by_day = {}
+            for stop in stops:
+                stops_by_day.setdefault((stop[0] - self.start_date) // day_length, []).append(stop)
+            # Some assignments are worked on after the last day they are created on
+            for day in range(max([arguments.days] + [d + 1 for d in stops_by_day])):
+                day_stops = stops_by_day.get(day, [])
+                # Workers are tracked on 5 days a week, and every day they work on assignments
+                if not day_stops and (day >= arguments.days or self.random.random() >= 5 / 7.0):
+                    continue
+                # Working hours, stretched to the assignments worked on that day
+                begin = self.start_date + day * day_length + arguments.work_start_hour * 3600000
+                end = begin + arguments.working_hours * 3600000
+                if day_stops:
+                    begin = min(begin, day_stops[0][0] - TRAVEL_MINUTES * 60000)
+                    end = max(end, max(stop[1] for stop in day_stops) + TRAVEL_MINUTES * 60000)
+                time = begin + self.random.random() * interval
+                while time < end:
+                    x, y = self._position(stops, home, int(time))
+                    accuracy = min(self.random.lognormvariate(math.log(8), 0.6), 500.0)
+                    x, y = self.random.gauss(x, accuracy / 2), self.random.gauss(y, accuracy / 2)
+                    creation_date = int(time)
+                    yield (round(accuracy, 1), random_global_id(self.random), creation_date, worker["username"],
+                           creation_date, worker["username"], self._geometry(x, y))
+                    time += interval * self.random.uniform(0.8, 1.2)
+
+    def add_tracks(self):
+        if self.track_schema is None or self.arguments.tracks_per_hour <= 0:
+            if self.arguments.tracks_per_hour > 0:
+                logging.getLogger().info("Version 2 projects do not have a tracks layer, no tracks were generated")
+            return
+        schema = self.track_schema
+        layer = self.layers["tracks"]
+        self._insert(layer, [schema.accuracy, schema.global_id] + self._editor_columns(schema) + [GEOMETRY_COLUMN],
+                     self._iter_tracks(), "tracks")
+        logging.getLogger().info("Indexing the tracks")
+        self.store.add_index(layer, [schema.editor, schema.creation_date])
+
+    def add_indexes(self):
+        """
+        Indexes the fields the scripts query large projects by, once the layers are filled
+        """
+        schema = self.assignment_schema
+        for field_name in (schema.status, schema.worker_id, schema.work_order_id, schema.completed_date):
+            self.store.add_index(self.layers["assignments"], [field_name])
+        self.store.add_index(self.layers["workers"], [self.worker_schema.user_id])
+
+    def check_joined_fields(self):
+        """
+        Logs the fields create_joined_view.py joins that the generated layers leave empty
+        """
+        import create_joined_view
+        checks = [("assignments", create_joined_view.assignment_fields), ("workers", create_joined_view.worker_fields),
+                  ("dispatchers", create_joined_view.dispatcher_fields)]
+        if "assignment_types" in self.layers:
+            checks.append(("assignment_types", create_joined_view.assignment_type_fields))
+        for key, fields in checks:
+            layer = self.layers[key]
+            for field in fields:
+                name = layer.get_field(field["source"])["name"]
+                if not layer.query({"where": "{} IS NOT NULL".format(name), "returnCountOnly": "true"})["count"]:
+                    logging.getLogger().warning("No {} have a {}".format(key.replace("_", " "), name))
+
+
+def random_global_id(generator):
+    """
+    :param generator: (Random) The random generator, so that the global ids are reproducible with -seed
+    :return: (string) A global id, e.g. {6F9619FF-8B86-4011-B42D-00C04FC964FF}
+    """
+    return "{" + str(uuid.UUID(int=generator.getrandbits(128), version=4)).upper() + "}"
+
+
+def main(arguments):
+    logger = initialize_logging(arguments.log_file)
+    store = Store(arguments.database)
+    # The database is generated again if the generation is interrupted, so skip waiting for each batch to be on disk
+    store.connection.execute("PRAGMA synchronous = OFF")
+    if arguments.password:
+        store.add_user(arguments.username, arguments.password)
+    item = create_project(store, arguments.title, arguments.username, major_version=arguments.project_version)
+    logger.info("Created project '{}' with id {}".format(arguments.title, item["id"]))
+    layers = get_project_layers(store, item)
+    arguments.group_id = (item.get("properties", None) or {}).get("workforceProjectGroupId", None) or \
+        json.loads(store.get_item_data(item["id"]) or "{}").get("groupId", None)
+    generator = _Generator(store, layers, arguments.username, arguments)
+    generator.add_clusters()
+    generator.add_assignment_types()
+    generator.add_dispatchers()
+    generator.add_workers()
+    generator.add_assignments()
+    generator.add_attachments()
+    generator.add_tracks()
+    generator.add_indexes()
+    generator.check_joined_fields()
+    store.close()
+    logger.info("Generated project {}".format(item["id"]))
+    print(item["id"])
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Generate a synthetic Workforce project in a local server database")
+    parser.add_argument('-db', dest='database', help="The SQLite database of the local server, created if it does not exist",
+                        required=True)
+    parser.add_argument('-u', dest='username', help="The owner of the project, added as an administrator if -p is given",
+                        required=True)
+    parser.add_argument('-p', dest='password', help="The password of the owner, also given to the generated users")
+    parser.add_argument('-title', dest='title', default="Generated Project", help="The title of the project")
+    parser.add_argument('-project-version', dest='project_version', type=int, choices=[1, 2], default=2,
+                        help="The major version of the project. Only version 1 projects have tracks.")
+    parser.add_argument('-assignments', dest='assignments', type=int, default=10000, help="The number of assignments")
+    parser.add_argument('-assignment-types', dest='assignment_types', type=int, default=20,
+                        help="The number of assignment types, the first ones being the most common")
+    parser.add_argument('-workers', dest='workers', type=int, default=100, help="The number of workers")
+    parser.add_argument('-dispatchers', dest='dispatchers', type=int, default=5,
+                        help="The number of dispatchers, besides the owner")
+    parser.add_argument('-status-weights', dest='status_weights', default=DEFAULT_STATUS_WEIGHTS,
+                        help="The relative number of assignments with each status")
+    parser.add_argument('-start-date', dest='start_date',
+                        help="The first day assignments are created (YYYY-MM-DD, UTC), -days before today by default")
+    parser.add_argument('-days', dest='days', type=int, default=30, help="The number of days assignments are created over")
+    parser.add_argument('-work-start-hour', dest='work_start_hour', type=int, default=8,
+                        help="The hour (UTC) the working day starts")
+    parser.add_argument('-working-hours', dest='working_hours', type=int, default=8, help="The length of the working day")
+    parser.add_argument('-due-date-ratio', dest='due_date_ratio', type=float, default=0.5,
+                        help="The ratio of assignments with a due date")
+    parser.add_argument('-center', dest='center', type=float, nargs=2, default=[-117.19, 34.06], metavar=("LON", "LAT"),
+                        help="The center of the region of the project")
+    parser.add_argument('-region-radius', dest='region_radius', type=float, default=50,
+                        help="The radius (km) of the region the clusters are in")
+    parser.add_argument('-clusters', dest='clusters', type=int, default=10,
+                        help="The number of clusters the assignments and workers are grouped in")
+    parser.add_argument('-cluster-spread', dest='cluster_spread', type=float, default=2,
+                        help="The standard deviation (km) of the distance to the center of a cluster")
+    parser.add_argument('-cluster-skew', dest='cluster_skew', type=float, default=1,
+                        help="How much larger the first clusters are (Zipf exponent), 0 for clusters of the same size")
+    parser.add_argument('-tracks-per-hour', dest='tracks_per_hour', type=float, default=12,
+                        help="How often workers are tracked during working hours (version 1 projects)")
+    parser.add_argument('-invalid-completion-ratio', dest='invalid_completion_ratio', type=float, default=0.02,
+                        help="The ratio of completed assignments the worker was not at when completing them")
+    parser.add_argument('-attachment-ratio', dest='attachment_ratio', type=float, default=0.05,
+                        help="The ratio of assignments with attachments (1 to 5 of them)")
+    parser.add_argument('-attachment-size', dest='attachment_size', type=float, default=150,
+                        help="The median size (KB) of the attachments")
+    parser.add_argument('-attachment-size-sigma', dest='attachment_size_sigma', type=float, default=1,
+                        help="The standard deviation of the logarithm of the size of the attachments")
+    parser.add_argument('-seed', dest='seed', type=int, default=0, help="The seed of the random generator")
+    parser.add_argument('-batch-size', dest='batch_size', type=int, default=50000,
+                        help="The number of rows inserted per transaction")
+    parser.add_argument('-log-file', dest='log_file', help="The log file to use")
+    return parser
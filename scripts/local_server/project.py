@@ -0,0 +1,182 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Creates Workforce projects in the local server
+
+   A project has the items a project created in ArcGIS Online has, using the layer definitions of the ArcGIS API for
+   Python: an offline-enabled (version 2) project is a feature service with the assignments, workers, dispatchers,
+   assignment types and integrations layers, a version 1 project is a Workforce Project item referencing the
+   assignments, workers, dispatchers and location tracking services. Both have a group and the dispatcher and worker
+   web maps. The owner is added as the first dispatcher.
+"""
+
+import copy
+
+_NAVIGATOR_URL_TEMPLATE = "https://navigator.arcgis.app?stop=${assignment.latitude},${assignment.longitude}" \
+                          "&stopname=${assignment.location}&callback=https://workforce.arcgis.app" \
+                          "&callbackprompt=Workforce"
+
+# The layers of a version 2 project, in the order of their ids
+_DEFINITIONS = ["assignment_layer_definition_v2", "worker_layer_definition_v2", "dispatcher_table_definition_v2",
+                "assignment_type_table_definition_v2", "app_integration_table_definition_v2"]
+# The services of a version 1 project, by their key in the project data
+_DEFINITIONS_V1 = [("assignments", "assignment_layer_definition_v1"), ("workers", "worker_layer_definition_v1"),
+                   ("dispatchers", "dispatcher_layer_definition_v1"), ("tracks", "tracking_layer_definition_v1")]
+# The fields ArcGIS Online adds when editor tracking is enabled on a version 1 service
+_EDITOR_TRACKING_FIELDS = {"creationDateField": ("CreationDate", "esriFieldTypeDate"),
+                           "creatorField": ("Creator", "esriFieldTypeString"),
+                           "editDateField": ("EditDate", "esriFieldTypeDate"),
+                           "editorField": ("Editor", "esriFieldTypeString")}
+
+
+def get_service_url(service_name):
+    """
+    Gets the url of a feature service, relative to the local server. Urls starting with / are made absolute when
+    items are returned.
+    :param service_name: (string) The name of the service
+    :return: (string) The url
+    """
+    return "/server/rest/services/{}/FeatureServer".format(service_name)
+
+
+def _get_definitions(names):
+    from arcgis.apps.workforce._store import _definitions
+    definitions = [copy.deepcopy(getattr(_definitions, name)) for name in names]
+    for definition in definitions:
+        # Protocol buffers are not implemented, the scripts fall back to JSON
+        definition["supportedQueryFormats"] = "JSON"
+    return definitions
+
+
+def _add_editor_tracking(definition):
+    """
+    Adds the editor tracking fields to a version 1 layer definition
+    :param definition: (Dict) The layer definition
+    """
+    definition["editFieldsInfo"] = {}
+    for key, (name, field_type) in _EDITOR_TRACKING_FIELDS.items():
+        definition["fields"].append({"name": name, "alias": name, "type": field_type, "sqlType": "sqlTypeOther",
+                                     "length": 128 if field_type == "esriFieldTypeString" else 8, "nullable": True,
+                                     "editable": False, "domain": None, "defaultValue": None})
+        definition["editFieldsInfo"][key] = name
+
+
+def _add_web_map(store, title, owner, keyword, layers):
+    """
+    Adds a web map showing layers of the project
+    :param layers: (List<(Dict, Dict)>) The service item and the definition of each layer
+    :return: (Dict) The web map item
+    """
+    data = {
+        "operationalLayers": [{"id": "{}_{}".format(layer["name"].replace(" ", ""), layer["id"]),
+                               "title": layer["name"], "url": "{}/{}".format(service_item["url"], layer["id"]),
+                               "layerType": "ArcGISFeatureLayer", "itemId": service_item["id"], "visibility": True}
+                              for service_item, layer in layers],
+        "baseMap": {"baseMapLayers": [], "title": "None"},
+        "spatialReference": {"wkid": 102100, "latestWkid": 3857},
+        "version": "2.18"
+    }
+    service_item_ids = list(dict.fromkeys(service_item["id"] for service_item, _ in layers))
+    return store.add_item({"title": title, "type": "Web Map", "owner": owner,
+                           "typeKeywords": ["ArcGIS Online", "Collector", "Data Editing", "Explorer Web Map", "Map",
+                                            "Offline", "Online Map", "Web Map", "Workforce Project", keyword],
+                           "relationships": {"WorkforceMap2FeatureService": service_item_ids}}, data)
+
+
+def _add_service_item(store, title, owner, summary, service_name, type_keywords):
+    return store.add_item({"title": title, "type": "Feature Service", "owner": owner, "snippet": summary,
+                           "url": get_service_url(service_name), "name": service_name,
+                           "typeKeywords": ["ArcGIS Server", "Data", "Feature Access", "Feature Service", "Service",
+                                            "Hosted Service"] + type_keywords,
+                           "tags": ["workforce"]})
+
+
+def create_project(store, title, owner, summary=None, major_version=2):
+    """
+    Creates a Workforce project
+    :param store: (Store) The store of the local server
+    :param title: (string) The title of the project
+    :param owner: (string) The username of the owner, who must exist
+    :param summary: (string) The summary of the project
+    :param major_version: (int) 2 for an offline-enabled project, 1 for a project with location tracking
+    :return: (Dict) The project item, whose id is the project id
+    """
+    user = store.get_user(owner)
+    if user is None:
+        raise ValueError("User '{}' does not exist".format(owner))
+    if major_version not in (1, 2):
+        raise ValueError("Invalid major version: {}".format(major_version))
+    group = store.add_group(title, owner)
+    if major_version == 1:
+        return _create_v1_project(store, title, user, summary, group)
+    service_name = "workforce_{}".format(group["id"])
+    definitions = _get_definitions(_DEFINITIONS)
+    layers = [d for d in definitions if d.get("geometryType", None)]
+    tables = [d for d in definitions if not d.get("geometryType", None)]
+    store.add_service(service_name, layers, tables)
+    service_item = _add_service_item(store, title, owner, summary, service_name, ["Workforce Project"])
+    map_layers = [(service_item, definition) for definition in definitions[:2]]
+    dispatcher_map = _add_web_map(store, title, owner, "Workforce Dispatcher", map_layers)
+    worker_map = _add_web_map(store, title, owner, "Workforce Worker", map_layers)
+    service_item = store.update_item(service_item["id"], {"properties": {
+        "workforceProjectGroupId": group["id"],
+        "workforceProjectVersion": "2.0.0",
+        "workforceDispatcherMapId": dispatcher_map["id"],
+        "workforceWorkerMapId": worker_map["id"]
+    }})
+    dispatchers = store.get_layer(service_name, 2)
+    dispatchers.apply_edits({"adds": [{"attributes": {"name": user["fullName"], "userid": owner}}]}, owner)
+    integrations = store.get_layer(service_name, 4)
+    integrations.apply_edits({"adds": [{"attributes": {
+        "appid": "arcgis-navigator",
+        "prompt": "Navigate to Assignment",
+        "urltemplate": _NAVIGATOR_URL_TEMPLATE
+    }}]}, owner)
+    return service_item
+
+
+def _create_v1_project(store, title, user, summary, group):
+    owner = user["username"]
+    service_items = {}
+    definitions = {}
+    for key, definition in zip([key for key, _ in _DEFINITIONS_V1],
+                               _get_definitions([name for _, name in _DEFINITIONS_V1])):
+        _add_editor_tracking(definition)
+        if key == "assignments":
+            definition["hasAttachments"] = True
+            definition.setdefault("advancedQueryCapabilities", {})["supportsQueryAttachments"] = True
+        service_name = "{}_{}".format("location" if key == "tracks" else key, group["id"])
+        store.add_service(service_name, [definition])
+        definitions[key] = definition
+        service_items[key] = _add_service_item(store, title if key == "assignments" else "{}_{}".format(key, title),
+                                               owner, summary, service_name, [])
+    dispatcher_map = _add_web_map(store, title, owner, "Workforce Dispatcher",
+                                  [(service_items[key], definitions[key]) for key in ("assignments", "workers")])
+    worker_map = _add_web_map(store, title, owner, "Workforce Worker",
+                              [(service_items[key], definitions[key]) for key in ("assignments", "workers", "tracks")])
+    data = {"workerWebMapId": worker_map["id"], "dispatcherWebMapId": dispatcher_map["id"]}
+    for key, service_item in service_items.items():
+        data[key] = {"serviceItemId": service_item["id"], "url": "{}/0".format(service_item["url"])}
+    data["tracks"].update({"enabled": True, "updateInterval": 30})
+    data.update({
+        "assignmentIntegrations": [{"id": "default-navigator", "prompt": "Navigate to Assignment",
+                                    "urlTemplate": _NAVIGATOR_URL_TEMPLATE}],
+        "version": "1.3.0",
+        "groupId": group["id"],
+        "folderId": None
+    })
+    project_item = store.add_item({"title": title, "type": "Workforce Project", "owner": owner, "snippet": summary,
+                                   "typeKeywords": ["Workforce Project"], "tags": ["workforce"]}, data)
+    dispatchers = store.get_layer(service_items["dispatchers"]["name"], 0)
+    dispatchers.apply_edits({"adds": [{"attributes": {"name": user["fullName"], "userId": owner}}]}, owner)
+    return project_item
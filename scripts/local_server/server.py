@@ -0,0 +1,732 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   The HTTP side of the local server: the portal (/portal/sharing/rest) and the feature services
+   (/server/rest/services/<name>/FeatureServer) answering the requests of the ArcGIS API for Python
+
+   The ArcGIS API for Python only talks to portals over https, so the server always uses TLS. Connect with
+   --skip-ssl-verification (verify_cert=False) unless the certificate is trusted.
+"""
+
+import email.parser
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import secrets
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+from .project import get_service_url
+from .store import ServiceError
+
+PORTAL_PATH = "/portal"
+SHARING_PATH = PORTAL_PATH + "/sharing/rest"
+SERVICES_PATH = "/server/rest/services"
+ADMIN_SERVICES_PATH = "/server/rest/admin/services"
+# The number of minutes a token is valid for, unless the client asks for another expiration
+DEFAULT_TOKEN_EXPIRATION = 60
+# The version of ArcGIS Enterprise the portal reports
+PORTAL_VERSION = "8.2"
+# The name of the geocoding service, and the batch limits it reports, those of the ArcGIS World Geocoding Service
+GEOCODE_SERVICE = "Locator"
+GEOCODE_MAX_BATCH_SIZE = 1000
+GEOCODE_SUGGESTED_BATCH_SIZE = 150
+# An address made of a latitude and a longitude, e.g. "34.05, -117.19"
+_COORDINATES = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+
+_routes = []
+
+
+def route(pattern, authenticated=True):
+    """
+    Registers a handler for the paths matching a pattern. The groups of the pattern are passed to the handler, after
+    the request.
+    :param pattern: (string) The regular expression of the path
+    :param authenticated: (bool) Whether the request needs a valid token
+    """
+    def register(handler):
+        _routes.append((re.compile(pattern + "/?$"), authenticated, handler))
+        return handler
+    return register
+
+
+class Request(object):
+    """
+    A parsed request: its parameters (from the query string and the form), uploaded files and user
+    """
+
+    def __init__(self, server, base_url, path, params, files):
+        self.server = server
+        self.store = server.store
+        self.base_url = base_url
+        self.path = path
+        self.params = params
+        self.files = files
+        self.user = None
+
+    @property
+    def username(self):
+        return self.user["username"] if self.user else None
+
+    def absolute(self, item):
+        """
+        Makes the urls of an item, or of the data of an item, absolute for the host the client connected to
+        :param item: (Dict) The item, or its data
+        :return: (Dict) The item
+        """
+        if isinstance(item, list):
+            return [self.absolute(value) for value in item]
+        if not isinstance(item, dict):
+            return item
+        item = {key: self.absolute(value) for key, value in item.items()}
+        if isinstance(item.get("url", None), str) and item["url"].startswith("/"):
+            item["url"] = self.base_url + item["url"]
+        return item
+
+
+class Response(object):
+    """
+    A response that is not JSON, e.g. the content of an attachment
+    """
+
+    def __init__(self, body, content_type, file_name=None):
+        self.body = body
+        self.content_type = content_type
+        self.file_name = file_name
+
+
+class LocalServer(ThreadingHTTPServer):
+    """
+    The local portal and feature services, backed by a Store
+    """
+    daemon_threads = True
+
+    def __init__(self, address, store, cert_file, key_file):
+        """
+        :param address: (string, int) The host and port to listen on
+        :param store: (Store) The store
+        :param cert_file: (string) The certificate of the server, in PEM format
+        :param key_file: (string) The private key of the certificate, in PEM format
+        """
+        super(LocalServer, self).__init__(address, _Handler)
+        self.store = store
+        self._tokens = {}
+        self._tokens_lock = threading.Lock()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+        # The handshake happens in the thread of the request rather than in the loop accepting connections
+        self.socket = context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "https://{}:{}{}".format(host, port, PORTAL_PATH)
+
+    def create_token(self, user, expiration):
+        """
+        :param user: (Dict) The user the token is for
+        :param expiration: (int) The number of minutes the token is valid for
+        :return: (string, int) The token and when it expires, in epoch milliseconds
+        """
+        token = secrets.token_urlsafe(32)
+        expires = int((time.time() + expiration * 60) * 1000)
+        with self._tokens_lock:
+            self._tokens[token] = (user["username"], expires)
+        return token, expires
+
+    def get_token_user(self, token):
+        """
+        :param token: (string) A token
+        :return: (Dict) The user of the token, or None if the token is unknown or expired
+        """
+        with self._tokens_lock:
+            username, expires = self._tokens.get(token, (None, 0))
+        if username is None or expires < time.time() * 1000:
+            return None
+        return self.store.get_user(username)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, which Nagle's algorithm holds back until the client acknowledges
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.getLogger().debug("%s %s", self.address_string(), format % args)
+
+    def do_GET(self):
+        self._handle(b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        self._handle(self.rfile.read(length) if length else b"")
+
+    def _parse(self, body):
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        files = {}
+        content_type = self.headers.get("Content-Type", "") or ""
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser().parsebytes(
+                "Content-Type: {}\r\n\r\n".format(content_type).encode("latin-1") + body)
+            for part in message.get_payload():
+                name = part.get_param("name", header="content-disposition")
+                content = part.get_payload(decode=True) or b""
+                file_name = part.get_filename()
+                if file_name is None:
+                    params[name] = content.decode("utf-8")
+                else:
+                    files[name] = (os.path.basename(file_name), part.get_content_type(), content)
+        elif body:
+            params.update(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+        return url.path.rstrip("/") or "/", params, files
+
+    def _get_token(self, params):
+        token = params.get("token", None)
+        for header in ("X-Esri-Authorization", "Authorization"):
+            value = self.headers.get(header, None)
+            if not token and value and value.lower().startswith("bearer "):
+                token = value[7:].strip()
+        return token
+
+    def _handle(self, body):
+        try:
+            path, params, files = self._parse(body)
+            request = Request(self.server, "https://{}".format(self.headers.get("Host", "localhost")), path, params,
+                              files)
+            result = self._dispatch(request)
+        except ServiceError as e:
+            result = e.to_json()
+        except Exception as e:
+            logging.getLogger().exception("Request failed: %s", self.path)
+            result = ServiceError(str(e), 500).to_json()
+        if isinstance(result, Response):
+            headers = {"Content-Type": result.content_type}
+            if result.file_name:
+                headers["Content-Disposition"] = 'attachment; filename="{}"'.format(result.file_name)
+            self._send(result.body, headers)
+        else:
+            self._send(json.dumps(result).encode("utf-8"), {"Content-Type": "application/json; charset=utf-8"})
+
+    def _dispatch(self, request):
+        for pattern, authenticated, handler in _routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            token = self._get_token(request.params)
+            if token:
+                request.user = self.server.get_token_user(token)
+                if request.user is None:
+                    raise ServiceError("Invalid token.", 498)
+            if authenticated and request.user is None:
+                raise ServiceError("Token Required", 499)
+            return handler(request, *match.groups())
+        raise ServiceError("Invalid URL", 400)
+
+    def _send(self, body, headers):
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _get_user_json(user):
+    return dict(user, groups=[])
+
+
+# Portal
+
+
+@route(SHARING_PATH, authenticated=False)
+def _root(request):
+    return {"currentVersion": PORTAL_VERSION}
+
+
+@route(SHARING_PATH + "/info", authenticated=False)
+def _info(request):
+    return {"owningSystemUrl": request.base_url + PORTAL_PATH,
+            "authInfo": {"tokenServicesUrl": request.base_url + SHARING_PATH + "/generateToken",
+                         "isTokenBasedSecurity": True}}
+
+
+@route(SHARING_PATH + "/generateToken", authenticated=False)
+def _generate_token(request):
+    # The ArcGIS API for Python exchanges the portal token for a token of the server of each service
+    user = request.user if request.params.get("request", None) == "getToken" else None
+    if user is None:
+        user = request.store.check_password(request.params.get("username", ""), request.params.get("password", ""))
+    if user is None:
+        raise ServiceError("Unable to generate token.", 400, ["Invalid username or password."])
+    expiration = int(request.params.get("expiration", None) or DEFAULT_TOKEN_EXPIRATION)
+    token, expires = request.server.create_token(user, expiration)
+    return {"token": token, "expires": expires, "ssl": True}
+
+
+@route(SHARING_PATH + "/portals/self", authenticated=False)
+def _portal_self(request):
+    portal = {"id": "local", "name": "Local Workforce Scripts Server", "portalName": "ArcGIS Enterprise",
+              "portalMode": "singletenant", "isPortal": True, "allSSL": True, "supportsOAuth": False,
+              "portalHostname": request.base_url[len("https://"):] + PORTAL_PATH, "urlKey": None,
+              "customBaseUrl": None, "currentVersion": PORTAL_VERSION,
+              "helperServices": {"geocode": [{"url": _get_geocode_url(request), "name": "Local Locator", "batch": True,
+                                              "placefinding": True, "suggest": False}]},
+              "useVectorBasemaps": False, "basemapGalleryGroupQuery": "", "defaultExtent": {
+                  "xmin": -20037508.34, "ymin": -20037508.34, "xmax": 20037508.34, "ymax": 20037508.34,
+                  "spatialReference": {"wkid": 102100, "latestWkid": 3857}}}
+    if request.user is not None:
+        portal["user"] = _get_user_json(request.user)
+    return portal
+
+
+@route(PORTAL_PATH + "/portaladmin", authenticated=False)
+def _portal_admin(request):
+    return {}
+
+
+@route(SHARING_PATH + "/community/self")
+def _community_self(request):
+    return _get_user_json(request.user)
+
+
+@route(SHARING_PATH + "/community/users/([^/]+)")
+def _community_user(request, username):
+    user = request.store.get_user(username)
+    if user is None:
+        raise ServiceError("User does not exist or is inaccessible.", 400)
+    return _get_user_json(user)
+
+
+@route(SHARING_PATH + "/content/users/([^/]+)(?:/([0-9a-f]+))?")
+def _user_content(request, username, folder_id=None):
+    folders = request.store.get_folders(username)
+    items = [request.absolute(item) for item in request.store.get_user_items(username, folder_id)]
+    current_folder = next((folder for folder in folders if folder["id"] == folder_id), None)
+    return {"username": username, "total": len(items), "start": 1, "num": len(items), "nextStart": -1,
+            "currentFolder": current_folder, "items": items, "folders": folders if folder_id is None else []}
+
+
+@route(SHARING_PATH + "/content/users/([^/]+)/createFolder")
+def _create_folder(request, username):
+    return {"success": True, "folder": request.store.add_folder(username, request.params.get("title", ""))}
+
+
+@route(SHARING_PATH + "/content/users/[^/]+/([0-9a-f]+)/delete")
+def _delete_folder(request, folder_id):
+    request.store.delete_folder(folder_id)
+    return {"success": True, "folder": {"id": folder_id}}
+
+
+@route(SHARING_PATH + "/community/groups/([0-9a-f]+)")
+def _group(request, group_id):
+    group = request.store.get_group(group_id)
+    if group is None:
+        raise ServiceError("Group does not exist or is inaccessible.", 400)
+    return group
+
+
+@route(SHARING_PATH + "/community/createGroup")
+def _create_group(request):
+    group = request.store.add_group(request.params.get("title", ""), request.username)
+    return {"success": True, "group": group}
+
+
+@route(SHARING_PATH + "/community/groups/([0-9a-f]+)/(?:protect|unprotect)")
+def _protect_group(request, group_id):
+    # Groups of the local server are always protected
+    return {"success": True}
+
+
+@route(SHARING_PATH + "/community/groups/([0-9a-f]+)/addUsers")
+def _add_group_users(request, group_id):
+    usernames = [u for u in request.params.get("users", "").split(",") if u]
+    usernames += [u for u in request.params.get("admins", "").split(",") if u]
+    return {"notAdded": request.store.add_group_users(group_id, usernames)}
+
+
+@route(SHARING_PATH + "/community/groups/([0-9a-f]+)/removeUsers")
+def _remove_group_users(request, group_id):
+    return {"notRemoved": request.store.remove_group_users(group_id, request.params.get("users", "").split(","))}
+
+
+@route(SHARING_PATH + "/content/items/([0-9a-f]+)")
+def _item(request, item_id):
+    item = request.store.get_item(item_id)
+    if item is None:
+        raise ServiceError("Item does not exist or is inaccessible.", 400)
+    return request.absolute(item)
+
+
+@route(SHARING_PATH + "/content/items/([0-9a-f]+)/data")
+def _item_data(request, item_id):
+    data = request.store.get_item_data(item_id)
+    try:
+        # The project and web map data have the urls of the layers
+        data = json.dumps(request.absolute(json.loads(data or "{}")))
+    except ValueError:
+        pass
+    return Response(data.encode("utf-8"), "application/json; charset=utf-8")
+
+
+@route(SHARING_PATH + "/content/items/([0-9a-f]+)/relatedItems")
+def _related_items(request, item_id):
+    items = request.store.get_related_items(item_id, request.params.get("relationshipType", ""),
+                                            request.params.get("direction", "forward"))
+    return {"total": len(items), "relatedItems": [request.absolute(item) for item in items]}
+
+
+def _get_item_properties(request):
+    properties = {}
+    for key, value in request.params.items():
+        if key in ("f", "token", "text", "clearEmptyFields", "async", "overwrite"):
+            continue
+        if key in ("properties", "extent", "typeKeywords", "tags") and value.startswith(("{", "[")):
+            value = json.loads(value)
+        elif key in ("typeKeywords", "tags"):
+            value = [v.strip() for v in value.split(",") if v.strip()]
+        properties[key] = value
+    return properties
+
+
+@route(SHARING_PATH + "/content/users/([^/]+)(?:/([0-9a-f]+))?/addItem")
+def _add_item(request, username, folder_id=None):
+    item = request.store.add_item(dict(_get_item_properties(request), owner=username, ownerFolder=folder_id),
+                                  request.params.get("text", None))
+    return {"success": True, "id": item["id"], "folder": folder_id}
+
+
+@route(SHARING_PATH + "/content/users/([^/]+)(?:/([0-9a-f]+))?/createService")
+def _create_service(request, username, folder_id=None):
+    properties = json.loads(request.params.get("createParameters", None) or "{}")
+    name = properties.pop("name", "")
+    if request.store.get_service(name) is not None:
+        raise ServiceError("Service name '{}' already exists".format(name), 409)
+    request.store.add_service(name, [], [], properties)
+    item = request.store.add_item({"title": name, "type": "Feature Service", "owner": username,
+                                   "ownerFolder": folder_id, "url": get_service_url(name), "name": name,
+                                   "snippet": request.params.get("snippet", None),
+                                   "typeKeywords": ["ArcGIS Server", "Data", "Feature Access", "Feature Service",
+                                                    "Service", "Hosted Service"],
+                                   "tags": [t for t in request.params.get("tags", "").split(",") if t]})
+    url = request.base_url + item["url"]
+    return {"success": True, "itemId": item["id"], "serviceItemId": item["id"], "name": name, "serviceurl": url,
+            "encodedServiceURL": url, "size": -1, "type": "Feature Service", "isView": False}
+
+
+@route(SHARING_PATH + "/content/users/[^/]+(?:/[^/]+)?/items/([0-9a-f]+)/update")
+def _update_item(request, item_id):
+    request.store.update_item(item_id, _get_item_properties(request), request.params.get("text", None))
+    return {"success": True, "id": item_id}
+
+
+@route(SHARING_PATH + "/content/users/[^/]+(?:/[^/]+)?/items/([0-9a-f]+)/(protect|unprotect)")
+def _protect_item(request, item_id, operation):
+    request.store.update_item(item_id, {"protected": operation == "protect"})
+    return {"success": True}
+
+
+@route(SHARING_PATH + "/content/users/[^/]+(?:/[^/]+)?/items/([0-9a-f]+)/delete")
+def _delete_item(request, item_id):
+    item = request.store.get_item(item_id)
+    if item is not None and item.get("protected", False):
+        raise ServiceError("Unable to delete item. Delete protection is turned on.", 400)
+    request.store.delete_item(item_id)
+    return {"success": True, "itemId": item_id}
+
+
+@route(SHARING_PATH + "/content/users/[^/]+/shareItems")
+def _share_items(request):
+    # Every user of the local server can access every item, sharing only has to succeed
+    return {"results": [{"itemId": item_id, "success": True, "notSharedWith": []}
+                        for item_id in request.params.get("items", "").split(",") if item_id]}
+
+
+@route(SHARING_PATH + "/content/items/([0-9a-f]+)/share")
+def _share_item(request, item_id):
+    return {"itemId": item_id, "notSharedWith": []}
+
+
+@route(SHARING_PATH + "/content/users/[^/]+/addRelationship")
+def _add_relationship(request):
+    request.store.add_relationship(request.params.get("originItemId", ""),
+                                   request.params.get("destinationItemId", ""),
+                                   request.params.get("relationshipType", ""))
+    return {"success": True}
+
+
+@route(SHARING_PATH + "/portals/self/isServiceNameAvailable")
+def _is_service_name_available(request):
+    return {"available": request.store.get_service(request.params.get("name", "")) is None}
+
+
+# Feature services
+
+
+def _get_layer(request, service, layer_id):
+    if request.store.get_service(service) is None:
+        raise ServiceError("Service not found", 404)
+    return request.store.get_layer(service, layer_id)
+
+
+@route(SERVICES_PATH, authenticated=False)
+def _services(request):
+    return {"currentVersion": 10.7, "folders": [], "services": []}
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer")
+def _service(request, service):
+    definition = request.store.get_service(service)
+    if definition is None:
+        raise ServiceError("Service not found", 404)
+    return definition
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/applyEdits")
+def _service_apply_edits(request, service):
+    edits = json.loads(request.params.get("edits", None) or "[]")
+    results = []
+    for edit in edits:
+        layer = _get_layer(request, service, edit["id"])
+        result = layer.apply_edits(dict(edit, useGlobalIds=request.params.get("useGlobalIds", "false"),
+                                        rollbackOnFailure=request.params.get("rollbackOnFailure", "true")),
+                                   request.username)
+        results.append(dict(result, id=edit["id"]))
+    return results
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)")
+def _layer(request, service, layer_id):
+    return _get_layer(request, service, layer_id).definition
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/query")
+def _query(request, service, layer_id):
+    if request.params.get("f", "json") not in ("json", "pjson"):
+        raise ServiceError("Unsupported format: '{}'".format(request.params["f"]))
+    return _get_layer(request, service, layer_id).query(request.params)
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/applyEdits")
+def _apply_edits(request, service, layer_id):
+    return _get_layer(request, service, layer_id).apply_edits(request.params, request.username)
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/addFeatures")
+def _add_features(request, service, layer_id):
+    params = dict(request.params, adds=request.params.get("features", None))
+    return {"addResults": _get_layer(request, service, layer_id).apply_edits(params, request.username)["addResults"]}
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/updateFeatures")
+def _update_features(request, service, layer_id):
+    params = dict(request.params, updates=request.params.get("features", None))
+    results = _get_layer(request, service, layer_id).apply_edits(params, request.username)
+    return {"updateResults": results["updateResults"]}
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/deleteFeatures")
+def _delete_features(request, service, layer_id):
+    layer = _get_layer(request, service, layer_id)
+    object_ids = request.params.get("objectIds", None)
+    if not object_ids:
+        object_ids = layer.query({"where": request.params.get("where", None) or "1=0", "returnIdsOnly": "true"})["objectIds"]
+    params = dict(request.params, deletes=",".join(str(object_id) for object_id in object_ids)
+                  if isinstance(object_ids, list) else object_ids)
+    return {"deleteResults": layer.apply_edits(params, request.username)["deleteResults"]}
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/queryAttachments")
+def _query_attachments(request, service, layer_id):
+    return _get_layer(request, service, layer_id).query_attachments(request.params)
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/(\\d+)/attachments")
+def _attachments(request, service, layer_id, object_id):
+    return _get_layer(request, service, layer_id).get_attachments(int(object_id))
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/(\\d+)/attachments/(\\d+)")
+def _attachment(request, service, layer_id, object_id, attachment_id):
+    layer = _get_layer(request, service, layer_id)
+    name, content_type, data = layer.get_attachment(int(object_id), int(attachment_id))
+    return Response(bytes(data), content_type or "application/octet-stream", name)
+
+
+def _get_upload(request):
+    if "attachment" not in request.files:
+        raise ServiceError("An attachment file is required")
+    return request.files["attachment"]
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/(\\d+)/addAttachment")
+def _add_attachment(request, service, layer_id, object_id):
+    name, content_type, data = _get_upload(request)
+    return _get_layer(request, service, layer_id).add_attachment(int(object_id), name, content_type, data,
+                                                                 request.params.get("keywords", None))
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/(\\d+)/updateAttachment")
+def _update_attachment(request, service, layer_id, object_id):
+    name, content_type, data = _get_upload(request)
+    return _get_layer(request, service, layer_id).update_attachment(
+        int(object_id), int(request.params.get("attachmentId", 0)), name, content_type, data)
+
+
+@route(SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/(\\d+)/deleteAttachments")
+def _delete_attachments(request, service, layer_id, object_id):
+    attachment_ids = [int(a) for a in request.params.get("attachmentIds", "").split(",") if a.strip()]
+    return _get_layer(request, service, layer_id).delete_attachments(int(object_id), attachment_ids)
+
+
+# Geocoding, with a stand-in for a locator that finds "<latitude>, <longitude>" and makes up a location for any
+# other address, so that geocoding scripts can run offline
+
+
+def _get_geocode_url(request):
+    return request.base_url + SERVICES_PATH + "/" + GEOCODE_SERVICE + "/GeocodeServer"
+
+
+def _parse_out_sr(value):
+    if not value:
+        return 4326
+    if isinstance(value, str) and value.strip().startswith("{"):
+        value = json.loads(value)
+    if isinstance(value, dict):
+        value = value.get("latestWkid", None) or value.get("wkid", None)
+    wkid = int(value)
+    if wkid not in (4326, 3857, 102100):
+        raise ServiceError("Unsupported output spatial reference: {}".format(wkid))
+    return wkid
+
+
+def _locate(address, wkid):
+    """
+    :return: (Tuple<float, float>) The x and y of an address, or None if the address is empty
+    """
+    if not address.strip():
+        return None
+    match = _COORDINATES.match(address)
+    if match:
+        y, x = float(match.group(1)), float(match.group(2))
+    else:
+        digest = hashlib.sha1(" ".join(address.lower().split()).encode("utf-8")).digest()
+        x = -118 + int.from_bytes(digest[:4], "big") / 2 ** 32
+        y = 33.5 + int.from_bytes(digest[4:8], "big") / 2 ** 32
+    if wkid == 4326:
+        return x, y
+    # Web Mercator
+    return x * 20037508.34 / 180, math.log(math.tan((90 + y) * math.pi / 360)) * 6378137
+
+
+@route(SERVICES_PATH + "/" + GEOCODE_SERVICE + "/GeocodeServer")
+def _geocoder(request):
+    return {"currentVersion": 10.7, "serviceDescription": "Local Workforce Scripts Locator",
+            "addressFields": [{"name": "Address", "type": "esriFieldTypeString", "alias": "Address", "required": False,
+                               "length": 100}],
+            "singleLineAddressField": {"name": "SingleLine", "type": "esriFieldTypeString", "alias": "Single Line Input",
+                                       "required": False, "length": 200},
+            "candidateFields": [], "spatialReference": {"wkid": 4326, "latestWkid": 4326},
+            "locatorProperties": {"MaxBatchSize": GEOCODE_MAX_BATCH_SIZE,
+                                  "SuggestedBatchSize": GEOCODE_SUGGESTED_BATCH_SIZE},
+            "capabilities": "Geocode"}
+
+
+@route(SERVICES_PATH + "/" + GEOCODE_SERVICE + "/GeocodeServer/geocodeAddresses")
+def _geocode_addresses(request):
+    records = json.loads(request.params.get("addresses", None) or "{}").get("records", [])
+    if len(records) > GEOCODE_MAX_BATCH_SIZE:
+        raise ServiceError("Unable to complete operation.", 400,
+                           ["The number of addresses exceeds the maximum batch size of {}".format(GEOCODE_MAX_BATCH_SIZE)])
+    wkid = _parse_out_sr(request.params.get("outSR", None))
+    locations = []
+    for record in records:
+        attributes = record.get("attributes", {})
+        address = str(attributes.get("SingleLine", None) or attributes.get("Address", None) or "")
+        location = _locate(address, wkid)
+        score = 100 if location else 0
+        locations.append({"address": address if location else "",
+                          "location": {"x": location[0], "y": location[1]} if location else {"x": "NaN", "y": "NaN"},
+                          "score": score,
+                          "attributes": {"ResultID": attributes.get("OBJECTID", None), "Loc_name": GEOCODE_SERVICE,
+                                         "Status": "M" if location else "U", "Score": score,
+                                         "Match_addr": address if location else ""}})
+    return {"spatialReference": {"wkid": wkid, "latestWkid": 3857 if wkid == 102100 else wkid}, "locations": locations}
+
+
+# Administration of the feature services, used to create projects
+
+
+@route(ADMIN_SERVICES_PATH + "/([^/]+)/FeatureServer")
+def _admin_service(request, service):
+    return _service(request, service)
+
+
+@route(ADMIN_SERVICES_PATH + "/([^/]+)/FeatureServer(?:/\\d+)?/refresh")
+def _admin_refresh(request, service):
+    return {"success": True}
+
+
+@route(ADMIN_SERVICES_PATH + "/([^/]+)/FeatureServer/addToDefinition")
+def _add_to_service_definition(request, service):
+    definition = json.loads(request.params.get("addToDefinition", None) or "{}")
+    request.store.add_to_service(service, definition.get("layers", []), definition.get("tables", []))
+    return {"success": True}
+
+
+@route(ADMIN_SERVICES_PATH + "/([^/]+)/FeatureServer/updateDefinition")
+def _update_service_definition(request, service):
+    request.store.update_service(service, json.loads(request.params.get("updateDefinition", None) or "{}"))
+    return {"success": True}
+
+
+@route(ADMIN_SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)")
+def _admin_layer(request, service, layer_id):
+    return _layer(request, service, layer_id)
+
+
+@route(ADMIN_SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/addToDefinition")
+def _add_to_layer_definition(request, service, layer_id):
+    definition = json.loads(request.params.get("addToDefinition", None) or "{}")
+    _get_layer(request, service, layer_id)
+    if set(definition) - {"fields"}:
+        raise ServiceError("Only fields can be added to the definition of a layer")
+    request.store.add_fields(service, layer_id, definition.get("fields", []))
+    return {"success": True}
+
+
+@route(ADMIN_SERVICES_PATH + "/([^/]+)/FeatureServer/(\\d+)/updateDefinition")
+def _update_layer_definition(request, service, layer_id):
+    _get_layer(request, service, layer_id)
+    request.store.update_layer_definition(service, layer_id,
+                                          json.loads(request.params.get("updateDefinition", None) or "{}"))
+    return {"success": True}
+
+
+def create_certificate(cert_file, key_file, host):
+    """
+    Creates a self-signed certificate with the openssl command line tool
+    :param cert_file: (string) The certificate file to write
+    :param key_file: (string) The private key file to write
+    :param host: (string) The host name of the certificate
+    """
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key_file, "-out",
+                    cert_file, "-days", "3650", "-subj", "/CN={}".format(host)],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.chmod(key_file, 0o600)
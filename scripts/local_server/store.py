@@ -0,0 +1,1066 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   The SQLite database behind the local server: the portal users, groups and items, and one table per feature layer
+   with its attachments
+
+   The layers answer the subset of the feature service REST API the scripts use: query (where, objectIds, outFields,
+   orderByFields, paging, returnIdsOnly, returnCountOnly, returnExtentOnly, returnDistinctValues and outStatistics),
+   applyEdits and the attachment operations. Where clauses are run by SQLite once their date literals are converted to
+   epoch milliseconds, the way dates are stored. Spatial filters and projections are not supported.
+"""
+
+import datetime
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+# The SQLite type of each field type
+_COLUMN_TYPES = {
+    "esriFieldTypeOID": "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "esriFieldTypeSmallInteger": "INTEGER",
+    "esriFieldTypeInteger": "INTEGER",
+    "esriFieldTypeDate": "INTEGER",
+    "esriFieldTypeSingle": "REAL",
+    "esriFieldTypeDouble": "REAL",
+    "esriFieldTypeGlobalID": "TEXT COLLATE NOCASE",
+    "esriFieldTypeGUID": "TEXT COLLATE NOCASE",
+}
+_GUID_TYPES = {"esriFieldTypeGlobalID", "esriFieldTypeGUID"}
+# The column holding the geometry of a feature as JSON
+GEOMETRY_COLUMN = "__geometry"
+_STATISTICS = {"count": "COUNT", "sum": "SUM", "min": "MIN", "max": "MAX", "avg": "AVG"}
+# Date literals, string literals (which are left alone), the current date and statement separators
+_WHERE_TOKENS = re.compile(r"\b(timestamp|date)\s*'([^']*)'|('(?:[^']|'')*')|\b(current_timestamp|current_date)\b|(;|--|/\*)",
+                           re.IGNORECASE)
+# A date field compared to a string, e.g. CreationDate >= '2020-07-01 13:30:00', which services cast to a date
+_DATE_COMPARISON = re.compile(r"\b(\w+)\s*(<=|>=|<>|!=|=|<|>)\s*'(\d{4}-\d{2}-\d{2}[^']*)'")
+_DATE_FORMATS = ["%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"]
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY COLLATE NOCASE, password TEXT, json TEXT);
+CREATE TABLE IF NOT EXISTS groups (id TEXT PRIMARY KEY, json TEXT);
+CREATE TABLE IF NOT EXISTS group_users (group_id TEXT, username TEXT COLLATE NOCASE, PRIMARY KEY (group_id, username));
+CREATE TABLE IF NOT EXISTS folders (id TEXT PRIMARY KEY, username TEXT COLLATE NOCASE, json TEXT);
+CREATE TABLE IF NOT EXISTS items (id TEXT PRIMARY KEY, json TEXT, data TEXT);
+CREATE TABLE IF NOT EXISTS services (name TEXT PRIMARY KEY, json TEXT);
+CREATE TABLE IF NOT EXISTS layers (service TEXT, id INTEGER, json TEXT, table_name TEXT, PRIMARY KEY (service, id));
+CREATE TABLE IF NOT EXISTS attachments (id INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT, parent_id INTEGER,
+    global_id TEXT, name TEXT, content_type TEXT, keywords TEXT, data BLOB);
+CREATE INDEX IF NOT EXISTS attachments_parent ON attachments (table_name, parent_id);
+"""
+
+
+class ServiceError(Exception):
+    """
+    An error returned to the client as an ArcGIS REST error
+    """
+
+    def __init__(self, message, code=400, details=None):
+        """
+        :param message: (string) The error message
+        :param code: (int) The error code, an HTTP status code
+        :param details: (List<string>) More details about the error
+        """
+        super(ServiceError, self).__init__(message)
+        self.code = code
+        self.details = details or []
+
+    def to_json(self):
+        return {"error": {"code": self.code, "message": str(self), "details": self.details}}
+
+
+def now():
+    """
+    :return: (int) The current time in epoch milliseconds, the way dates are stored
+    """
+    return int(time.time() * 1000)
+
+
+def new_id():
+    """
+    :return: (string) A new item or group id
+    """
+    return uuid.uuid4().hex
+
+
+def new_global_id():
+    """
+    :return: (string) A new global id, e.g. {6F9619FF-8B86-D011-B42D-00C04FC964FF}
+    """
+    return "{" + str(uuid.uuid4()).upper() + "}"
+
+
+def normalize_guid(value):
+    """
+    Formats a GUID the way feature services return them, upper case and in braces
+    :param value: (string) The GUID
+    :return: (string) The formatted GUID, or the value if it is not a GUID
+    """
+    if not isinstance(value, str) or not value:
+        return value
+    try:
+        return "{" + str(uuid.UUID(value.strip("{}"))).upper() + "}"
+    except ValueError:
+        return value
+
+
+def parse_date(value):
+    """
+    Parses the date of a timestamp or date literal, in UTC
+    :param value: (string) The date, e.g. 2020-07-01 13:30:00
+    :return: (int) The date in epoch milliseconds
+    """
+    for date_format in _DATE_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(value.strip(), date_format)
+        except ValueError:
+            continue
+        return int(parsed.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    raise ServiceError("Invalid date: '{}'".format(value))
+
+
+def translate_where(where):
+    """
+    Converts a standardized where clause to SQLite, replacing the date literals with epoch milliseconds
+    :param where: (string) The where clause
+    :return: (string) The SQLite expression
+    """
+    def replace(match):
+        if match.group(2) is not None:
+            return str(parse_date(match.group(2)))
+        if match.group(3) is not None:
+            return match.group(3)
+        if match.group(4) is not None:
+            today = datetime.datetime.utcnow()
+            if match.group(4).lower() == "current_date":
+                today = today.replace(hour=0, minute=0, second=0, microsecond=0)
+            return str(int(today.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000))
+        raise ServiceError("Invalid where clause: '{}'".format(where))
+    return _WHERE_TOKENS.sub(replace, where or "1=1")
+
+
+def _is_true(value):
+    return value is True or (isinstance(value, str) and value.lower() == "true")
+
+
+def _split(value):
+    """
+    Splits a comma separated parameter, or a JSON list
+    :param value: (string or List) The parameter
+    :return: (List<string>) The values
+    """
+    if value is None or value == "":
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    value = value.strip()
+    if value.startswith("["):
+        return [str(v) for v in json.loads(value)]
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _load(value, default=None):
+    """
+    Loads a JSON parameter
+    :param value: (string or object) The parameter
+    :param default: The value of an empty parameter
+    :return: The loaded value
+    """
+    if value is None or value == "":
+        return default
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise ServiceError("Invalid JSON: '{}'".format(value[:100]))
+    return value
+
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class Layer(object):
+    """
+    A feature layer or table of the local server
+    """
+
+    def __init__(self, store, service, definition, table_name):
+        """
+        :param store: (Store) The store the layer is in
+        :param service: (string) The name of the feature service
+        :param definition: (Dict) The layer definition, as returned by the REST API
+        :param table_name: (string) The SQLite table of the features
+        """
+        self.store = store
+        self.service = service
+        self.definition = definition
+        self.table_name = table_name
+        self.fields = definition["fields"]
+        self._fields = {field["name"].lower(): field for field in self.fields}
+        self.object_id_field = definition.get("objectIdField") or self._field_of_type("esriFieldTypeOID")
+        self.global_id_field = definition.get("globalIdField") or self._field_of_type("esriFieldTypeGlobalID")
+        self.has_geometry = bool(definition.get("geometryType"))
+        self.edit_fields = definition.get("editFieldsInfo") or {}
+
+    def _field_of_type(self, field_type):
+        for field in self.fields:
+            if field["type"] == field_type:
+                return field["name"]
+        return None
+
+    @property
+    def max_record_count(self):
+        return int(self.definition.get("maxRecordCount", None) or 1000)
+
+    def get_field(self, name):
+        """
+        Gets a field by name, ignoring case
+        :param name: (string) The name of the field
+        :return: (Dict) The field
+        """
+        field = self._fields.get(name.strip().lower(), None)
+        if field is None:
+            raise ServiceError("Invalid field: '{}'".format(name))
+        return field
+
+    def _select(self, sql, parameters=()):
+        with self.store.lock:
+            return self.store.connection.execute(sql, parameters).fetchall()
+
+    def _where(self, params):
+        """
+        Builds the SQLite filter of a query from its where clause, objectIds and globalIds
+        :param params: (Dict) The query parameters
+        :return: (string, List) The filter and its parameters
+        """
+        if params.get("geometry", None):
+            raise ServiceError("Spatial filters are not supported by the local server")
+        clauses = ["({})".format(translate_where(self._cast_dates(params.get("where", None) or "1=1")))]
+        values = []
+        object_ids = _split(params.get("objectIds", None))
+        if object_ids:
+            clauses.append("{} IN ({})".format(_quote(self.object_id_field), ",".join("?" * len(object_ids))))
+            values.extend(int(object_id) for object_id in object_ids)
+        global_ids = _split(params.get("globalIds", None))
+        if global_ids and self.global_id_field:
+            clauses.append("{} IN ({})".format(_quote(self.global_id_field), ",".join("?" * len(global_ids))))
+            values.extend(normalize_guid(global_id) for global_id in global_ids)
+        return " AND ".join(clauses), values
+
+    def _cast_dates(self, where):
+        """
+        Replaces the strings compared to date fields with epoch milliseconds
+        :param where: (string) The where clause
+        :return: (string) The where clause
+        """
+        def replace(match):
+            field = self._fields.get(match.group(1).lower(), None)
+            if field is None or field["type"] != "esriFieldTypeDate":
+                return match.group(0)
+            return "{} {} {}".format(match.group(1), match.group(2), parse_date(match.group(3)))
+        return _DATE_COMPARISON.sub(replace, where)
+
+    def _order_by(self, params, extra_names=()):
+        clauses = []
+        for clause in _split(params.get("orderByFields", None)):
+            parts = clause.split()
+            direction = parts[1].upper() if len(parts) > 1 else "ASC"
+            if direction not in ("ASC", "DESC") or len(parts) > 2:
+                raise ServiceError("Invalid orderByFields: '{}'".format(params["orderByFields"]))
+            name = parts[0] if parts[0] in extra_names else self.get_field(parts[0])["name"]
+            clauses.append("{} {}".format(_quote(name), direction))
+        return clauses
+
+    def _out_fields(self, params):
+        names = _split(params.get("outFields", None)) or [self.object_id_field]
+        if "*" in names:
+            return list(self.fields)
+        fields = [self.get_field(name) for name in names]
+        return [field for i, field in enumerate(fields) if field not in fields[:i]]
+
+    def query(self, params):
+        """
+        Queries the layer
+        :param params: (Dict) The query parameters of the REST API
+        :return: (Dict) The response
+        """
+        where, values = self._where(params)
+        table = _quote(self.table_name)
+        if _is_true(params.get("returnCountOnly", None)) and not _is_true(params.get("returnExtentOnly", None)):
+            return {"count": self._select("SELECT COUNT(*) FROM {} WHERE {}".format(table, where), values)[0][0]}
+        if _is_true(params.get("returnIdsOnly", None)):
+            order_by = self._order_by(params) or [_quote(self.object_id_field)]
+            rows = self._select("SELECT {} FROM {} WHERE {} ORDER BY {}".format(
+                _quote(self.object_id_field), table, where, ", ".join(order_by)), values)
+            return {"objectIdFieldName": self.object_id_field, "objectIds": [row[0] for row in rows]}
+        if _is_true(params.get("returnExtentOnly", None)):
+            return self._query_extent(where, values, _is_true(params.get("returnCountOnly", None)))
+        if params.get("outStatistics", None):
+            return self._query_statistics(params, where, values)
+
+        fields = self._out_fields(params)
+        distinct = _is_true(params.get("returnDistinctValues", None))
+        return_geometry = self.has_geometry and not distinct and _is_true(params.get("returnGeometry", "true"))
+        columns = [_quote(field["name"]) for field in fields]
+        if return_geometry:
+            columns.append(_quote(GEOMETRY_COLUMN))
+        order_by = self._order_by(params) or ([] if distinct else [_quote(self.object_id_field)])
+        sql = "SELECT {}{} FROM {} WHERE {}".format("DISTINCT " if distinct else "", ", ".join(columns), table, where)
+        if order_by:
+            sql += " ORDER BY " + ", ".join(order_by)
+        offset = int(params.get("resultOffset", None) or 0)
+        count = int(params.get("resultRecordCount", None) or self.max_record_count)
+        count = min(count, self.max_record_count)
+        # One more record than requested tells whether the transfer limit was exceeded
+        rows = self._select(sql + " LIMIT ? OFFSET ?", values + [count + 1, offset])
+        features = []
+        for row in rows[:count]:
+            feature = {"attributes": {field["name"]: value for field, value in zip(fields, row)}}
+            if return_geometry and row[-1] is not None:
+                feature["geometry"] = json.loads(row[-1])
+            features.append(feature)
+        response = {
+            "objectIdFieldName": self.object_id_field,
+            "globalIdFieldName": self.global_id_field or "",
+            "fields": fields,
+            "features": features,
+            "exceededTransferLimit": len(rows) > count
+        }
+        if self.has_geometry:
+            response["geometryType"] = self.definition["geometryType"]
+            response["spatialReference"] = self.spatial_reference
+        return response
+
+    @property
+    def spatial_reference(self):
+        extent = self.definition.get("extent", None) or {}
+        return extent.get("spatialReference", None) or {"wkid": 102100, "latestWkid": 3857}
+
+    def _query_extent(self, where, values, return_count):
+        rows = self._select("SELECT {} FROM {} WHERE {}".format(_quote(GEOMETRY_COLUMN), _quote(self.table_name), where),
+                            values)
+        points = [json.loads(row[0]) for row in rows if row[0] is not None]
+        points = [point for point in points if "x" in point and "y" in point]
+        extent = {"xmin": "NaN", "ymin": "NaN", "xmax": "NaN", "ymax": "NaN", "spatialReference": self.spatial_reference}
+        if points:
+            extent.update(xmin=min(p["x"] for p in points), ymin=min(p["y"] for p in points),
+                          xmax=max(p["x"] for p in points), ymax=max(p["y"] for p in points))
+        response = {"extent": extent}
+        if return_count:
+            response["count"] = len(rows)
+        return response
+
+    def _query_statistics(self, params, where, values):
+        statistics = _load(params["outStatistics"], [])
+        group_by = [self.get_field(name) for name in _split(params.get("groupByFieldsForStatistics", None))]
+        columns = [_quote(field["name"]) for field in group_by]
+        fields = list(group_by)
+        for statistic in statistics:
+            function = _STATISTICS.get(statistic.get("statisticType", "").lower(), None)
+            if function is None:
+                raise ServiceError("Unsupported statisticType: '{}'".format(statistic.get("statisticType", None)))
+            on_field = statistic.get("onStatisticField", "*")
+            column = "*" if on_field == "*" and function == "COUNT" else _quote(self.get_field(on_field)["name"])
+            out_name = statistic.get("outStatisticFieldName", None) or "{}_{}".format(
+                statistic["statisticType"].upper(), on_field.replace("*", "ALL"))
+            columns.append("{}({})".format(function, column))
+            fields.append({"name": out_name, "alias": out_name,
+                           "type": "esriFieldTypeInteger" if function == "COUNT" else "esriFieldTypeDouble"})
+        sql = "SELECT {} FROM {} WHERE {}".format(", ".join(columns), _quote(self.table_name), where)
+        if group_by:
+            sql += " GROUP BY " + ", ".join(_quote(field["name"]) for field in group_by)
+        order_by = self._order_by(params, [field["name"] for field in fields[len(group_by):]])
+        if order_by:
+            sql += " ORDER BY " + ", ".join(order_by)
+        rows = self._select(sql, values)
+        return {"fields": fields,
+                "features": [{"attributes": {field["name"]: value for field, value in zip(fields, row)}} for row in rows]}
+
+    def _get_object_id(self, connection, global_id):
+        row = connection.execute("SELECT {} FROM {} WHERE {} = ?".format(
+            _quote(self.object_id_field), _quote(self.table_name), _quote(self.global_id_field)),
+            (normalize_guid(global_id),)).fetchone()
+        return row[0] if row else None
+
+    def _get_global_id(self, connection, object_id):
+        if not self.global_id_field:
+            return None
+        row = connection.execute("SELECT {} FROM {} WHERE {} = ?".format(
+            _quote(self.global_id_field), _quote(self.table_name), _quote(self.object_id_field)), (object_id,)).fetchone()
+        return row[0] if row else None
+
+    def _get_values(self, feature, username, adding):
+        """
+        Gets the columns and values to write for a feature, setting the editor tracking fields
+        :param feature: (Dict) The feature, with attributes and geometry
+        :param username: (string) The user making the edit
+        :param adding: (bool) Whether the feature is being added
+        :return: (Dict) The values by column
+        """
+        values = {}
+        for name, value in (feature.get("attributes", None) or {}).items():
+            field = self.get_field(name)
+            if field["type"] in ("esriFieldTypeOID", "esriFieldTypeGlobalID"):
+                continue
+            if field["type"] in _GUID_TYPES:
+                value = normalize_guid(value)
+            values[field["name"]] = value
+        if "geometry" in feature and self.has_geometry:
+            values[GEOMETRY_COLUMN] = json.dumps(feature["geometry"]) if feature["geometry"] else None
+        edit_date = now()
+        tracking = [("editorField", username), ("editDateField", edit_date)]
+        if adding:
+            tracking += [("creatorField", username), ("creationDateField", edit_date)]
+        for key, value in tracking:
+            if self.edit_fields.get(key, None):
+                values[self.get_field(self.edit_fields[key])["name"]] = value
+        return values
+
+    def _add(self, connection, feature, username, use_global_ids):
+        values = self._get_values(feature, username, True)
+        global_id = None
+        if self.global_id_field:
+            attributes = {k.lower(): v for k, v in (feature.get("attributes", None) or {}).items()}
+            global_id = attributes.get(self.global_id_field.lower(), None) if use_global_ids else None
+            global_id = normalize_guid(global_id) or new_global_id()
+            values[self.global_id_field] = global_id
+        columns = list(values)
+        cursor = connection.execute("INSERT INTO {} ({}) VALUES ({})".format(
+            _quote(self.table_name), ", ".join(_quote(c) for c in columns), ", ".join("?" * len(columns))),
+            [values[c] for c in columns])
+        return {"objectId": cursor.lastrowid, "globalId": global_id, "success": True}
+
+    def _update(self, connection, feature, username, use_global_ids):
+        attributes = {k.lower(): v for k, v in (feature.get("attributes", None) or {}).items()}
+        if use_global_ids and self.global_id_field:
+            object_id = self._get_object_id(connection, attributes.get(self.global_id_field.lower(), None))
+        else:
+            object_id = attributes.get(self.object_id_field.lower(), None)
+        values = self._get_values(feature, username, False)
+        columns = list(values)
+        cursor = connection.execute("UPDATE {} SET {} WHERE {} = ?".format(
+            _quote(self.table_name), ", ".join("{} = ?".format(_quote(c)) for c in columns),
+            _quote(self.object_id_field)), [values[c] for c in columns] + [object_id])
+        if not cursor.rowcount:
+            return _failed(object_id, None, 1019, "Object is missing.")
+        return {"objectId": object_id, "globalId": self._get_global_id(connection, object_id), "success": True}
+
+    def _delete(self, connection, key, use_global_ids):
+        if use_global_ids and self.global_id_field:
+            global_id, object_id = normalize_guid(key), self._get_object_id(connection, key)
+        else:
+            object_id = int(key)
+            global_id = self._get_global_id(connection, object_id)
+        cursor = connection.execute("DELETE FROM {} WHERE {} = ?".format(
+            _quote(self.table_name), _quote(self.object_id_field)), (object_id,))
+        if not cursor.rowcount:
+            return _failed(object_id, global_id, 1019, "Object is missing.")
+        connection.execute("DELETE FROM attachments WHERE table_name = ? AND parent_id = ?", (self.table_name, object_id))
+        return {"objectId": object_id, "globalId": global_id, "success": True}
+
+    def apply_edits(self, params, username):
+        """
+        Adds, updates and deletes features
+        :param params: (Dict) The applyEdits parameters of the REST API
+        :param username: (string) The user making the edits
+        :return: (Dict) The results of the edits
+        """
+        use_global_ids = _is_true(params.get("useGlobalIds", None))
+        rollback = _is_true(params.get("rollbackOnFailure", "true"))
+        with self.store.lock:
+            connection = self.store.connection
+            response = self._apply_edits(connection, params, username, use_global_ids)
+            failed = [result for results in response.values() for result in results if not result["success"]]
+            if failed and rollback:
+                connection.rollback()
+                raise ServiceError("Unable to complete operation.", details=[r["error"]["description"] for r in failed])
+            connection.commit()
+        return response
+
+    def _apply_edits(self, connection, params, username, use_global_ids):
+        response = {"addResults": [], "updateResults": [], "deleteResults": []}
+        for feature in _load(params.get("adds", None), []):
+            response["addResults"].append(self._edit(self._add, connection, feature, username, use_global_ids))
+        for feature in _load(params.get("updates", None), []):
+            response["updateResults"].append(self._edit(self._update, connection, feature, username, use_global_ids))
+        for key in _split(params.get("deletes", None)):
+            try:
+                response["deleteResults"].append(self._delete(connection, key, use_global_ids))
+            except (ValueError, sqlite3.Error) as e:
+                response["deleteResults"].append(_failed(None, None, 1000, str(e)))
+        return response
+
+    def _edit(self, edit, connection, feature, username, use_global_ids):
+        try:
+            return edit(connection, feature, username, use_global_ids)
+        except (ServiceError, sqlite3.Error, TypeError, ValueError) as e:
+            return _failed(None, None, 1000, str(e))
+
+    def _check_feature(self, object_id):
+        if not self._select("SELECT 1 FROM {} WHERE {} = ?".format(_quote(self.table_name), _quote(self.object_id_field)),
+                            (object_id,)):
+            raise ServiceError("Feature {} not found".format(object_id), 404)
+
+    def _attachment_info(self, row, parent_global_id):
+        return {"id": row[0], "globalId": row[1], "parentGlobalId": parent_global_id, "name": row[2],
+                "contentType": row[3], "size": row[4], "keywords": row[5] or ""}
+
+    def _attachment_rows(self, object_id):
+        return self._select("SELECT id, global_id, name, content_type, LENGTH(data), keywords FROM attachments "
+                            "WHERE table_name = ? AND parent_id = ? ORDER BY id", (self.table_name, object_id))
+
+    def get_attachments(self, object_id):
+        """
+        Lists the attachments of a feature
+        :param object_id: (int) The object id of the feature
+        :return: (Dict) The attachment infos
+        """
+        with self.store.lock:
+            self._check_feature(object_id)
+            parent_global_id = self._get_global_id(self.store.connection, object_id)
+            return {"attachmentInfos": [self._attachment_info(row, parent_global_id)
+                                        for row in self._attachment_rows(object_id)]}
+
+    def get_attachment(self, object_id, attachment_id):
+        """
+        Gets the content of an attachment
+        :param object_id: (int) The object id of the feature
+        :param attachment_id: (int) The id of the attachment
+        :return: (string, string, bytes) The name, content type and content of the attachment
+        """
+        rows = self._select("SELECT name, content_type, data FROM attachments WHERE table_name = ? AND parent_id = ? "
+                            "AND id = ?", (self.table_name, object_id, attachment_id))
+        if not rows:
+            raise ServiceError("Attachment {} not found".format(attachment_id), 404)
+        return rows[0]
+
+    def add_attachment(self, object_id, name, content_type, data, keywords=None):
+        """
+        Adds an attachment to a feature
+        :param object_id: (int) The object id of the feature
+        :param name: (string) The file name of the attachment
+        :param content_type: (string) The content type of the attachment
+        :param data: (bytes) The content of the attachment
+        :param keywords: (string) The keywords of the attachment
+        :return: (Dict) The result
+        """
+        if not self.definition.get("hasAttachments", False):
+            raise ServiceError("Layer {} does not support attachments".format(self.definition["id"]))
+        global_id = new_global_id()
+        with self.store.lock:
+            self._check_feature(object_id)
+            cursor = self.store.connection.execute(
+                "INSERT INTO attachments (table_name, parent_id, global_id, name, content_type, keywords, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (self.table_name, object_id, global_id, name, content_type, keywords,
+                                                 sqlite3.Binary(data)))
+            self.store.connection.commit()
+        return {"addAttachmentResult": {"objectId": cursor.lastrowid, "globalId": global_id, "success": True}}
+
+    def update_attachment(self, object_id, attachment_id, name, content_type, data):
+        """
+        Replaces the content of an attachment
+        :param object_id: (int) The object id of the feature
+        :param attachment_id: (int) The id of the attachment
+        :param name: (string) The new file name of the attachment
+        :param content_type: (string) The new content type of the attachment
+        :param data: (bytes) The new content of the attachment
+        :return: (Dict) The result
+        """
+        with self.store.lock:
+            cursor = self.store.connection.execute(
+                "UPDATE attachments SET name = ?, content_type = ?, data = ? WHERE table_name = ? AND parent_id = ? "
+                "AND id = ?", (name, content_type, sqlite3.Binary(data), self.table_name, object_id, attachment_id))
+            self.store.connection.commit()
+        if not cursor.rowcount:
+            return {"updateAttachmentResult": _failed(attachment_id, None, 1019, "Attachment is missing.")}
+        return {"updateAttachmentResult": {"objectId": attachment_id, "success": True}}
+
+    def delete_attachments(self, object_id, attachment_ids):
+        """
+        Deletes attachments of a feature
+        :param object_id: (int) The object id of the feature
+        :param attachment_ids: (List<int>) The ids of the attachments
+        :return: (Dict) The results
+        """
+        results = []
+        with self.store.lock:
+            for attachment_id in attachment_ids:
+                cursor = self.store.connection.execute(
+                    "DELETE FROM attachments WHERE table_name = ? AND parent_id = ? AND id = ?",
+                    (self.table_name, object_id, attachment_id))
+                if cursor.rowcount:
+                    results.append({"objectId": attachment_id, "success": True})
+                else:
+                    results.append(_failed(attachment_id, None, 1019, "Attachment is missing."))
+            self.store.connection.commit()
+        return {"deleteAttachmentResults": results}
+
+    def query_attachments(self, params):
+        """
+        Lists the attachments of the features matching a query
+        :param params: (Dict) The queryAttachments parameters of the REST API
+        :return: (Dict) The attachment groups
+        """
+        where, values = self._where({"where": params.get("definitionExpression", None),
+                                     "objectIds": params.get("objectIds", None),
+                                     "globalIds": params.get("globalIds", None)})
+        groups = []
+        global_id_column = _quote(self.global_id_field) if self.global_id_field else "NULL"
+        for object_id, global_id in self._select("SELECT {}, {} FROM {} WHERE {} ORDER BY 1".format(
+                _quote(self.object_id_field), global_id_column, _quote(self.table_name), where), values):
+            infos = [self._attachment_info(row, global_id) for row in self._attachment_rows(object_id)]
+            if infos:
+                groups.append({"parentObjectId": object_id, "parentGlobalId": global_id, "attachmentInfos": infos})
+        return {"fields": [], "attachmentGroups": groups}
+
+
+def _failed(object_id, global_id, code, description):
+    return {"objectId": object_id, "globalId": global_id, "success": False,
+            "error": {"code": code, "description": description}}
+
+
+class Store(object):
+    """
+    The SQLite database of the local server. A single connection is shared by the threads of the server, one
+    statement at a time.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: (string) The SQLite database file, created if it does not exist
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(_SCHEMA)
+        self._layers = {}
+
+    def close(self):
+        self.connection.close()
+
+    def _select_value(self, sql, parameters=()):
+        with self.lock:
+            row = self.connection.execute(sql, parameters).fetchone()
+        return row[0] if row else None
+
+    def _get_json(self, sql, parameters):
+        with self.lock:
+            row = self.connection.execute(sql, parameters).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Users and groups
+
+    def add_user(self, username, password, full_name=None, role="org_admin"):
+        """
+        Adds a user, or replaces it
+        :param username: (string) The username
+        :param password: (string) The password
+        :param full_name: (string) The full name of the user, the username by default
+        :param role: (string) The role of the user
+        :return: (Dict) The user
+        """
+        return self.add_users([(username, full_name)], password, role)[0]
+
+    def add_users(self, users, password, role="org_user"):
+        """
+        Adds users with the same password and role, or replaces them, in one transaction
+        :param users: (List<(string, string)>) The username and full name of each user
+        :param password: (string) The password
+        :param role: (string) The role of the users
+        :return: (List<Dict>) The users
+        """
+        added = [{"username": username, "fullName": full_name or username, "firstName": full_name or username,
+                  "lastName": "", "email": "{}@localhost".format(username), "role": role, "orgId": "local",
+                  "userType": "creator", "privileges": [], "groups": [], "created": now(), "modified": now()}
+                 for username, full_name in users]
+        password_hash = _hash_password(password)
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO users (username, password, json) VALUES (?, ?, ?)",
+                                        [(user["username"], password_hash, json.dumps(user)) for user in added])
+            self.connection.commit()
+        return added
+
+    def check_password(self, username, password):
+        """
+        :param username: (string) The username
+        :param password: (string) The password
+        :return: (Dict) The user if the password is correct, otherwise None
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT password, json FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None or row[0] != _hash_password(password):
+            return None
+        return json.loads(row[1])
+
+    def get_user(self, username):
+        return self._get_json("SELECT json FROM users WHERE username = ?", (username,))
+
+    def add_group(self, title, owner):
+        """
+        Adds a group
+        :param title: (string) The title of the group
+        :param owner: (string) The owner of the group, who is also its first member
+        :return: (Dict) The group
+        """
+        group = {"id": new_id(), "title": title, "owner": owner, "access": "private", "protected": True,
+                 "isInvitationOnly": True, "tags": [], "created": now(), "modified": now()}
+        with self.lock:
+            self.connection.execute("INSERT INTO groups (id, json) VALUES (?, ?)", (group["id"], json.dumps(group)))
+            self.connection.commit()
+        self.add_group_users(group["id"], [owner])
+        return group
+
+    def get_group(self, group_id):
+        return self._get_json("SELECT json FROM groups WHERE id = ?", (group_id,))
+
+    def add_group_users(self, group_id, usernames):
+        """
+        Adds users to a group
+        :param group_id: (string) The id of the group
+        :param usernames: (List<string>) The users
+        :return: (List<string>) The users that do not exist and were not added
+        """
+        with self.lock:
+            existing = {row[0].lower() for row in self.connection.execute("SELECT username FROM users")}
+            not_added = [username for username in usernames if username.lower() not in existing]
+            self.connection.executemany("INSERT OR IGNORE INTO group_users (group_id, username) VALUES (?, ?)",
+                                        [(group_id, username) for username in usernames if username not in not_added])
+            self.connection.commit()
+        return not_added
+
+    def remove_group_users(self, group_id, usernames):
+        with self.lock:
+            self.connection.executemany("DELETE FROM group_users WHERE group_id = ? AND username = ?",
+                                        [(group_id, username) for username in usernames])
+            self.connection.commit()
+        return []
+
+    # Folders
+
+    def add_folder(self, username, title):
+        """
+        Adds a folder to the content of a user
+        :param username: (string) The owner of the folder
+        :param title: (string) The title of the folder, unique for the user
+        :return: (Dict) The folder
+        """
+        if any(folder["title"].lower() == title.lower() for folder in self.get_folders(username)):
+            raise ServiceError("Folder '{}' already exists.".format(title), 400)
+        folder = {"id": new_id(), "title": title, "username": username, "created": now()}
+        with self.lock:
+            self.connection.execute("INSERT INTO folders (id, username, json) VALUES (?, ?, ?)",
+                                    (folder["id"], username, json.dumps(folder)))
+            self.connection.commit()
+        return folder
+
+    def get_folders(self, username):
+        with self.lock:
+            rows = self.connection.execute("SELECT json FROM folders WHERE username = ?", (username,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete_folder(self, folder_id):
+        with self.lock:
+            self.connection.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
+            self.connection.commit()
+
+    # Items
+
+    def add_item(self, item, data=None):
+        """
+        Adds an item, or replaces it
+        :param item: (Dict) The item, with at least a title, type and owner. An id is generated if it has none.
+        :param data: (Dict or string) The data of the item
+        :return: (Dict) The item
+        """
+        item = dict(item)
+        item.setdefault("id", new_id())
+        for key, value in (("created", now()), ("modified", now()), ("typeKeywords", []), ("tags", []),
+                           ("access", "private"), ("snippet", None), ("description", None), ("properties", None),
+                           ("url", None), ("ownerFolder", None), ("protected", False), ("size", -1), ("extent", [])):
+            item.setdefault(key, value)
+        if data is not None and not isinstance(data, str):
+            data = json.dumps(data)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO items (id, json, data) VALUES (?, ?, ?)",
+                                    (item["id"], json.dumps(item), data))
+            self.connection.commit()
+        return item
+
+    def get_item(self, item_id):
+        return self._get_json("SELECT json FROM items WHERE id = ?", (item_id,))
+
+    def get_item_data(self, item_id):
+        """
+        :param item_id: (string) The id of the item
+        :return: (string) The data of the item, or None if it has none
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM items WHERE id = ?", (item_id,)).fetchone()
+        if row is None:
+            raise ServiceError("Item does not exist or is inaccessible.", 400)
+        return row[0]
+
+    def update_item(self, item_id, properties, data=None):
+        """
+        Updates the properties and data of an item
+        :param item_id: (string) The id of the item
+        :param properties: (Dict) The properties to change
+        :param data: (string) The new data of the item, if any
+        :return: (Dict) The item
+        """
+        item = self.get_item(item_id)
+        if item is None:
+            raise ServiceError("Item does not exist or is inaccessible.", 400)
+        item.update(properties)
+        item["modified"] = now()
+        with self.lock:
+            self.connection.execute("UPDATE items SET json = ? WHERE id = ?", (json.dumps(item), item_id))
+            if data is not None:
+                self.connection.execute("UPDATE items SET data = ? WHERE id = ?", (data, item_id))
+            self.connection.commit()
+        return item
+
+    def get_user_items(self, username, folder_id=None):
+        """
+        :param username: (string) The owner of the items
+        :param folder_id: (string) The folder of the items, None for the root folder of the user
+        :return: (List<Dict>) The items
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT json FROM items").fetchall()
+        items = [json.loads(row[0]) for row in rows]
+        return [item for item in items
+                if item["owner"].lower() == username.lower() and item.get("ownerFolder", None) == folder_id]
+
+    def delete_item(self, item_id):
+        with self.lock:
+            self.connection.execute("DELETE FROM items WHERE id = ?", (item_id,))
+            self.connection.commit()
+
+    def add_relationship(self, origin_item_id, destination_item_id, relationship_type):
+        """
+        Relates an item to another, e.g. a web map to the feature service it shows
+        :param origin_item_id: (string) The id of the origin item
+        :param destination_item_id: (string) The id of the destination item
+        :param relationship_type: (string) The type of the relationship
+        :return: (Dict) The origin item
+        """
+        item = self.get_item(origin_item_id)
+        if item is None or self.get_item(destination_item_id) is None:
+            raise ServiceError("Item does not exist or is inaccessible.", 400)
+        relationships = item.get("relationships", None) or {}
+        related_ids = relationships.setdefault(relationship_type, [])
+        if destination_item_id not in related_ids:
+            related_ids.append(destination_item_id)
+        return self.update_item(origin_item_id, {"relationships": relationships})
+
+    def get_related_items(self, item_id, relationship_type, direction):
+        """
+        Gets the items related to an item. Web maps are related to the feature service they show with
+        WorkforceMap2FeatureService, forward from the map.
+        :param item_id: (string) The id of the item
+        :param relationship_type: (string) The type of the relationship
+        :param direction: (string) forward or reverse
+        :return: (List<Dict>) The related items
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT json FROM items").fetchall()
+        items = [json.loads(row[0]) for row in rows]
+        related = []
+        for item in items:
+            relationships = item.get("relationships", None) or {}
+            if direction == "reverse" and item_id in relationships.get(relationship_type, []):
+                related.append(item)
+        if direction != "reverse":
+            item = self.get_item(item_id) or {}
+            for related_id in (item.get("relationships", None) or {}).get(relationship_type, []):
+                related_item = self.get_item(related_id)
+                if related_item:
+                    related.append(related_item)
+        return related
+
+    # Feature services
+
+    def add_service(self, name, layers, tables=(), service_properties=None):
+        """
+        Adds a feature service and creates the tables of its layers
+        :param name: (string) The name of the service
+        :param layers: (List<Dict>) The layer definitions
+        :param tables: (List<Dict>) The table definitions
+        :param service_properties: (Dict) More properties of the service
+        :return: (Dict) The service definition
+        """
+        service = {"currentVersion": 10.7, "serviceDescription": "", "hasVersionedData": False,
+                   "supportsDisconnectedEditing": False, "supportsApplyEditsWithGlobalIds": True,
+                   "capabilities": "Query,Editing,Create,Update,Delete", "maxRecordCount": 1000,
+                   "supportedQueryFormats": "JSON", "allowGeometryUpdates": True, "syncEnabled": False,
+                   "spatialReference": {"wkid": 102100, "latestWkid": 3857}, "layers": [], "tables": []}
+        service.update(service_properties or {})
+        with self.lock:
+            self.connection.execute("INSERT INTO services (name, json) VALUES (?, ?)", (name, json.dumps(service)))
+            self.connection.commit()
+        return self.add_to_service(name, layers, tables)
+
+    def add_to_service(self, name, layers, tables=()):
+        """
+        Adds layers to a feature service and creates their tables, as addToDefinition does
+        :param name: (string) The name of the service
+        :param layers: (List<Dict>) The layer definitions
+        :param tables: (List<Dict>) The table definitions
+        :return: (Dict) The service definition
+        """
+        service = self.get_service(name)
+        if service is None:
+            raise ServiceError("Service not found", 404)
+        service["layers"] += [{"id": d["id"], "name": d["name"], "geometryType": d.get("geometryType", None)}
+                              for d in layers]
+        service["tables"] += [{"id": d["id"], "name": d["name"]} for d in tables]
+        with self.lock:
+            self.connection.execute("UPDATE services SET json = ? WHERE name = ?", (json.dumps(service), name))
+            for definition in list(layers) + list(tables):
+                table_name = "{}_{}".format(re.sub(r"\W+", "_", name), definition["id"])
+                columns = ["{} {}".format(_quote(field["name"]), _COLUMN_TYPES.get(field["type"], "TEXT"))
+                           for field in definition["fields"]]
+                columns.append("{} TEXT".format(_quote(GEOMETRY_COLUMN)))
+                self.connection.execute("CREATE TABLE {} ({})".format(_quote(table_name), ", ".join(columns)))
+                for field in definition["fields"]:
+                    if field["type"] in _GUID_TYPES:
+                        self.connection.execute("CREATE INDEX {} ON {} ({})".format(
+                            _quote("{}_{}".format(table_name, field["name"])), _quote(table_name),
+                            _quote(field["name"])))
+                self.connection.execute("INSERT INTO layers (service, id, json, table_name) VALUES (?, ?, ?, ?)",
+                                        (name, definition["id"], json.dumps(definition), table_name))
+            self.connection.commit()
+        return service
+
+    def update_service(self, name, properties):
+        """
+        Changes the definition of a feature service, e.g. its editor tracking
+        :param name: (string) The name of the service
+        :param properties: (Dict) The properties of the definition to replace
+        :return: (Dict) The service definition
+        """
+        service = self.get_service(name)
+        if service is None:
+            raise ServiceError("Service not found", 404)
+        service.update({key: value for key, value in properties.items() if key not in ("layers", "tables")})
+        with self.lock:
+            self.connection.execute("UPDATE services SET json = ? WHERE name = ?", (json.dumps(service), name))
+            self.connection.commit()
+        return service
+
+    def get_service(self, name):
+        return self._get_json("SELECT json FROM services WHERE name = ?", (name,))
+
+    def get_layer(self, service, layer_id):
+        """
+        Gets a layer of a service
+        :param service: (string) The name of the service
+        :param layer_id: (int) The id of the layer
+        :return: (Layer) The layer
+        """
+        key = (service, int(layer_id))
+        layer = self._layers.get(key, None)
+        if layer is None:
+            with self.lock:
+                row = self.connection.execute("SELECT json, table_name FROM layers WHERE service = ? AND id = ?",
+                                              key).fetchone()
+            if row is None:
+                raise ServiceError("Invalid URL", 400)
+            layer = self._layers[key] = Layer(self, service, json.loads(row[0]), row[1])
+        return layer
+
+    def update_layer_definition(self, service, layer_id, properties):
+        """
+        Changes the definition of a layer, e.g. the assignment type domain of a version 1 project
+        :param service: (string) The name of the service
+        :param layer_id: (int) The id of the layer
+        :param properties: (Dict) The properties of the definition to replace
+        :return: (Layer) The updated layer
+        """
+        layer = self.get_layer(service, layer_id)
+        definition = dict(layer.definition, **properties)
+        with self.lock:
+            self.connection.execute("UPDATE layers SET json = ? WHERE service = ? AND id = ?",
+                                    (json.dumps(definition), service, int(layer_id)))
+            self.connection.commit()
+        del self._layers[(service, int(layer_id))]
+        return self.get_layer(service, layer_id)
+
+    def add_fields(self, service, layer_id, fields):
+        """
+        Adds fields to a layer and the columns of its table, e.g. the custom fields migrate_to_v2 copies
+        :param service: (string) The name of the service
+        :param layer_id: (int) The id of the layer
+        :param fields: (List<Dict>) The field definitions
+        :return: (Layer) The updated layer
+        """
+        layer = self.get_layer(service, layer_id)
+        existing = {field["name"].lower() for field in layer.definition["fields"]}
+        fields = [field for field in fields if field["name"].lower() not in existing]
+        with self.lock:
+            for field in fields:
+                self.connection.execute("ALTER TABLE {} ADD COLUMN {} {}".format(
+                    _quote(layer.table_name), _quote(field["name"]), _COLUMN_TYPES.get(field["type"], "TEXT")))
+        return self.update_layer_definition(service, layer_id, {"fields": layer.definition["fields"] + fields})
+
+    def add_index(self, layer, field_names):
+        """
+        Indexes fields of a layer that large layers are queried by, e.g. the editor and creation date of tracks
+        :param layer: (Layer) The layer
+        :param field_names: (List<string>) The fields of the index, in order
+        """
+        names = [layer.get_field(name)["name"] for name in field_names]
+        with self.lock:
+            self.connection.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                _quote("{}_{}".format(layer.table_name, "_".join(names))), _quote(layer.table_name),
+                ", ".join(_quote(name) for name in names)))
+            self.connection.commit()
+
+    def insert_rows(self, table_name, columns, rows):
+        """
+        Inserts rows as they are, in one transaction, without the validation and editor tracking of applyEdits.
+        Used to load generated projects quickly.
+        :param table_name: (string) The table, e.g. Layer.table_name or attachments
+        :param columns: (List<string>) The columns of the rows, e.g. field names and GEOMETRY_COLUMN
+        :param rows: (Iterable<tuple>) The values of the rows
+        :return: (int) The number of rows inserted
+        """
+        with self.lock:
+            cursor = self.connection.executemany("INSERT INTO {} ({}) VALUES ({})".format(
+                _quote(table_name), ", ".join(_quote(column) for column in columns), ", ".join("?" * len(columns))),
+                rows)
+            self.connection.commit()
+        return cursor.rowcount
+
+    def get_max_object_id(self, layer):
+        """
+        :param layer: (Layer) The layer
+        :return: (int) The largest object id of the layer, 0 if it is empty
+        """
+        sql = "SELECT MAX({}) FROM {}".format(_quote(layer.object_id_field), _quote(layer.table_name))
+        return self._select_value(sql) or 0
+
+    def get_layers(self, service):
+        with self.lock:
+            rows = self.connection.execute("SELECT id FROM layers WHERE service = ? ORDER BY id", (service,)).fetchall()
+        return [self.get_layer(service, row[0]) for row in rows]
+
+
+def _hash_password(password):
+    return hashlib.sha256(("workforce-scripts:" + (password or "")).encode("utf-8")).hexdigest()
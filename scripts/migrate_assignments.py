@@ -14,61 +14,76 @@
 """
 
 import argparse
-import logging
-import logging.handlers
-import tempfile
 import sys
-import traceback
-from arcgis.gis import GIS
-from arcgis.apps import workforce
-from arcgis.features import Feature, FeatureSet
+from utils import (DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND, add_diagnostic_arguments, apply_edits,
+                   columns_to_features, connect, get_assignment_type_global_ids, get_project, get_reference_cache,
+                   initialize_logging, iter_column_pages, iter_pages, log_edit_results, migrate_assignment_attachments,
+                   run)
 
 
-def initialize_logging(log_file=None):
+def get_user_global_ids(users, get_new_user):
     """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
+    Maps the object ids of the workers or dispatchers of a version 1 project to the GlobalIDs of the version 2 workers
+    or dispatchers with the same user ids
+    :param users: (List<Worker>|List<Dispatcher>) The workers or dispatchers of the version 1 project
+    :param get_new_user: (Function) Finds a version 2 worker or dispatcher by user id, returning None if none matches
+    :return: (Dict) The GlobalID of the version 2 worker or dispatcher of each version 1 object id that has one
     """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+    global_ids = {}
+    for user in users:
+        new_user = get_new_user(user.user_id)
+        if new_user:
+            global_ids.setdefault(user.object_id, new_user.global_id)
+    return global_ids
 
 
-def get_assignment_type_global_id(assignment_types, assignment_type_name):
-    for at in assignment_types:
-        if at.name == assignment_type_name:
-            return at.global_id
-
-
-def get_worker_global_id(old_workers, new_worker_manager, worker_object_id):
-    for worker in old_workers:
-        if worker.object_id == worker_object_id:
-            return new_worker_manager.get(user_id=worker.user_id).global_id
-
-
-def get_dispatcher_global_id(old_dispatchers, new_dispatcher_manager, dispatcher_object_id):
-    for dispatcher in old_dispatchers:
-        if dispatcher.object_id == dispatcher_object_id:
-            return new_dispatcher_manager.get(user_id=dispatcher.user_id).global_id
-    return new_dispatcher_manager.search()[0].global_id
+def get_v2_attributes(attributes, geometry, schema, v2_schema, assignment_type_global_ids, worker_global_ids,
+                      dispatcher_global_ids, default_dispatcher_global_id, custom_fields):
+    """
+    Builds the attributes of the version 2 copy of a version 1 assignment
+    :param attributes: (Dict) The attributes of the version 1 assignment
+    :param geometry: (Dict) The geometry of the version 1 assignment
+    :param schema: (AssignmentSchema) The assignment schema of the version 1 project
+    :param v2_schema: (AssignmentSchema) The assignment schema of the version 2 project
+    :param assignment_type_global_ids: (Dict) The version 2 assignment type GlobalID of each version 1 code
+    :param worker_global_ids: (Dict) The version 2 worker GlobalID of each version 1 worker object id
+    :param dispatcher_global_ids: (Dict) The version 2 dispatcher GlobalID of each version 1 dispatcher object id
+    :param default_dispatcher_global_id: (string) The GlobalID of the dispatcher of the assignments whose dispatcher is
+                                         not in the version 2 project
+    :param custom_fields: (List<Dict>) The fields copied as is
+    :return: (Dict) The attributes of the version 2 assignment
+    """
+    # set attributes in case they are empty
+    assignment_location = (str(geometry["x"]) + " " + str(geometry["y"])) if \
+        attributes[schema.location] is None else attributes[schema.location]
+    assignment_status = 0 if attributes[schema.status] is None else attributes[schema.status]
+    assignment_priority = 0 if attributes[schema.priority] is None else attributes[schema.priority]
+
+    # Set attributes
+    v2_attributes = {v2_schema.status: assignment_status,
+                     v2_schema.notes: attributes[schema.notes],
+                     v2_schema.priority: assignment_priority,
+                     v2_schema.assignment_type: assignment_type_global_ids.get(attributes[schema.assignment_type], None),
+                     v2_schema.work_order_id: attributes[schema.work_order_id],
+                     v2_schema.due_date: attributes[schema.due_date],
+                     v2_schema.description: attributes[schema.description],
+                     v2_schema.worker_id: worker_global_ids.get(attributes[schema.worker_id], None),
+                     v2_schema.location: assignment_location,
+                     v2_schema.declined_comment: attributes[schema.declined_comment],
+                     v2_schema.assigned_date: attributes[schema.assigned_date],
+                     v2_schema.in_progress_date: attributes[schema.in_progress_date],
+                     v2_schema.completed_date: attributes[schema.completed_date],
+                     v2_schema.declined_date: attributes[schema.declined_date],
+                     v2_schema.paused_date: attributes[schema.paused_date],
+                     v2_schema.dispatcher_id: dispatcher_global_ids.get(attributes[schema.dispatcher_id],
+                                                                        default_dispatcher_global_id),
+                     v2_schema.global_id: attributes[schema.global_id],
+                     v2_schema.object_id: attributes[schema.object_id]}
+
+    # Add Custom Field Values
+    for field in custom_fields:
+        v2_attributes[field["name"]] = attributes[field["name"]]
+    return v2_attributes
 
 
 def add_custom_fields(old_layer, new_layer):
@@ -91,6 +106,7 @@ def add_custom_fields(old_layer, new_layer):
 
 
 def main(arguments):  # noqa: C901
+    from arcgis.features import Feature
     # Initialize logging
     logger = initialize_logging(arguments.log_file)
 
@@ -98,14 +114,11 @@ def main(arguments):  # noqa: C901
     logger.info("Authenticating...")
 
     # First step is to get authenticate and get a valid token
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
 
     # Get the old workforce project
     item = gis.content.get(arguments.classic_project_id)
-    project = workforce.Project(item)
+    project = get_project(item)
     try:
         if project._is_v2_project:
             raise Exception("The first project provided is a v2 project. Please migrate assignment data from v1 projects")
@@ -114,132 +127,83 @@ def main(arguments):  # noqa: C901
                         "Check with `arcgis.__version__` in your Python console")
 
     # Get new workforce project
-    v2_project = workforce.Project(gis.content.get(arguments.new_project_id))
+    v2_project = get_project(gis.content.get(arguments.new_project_id))
     if not v2_project._is_v2_project:
         raise Exception("The second project provided is a v1 project. Please migrate assignment data to v2 projects")
 
+    reference_cache = get_reference_cache(project)
+    v2_reference_cache = get_reference_cache(v2_project)
+
     # validate correct assignment types are present
-    existing_assignment_types = project.assignment_types.search()
+    existing_assignment_types = reference_cache.assignment_types
     for assignment_type in existing_assignment_types:
-        if not v2_project.assignment_types.get(name=assignment_type.name):
+        if not v2_reference_cache.get_assignment_type(name=assignment_type.name):
             raise Exception("One of your assignment types in your classic project is not in your offline project")
 
     # validate correct workers are present
-    for worker in project.workers.search():
-        if not v2_project.workers.get(user_id=worker.user_id):
+    for worker in reference_cache.workers:
+        if not v2_reference_cache.get_worker(user_id=worker.user_id):
             raise Exception("One of your workers in your classic project is not in your offline project")
 
     # Migrate Assignments
     logger.info("Migrating assignments")
     assignment_ghost = False
 
-    # Get Existing Assignments
-    existing_assignments = project.assignments_layer.query(where=arguments.where,
-                                                           return_all_records=True,
-                                                           out_sr=v2_project.assignments_layer.properties['extent']['spatialReference']).features
-    assignments_to_add = []
     layer = v2_project.assignments_layer
 
     # Set Custom Fields for Assignments and Templates
     custom_fields = add_custom_fields(project.assignments_layer, layer)
 
-    # Get workers & dispatchers
-    workers = project.workers.search()
-    dispatchers = project.dispatchers.search()
-
-    # Prepare Assignments to be Added
-    for assignment in existing_assignments:
-        if assignment.attributes[project._assignment_schema.assignment_type]:
-
-            # set attributes in case they are empty
-            assignment_location = (str(assignment.geometry["x"]) + " " + str(assignment.geometry["y"])) if \
-                assignment.attributes[project._assignment_schema.location] is None else \
-                assignment.attributes[project._assignment_schema.location]
-            assignment_status = 0 if assignment.attributes[project._assignment_schema.status] is None else \
-                assignment.attributes[project._assignment_schema.status]
-            assignment_priority = 0 if assignment.attributes[project._assignment_schema.priority] is None else \
-                assignment.attributes[project._assignment_schema.priority]
-
-            # get AT name based on code stored
-            assignment_type_name = ""
-            for at in existing_assignment_types:
-                if at.code == assignment.attributes[project._assignment_schema.assignment_type]:
-                    assignment_type_name = at.name
-                    break
-
-            # Set attributes
-            attributes = {v2_project._assignment_schema.status: assignment_status,
-                          v2_project._assignment_schema.notes: assignment.attributes[project._assignment_schema.notes],
-                          v2_project._assignment_schema.priority: assignment_priority,
-                          v2_project._assignment_schema.assignment_type:
-                              get_assignment_type_global_id(v2_project.assignment_types.search(), assignment_type_name),
-                          v2_project._assignment_schema.work_order_id: assignment.attributes[project._assignment_schema.work_order_id],
-                          v2_project._assignment_schema.due_date: assignment.attributes[project._assignment_schema.due_date],
-                          v2_project._assignment_schema.description: assignment.attributes[project._assignment_schema.description],
-                          v2_project._assignment_schema.worker_id:
-                              get_worker_global_id(workers, v2_project.workers, assignment.attributes[project._assignment_schema.worker_id]),
-                          v2_project._assignment_schema.location: assignment_location,
-                          v2_project._assignment_schema.declined_comment: assignment.attributes[project._assignment_schema.declined_comment],
-                          v2_project._assignment_schema.assigned_date: assignment.attributes[project._assignment_schema.assigned_date],
-                          v2_project._assignment_schema.in_progress_date: assignment.attributes[project._assignment_schema.in_progress_date],
-                          v2_project._assignment_schema.completed_date: assignment.attributes[project._assignment_schema.completed_date],
-                          v2_project._assignment_schema.declined_date: assignment.attributes[project._assignment_schema.declined_date],
-                          v2_project._assignment_schema.paused_date: assignment.attributes[project._assignment_schema.paused_date],
-                          v2_project._assignment_schema.dispatcher_id:
-                              get_dispatcher_global_id(dispatchers, v2_project.dispatchers,
-                                                       assignment.attributes[project._assignment_schema.dispatcher_id]),
-                          v2_project._assignment_schema.global_id: assignment.attributes[project._assignment_schema.global_id],
-                          v2_project._assignment_schema.object_id: assignment.attributes[project._assignment_schema.object_id]}
-
-            # Add Custom Field Values
-            for field in custom_fields:
-                attributes[field["name"]] = assignment.attributes[field["name"]]
-            feature = Feature(geometry=assignment.geometry, attributes=attributes)
-            assignments_to_add.append(feature)
-        else:
-            logger.info("One assignment's migration skipped - does not have an assignment type")
-            assignment_ghost = True
-
-    # Add Assignments
-    for i in range(0, len(assignments_to_add), 100):
-        layer.edit_features(adds=FeatureSet(assignments_to_add[i:i + 100]), use_global_ids=True)
-    new_assignments = v2_project.assignments_layer.query("1=1", return_all_records=True).features
+    # Map the assignment types, workers and dispatchers to the version 2 ones once, rather than for each assignment
+    assignment_type_global_ids = get_assignment_type_global_ids(existing_assignment_types, v2_reference_cache.assignment_types)
+    worker_global_ids = get_user_global_ids(reference_cache.workers, lambda user_id: v2_reference_cache.get_worker(user_id=user_id))
+    dispatcher_global_ids = get_user_global_ids(reference_cache.dispatchers,
+                                                lambda user_id: v2_reference_cache.get_dispatcher(user_id=user_id))
+    new_dispatchers = v2_reference_cache.dispatchers
+    default_dispatcher_global_id = new_dispatchers[0].global_id if new_dispatchers else None
+
+    # Get Existing Assignments, then prepare and add them one page at a time
+    existing_assignment_count = 0
+    out_sr = v2_project.assignments_layer.properties['extent']['spatialReference']
+    if arguments.use_pbf:
+        pages = (columns_to_features(page) for page in
+                 iter_column_pages(project.assignments_layer, where=arguments.where, out_sr=out_sr, max_workers=arguments.threads))
+    else:
+        pages = iter_pages(project.assignments_layer, where=arguments.where, out_sr=out_sr, max_workers=arguments.threads)
+    for page in pages:
+        # Prepare Assignments to be Added
+        assignments_to_add = []
+        for assignment in page:
+            existing_assignment_count += 1
+            if assignment.attributes[project._assignment_schema.assignment_type]:
+                attributes = get_v2_attributes(assignment.attributes, assignment.geometry, project._assignment_schema,
+                                               v2_project._assignment_schema, assignment_type_global_ids, worker_global_ids,
+                                               dispatcher_global_ids, default_dispatcher_global_id, custom_fields)
+                feature = Feature(geometry=assignment.geometry, attributes=attributes)
+                assignments_to_add.append(feature)
+            else:
+                logger.info("One assignment's migration skipped - does not have an assignment type")
+                assignment_ghost = True
+
+        # Add Assignments
+        log_edit_results(apply_edits(layer, adds=assignments_to_add, use_global_ids=True))
+    new_assignment_count = v2_project.assignments_layer.query("1=1", return_count_only=True)
     # skip validation if there's a ghost
-    if (len(new_assignments) == len(existing_assignments)) or assignment_ghost:
+    if (new_assignment_count == existing_assignment_count) or assignment_ghost:
         logger.info("Assignments successfully migrated")
     else:
         raise Exception("Assignments not migrated successfully. Unknown error")
 
     # Migrate Attachments
     logger.info("Migrating Attachments")
-    for i, assignment in enumerate(existing_assignments):
-        object_id = assignment.attributes[project._assignment_schema.object_id]
-        logger.info(f"Migrating attachments for assignment {i + 1}/{len(existing_assignments)} objectId: {object_id}")
-        new_assignment_object_id = v2_project.assignments.get(global_id=assignment.attributes[project._assignment_schema.global_id]).object_id
-        if len(project.assignments_layer.attachments.get_list(object_id)) > 0:
-            with tempfile.TemporaryDirectory() as dirpath:
-                try:
-                    paths = project.assignments_layer.attachments.download(oid=object_id, save_path=dirpath)
-                except Exception as e:
-                    logger.info(f"Failed to download attachments for assignment: {assignment.attributes[project._assignment_schema.global_id]}")
-                    logger.exception(e)
-                for path in paths:
-                    try:
-                        v2_project.assignments_layer.attachments.add(oid=new_assignment_object_id, file_path=path)
-                    except Exception as e:
-                        logger.info(f"Failed to upload attachment: {path} from assignment: {assignment.attributes[project._assignment_schema.global_id]}")
-                        logger.exception(e)
-        else:
-            logger.info(f"No attachments to migrate for objectId: {object_id}")
-    if len(project.assignments_layer.attachments.search("1=1")) == len(
-            v2_project.assignments_layer.attachments.search("1=1")):
+    if migrate_assignment_attachments(project, v2_project, arguments.where, arguments.threads, arguments.requests_per_second):
         logger.info("Attachments successfully migrated")
     else:
         logger.info("Not all of your attachments migrated successfully. Continuing with migration")
     logger.info("Script Completed")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Migrate Version 1 Project assignment data to Version 2")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -253,13 +217,18 @@ if __name__ == "__main__":
                         help="The where clause to determine what assignments to migrate. "
                              "Defaults to status IN (O, 1, 2, 4, 5) - completed and canceled assignments will not be migrated by default",
                         default="status IN (0, 1, 2, 4, 5)")
+    parser.add_argument('-threads', dest='threads', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="The number of concurrent requests to use when querying large layers and migrating attachments")
+    parser.add_argument('-requests-per-second', dest='requests_per_second', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="The maximum number of requests to start per second when running concurrently")
+    parser.add_argument('--use-pbf', dest='use_pbf', action='store_true',
+                        help="Request the assignments as protocol buffers, which are smaller and faster to decode than JSON")
     parser.add_argument('-log-file', dest='log_file', help='The log file to use')
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
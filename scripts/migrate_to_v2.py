@@ -15,43 +15,16 @@
 
 import argparse
 import logging
-import logging.handlers
 import tempfile
 import sys
-import traceback
-from arcgis.gis import GIS
-from arcgis.apps import workforce
-from arcgis.features import Feature, FeatureSet
+from utils import (DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND, ThrottledExecutor, add_diagnostic_arguments,
+                   apply_edits, columns_to_features, connect, get_assignment_type_global_ids, get_project,
+                   get_reference_cache, initialize_logging, iter_column_pages, iter_pages, log_edit_results,
+                   migrate_assignment_attachments, run, set_phase)
 import json
-import math
 
-
-def initialize_logging(log_file=None):
-    """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
-    """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+# The portal rejects add_users calls with more than 25 users
+MAX_ADD_USERS_PER_CALL = 25
 
 
 def _delete_workforce_items(fs_item):
@@ -114,18 +87,50 @@ def get_assignment_type_global_id(assignment_types, assignment_type_name):
     return None
 
 
-def get_worker_global_id(workers, worker_object_id):
-    for worker in workers:
-        if worker.object_id == worker_object_id:
-            return worker.global_id
-
-
-def get_dispatcher_global_id(skip_dispatchers, dispatchers, dispatcher_object_id):
-    if not skip_dispatchers:
-        for dispatcher in dispatchers:
-            if dispatcher.object_id == dispatcher_object_id:
-                return dispatcher.global_id
-    return None
+def get_v2_attributes(attributes, geometry, schema, v2_schema, assignment_type_global_ids, worker_global_ids,
+                      dispatcher_global_ids, custom_fields):
+    """
+    Builds the attributes of the version 2 copy of a version 1 assignment
+    :param attributes: (Dict) The attributes of the version 1 assignment
+    :param geometry: (Dict) The geometry of the version 1 assignment
+    :param schema: (AssignmentSchema) The assignment schema of the version 1 project
+    :param v2_schema: (AssignmentSchema) The assignment schema of the version 2 project
+    :param assignment_type_global_ids: (Dict) The version 2 assignment type GlobalID of each version 1 code
+    :param worker_global_ids: (Dict) The GlobalID of each version 1 worker object id, which the migration keeps
+    :param dispatcher_global_ids: (Dict) The GlobalID of each version 1 dispatcher object id, which the migration keeps,
+                                  empty when the dispatchers were not migrated
+    :param custom_fields: (List<Dict>) The fields copied as is
+    :return: (Dict) The attributes of the version 2 assignment
+    """
+    # set attributes in case they are empty
+    assignment_location = (str(geometry["x"]) + " " + str(geometry["y"])) if \
+        attributes[schema.location] is None else attributes[schema.location]
+    assignment_status = 0 if attributes[schema.status] is None else attributes[schema.status]
+    assignment_priority = 0 if attributes[schema.priority] is None else attributes[schema.priority]
+
+    v2_attributes = {v2_schema.status: assignment_status,
+                     v2_schema.notes: attributes[schema.notes],
+                     v2_schema.priority: assignment_priority,
+                     v2_schema.assignment_type: assignment_type_global_ids.get(attributes[schema.assignment_type], None),
+                     v2_schema.work_order_id: attributes[schema.work_order_id],
+                     v2_schema.due_date: attributes[schema.due_date],
+                     v2_schema.description: attributes[schema.description],
+                     v2_schema.worker_id: worker_global_ids.get(attributes[schema.worker_id], None),
+                     v2_schema.location: assignment_location,
+                     v2_schema.declined_comment: attributes[schema.declined_comment],
+                     v2_schema.assigned_date: attributes[schema.assigned_date],
+                     v2_schema.in_progress_date: attributes[schema.in_progress_date],
+                     v2_schema.completed_date: attributes[schema.completed_date],
+                     v2_schema.declined_date: attributes[schema.declined_date],
+                     v2_schema.paused_date: attributes[schema.paused_date],
+                     v2_schema.dispatcher_id: dispatcher_global_ids.get(attributes[schema.dispatcher_id], None),
+                     v2_schema.global_id: attributes[schema.global_id],
+                     v2_schema.object_id: attributes[schema.object_id]}
+
+    # Add Custom Field Values
+    for field in custom_fields:
+        v2_attributes[field["name"]] = attributes[field["name"]]
+    return v2_attributes
 
 
 def add_custom_fields(old_layer, new_layer):
@@ -154,7 +159,24 @@ def get_wf_operational_layer(data, layer_id):
             return layer
 
 
+def add_users_to_group(group, usernames, max_workers, requests_per_second):
+    """
+    Adds users to a group, a few at a time and concurrently
+    :param group: (Group) The group to add the users to
+    :param usernames: (List<string>) The usernames
+    :param max_workers: (int) The number of concurrent requests to use
+    :param requests_per_second: (float) The maximum number of requests to start per second
+    """
+    chunks = [usernames[i:i + MAX_ADD_USERS_PER_CALL] for i in range(0, len(usernames), MAX_ADD_USERS_PER_CALL)]
+    with ThrottledExecutor(max_workers=max_workers, requests_per_second=requests_per_second) as executor:
+        for result in executor.map(group.add_users, chunks):
+            if result and result.get("notAdded"):
+                logging.getLogger().info("Users not added to the project group: {}".format(result["notAdded"]))
+
+
 def main(arguments):  # noqa: C901
+    from arcgis.apps import workforce
+    from arcgis.features import Feature
     # Initialize logging
     logger = initialize_logging(arguments.log_file)
 
@@ -162,14 +184,11 @@ def main(arguments):  # noqa: C901
     logger.info("Authenticating...")
 
     # First step is to get authenticate and get a valid token
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
 
     # Get the workforce project
     item = gis.content.get(arguments.project_id)
-    project = workforce.Project(item)
+    project = get_project(item)
     try:
         if project._is_v2_project:
             raise Exception("This is a v2 project. Please migrate v1 projects")
@@ -178,6 +197,7 @@ def main(arguments):  # noqa: C901
             "Cannot find the attribute is v2 project. "
             "Are you sure you have the API version 1.8.3 or greater installed? Check with `arcgis.__version__` in your Python console")
     logger.info(project)
+    set_phase("v2 project")
     logger.info("Creating base v2 project...")
 
     # Create WF Project w given title
@@ -201,8 +221,9 @@ def main(arguments):  # noqa: C901
             logger.info("Thumbnail not migrated successfully")
 
     # Migrate Assignment Types
+    set_phase("assignment types")
     logger.info("Migrating assignment types...")
-    existing_assignment_types = project.assignment_types.search()
+    existing_assignment_types = get_reference_cache(project).assignment_types
     at_to_add = []
 
     for assignment_type in existing_assignment_types:
@@ -222,11 +243,12 @@ def main(arguments):  # noqa: C901
 
     # Migrate Dispatchers
     if not arguments.skip_dispatchers:
+        set_phase("dispatchers")
         logger.info("Migrating dispatchers...")
         dispatcher_ghost = False
 
         # Get Existing Dispatchers
-        existing_dispatchers = project.dispatchers.search()
+        existing_dispatchers = get_reference_cache(project).dispatchers
         dispatchers_to_add = []
         layer = v2_project.dispatchers_layer
 
@@ -265,14 +287,10 @@ def main(arguments):  # noqa: C901
                     v2_dispatcher.update(contact_number=dispatcher.contact_number, name=dispatcher.name)
 
         # Add Dispatchers
-        for i in range(0, len(dispatchers_to_add), 100):
-            layer.edit_features(adds=FeatureSet(dispatchers_to_add[i:i + 100]), use_global_ids=True)
+        log_edit_results(apply_edits(layer, adds=dispatchers_to_add, use_global_ids=True))
         # add dispatcher named users to the project's group.
-        max_add_per_call = 25
-        for i in range(0, math.ceil(len(dispatchers_to_add) / max_add_per_call)):
-            v2_project.group.add_users(
-                [d.attributes[v2_project._dispatcher_schema.user_id] for d in
-                 dispatchers_to_add[i * max_add_per_call:(i * max_add_per_call) + max_add_per_call]])
+        add_users_to_group(v2_project.group, [d.attributes[v2_project._dispatcher_schema.user_id] for d in dispatchers_to_add],
+                           arguments.threads, arguments.requests_per_second)
         new_dispatchers = v2_project.dispatchers_layer.query("1=1", return_all_records=True).features
         if len(existing_dispatchers) == len(new_dispatchers) or dispatcher_ghost:
             logger.info("Dispatchers successfully migrated")
@@ -280,6 +298,7 @@ def main(arguments):  # noqa: C901
             raise Exception("Dispatchers not migrated successfully")
 
     # Migrate Workers
+    set_phase("workers")
     logger.info("Migrating workers...")
     worker_ghost = False
 
@@ -316,14 +335,10 @@ def main(arguments):  # noqa: C901
             logger.info("Worker migration skipped - does not have a user id")
 
     # Add Workers
-    for i in range(0, len(workers_to_add), 100):
-        layer.edit_features(adds=FeatureSet(workers_to_add[i:i + 100]), use_global_ids=True)
+    log_edit_results(apply_edits(layer, adds=workers_to_add, use_global_ids=True))
     # add worker named users to the project's group.
-    max_add_per_call = 25
-    for i in range(0, math.ceil(len(workers_to_add) / max_add_per_call)):
-        v2_project.group.add_users(
-            [w.attributes[v2_project._worker_schema.user_id] for w in
-             workers_to_add[i * max_add_per_call:(i * max_add_per_call) + max_add_per_call]])
+    add_users_to_group(v2_project.group, [w.attributes[v2_project._worker_schema.user_id] for w in workers_to_add],
+                       arguments.threads, arguments.requests_per_second)
     new_workers = v2_project.workers_layer.query("1=1", return_all_records=True).features
     if (len(existing_workers) == len(new_workers)) or worker_ghost:
         logger.info("Workers successfully migrated")
@@ -332,122 +347,65 @@ def main(arguments):  # noqa: C901
         raise Exception("Workers not migrated successfully. Cleaning up new project")
 
     # Migrate Assignments
+    set_phase("assignments")
     logger.info("Migrating assignments")
     assignment_ghost = False
 
-    # Get Existing Assignments
-    existing_assignments = project.assignments_layer.query(arguments.where,
-                                                           return_all_records=True,
-                                                           out_sr=v2_project.assignments_layer.properties['extent']['spatialReference']).features
-    assignments_to_add = []
     layer = v2_project.assignments_layer
 
     # Set Custom Fields for Assignments and Templates
     custom_fields = add_custom_fields(project.assignments_layer, layer)
 
-    # Get workers & dispatchers
-    workers = project.workers.search()
-    dispatchers = project.dispatchers.search()
-
-    # Prepare Assignments to be Added
-    for assignment in existing_assignments:
-        if assignment.attributes[project._assignment_schema.assignment_type]:
-
-            # set attributes in case they are empty
-            assignment_location = (str(assignment.geometry["x"]) + " " + str(assignment.geometry["y"])) if \
-                assignment.attributes[project._assignment_schema.location] is None else assignment.attributes[project._assignment_schema.location]
-            assignment_status = 0 if assignment.attributes[project._assignment_schema.status] is None else \
-                assignment.attributes[project._assignment_schema.status]
-            assignment_priority = 0 if assignment.attributes[project._assignment_schema.priority] is None else \
-                assignment.attributes[project._assignment_schema.priority]
-
-            assignment_type_name = ""
-            for at in existing_assignment_types:
-                if at.code == assignment.attributes[project._assignment_schema.assignment_type]:
-                    assignment_type_name = at.name
-                    break
-            attributes = {v2_project._assignment_schema.status: assignment_status,
-                          v2_project._assignment_schema.notes: assignment.attributes[project._assignment_schema.notes],
-                          v2_project._assignment_schema.priority: assignment_priority,
-                          v2_project._assignment_schema.assignment_type: get_assignment_type_global_id(
-                              new_assignment_types, assignment_type_name),
-                          v2_project._assignment_schema.work_order_id: assignment.attributes[
-                              project._assignment_schema.work_order_id],
-                          v2_project._assignment_schema.due_date: assignment.attributes[
-                              project._assignment_schema.due_date],
-                          v2_project._assignment_schema.description: assignment.attributes[
-                              project._assignment_schema.description],
-                          v2_project._assignment_schema.worker_id: get_worker_global_id(workers,
-                                                                                        assignment.attributes[
-                                                                                            project._assignment_schema.worker_id]),
-                          v2_project._assignment_schema.location: assignment_location,
-                          v2_project._assignment_schema.declined_comment: assignment.attributes[
-                              project._assignment_schema.declined_comment],
-                          v2_project._assignment_schema.assigned_date: assignment.attributes[
-                              project._assignment_schema.assigned_date],
-                          v2_project._assignment_schema.in_progress_date: assignment.attributes[
-                              project._assignment_schema.in_progress_date],
-                          v2_project._assignment_schema.completed_date: assignment.attributes[
-                              project._assignment_schema.completed_date],
-                          v2_project._assignment_schema.declined_date: assignment.attributes[
-                              project._assignment_schema.declined_date],
-                          v2_project._assignment_schema.paused_date: assignment.attributes[
-                              project._assignment_schema.paused_date],
-                          v2_project._assignment_schema.dispatcher_id: get_dispatcher_global_id(
-                              arguments.skip_dispatchers, dispatchers,
-                              assignment.attributes[project._assignment_schema.dispatcher_id]),
-                          v2_project._assignment_schema.global_id: assignment.attributes[
-                              project._assignment_schema.global_id],
-                          v2_project._assignment_schema.object_id: assignment.attributes[
-                              project._assignment_schema.object_id]}
+    # Map the assignment types, workers and dispatchers to the version 2 ones once, rather than for each assignment.
+    # The migrated workers and dispatchers kept their GlobalIDs
+    assignment_type_global_ids = get_assignment_type_global_ids(existing_assignment_types, new_assignment_types)
+    worker_global_ids = {worker.object_id: worker.global_id for worker in get_reference_cache(project).workers}
+    dispatcher_global_ids = {}
+    if not arguments.skip_dispatchers:
+        dispatcher_global_ids = {dispatcher.object_id: dispatcher.global_id for dispatcher in get_reference_cache(project).dispatchers}
+
+    # Get Existing Assignments, then prepare and add them one page at a time
+    existing_assignment_count = 0
+    out_sr = v2_project.assignments_layer.properties['extent']['spatialReference']
+    if arguments.use_pbf:
+        pages = (columns_to_features(page) for page in
+                 iter_column_pages(project.assignments_layer, where=arguments.where, out_sr=out_sr, max_workers=arguments.threads))
+    else:
+        pages = iter_pages(project.assignments_layer, where=arguments.where, out_sr=out_sr, max_workers=arguments.threads)
+    for page in pages:
+        # Prepare Assignments to be Added
+        assignments_to_add = []
+        for assignment in page:
+            existing_assignment_count += 1
+            if assignment.attributes[project._assignment_schema.assignment_type]:
+                attributes = get_v2_attributes(assignment.attributes, assignment.geometry, project._assignment_schema,
+                                               v2_project._assignment_schema, assignment_type_global_ids, worker_global_ids,
+                                               dispatcher_global_ids, custom_fields)
+                feature = Feature(geometry=assignment.geometry, attributes=attributes)
+                assignments_to_add.append(feature)
+            else:
+                logger.info("One assignment's migration skipped - does not have an assignment type")
+                assignment_ghost = True
 
-            # Add Custom Field Values
-            for field in custom_fields:
-                attributes[field["name"]] = assignment.attributes[field["name"]]
-            feature = Feature(geometry=assignment.geometry, attributes=attributes)
-            assignments_to_add.append(feature)
-        else:
-            logger.info("One assignment's migration skipped - does not have an assignment type")
-            assignment_ghost = True
-
-    # Add Assignments
-    for i in range(0, len(assignments_to_add), 100):
-        layer.edit_features(adds=FeatureSet(assignments_to_add[i:i + 100]), use_global_ids=True)
-    new_assignments = v2_project.assignments_layer.query(arguments.where, return_all_records=True).features
-    if (len(new_assignments) == len(existing_assignments)) or assignment_ghost:
+        # Add Assignments
+        log_edit_results(apply_edits(layer, adds=assignments_to_add, use_global_ids=True))
+    new_assignment_count = v2_project.assignments_layer.query(arguments.where, return_count_only=True)
+    if (new_assignment_count == existing_assignment_count) or assignment_ghost:
         logger.info("Assignments successfully migrated")
     else:
         cleanup_project(gis, title)
         raise Exception("Assignments not migrated successfully. Cleaning up new project")
 
     # Migrate Attachments
+    set_phase("attachments")
     logger.info("Migrating Attachments")
-    for i, assignment in enumerate(existing_assignments):
-        object_id = assignment.attributes[project._assignment_schema.object_id]
-        logger.info(f"Migrating attachments for assignment {i + 1}/{len(existing_assignments)} objectId: {object_id}")
-        new_assignment_object_id = v2_project.assignments.get(global_id=assignment.attributes[project._assignment_schema.global_id]).object_id
-        if len(project.assignments_layer.attachments.get_list(object_id)) > 0:
-            with tempfile.TemporaryDirectory() as dirpath:
-                try:
-                    paths = project.assignments_layer.attachments.download(oid=object_id, save_path=dirpath)
-                except Exception as e:
-                    logger.info(f"Failed to download attachments for assignment: {assignment.attributes[project._assignment_schema.global_id]}")
-                    logger.exception(e)
-                for path in paths:
-                    try:
-                        v2_project.assignments_layer.attachments.add(oid=new_assignment_object_id, file_path=path)
-                    except Exception as e:
-                        logger.info(f"Failed to upload attachment: {path} from assignment: {assignment.attributes[project._assignment_schema.global_id]}")
-                        logger.exception(e)
-        else:
-            logger.info(f"No attachments to migrate for objectId: {object_id}")
-    if len(project.assignments_layer.attachments.search("1=1")) == len(
-            v2_project.assignments_layer.attachments.search("1=1")):
+    if migrate_assignment_attachments(project, v2_project, arguments.where, arguments.threads, arguments.requests_per_second):
         logger.info("Attachments successfully migrated")
     else:
         logger.info("Not all of your attachments migrated successfully. Continuing with migration")
 
     # Migrate Integrations
+    set_phase("integrations")
     logger.info("Migrating Integrations")
     v2_project.integrations.batch_delete([v2_project.integrations.get("arcgis-navigator")[0]])
     previous_integrations = project.integrations.search()
@@ -473,6 +431,7 @@ def main(arguments):  # noqa: C901
     logger.info("Integrations migrated successfully")
 
     # Migrate Webmaps - Retain non-WF layers
+    set_phase("webmaps")
     logger.info("Migrating Webmaps")
     upgrade_webmaps(project.worker_webmap, v2_project.worker_webmap)
     upgrade_webmaps(project.dispatcher_webmap, v2_project.dispatcher_webmap)
@@ -514,7 +473,7 @@ def upgrade_webmaps(old_webmap, new_webmap):
         raise Exception("Layers not added successfully")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Migrate Version 1 Project to Version 2")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -528,14 +487,19 @@ if __name__ == "__main__":
                         help="The where clause to determine what assignments to migrate. "
                              "Defaults to status IN (O, 1, 2, 4, 5) - completed and canceled assignments will not be migrated by default",
                         default="status IN (0, 1, 2, 4, 5)")
+    parser.add_argument('-threads', dest='threads', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="The number of concurrent requests to use when querying large layers and migrating attachments")
+    parser.add_argument('-requests-per-second', dest='requests_per_second', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="The maximum number of requests to start per second when running concurrently")
+    parser.add_argument('--use-pbf', dest='use_pbf', action='store_true',
+                        help="Request the assignments as protocol buffers, which are smaller and faster to decode than JSON")
     parser.add_argument('--skip-dispatchers', dest='skip_dispatchers', action='store_true',
                         help='Do not migrate dispatchers from v1 project')
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
@@ -24,44 +24,16 @@
 """
 
 import argparse
-import logging
-import logging.handlers
 import sys
-import traceback
-from arcgis.apps import workforce
-from arcgis.gis import GIS
-from arcgis.features import FeatureLayer
-
-
-def initialize_logging(log_file=None):
-    """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
-    """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+from utils import (DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND, add_diagnostic_arguments, connect, count_in, count_key,
+                   get_project, get_status_where, initialize_logging, iter_assignments, run)
+
+# The assignment columns this script reads, the location is used to describe the assignment
+ASSIGNMENT_COLUMNS = ["work_order_id", "location"]
 
 
 def main(arguments):
+    from arcgis.features import FeatureLayer
     # Initialize logging
     logger = initialize_logging(arguments.log_file)
 
@@ -69,16 +41,13 @@ def main(arguments):
     logger.info("Authenticating...")
 
     # First step is to get authenticate and get a valid token
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
     logger.info("Getting workforce project")
 
     # Get the workforce project
     item = gis.content.get(arguments.project_id)
     try:
-        project = workforce.Project(item)
+        project = get_project(item)
     except Exception as e:
         logger.info(e)
         logger.info("Invalid project id")
@@ -109,21 +78,26 @@ def main(arguments):
 
     # Updating Assignments
     logger.info("Querying assignments")
-    assignments = project.assignments.search()
-    for assignment in assignments:
-        if assignment.status == "completed" and assignment.work_order_id:
-            where = f"{arguments.field_name} = '{assignment.work_order_id}'"
-            if layer.query(where=where, return_count_only=True) == 0:
-                logger.info(f"Potential Assignment without corresponding work order: {str(assignment)} with OBJECTID {assignment.object_id}")
-                if gis.properties["isPortal"]:
-                    portal_url = gis.properties['portalHostname']
-                    logger.info(f"Assignment Link: {portal_url}/apps/workforce/#/projects/{arguments.project_id}/dispatch/assignments/{assignment.object_id}")
-                else:
-                    logger.info(f"Assignment Link: https://workforce.arcgis.com/projects/{arguments.project_id}/dispatch/assignments/{assignment.object_id}")
+    where = "{} AND {} IS NOT NULL AND {} <> ''".format(get_status_where(project._assignment_schema, ["completed"]),
+                                                        project._assignment_schema.work_order_id,
+                                                        project._assignment_schema.work_order_id)
+    assignments = list(iter_assignments(project, where=where, columns=ASSIGNMENT_COLUMNS))
+    # Count the survey features of every work order at once rather than one query per assignment
+    work_order_counts = count_in(layer, arguments.field_name, [assignment.work_order_id for assignment in assignments],
+                                 max_workers=arguments.threads, requests_per_second=arguments.requests_per_second)
+    counts = [work_order_counts.get(count_key(assignment.work_order_id), 0) for assignment in assignments]
+    for assignment, count in zip(assignments, counts):
+        if count == 0:
+            logger.info(f"Potential Assignment without corresponding work order: {str(assignment)} with OBJECTID {assignment.object_id}")
+            if gis.properties["isPortal"]:
+                portal_url = gis.properties['portalHostname']
+                logger.info(f"Assignment Link: {portal_url}/apps/workforce/#/projects/{arguments.project_id}/dispatch/assignments/{assignment.object_id}")
+            else:
+                logger.info(f"Assignment Link: https://workforce.arcgis.com/projects/{arguments.project_id}/dispatch/assignments/{assignment.object_id}")
     logger.info("Completed!")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Report completed assignments without work orders")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -141,12 +115,15 @@ if __name__ == "__main__":
                         help="The field name within the Survey or Collector layer you use to integrate with Workforce."
                              " Use actual field name, not alias. Default is work_order_id")
     parser.add_argument('-log-file', dest='log_file', help='The log file to use')
+    parser.add_argument('-threads', dest='threads', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="The number of concurrent requests to use when looking up work orders")
+    parser.add_argument('-requests-per-second', dest='requests_per_second', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="The maximum number of requests to start per second when running concurrently")
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true',
                         help="Verify the SSL Certificate of the server")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
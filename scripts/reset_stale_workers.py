@@ -24,44 +24,14 @@
 """
 
 import argparse
-import logging
-import logging.handlers
 import sys
-import traceback
-from arcgis.apps import workforce
-from arcgis.gis import GIS
-import pendulum
-
-
-def initialize_logging(log_file=None):
-    """
-    Setup logging
-    :param log_file: (string) The file to log to
-    :return: (Logger) a logging instance
-    """
-    # initialize logging
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s")
-    # Grab the root logger
-    logger = logging.getLogger()
-    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    logger.setLevel(logging.DEBUG)
-    # Create a handler to print to the console
-    sh = logging.StreamHandler(sys.stdout)
-    sh.setFormatter(formatter)
-    sh.setLevel(logging.INFO)
-    # Create a handler to log to the specified file
-    if log_file:
-        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
-        rh.setFormatter(formatter)
-        rh.setLevel(logging.DEBUG)
-        logger.addHandler(rh)
-    # Add the handlers to the root logger
-    logger.addHandler(sh)
-    return logger
+from utils import (WORKER_STATUSES, add_diagnostic_arguments, apply_edits, connect, get_failed_edits, get_project,
+                   get_projection, get_status_where, initialize_logging, iter_features, log_edit_results, run)
 
 
 def main(arguments):
+    import pendulum
+    from arcgis.features import Feature
     # Initialize logging
     logger = initialize_logging(arguments.log_file)
 
@@ -69,17 +39,14 @@ def main(arguments):
     logger.info("Authenticating...")
 
     # First step is to get authenticate and get a valid token
-    gis = GIS(arguments.org_url,
-              username=arguments.username,
-              password=arguments.password,
-              verify_cert=not arguments.skip_ssl_verification)
+    gis = connect(arguments)
 
     logger.info("Getting workforce project")
 
     # Get the workforce project
     item = gis.content.get(arguments.project_id)
     try:
-        project = workforce.Project(item)
+        project = get_project(item)
     except Exception as e:
         logger.info(e)
         logger.info("Invalid project id")
@@ -88,12 +55,12 @@ def main(arguments):
     # First check if relative date
     logger.info("Formatting date")
     try:
-        delta = int(args.cutoff_date)
+        delta = int(arguments.cutoff_date)
         utc_dt = pendulum.now().subtract(minutes=delta).in_tz('UTC')
     except Exception:
         # If not relative date, then attempt to convert date and attach timezone to naive date value
         try:
-            local_cutoff_date = pendulum.from_format(arguments.cutoff_date, "MM/DD/YYYY hh:mm:ss", tz=args.timezone, formatter='alternative')
+            local_cutoff_date = pendulum.from_format(arguments.cutoff_date, "MM/DD/YYYY hh:mm:ss", tz=arguments.timezone, formatter='alternative')
         except Exception as e:
             logger.info(e)
             logger.info("Invalid date format. Please check documentation and try again")
@@ -103,16 +70,23 @@ def main(arguments):
 
     # Query using UTC-formatted date and reset those workers
     logger.info("Querying workers")
-    where = f"{project._worker_schema.edit_date} < TIMESTAMP '{formatted_date}'"
-    workers = project.workers.search(where=where)
-    for worker in workers:
-        worker.status = "not_working"
+    schema = project._worker_schema
+    # Workers that are already not working are left alone
+    not_working = get_status_where(schema, ["not_working"], WORKER_STATUSES)
+    where = f"{schema.edit_date} < TIMESTAMP '{formatted_date}' AND ({schema.status} IS NULL OR NOT {not_working})"
+    # Only the object ids are needed to reset the status
+    workers = [Feature(attributes={schema.object_id: worker.attributes[schema.object_id], schema.status: WORKER_STATUSES["not_working"]})
+               for worker in iter_features(project.workers_layer, where=where, **get_projection(schema, ["object_id"]))]
     logger.info("Updating workers")
-    project.workers.batch_update(workers)
+    results = apply_edits(project.workers_layer, updates=workers)
+    log_edit_results(results)
+    failed = get_failed_edits(results)
+    if failed:
+        logger.info(f"{len(failed)} workers could not be updated")
     logger.info("Completed!")
 
 
-if __name__ == "__main__":
+def get_parser():
     # Get all of the commandline arguments
     parser = argparse.ArgumentParser("Reset stale workers' status to not working")
     parser.add_argument('-u', dest='username', help="The username to authenticate with", required=True)
@@ -128,10 +102,9 @@ if __name__ == "__main__":
     parser.add_argument('-timezone', dest='timezone', default="UTC", help="The timezone for the cutoff date")
     parser.add_argument('-log-file', dest='log_file', help='The log file to use')
     parser.add_argument('--skip-ssl-verification', dest='skip_ssl_verification', action='store_true', help="Verify the SSL Certificate of the server")
-    args = parser.parse_args()
-    try:
-        main(args)
-    except Exception as e:
-        logging.getLogger().critical("Exception detected, script exiting")
-        logging.getLogger().critical(e)
-        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+    add_diagnostic_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run(main, get_parser().parse_args()))
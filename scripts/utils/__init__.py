@@ -0,0 +1,54 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Helpers shared by the Workforce scripts
+"""
+
+from .auth import get_gis, refresh_gis
+from .batching import AdaptiveBatchSize
+from .cassette import (RECORDED_LATENCY, Cassette, CassetteError, CassettePlayer, add_cassette_arguments, start_cassette,
+                       stop_cassette)
+from .bootstrap import add_diagnostic_arguments, connect, run
+from .logs import LOG_FORMATS, JsonFormatter, RateLimitedLogger, add_log_format_arguments, initialize_logging, stop_logging
+from .edits import apply_edits, apply_in_batches, get_failed_edits, log_edit_results
+from .geocoding import (DEFAULT_GEOCODE_TTL, GeocodeCache, batch_geocode_in_chunks, geocode_addresses, get_batch_size,
+                        get_geocode_cache, get_geocoder_id, is_matched, normalize_address)
+from .migration import get_assignment_type_global_ids, migrate_assignment_attachments, migrate_attachments
+from .planner import plan_in_clauses, query_in, count_in, count_key
+from .project_cache import get_project
+from .projection import (ASSIGNMENT_STATUSES, WORKER_STATUSES, get_out_fields, get_projection, get_assignment_projection,
+                         get_status_where)
+from .throttle import DEFAULT_REQUESTS_PER_SECOND, ThrottledExecutor, get_session
+from .reference_cache import DEFAULT_TTL, ReferenceCache, get_reference_cache
+from .metrics import (DEFAULT_METRICS_HOST, MetricsRegistry, PollMetrics, get_registry, instrument_requests,
+                      start_metrics_server, write_metrics)
+from .profiling import PhaseProfiler, add_profile_arguments, start_profiling, stop_profiling
+from .tracing import RequestTracer, add_trace_arguments, set_phase, start_tracing, stop_tracing
+from .query import (DEFAULT_MAX_WORKERS, iter_pages, iter_features, iter_assignments, query_object_ids, iter_column_pages,
+                    columns_to_features, page_length, query_attachments)
+
+__all__ = ["get_gis", "refresh_gis", "AdaptiveBatchSize", "initialize_logging", "connect", "run", "apply_edits",
+           "apply_in_batches", "get_failed_edits", "log_edit_results", "DEFAULT_MAX_WORKERS", "iter_pages",
+           "iter_features", "iter_assignments", "query_object_ids", "iter_column_pages", "columns_to_features",
+           "page_length", "DEFAULT_REQUESTS_PER_SECOND", "ThrottledExecutor", "get_session", "ASSIGNMENT_STATUSES",
+           "WORKER_STATUSES", "get_out_fields", "get_projection", "get_assignment_projection", "get_status_where",
+           "plan_in_clauses", "query_in", "count_in", "get_project", "DEFAULT_TTL", "ReferenceCache",
+           "get_reference_cache", "RequestTracer", "add_trace_arguments", "set_phase", "start_tracing", "stop_tracing",
+           "PhaseProfiler", "start_profiling", "stop_profiling", "RECORDED_LATENCY", "Cassette", "CassetteError",
+           "CassettePlayer", "start_cassette", "stop_cassette", "LOG_FORMATS", "JsonFormatter", "RateLimitedLogger",
+           "stop_logging", "DEFAULT_METRICS_HOST", "MetricsRegistry", "PollMetrics", "get_registry", "instrument_requests",
+           "start_metrics_server", "write_metrics", "DEFAULT_GEOCODE_TTL", "GeocodeCache", "geocode_addresses",
+           "get_geocode_cache", "get_geocoder_id", "normalize_address", "batch_geocode_in_chunks",
+           "get_batch_size", "is_matched", "migrate_attachments", "add_diagnostic_arguments", "add_profile_arguments",
+           "add_cassette_arguments", "add_log_format_arguments", "get_assignment_type_global_ids",
+           "query_attachments", "migrate_assignment_attachments", "count_key"]
@@ -0,0 +1,174 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Reuses the token of a previous login across script runs
+
+   Every GIS(org_url, username, password) generates a new token, so scheduled scripts log in on every run and can
+   hit the login rate limits of the organization. When WORKFORCE_SCRIPTS_TOKEN_CACHE=on, the token is saved in
+   ~/.workforce-scripts/tokens (readable by the current user only) and reused until shortly before it expires.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+from .project_cache import get_cache_root
+
+# A cached token is not used (and a GIS is refreshed) when it expires in less than this many seconds
+DEFAULT_REFRESH_MARGIN = 5 * 60
+
+
+def is_token_cache_enabled():
+    """
+    Checks whether the token cache was turned on
+    :return: (bool) True if tokens should be cached
+    """
+    return os.environ.get("WORKFORCE_SCRIPTS_TOKEN_CACHE", "").lower() in ("1", "on", "true", "yes")
+
+
+def _get_token_path(org_url, username):
+    # The file name does not reveal the org or user
+    key = "{}\n{}".format(org_url.lower().rstrip("/"), username.lower())
+    return os.path.join(get_cache_root(), "tokens", hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+
+def _is_private(path):
+    """
+    Checks that a file is a regular file owned by the current user that other users cannot read or write
+    """
+    info = os.lstat(path)
+    if not stat.S_ISREG(info.st_mode):
+        return False
+    # Windows does not have POSIX permissions; the file is in the user's profile
+    if os.name == "nt":
+        return True
+    return info.st_uid == os.getuid() and not info.st_mode & (stat.S_IRWXG | stat.S_IRWXO)
+
+
+def _read_token(path):
+    try:
+        if not _is_private(path):
+            logging.getLogger().warning("Ignoring cached token {}, it can be read by other users".format(path))
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_token(path, entry):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.chmod(directory, 0o700)
+    # mkstemp creates the file with 0600 permissions
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def _remove_token(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_token_expiry(gis):
+    """
+    Gets when the token of a GIS expires
+    :param gis: (GIS) The GIS
+    :return: (float) The expiry as a POSIX timestamp, or None if the GIS does not have a token that expires
+    """
+    con = gis._con
+    if getattr(con, "_create_time", None) is None or not getattr(con, "_expiration", None):
+        return None
+    return (con._create_time + datetime.timedelta(minutes=con._expiration)).timestamp()
+
+
+def _get_gis_from_token(org_url, entry, verify_cert):
+    """
+    Builds a GIS from a cached token
+    :return: (GIS) The GIS, or None if the token was not accepted for the cached user
+    """
+    from arcgis.gis import GIS
+    gis = GIS(org_url, token=entry["token"], verify_cert=verify_cert)
+    me = gis.users.me
+    if me is None or me.username.lower() != entry["username"].lower():
+        return None
+    # Treat the token as valid until it actually expires, rather than for the default expiration of a new GIS
+    gis._con._create_time = (datetime.datetime.fromtimestamp(entry["expires"]) -
+                             datetime.timedelta(minutes=gis._con._expiration))
+    return gis
+
+
+def get_gis(org_url, username=None, password=None, verify_cert=True, refresh_margin=DEFAULT_REFRESH_MARGIN):
+    """
+    Connects to an organization, reusing a cached token when the token cache is enabled. This replaces
+    GIS(org_url, username, password, verify_cert=verify_cert).
+    :param org_url: (string) The url of the organization
+    :param username: (string) The username to log in with
+    :param password: (string) The password to log in with
+    :param verify_cert: (bool) Whether or not to verify the SSL certificate of the organization
+    :param refresh_margin: (int) The number of seconds before its expiry after which a cached token is not used
+    :return: (GIS) The GIS
+    """
+    from arcgis.gis import GIS
+    if not (is_token_cache_enabled() and username and password):
+        return GIS(org_url, username=username, password=password, verify_cert=verify_cert)
+    logger = logging.getLogger()
+    path = _get_token_path(org_url, username)
+    entry = _read_token(path)
+    if entry and entry.get("expires", 0) - time.time() > refresh_margin:
+        try:
+            gis = _get_gis_from_token(org_url, entry, verify_cert)
+            if gis is not None:
+                logger.debug("Using the cached token of {}".format(username))
+                return gis
+        except Exception as e:
+            logger.debug("The cached token of {} could not be used: {}".format(username, e))
+        _remove_token(path)
+    gis = GIS(org_url, username=username, password=password, verify_cert=verify_cert)
+    expires = get_token_expiry(gis)
+    if expires is not None:
+        try:
+            _write_token(path, {"username": username, "token": gis._con.token, "expires": expires})
+        except Exception as e:
+            logger.debug("Could not cache the token of {}: {}".format(username, e))
+    return gis
+
+
+def refresh_gis(gis, org_url, username=None, password=None, verify_cert=True, refresh_margin=DEFAULT_REFRESH_MARGIN):
+    """
+    Replaces a GIS whose token is about to expire. For processes that keep running, like the assignment monitor.
+    :param gis: (GIS) The GIS in use
+    :param org_url: (string) The url of the organization
+    :param username: (string) The username to log in with
+    :param password: (string) The password to log in with
+    :param verify_cert: (bool) Whether or not to verify the SSL certificate of the organization
+    :param refresh_margin: (int) The number of seconds before the expiry of its token at which the GIS is replaced
+    :return: (GIS) The same GIS if its token is still valid, otherwise a new one
+    """
+    expires = get_token_expiry(gis)
+    if not is_token_cache_enabled() or expires is None or expires - time.time() > refresh_margin:
+        return gis
+    logging.getLogger().info("Refreshing the token of {}".format(username))
+    return get_gis(org_url, username, password, verify_cert, refresh_margin)
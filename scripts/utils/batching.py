@@ -0,0 +1,106 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Sizes edit batches from their encoded payload and the latency of recent responses
+"""
+
+import json
+import logging
+
+
+def encoded_size(item):
+    """
+    Estimates the number of bytes an item adds to an edit request
+    :param item: (Feature, workforce model, dict or id) The item being edited
+    :return: (int) The size of its JSON encoding
+    """
+    feature = getattr(item, "feature", item)
+    value = getattr(feature, "as_dict", feature)
+    return len(json.dumps(value, default=str))
+
+
+class AdaptiveBatchSize(object):
+    """
+    Picks the number of items to send in the next request. The size grows while the server answers quickly and is
+    halved when a response is slow or a request fails. Each batch is also capped by its encoded size, so rows with
+    long notes or complex geometries are sent in smaller batches than narrow ones.
+    """
+
+    def __init__(self, initial=100, minimum=10, maximum=1000, max_payload_bytes=2000000, fast_seconds=5.0, slow_seconds=20.0,
+                 growth=1.5):
+        """
+        :param initial: (int) The number of items in the first batch
+        :param minimum: (int) The smallest batch to shrink to
+        :param maximum: (int) The largest batch to grow to
+        :param max_payload_bytes: (int) The maximum encoded size of a batch
+        :param fast_seconds: (float) Responses faster than this grow the batch size
+        :param slow_seconds: (float) Responses slower than this shrink the batch size
+        :param growth: (float) The factor to grow the batch size by
+        """
+        self.size = initial
+        self.minimum = min(minimum, initial)
+        self.maximum = max(maximum, initial)
+        self.max_payload_bytes = max_payload_bytes
+        self.fast_seconds = fast_seconds
+        self.slow_seconds = slow_seconds
+        self.growth = growth
+
+    @classmethod
+    def fixed(cls, size):
+        """
+        Creates a controller that always uses the same batch size
+        :param size: (int) The batch size
+        :return: (AdaptiveBatchSize) The controller
+        """
+        return cls(initial=size, minimum=size, maximum=size, max_payload_bytes=None)
+
+    def take(self, items, start):
+        """
+        Gets the next batch of items
+        :param items: (List) All of the items
+        :param start: (int) The index of the first item not yet sent
+        :return: (List) The next batch, always containing at least one item
+        """
+        end = min(start + self.size, len(items))
+        if self.max_payload_bytes:
+            payload = 0
+            for i in range(start, end):
+                payload += encoded_size(items[i])
+                if payload > self.max_payload_bytes and i > start:
+                    end = i
+                    break
+        return items[start:end]
+
+    def record_success(self, count, seconds):
+        """
+        Adjusts the batch size after a successful request
+        :param count: (int) The number of items that were sent
+        :param seconds: (float) How long the request took
+        """
+        if seconds > self.slow_seconds:
+            self._resize(self.size // 2)
+        elif seconds < self.fast_seconds and count >= self.size:
+            # Only grow when the batch was full, otherwise the payload limit or the end of the items capped it
+            self._resize(int(self.size * self.growth) + 1)
+
+    def record_failure(self):
+        """
+        Shrinks the batch size after a request failed (HTTP error, timeout, ...)
+        """
+        self._resize(self.size // 2)
+
+    def _resize(self, size):
+        size = max(self.minimum, min(self.maximum, size))
+        if size != self.size:
+            logging.getLogger().debug("Batch size changed from {} to {}".format(self.size, size))
+            self.size = size
@@ -0,0 +1,85 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   The start up shared by the scripts: connecting to the organization and reporting the errors of a run
+
+   Only the standard library is imported here, so that parsing the arguments (and --help) does not wait for the
+   ArcGIS API for Python to load.
+"""
+
+import logging
+import traceback
+from .cassette import add_cassette_arguments, start_cassette, stop_cassette
+from .logs import add_log_format_arguments, set_default_log_format
+from .profiling import add_profile_arguments, start_profiling, stop_profiling
+from .tracing import add_trace_arguments, start_tracing, stop_tracing
+
+
+def connect(arguments):
+    """
+    Connects to the organization given on the command line
+    :param arguments: (Namespace) The parsed arguments, with org_url, username, password and skip_ssl_verification
+    :return: (GIS) The GIS
+    """
+    from .auth import get_gis
+    return get_gis(arguments.org_url,
+                   username=arguments.username,
+                   password=arguments.password,
+                   verify_cert=not arguments.skip_ssl_verification)
+
+
+def add_diagnostic_arguments(parser):
+    """
+    Adds the tracing, profiling, cassette and log format arguments that run acts on to the parser of a script
+    :param parser: (ArgumentParser) The parser of the script
+    :return: (ArgumentParser) The parser
+    """
+    add_trace_arguments(parser)
+    add_profile_arguments(parser)
+    add_cassette_arguments(parser)
+    add_log_format_arguments(parser)
+    return parser
+
+
+def run(main, arguments):
+    """
+    Runs the main function of a script, logging the exception that stopped it, tracing its HTTP calls when
+    --trace-requests or -trace-json was given, profiling it when --profile or -profile-dir was given and recording or
+    replaying its HTTP calls when -record-cassette or -replay-cassette was given
+    :param main: (Function) The main function of the script
+    :param arguments: (Namespace) The parsed arguments
+    :return: (int) The exit code, 0 if the script succeeded and 1 if it raised
+    """
+    set_default_log_format(getattr(arguments, "log_format", None))
+    record_cassette = getattr(arguments, "record_cassette", None)
+    replay_cassette = getattr(arguments, "replay_cassette", None)
+    if record_cassette or replay_cassette:
+        start_cassette(record_cassette, replay_cassette, getattr(arguments, "replay_latency", None))
+    trace_json = getattr(arguments, "trace_json", None)
+    if getattr(arguments, "trace_requests", False) or trace_json:
+        start_tracing()
+    profile_dir = getattr(arguments, "profile_dir", None)
+    if getattr(arguments, "profile", False) or profile_dir:
+        start_profiling(profile_dir or "profile")
+    try:
+        main(arguments)
+    except Exception as e:
+        logging.getLogger().critical("Exception detected, script exiting")
+        logging.getLogger().critical(e)
+        logging.getLogger().critical(traceback.format_exc().replace("\n", " | "))
+        return 1
+    finally:
+        stop_profiling()
+        stop_tracing(trace_json)
+        stop_cassette()
+    return 0
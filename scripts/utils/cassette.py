@@ -0,0 +1,310 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Records the HTTP traffic of a script into a cassette file and replays it offline
+
+   Run a script with -record-cassette calls.json.gz against a real organization and every request sent through the
+   requests library is saved with its response and latency. Run it again with -replay-cassette calls.json.gz and the
+   same requests are answered from the cassette, without a network, optionally after the recorded latency or a fixed
+   one (-replay-latency). The script runs as it did against the organization, so the client side of a run (parsing,
+   batching, threads) can be profiled and changed without touching the live services.
+
+   Requests are matched by method, url and body. Tokens and passwords are left out of the match and out of the
+   cassette, and tokens are removed from the recorded responses. A request that changes between runs (for example one
+   with the current date in its where clause) gets the next unused response recorded for the same method and path.
+"""
+
+import base64
+import collections
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+# The value of -replay-latency that replays the latency of each recorded call
+RECORDED_LATENCY = "recorded"
+CASSETTE_VERSION = 1
+# Request parameters that change between runs or are secrets
+_IGNORED_PARAMETERS = {"token", "password", "_ts"}
+# Response headers kept in the cassette
+_KEPT_HEADERS = ("Content-Type", "Content-Disposition", "Retry-After", "Location")
+# Tokens in responses, e.g. from generateToken or oauth2/token
+_TOKEN = re.compile(r'("(?:token|access_token|refresh_token)"\s*:\s*")[^"]*(")')
+_REDACTED = "REDACTED"
+
+_cassette = None
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _strip_url(url):
+    parsed = urlparse(url)
+    query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if k not in _IGNORED_PARAMETERS]
+    return urlunparse(parsed._replace(query=urlencode(sorted(query))))
+
+
+def _get_body_hash(request):
+    body = request.body
+    if not body:
+        return ""
+    content_type = request.headers.get("Content-Type", "")
+    if "x-www-form-urlencoded" in content_type:
+        text = body.decode("utf-8") if isinstance(body, bytes) else body
+        parameters = [(k, v) for k, v in parse_qsl(text, keep_blank_values=True) if k not in _IGNORED_PARAMETERS]
+        body = urlencode(sorted(parameters))
+    elif "multipart" in content_type:
+        # The boundary is random, so uploads are matched by url only
+        return ""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    elif not isinstance(body, bytes):
+        return ""
+    return hashlib.sha1(body).hexdigest()
+
+
+def get_key(request):
+    """
+    Gets the key a request is matched by, without its token and password
+    :param request: (PreparedRequest) The request
+    :return: (string) The method, url and hash of the body
+    """
+    return "{} {} {}".format(request.method, _strip_url(request.url), _get_body_hash(request)).rstrip()
+
+
+def _get_path_key(key):
+    method, url = key.split(" ")[:2]
+    return "{} {}".format(method, url.split("?")[0])
+
+
+class CassetteError(Exception):
+    """
+    Raised when a replayed request was not recorded
+    """
+
+
+class Cassette(object):
+    """
+    The recorded calls of a script, in the order they were made
+    """
+
+    def __init__(self, interactions=None):
+        """
+        :param interactions: (List<Dict>) The recorded calls, with key, status, headers, text or base64 and latency_ms
+        """
+        self.interactions = interactions or []
+        self._lock = threading.Lock()
+        self._by_key = None
+        self._by_path = None
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a cassette written by save
+        :param path: (string) The file, compressed with gzip if it ends with .gz
+        :return: (Cassette) The cassette
+        """
+        with _open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != CASSETTE_VERSION:
+            raise CassetteError("{} is not a version {} cassette".format(path, CASSETTE_VERSION))
+        return cls(data["interactions"])
+
+    def save(self, path):
+        """
+        Writes the cassette
+        :param path: (string) The file, compressed with gzip if it ends with .gz
+        """
+        with self._lock:
+            interactions = list(self.interactions)
+        with _open(path, "w") as f:
+            json.dump({"version": CASSETTE_VERSION, "interactions": interactions}, f, separators=(",", ":"))
+
+    def record(self, request, response, elapsed):
+        """
+        Adds a call to the cassette
+        :param request: (PreparedRequest) The request that was sent
+        :param response: (Response) Its response, which is read in full
+        :param elapsed: (float) The number of seconds the call took
+        """
+        content = response.content or b""
+        interaction = {"key": get_key(request), "status": response.status_code,
+                       "headers": {h: response.headers[h] for h in _KEPT_HEADERS if h in response.headers},
+                       "latency_ms": round(elapsed * 1000, 3)}
+        try:
+            interaction["text"] = _TOKEN.sub(r"\g<1>{}\g<2>".format(_REDACTED), content.decode("utf-8"))
+        except UnicodeDecodeError:
+            interaction["base64"] = base64.b64encode(content).decode("ascii")
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def next(self, request):
+        """
+        Takes the recorded call that answers a request: the next unused call with the same key, then the next unused
+        call with the same method and path, then the last call with the same key again
+        :param request: (PreparedRequest) The request
+        :return: (Dict) The recorded call
+        """
+        key = get_key(request)
+        with self._lock:
+            if self._by_key is None:
+                self._by_key = collections.defaultdict(collections.deque)
+                self._by_path = collections.defaultdict(collections.deque)
+                for interaction in self.interactions:
+                    self._by_key[interaction["key"]].append(interaction)
+                    self._by_path[_get_path_key(interaction["key"])].append(interaction)
+            for queue in (self._by_key.get(key), self._by_path.get(_get_path_key(key))):
+                while queue:
+                    interaction = queue.popleft()
+                    if not interaction.get("used"):
+                        interaction["used"] = True
+                        return interaction
+            for interaction in reversed(self.interactions):
+                if interaction["key"] == key:
+                    return interaction
+        raise CassetteError("No recorded response for {}".format(key))
+
+
+def _build_response(request, interaction):
+    import io
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+    if "base64" in interaction:
+        content = base64.b64decode(interaction["base64"])
+    else:
+        content = interaction["text"].encode("utf-8")
+    response = Response()
+    response.status_code = interaction["status"]
+    response.headers = CaseInsensitiveDict(interaction["headers"])
+    response.headers["Content-Length"] = str(len(content))
+    response.raw = io.BytesIO(content)
+    response._content = content
+    response._content_consumed = True
+    response.url = request.url
+    response.request = request
+    response.encoding = "utf-8" if "text" in interaction else None
+    response.reason = "Replayed"
+    return response
+
+
+class CassettePlayer(object):
+    """
+    Records the calls sent through requests to a cassette, or answers them from one, while it is started. The
+    transport adapter is replaced, so sessions, cookies and redirects behave as they do against a server.
+    """
+
+    def __init__(self, cassette, replay=False, latency=None):
+        """
+        :param cassette: (Cassette) The cassette to record to or replay
+        :param replay: (bool) Whether to replay the cassette rather than record to it
+        :param latency: (float|string) The number of milliseconds to wait before answering a replayed call, or
+            RECORDED_LATENCY to wait as long as the recorded call took
+        """
+        self.cassette = cassette
+        self.replay = replay
+        self.latency = latency
+        self.record_file = None
+        self._send = None
+
+    def start(self):
+        """
+        Starts recording or replaying
+        :return: (CassettePlayer) The player
+        """
+        from requests.adapters import HTTPAdapter
+        player = self
+        send = HTTPAdapter.send
+
+        def recording_send(adapter, request, **kwargs):
+            started = time.perf_counter()
+            response = send(adapter, request, **kwargs)
+            player.cassette.record(request, response, time.perf_counter() - started)
+            return response
+
+        def replaying_send(adapter, request, **kwargs):
+            interaction = player.cassette.next(request)
+            if player.latency == RECORDED_LATENCY:
+                time.sleep(interaction["latency_ms"] / 1000)
+            elif player.latency:
+                time.sleep(float(player.latency) / 1000)
+            return _build_response(request, interaction)
+
+        self._send = send
+        HTTPAdapter.send = replaying_send if self.replay else recording_send
+        return self
+
+    def stop(self):
+        """
+        Stops recording or replaying
+        """
+        from requests.adapters import HTTPAdapter
+        if self._send is not None:
+            HTTPAdapter.send = self._send
+            self._send = None
+
+
+def add_cassette_arguments(parser):
+    """
+    Adds the arguments to record or replay a cassette to the parser of a script
+    :param parser: (ArgumentParser) The parser of the script
+    :return: (ArgumentParser) The parser
+    """
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('-record-cassette', dest='record_cassette',
+                          help="Record every HTTP call and its response to this cassette file (gzipped if it ends "
+                               "with .gz)")
+    cassette.add_argument('-replay-cassette', dest='replay_cassette',
+                          help="Answer the HTTP calls of the script from this cassette file instead of the network")
+    parser.add_argument('-replay-latency', dest='replay_latency', default=None,
+                        help="The milliseconds to wait before answering each replayed call, or 'recorded' to wait as "
+                             "long as the recorded call took")
+    return parser
+
+
+def start_cassette(record_file=None, replay_file=None, latency=None):
+    """
+    Starts recording the HTTP calls of the process to a cassette, or replaying them from one
+    :param record_file: (string) The cassette to record to
+    :param replay_file: (string) The cassette to replay
+    :param latency: (float|string) The latency of the replayed calls in milliseconds, or RECORDED_LATENCY
+    :return: (CassettePlayer) The player
+    """
+    global _cassette
+    if replay_file:
+        _cassette = CassettePlayer(Cassette.load(replay_file), replay=True, latency=latency).start()
+    else:
+        _cassette = CassettePlayer(Cassette()).start()
+    _cassette.record_file = record_file
+    return _cassette
+
+
+def stop_cassette():
+    """
+    Stops recording or replaying, and writes the recorded cassette
+    :return: (CassettePlayer) The player, or None if no cassette was started
+    """
+    global _cassette
+    player = _cassette
+    if player is None:
+        return None
+    _cassette = None
+    player.stop()
+    if not player.replay and player.record_file:
+        player.cassette.save(player.record_file)
+    return player
@@ -0,0 +1,231 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Chunked edits with retries
+
+   Large edits are split into chunks. A chunk whose request fails with a transient error (throttling, timeout, ...)
+   is retried on its own, so one bad request does not force the whole edit to be restarted. Adds are not idempotent,
+   so a chunk of adds that timed out or lost its connection is not retried, since the server may have applied it;
+   only the chunks the server refused (429, 503) are.
+
+   Other errors, like a validation error of the ArcGIS API for Python, would fail the same way again. The chunk is
+   split in halves until the items that fail are found, and the other items are applied. Per-feature failures
+   reported by the server are not retried either; they are returned in the consolidated results instead.
+
+   Unless a fixed chunk size is given, chunks are sized by an AdaptiveBatchSize, and a chunk that failed with a
+   transient error is retried at the reduced size.
+"""
+
+import logging
+import re
+import time
+from .batching import AdaptiveBatchSize
+from .throttle import is_retryable
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_DELAY = 2
+
+# The statuses and messages of the calls the server refused, which it did not apply
+_REFUSED_STATUS_CODES = {429, 503}
+_REFUSED_MESSAGE = re.compile(r"\b(429|503)\b|too many requests|service unavailable", re.IGNORECASE)
+
+# The keyword argument of edit_features and the key of the results it returns for each type of edit
+EDIT_TYPES = [("adds", "addResults"), ("updates", "updateResults"), ("deletes", "deleteResults")]
+
+
+def _get_batch_size(chunk_size):
+    """
+    Gets the batch size controller to use
+    :param chunk_size: (int or AdaptiveBatchSize) A fixed chunk size, a controller, or None for an adaptive one
+    :return: (AdaptiveBatchSize) The controller
+    """
+    if chunk_size is None:
+        return AdaptiveBatchSize()
+    if isinstance(chunk_size, AdaptiveBatchSize):
+        return chunk_size
+    return AdaptiveBatchSize.fixed(chunk_size)
+
+
+def _is_safe_to_retry(error, idempotent):
+    """
+    Checks whether a chunk that failed should be sent again
+    :param error: (Exception) The error raised by the operation
+    :param idempotent: (bool) Whether applying the chunk twice has the same effect as applying it once
+    :return: (bool) True if the error is transient, and the server did not apply the chunk or applying it again is safe
+    """
+    import requests
+    if not is_retryable(error):
+        return False
+    if idempotent or isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # The server may have applied a call that timed out or lost its connection
+    response = getattr(error, "response", None)
+    if response is not None:
+        return response.status_code in _REFUSED_STATUS_CODES
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return False
+    return bool(_REFUSED_MESSAGE.search(str(error)))
+
+
+def _split_chunk(operation, chunk, error):
+    """
+    Splits a chunk that failed with a deterministic error in halves until the items that fail are found
+    :param operation: (Function) The operation to call with each half
+    :param chunk: (List) The items of the chunk
+    :param error: (Exception) The error the chunk failed with
+    :return: (Generator<Tuple<List, object, Exception>>) Each part of the chunk with either the result of the
+        operation or the exception it failed with
+    """
+    if len(chunk) == 1:
+        logging.getLogger().error("Item failed: {}".format(error))
+        yield chunk, None, error
+        return
+    logging.getLogger().warning("Chunk of {} failed ({}), splitting it to find the items that fail".format(len(chunk), error))
+    middle = len(chunk) // 2
+    for half in (chunk[:middle], chunk[middle:]):
+        try:
+            result = operation(half)
+        except Exception as e:
+            if is_retryable(e):
+                logging.getLogger().error("Giving up on a chunk of {}: {}".format(len(half), e))
+                yield half, None, e
+            else:
+                yield from _split_chunk(operation, half, e)
+        else:
+            yield half, result, None
+
+
+def iter_chunk_results(operation, items, chunk_size=None, max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY,
+                       idempotent=True):
+    """
+    Calls an operation on successive chunks of items, retrying a chunk with an exponential backoff when it fails with
+    a transient error, and splitting it to isolate the items that fail when it fails with another error
+    :param operation: (Function) The operation to call with each chunk
+    :param items: (List) The items
+    :param chunk_size: (int or AdaptiveBatchSize) A fixed chunk size, a controller, or None for an adaptive one
+    :param max_retries: (int) The number of times to retry a chunk before giving up on it
+    :param retry_delay: (float) The number of seconds to wait before the first retry
+    :param idempotent: (bool) Whether a chunk may be sent again after a timeout, which it may have been applied in.
+        False for adds.
+    :return: (Generator<Tuple<List, object, Exception>>) Each chunk (or part of a chunk) with either the result of the
+        operation or the exception that made it give up
+    """
+    batch_size = _get_batch_size(chunk_size)
+    items = list(items)
+    position = 0
+    attempt = 0
+    while position < len(items):
+        chunk = batch_size.take(items, position)
+        started = time.time()
+        try:
+            result = operation(chunk)
+        except Exception as e:
+            if not is_retryable(e):
+                for outcome in _split_chunk(operation, chunk, e):
+                    yield outcome
+            else:
+                batch_size.record_failure()
+                if attempt < max_retries and _is_safe_to_retry(e, idempotent):
+                    delay = retry_delay * 2 ** attempt
+                    attempt += 1
+                    logging.getLogger().warning("Chunk of {} failed ({}), retrying in {} seconds ({}/{})".format(
+                        len(chunk), e, delay, attempt, max_retries))
+                    time.sleep(delay)
+                    continue
+                if attempt < max_retries:
+                    logging.getLogger().error("Not retrying a chunk of {} that the server may have applied: {}".format(
+                        len(chunk), e))
+                else:
+                    logging.getLogger().error("Giving up on a chunk of {} after {} retries: {}".format(
+                        len(chunk), max_retries, e))
+                yield chunk, None, e
+        else:
+            batch_size.record_success(len(chunk), time.time() - started)
+            yield chunk, result, None
+        attempt = 0
+        position += len(chunk)
+
+
+def apply_edits(layer, adds=None, updates=None, deletes=None, chunk_size=None, use_global_ids=False,
+                max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+    """
+    Applies adds, updates and deletes to a layer in chunks
+    :param layer: (FeatureLayer) The layer to edit
+    :param adds: (List<Feature>) The features to add
+    :param updates: (List<Feature>) The features to update
+    :param deletes: (List) The object ids (or global ids, with use_global_ids) to delete
+    :param chunk_size: (int or AdaptiveBatchSize) A fixed chunk size, a controller, or None for an adaptive one
+    :param use_global_ids: (bool) Whether the edits are identified by their GlobalID
+    :param max_retries: (int) The number of times to retry a chunk that fails
+    :param retry_delay: (float) The number of seconds to wait before the first retry
+    :return: (Dict) The addResults, updateResults and deleteResults of every edit, in the order given. The edits of a
+        chunk that could not be sent are reported as unsuccessful with the error that was raised.
+    """
+    results = {result_key: [] for _, result_key in EDIT_TYPES}
+    edits = {"adds": adds, "updates": updates, "deletes": deletes}
+    batch_size = _get_batch_size(chunk_size)
+    for edit_type, result_key in EDIT_TYPES:
+        def operation(chunk):
+            return layer.edit_features(use_global_ids=use_global_ids, **{edit_type: chunk})
+        for chunk, response, error in iter_chunk_results(operation, edits[edit_type] or [], batch_size, max_retries, retry_delay,
+                                                         idempotent=edit_type != "adds"):
+            if error is None:
+                results[result_key].extend(response.get(result_key, []))
+            else:
+                results[result_key].extend({"success": False, "error": {"description": str(error)}} for _ in chunk)
+    return results
+
+
+def get_failed_edits(results):
+    """
+    Gets the edits that were not successful
+    :param results: (Dict) The results returned by apply_edits
+    :return: (List<Dict>) The result of each failed edit
+    """
+    return [result for _, result_key in EDIT_TYPES for result in results.get(result_key, []) if not result.get("success", False)]
+
+
+def log_edit_results(results):
+    """
+    Logs a summary of the results returned by apply_edits
+    :param results: (Dict) The results returned by apply_edits
+    """
+    logger = logging.getLogger()
+    for edit_type, result_key in EDIT_TYPES:
+        if results[result_key]:
+            succeeded = sum(1 for result in results[result_key] if result.get("success", False))
+            logger.info("{} of {} {} succeeded".format(succeeded, len(results[result_key]), edit_type))
+    for result in get_failed_edits(results):
+        logger.debug("Failed edit: {}".format(result))
+
+
+def apply_in_batches(operation, items, chunk_size=None, max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY,
+                     idempotent=False):
+    """
+    Calls a workforce batch operation (such as project.workers.batch_add) in chunks
+    :param operation: (Function) The batch operation
+    :param items: (List) The workforce items to pass to the operation
+    :param chunk_size: (int or AdaptiveBatchSize) A fixed chunk size, a controller, or None for an adaptive one
+    :param max_retries: (int) The number of times to retry a chunk that fails
+    :param retry_delay: (float) The number of seconds to wait before the first retry
+    :param idempotent: (bool) Whether the operation may be retried after a timeout, False for batch_add
+    :return: (Tuple<List, List>) The results of the successful chunks and the items that failed
+    """
+    results = []
+    failed = []
+    for chunk, result, error in iter_chunk_results(operation, items, chunk_size, max_retries, retry_delay, idempotent):
+        if error is None:
+            results.extend(result or [])
+        else:
+            failed.extend(chunk)
+    return results, failed
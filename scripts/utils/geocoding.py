@@ -0,0 +1,290 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Geocoding with a cache on disk
+
+   Imports that run every day mostly geocode the same addresses again. The locations found are saved in a SQLite
+   database, keyed by the normalized address, the geocoder and the output spatial reference, and reused for 30 days.
+   Only the addresses that are not in the cache are sent to the geocoder, once each, which saves time and geocoding
+   credits. Addresses that could not be matched are not cached, so they are geocoded again on the next run.
+
+   The cache lives in ~/.workforce-scripts/geocode.sqlite (see WORKFORCE_SCRIPTS_CACHE_DIR). Set
+   WORKFORCE_SCRIPTS_GEOCODE_CACHE=off to always geocode every address.
+
+   The addresses that are not cached are geocoded in chunks of the batch size the geocoder suggests (never more than
+   its MaxBatchSize), several chunks at a time under the rate limit of a ThrottledExecutor. A chunk that fails is
+   retried on its own, and if it keeps failing only its addresses are left without a location.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from urllib.parse import urlparse, urlunparse
+from .edits import DEFAULT_MAX_RETRIES, DEFAULT_RETRY_DELAY
+from .project_cache import get_cache_root
+from .query import DEFAULT_MAX_WORKERS
+from .throttle import DEFAULT_REQUESTS_PER_SECOND, ThrottledExecutor
+
+# Cached locations older than this are geocoded again, in case the reference data of the geocoder changed
+DEFAULT_GEOCODE_TTL = 30 * 24 * 60 * 60
+# The number of addresses per geocoding request when the geocoder does not report its batch sizes
+DEFAULT_GEOCODE_BATCH_SIZE = 100
+# The number of addresses looked up in the cache per query, below the number of parameters SQLite allows
+_LOOKUP_CHUNK_SIZE = 500
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def normalize_address(address):
+    """
+    Normalizes an address so that the same address written differently is cached once
+    :param address: (string) The address
+    :return: (string) The address in lower case, without repeated spaces or spaces around commas
+    """
+    address = unicodedata.normalize("NFKC", str(address)).casefold()
+    address = re.sub(r"\s*,\s*", ", ", address)
+    return re.sub(r"\s+", " ", address).strip(" ,")
+
+
+def get_geocoder_id(geocoder):
+    """
+    Gets the key a geocoder is cached by
+    :param geocoder: (Geocoder) The geocoder
+    :return: (string) The url of the geocoder, without its token
+    """
+    return urlunparse(urlparse(geocoder.url)._replace(query="")).rstrip("/").lower()
+
+
+def _get_sr_key(out_sr):
+    if out_sr is None:
+        return ""
+    if isinstance(out_sr, dict):
+        return json.dumps(out_sr, sort_keys=True)
+    return str(out_sr)
+
+
+def is_matched(result):
+    """
+    Checks whether the geocoder found a location for an address
+    :param result: (Dict) The result of the address
+    :return: (bool) True if the result has a location
+    """
+    location = (result or {}).get("location", None)
+    if not location or not result.get("score", 0):
+        return False
+    return all(isinstance(location.get(axis, None), (int, float)) and location[axis] == location[axis] for axis in ("x", "y"))
+
+
+class GeocodeCache(object):
+    """
+    The locations of the addresses geocoded before, in a SQLite database shared by every run of the scripts
+    """
+
+    def __init__(self, path, ttl=DEFAULT_GEOCODE_TTL):
+        """
+        :param path: (string) The SQLite database, created if it does not exist
+        :param ttl: (float) The number of seconds a location is reused for
+        """
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS geocodes ("
+                                     "geocoder TEXT NOT NULL, "
+                                     "out_sr TEXT NOT NULL, "
+                                     "address TEXT NOT NULL, "
+                                     "result TEXT NOT NULL, "
+                                     "cached_at REAL NOT NULL, "
+                                     "PRIMARY KEY (geocoder, out_sr, address))")
+        self.purge()
+
+    def get(self, geocoder_id, out_sr, addresses):
+        """
+        Looks up addresses in the cache
+        :param geocoder_id: (string) The geocoder, from get_geocoder_id
+        :param out_sr: (int or Dict) The spatial reference of the locations
+        :param addresses: (List<string>) The normalized addresses
+        :return: (Dict) The cached result of each address that was found, by normalized address
+        """
+        addresses = list(set(addresses))
+        found = {}
+        oldest = time.time() - self.ttl
+        with self._lock:
+            for i in range(0, len(addresses), _LOOKUP_CHUNK_SIZE):
+                chunk = addresses[i:i + _LOOKUP_CHUNK_SIZE]
+                rows = self._connection.execute(
+                    "SELECT address, result FROM geocodes WHERE geocoder = ? AND out_sr = ? AND cached_at >= ? "
+                    "AND address IN ({})".format(",".join("?" * len(chunk))),
+                    [geocoder_id, _get_sr_key(out_sr), oldest] + chunk).fetchall()
+                found.update((address, json.loads(result)) for address, result in rows)
+        return found
+
+    def put(self, geocoder_id, out_sr, results):
+        """
+        Adds the results of addresses to the cache, leaving out the ones that were not matched
+        :param geocoder_id: (string) The geocoder, from get_geocoder_id
+        :param out_sr: (int or Dict) The spatial reference of the locations
+        :param results: (Dict) The result of each normalized address
+        """
+        now = time.time()
+        rows = [(geocoder_id, _get_sr_key(out_sr), address, json.dumps(result), now)
+                for address, result in results.items() if is_matched(result)]
+        if not rows:
+            return
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?)", rows)
+
+    def purge(self):
+        """
+        Removes the locations that are older than the TTL
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM geocodes WHERE cached_at < ?", (time.time() - self.ttl,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def get_geocode_cache():
+    """
+    Gets the geocode cache shared by the scripts
+    :return: (GeocodeCache) The cache, or None when the cache is turned off
+    """
+    global _default_cache
+    if os.environ.get("WORKFORCE_SCRIPTS_GEOCODE_CACHE", "").lower() in ("0", "off", "false", "no"):
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = GeocodeCache(os.path.join(get_cache_root(), "geocode.sqlite"))
+        return _default_cache
+
+
+def get_batch_size(geocoder, batch_size=None):
+    """
+    Gets the number of addresses to send in each request to a geocoder
+    :param geocoder: (Geocoder) The geocoder
+    :param batch_size: (int) The batch size to use instead of the one the geocoder suggests, if any
+    :return: (int) The batch size, no larger than the MaxBatchSize of the geocoder
+    """
+    try:
+        locator_properties = dict(geocoder.properties["locatorProperties"])
+    except Exception:
+        locator_properties = {}
+    maximum = locator_properties.get("MaxBatchSize", None)
+    batch_size = batch_size or locator_properties.get("SuggestedBatchSize", None) or maximum or DEFAULT_GEOCODE_BATCH_SIZE
+    if maximum:
+        batch_size = min(batch_size, maximum)
+    return max(int(batch_size), 1)
+
+
+def _geocode_chunk(executor, chunk, geocoder, out_sr, max_retries, retry_delay):
+    """
+    Geocodes a chunk of addresses, retrying with an exponential backoff when the request fails
+    :return: (List<Dict>) The result of each address, None for the addresses of a chunk that kept failing
+    """
+    from arcgis.geocoding import batch_geocode
+    attempt = 0
+    while True:
+        try:
+            results = executor.call(batch_geocode, chunk, geocoder=geocoder, out_sr=out_sr)
+            # batch_geocode puts each location at the position of its ResultID
+            return list(results or []) + [None] * (len(chunk) - len(results or []))
+        except Exception as e:
+            if attempt >= max_retries:
+                logging.getLogger().error("Giving up on geocoding a chunk of {} addresses after {} retries: {}".format(
+                    len(chunk), max_retries, e))
+                return [None] * len(chunk)
+            delay = retry_delay * 2 ** attempt
+            attempt += 1
+            logging.getLogger().warning("Geocoding a chunk of {} addresses failed ({}), retrying in {} seconds ({}/{})".format(
+                len(chunk), e, delay, attempt, max_retries))
+            time.sleep(delay)
+
+
+def batch_geocode_in_chunks(addresses, geocoder, out_sr=None, executor=None, batch_size=None,
+                            max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+    """
+    Geocodes addresses in chunks of the batch size of the geocoder, several chunks at a time
+    :param addresses: (List<string>) The addresses
+    :param geocoder: (Geocoder) The geocoder to use
+    :param out_sr: (int or Dict) The spatial reference to return the locations in
+    :param executor: (ThrottledExecutor) The executor to make the requests through, a new one by default
+    :param batch_size: (int) The number of addresses per request, the batch size the geocoder suggests by default
+    :param max_retries: (int) The number of times to retry a chunk that fails
+    :param retry_delay: (float) The number of seconds to wait before the first retry
+    :return: (List<Dict>) The result of each address, in the same order, or an empty dict for an address that was
+        not matched or whose chunk could not be geocoded
+    """
+    batch_size = get_batch_size(geocoder, batch_size)
+    chunks = [addresses[i:i + batch_size] for i in range(0, len(addresses), batch_size)]
+
+    def geocode(chunk_executor):
+        results = []
+        for chunk_results in chunk_executor.map_tasks(
+                lambda chunk: _geocode_chunk(chunk_executor, chunk, geocoder, out_sr, max_retries, retry_delay), chunks):
+            results.extend(result or {} for result in chunk_results)
+        return results
+
+    if executor is not None:
+        return geocode(executor)
+    with ThrottledExecutor(max_workers=DEFAULT_MAX_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND) as executor:
+        return geocode(executor)
+
+
+def geocode_addresses(addresses, geocoder=None, out_sr=None, geocode=None, cache=None):
+    """
+    Geocodes addresses, reading the ones geocoded before from the cache. The other addresses are geocoded once each,
+    and their locations are added to the cache.
+    :param addresses: (List<string>) The addresses
+    :param geocoder: (Geocoder) The geocoder to use, the first geocoder of the active GIS by default
+    :param out_sr: (int or Dict) The spatial reference to return the locations in
+    :param geocode: (Function) Called with the addresses that are not cached, returns their results in the same
+        order. batch_geocode_in_chunks by default.
+    :param cache: (GeocodeCache) The cache to use, the one shared by the scripts by default
+    :return: (List<Dict>) The result of each address, in the same order, with the location of the address if it was
+        matched
+    """
+    if geocoder is None:
+        import arcgis
+        from arcgis.geocoding import get_geocoders
+        geocoder = get_geocoders(arcgis.env.active_gis)[0]
+    if geocode is None:
+        def geocode(locations):
+            return batch_geocode_in_chunks(locations, geocoder, out_sr)
+    cache = cache or get_geocode_cache()
+    normalized = [normalize_address(address) for address in addresses]
+    geocoder_id = get_geocoder_id(geocoder)
+    results = cache.get(geocoder_id, out_sr, normalized) if cache else {}
+
+    # Geocode each address that was not cached once, even if it is repeated
+    missing = {}
+    for address, key in zip(addresses, normalized):
+        if key not in results and key not in missing:
+            missing[key] = address
+    if missing:
+        geocoded = dict(zip(missing, geocode(list(missing.values())) or []))
+        if cache:
+            cache.put(geocoder_id, out_sr, geocoded)
+        results.update(geocoded)
+    return [results.get(key, {}) for key in normalized]
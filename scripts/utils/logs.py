@@ -0,0 +1,208 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   The logging of the scripts
+
+   Messages are put on a queue and written to the console and the log file by a background thread, so that a slow
+   disk or console does not hold up a poll, a query or an upload. They are written as text by default, or as one
+   JSON object per line (-log-format json) for log collectors. Loops that log for every feature can log through a
+   RateLimitedLogger, which writes at most one of their messages every few seconds.
+"""
+
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+LOG_FORMATS = ("text", "json")
+TEXT_FORMAT = "[%(asctime)s] [%(filename)30s:%(lineno)4s - %(funcName)30s()][%(threadName)5s] [%(name)10.10s] [%(levelname)8s] %(message)s"
+# The number of seconds between two messages of a RateLimitedLogger
+DEFAULT_LOG_INTERVAL = 10
+# The number of frames between the caller of a RateLimitedLogger method and Logger.log, for findCaller
+_STACK_LEVEL = 3
+
+_listener = None
+_queue_handler = None
+_default_format = "text"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object on a single line
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "file": record.filename,
+            "line": record.lineno,
+            "function": record.funcName,
+            "message": record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue with their message and traceback formatted, but not the rest of the line, so that the
+    handlers of the listener can format them as text or JSON
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def add_log_format_arguments(parser):
+    """
+    Adds the log format argument to the parser of a script
+    :param parser: (ArgumentParser) The parser of the script
+    :return: (ArgumentParser) The parser
+    """
+    parser.add_argument('-log-format', dest='log_format', choices=LOG_FORMATS, default=None,
+                        help="Write the log messages as text (the default) or as one JSON object per line")
+    return parser
+
+
+def set_default_log_format(log_format):
+    """
+    Sets the format of the logs of the scripts that do not choose one. bootstrap.run sets it from -log-format.
+    :param log_format: (string) text or json, or None to keep the current default
+    """
+    global _default_format
+    if log_format:
+        if log_format not in LOG_FORMATS:
+            raise ValueError("Unknown log format: {}".format(log_format))
+        _default_format = log_format
+
+
+def initialize_logging(log_file=None, log_format=None):
+    """
+    Setup logging
+    :param log_file: (string) The file to log to
+    :param log_format: (string) text or json, the default format (-log-format) if not given
+    :return: (Logger) a logging instance
+    """
+    global _listener, _queue_handler
+    stop_logging()
+    log_format = log_format or _default_format
+    if log_format not in LOG_FORMATS:
+        raise ValueError("Unknown log format: {}".format(log_format))
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    # Grab the root logger
+    logger = logging.getLogger()
+    # Set the root logger logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL). Debug records are only written to the
+    # log file, without one they are dropped before they are formatted and queued.
+    logger.setLevel(logging.DEBUG if log_file else logging.INFO)
+    # Create a handler to print to the console
+    sh = logging.StreamHandler(sys.stdout)
+    sh.setFormatter(formatter)
+    sh.setLevel(logging.INFO)
+    handlers = [sh]
+    # Create a handler to log to the specified file
+    if log_file:
+        rh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=10485760)
+        rh.setFormatter(formatter)
+        rh.setLevel(logging.DEBUG)
+        handlers.append(rh)
+    # The handlers write from a background thread, the loggers only put the records on a queue
+    _listener = logging.handlers.QueueListener(queue.Queue(-1), *handlers, respect_handler_level=True)
+    _queue_handler = _QueueHandler(_listener.queue)
+    logger.addHandler(_queue_handler)
+    _listener.start()
+    return logger
+
+
+def stop_logging():
+    """
+    Writes the queued records and stops the background writer started by initialize_logging
+    """
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+class RateLimitedLogger(object):
+    """
+    Logs at most one message per interval for each message format and level, e.g. in a loop over every feature. The
+    messages should be formatted by the logger (logger.info("%s of %s", i, count)) rather than before, so that they
+    share a format. The number of messages left out is added to the next one that is logged.
+    """
+
+    def __init__(self, logger=None, interval=DEFAULT_LOG_INTERVAL):
+        """
+        :param logger: (Logger) The logger to log to, the root logger by default
+        :param interval: (float) The minimum number of seconds between two messages with the same format
+        """
+        self.logger = logger or logging.getLogger()
+        self.interval = interval
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def _log(self, level, msg, args, kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        key = (level, msg)
+        with self._lock:
+            last, suppressed = self._last.get(key, (None, 0))
+            if last is not None and now - last < self.interval:
+                self._last[key] = (last, suppressed + 1)
+                return
+            self._last[key] = (now, 0)
+        if suppressed:
+            msg = "{} ({} similar messages suppressed)".format(msg, suppressed)
+        if sys.version_info >= (3, 8):
+            kwargs.setdefault("stacklevel", _STACK_LEVEL)
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self._log(logging.DEBUG, msg, args, kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._log(logging.INFO, msg, args, kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self._log(logging.WARNING, msg, args, kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self._log(logging.ERROR, msg, args, kwargs)
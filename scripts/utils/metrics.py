@@ -0,0 +1,367 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Metrics of the scripts that keep polling a project, in the Prometheus text format
+
+   The assignment monitor and the auto-assign demo count their polls, the assignments they see and notify about, the
+   REST calls they make and how far they lag behind the project. start_metrics_server serves the metrics at
+   http://<host>:<port>/metrics for Prometheus to scrape, and write_metrics writes them to a file for the textfile
+   collector of the node exporter, for runs started by a scheduler. Only the standard library is used.
+"""
+
+import contextlib
+import math
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from .tracing import get_operation
+
+# The upper bounds of the buckets of the histograms, in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+DEFAULT_METRICS_HOST = "127.0.0.1"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# The statuses and error codes of a throttled call
+_THROTTLED_CODES = {429, 503}
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        # A metric without labels is reported from the start, with its initial value
+        if not self.labels:
+            self._values[()] = self._get_initial_value()
+
+    def _get_initial_value(self):
+        return 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("{} has the labels {}, not {}".format(self.name, self.labels, tuple(labels)))
+        return tuple(labels[name] for name in self.labels)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        """
+        :return: (List<string>) The lines of the metric in the Prometheus text format
+        """
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.type)]
+        for name, key, value in self._samples():
+            extra = None
+            if isinstance(name, tuple):
+                name, extra = name
+            lines.append("{}{} {}".format(name, _format_labels(self.labels, key, extra), _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """
+    A total that only goes up
+    """
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down
+    """
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    The distribution of durations, in buckets
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super(Histogram, self).__init__(name, documentation, labels)
+
+    def _get_initial_value(self):
+        return (0,) * len(self.buckets), 0.0
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or self._get_initial_value()
+            self._values[key] = (tuple(c + (value <= bound) for c, bound in zip(counts, self.buckets)), total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Observes the number of seconds the block takes, including when it raises
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        samples = []
+        for name, key, (counts, total) in super(Histogram, self)._samples():
+            for bound, count in zip(self.buckets, counts):
+                samples.append(((name + "_bucket", ("le", _format_value(bound))), key, count))
+            samples.append((name + "_sum", key, total))
+            samples.append((name + "_count", key, counts[-1]))
+        return samples
+
+
+class MetricsRegistry(object):
+    """
+    The metrics of a process, by name
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, documentation, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("{} is already a {}".format(name, metric.type))
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        """
+        :return: (Counter) The counter with this name, added if it does not exist yet
+        """
+        return self._get(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        """
+        :return: (Gauge) The gauge with this name, added if it does not exist yet
+        """
+        return self._get(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        :return: (Histogram) The histogram with this name, added if it does not exist yet
+        """
+        return self._get(Histogram, name, documentation, labels, buckets=buckets)
+
+    def render(self):
+        """
+        :return: (string) The metrics in the Prometheus text format
+        """
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return "".join(line + "\n" for metric in metrics for line in metric.render())
+
+
+def get_registry():
+    """
+    Gets the metrics registry of the process
+    :return: (MetricsRegistry) The registry
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+class PollMetrics(object):
+    """
+    The metrics shared by the scripts that poll a project for assignments and notify about them
+    """
+
+    def __init__(self, registry=None):
+        """
+        :param registry: (MetricsRegistry) The registry to add the metrics to, the registry of the process by default
+        """
+        registry = registry or get_registry()
+        self.poll_duration = registry.histogram("workforce_poll_duration_seconds", "The duration of each poll")
+        self.poll_failures = registry.counter("workforce_poll_failures_total", "The number of polls that raised")
+        self.last_poll = registry.gauge("workforce_last_poll_timestamp_seconds",
+                                        "The time the last poll ended, in seconds since the epoch")
+        self.assignments_seen = registry.gauge("workforce_assignments_seen", "The number of assignments the last poll found")
+        self.assignments_processed = registry.counter("workforce_assignments_processed_total",
+                                                      "The number of new assignments processed")
+        self.detection_lag = registry.histogram("workforce_detection_lag_seconds",
+                                                "The time from the change of an assignment to its processing")
+        self.notification_latency = registry.histogram("workforce_notification_latency_seconds",
+                                                       "The duration of each notification", ["channel"])
+        self.notification_failures = registry.counter("workforce_notification_failures_total",
+                                                      "The number of notifications that failed", ["channel"])
+        self.state_store_size = registry.gauge("workforce_state_store_bytes",
+                                               "The size of the SQLite database of the processed assignments")
+
+    def observe_state_store(self, database):
+        """
+        Sets the size of the state store, with its write-ahead log
+        :param database: (string) The SQLite database
+        """
+        size = 0
+        for path in (database, database + "-wal"):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        self.state_store_size.set(size)
+
+    def observe_detection(self, date):
+        """
+        Records the lag between the change of an assignment and now
+        :param date: (datetime) The completion or creation date of the assignment, timezone aware
+        """
+        if date is not None:
+            self.detection_lag.observe(max(time.time() - date.timestamp(), 0))
+
+    @contextlib.contextmanager
+    def notify(self, channel):
+        """
+        Times a notification and counts it as failed when the block raises
+        :param channel: (string) slack or email
+        """
+        try:
+            with self.notification_latency.time(channel=channel):
+                yield
+        except Exception:
+            self.notification_failures.inc(channel=channel)
+            raise
+
+
+def _is_throttled(status, content):
+    if status in _THROTTLED_CODES:
+        return True
+    return any('"code": {}'.format(code).encode() in content or '"code":{}'.format(code).encode() in content
+               for code in _THROTTLED_CODES)
+
+
+def instrument_requests(registry=None):
+    """
+    Counts the REST calls sent through requests, the calls that failed (an exception, an HTTP error or an error in the
+    JSON response) and the calls that were throttled
+    :param registry: (MetricsRegistry) The registry to add the metrics to, the registry of the process by default
+    """
+    import requests
+    registry = registry or get_registry()
+    calls = registry.counter("workforce_rest_requests_total", "The number of REST calls", ["operation"])
+    errors = registry.counter("workforce_rest_errors_total", "The number of REST calls that failed", ["operation"])
+    throttled = registry.counter("workforce_rest_throttled_total", "The number of REST calls that were throttled",
+                                 ["operation"])
+    send = requests.Session.send
+    if getattr(send, "instrumented", False):
+        return
+
+    def counted_send(session, request, **kwargs):
+        operation = get_operation(request.url)
+        calls.inc(operation=operation)
+        try:
+            response = send(session, request, **kwargs)
+        except Exception:
+            errors.inc(operation=operation)
+            raise
+        # The ArcGIS REST API reports most errors in the body of a 200 response, which streamed downloads do not have
+        head = b"" if kwargs.get("stream", False) else (response.content or b"")[:200]
+        if response.status_code >= 400 or head.lstrip().startswith(b'{"error"'):
+            errors.inc(operation=operation)
+            if _is_throttled(response.status_code, head):
+                throttled.inc(operation=operation)
+        return response
+
+    counted_send.instrumented = True
+    requests.Session.send = counted_send
+
+
+class _MetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer, which is only in Python 3.7+
+    daemon_threads = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host=DEFAULT_METRICS_HOST, registry=None):
+    """
+    Serves the metrics at http://<host>:<port>/metrics from a background thread
+    :param port: (int) The port to listen on
+    :param host: (string) The address to listen on, only this computer by default
+    :param registry: (MetricsRegistry) The metrics to serve, the registry of the process by default
+    :return: (HTTPServer) The server, stopped with shutdown()
+    """
+    server = _MetricsServer((host, port), _MetricsHandler)
+    server.registry = registry or get_registry()
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
+
+
+def write_metrics(path, registry=None):
+    """
+    Writes the metrics to a file, replacing it at once so that a collector never reads half of it
+    :param path: (string) The file, e.g. in the directory of the textfile collector of the node exporter
+    :param registry: (MetricsRegistry) The metrics to write, the registry of the process by default
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write((registry or get_registry()).render())
+    os.replace(temp_path, path)
@@ -0,0 +1,135 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Helpers shared by migrate_to_v2.py and migrate_assignments.py, which copy the assignments of a version 1 project to
+   a version 2 project
+"""
+
+import logging
+import os
+import tempfile
+from .logs import RateLimitedLogger
+from .planner import query_in
+from .query import get_object_id_field, query_attachments
+from .throttle import DEFAULT_REQUESTS_PER_SECOND, ThrottledExecutor
+
+
+def get_assignment_type_global_ids(assignment_types, new_assignment_types):
+    """
+    Maps the codes of the assignment types of a version 1 project to the GlobalIDs of the version 2 assignment types
+    with the same names, so that the assignments are migrated with dictionary lookups
+    :param assignment_types: (List<AssignmentType>) The assignment types of the version 1 project
+    :param new_assignment_types: (List<AssignmentType>) The assignment types of the version 2 project
+    :return: (Dict) The GlobalID of the version 2 assignment type of each version 1 code, None if none has its name
+    """
+    new_global_ids = {}
+    for assignment_type in new_assignment_types:
+        new_global_ids.setdefault(assignment_type.name, assignment_type.global_id)
+    global_ids = {}
+    for assignment_type in assignment_types:
+        global_ids.setdefault(assignment_type.code, new_global_ids.get(assignment_type.name, None))
+    return global_ids
+
+
+def _normalize_global_id(global_id):
+    # Services return GlobalIDs with or without braces
+    return global_id.strip("{}").upper() if global_id else global_id
+
+
+def get_object_ids_by_global_id(layer, global_ids, max_workers=1, requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+    """
+    Finds the object ids of the features with the given GlobalIDs, with IN queries rather than one query per feature
+    :param layer: (FeatureLayer) The layer to query
+    :param global_ids: (List<string>) The GlobalIDs
+    :param max_workers: (int) The number of queries to run concurrently
+    :param requests_per_second: (float) The number of queries that may be started per second
+    :return: (Dict) The object id of each GlobalID found, by GlobalID in upper case and without braces
+    """
+    object_id_field = get_object_id_field(layer)
+    global_id_field = layer.properties.get("globalIdField", None) or "GlobalID"
+    object_ids = {}
+    for feature in query_in(layer, global_id_field, global_ids, out_fields="{},{}".format(object_id_field, global_id_field),
+                            return_geometry=False, max_workers=max_workers, requests_per_second=requests_per_second):
+        object_ids[_normalize_global_id(feature.attributes[global_id_field])] = feature.attributes[object_id_field]
+    return object_ids
+
+
+def _download_attachment(layer, object_id, info, directory):
+    # Downloading by url, as AttachmentManager.download lists the attachments of the feature again first. Each
+    # attachment gets its own folder, as two attachments of a feature can have the same name.
+    save_path = os.path.join(directory, str(info["id"]))
+    os.makedirs(save_path)
+    return layer._con.get(path="{}/{}/attachments/{}".format(layer.url, object_id, info["id"]), try_json=False,
+                          out_folder=save_path, file_name=info["name"], token=layer._token, force_bytes=False)
+
+
+def migrate_attachments(executor, project, v2_project, group, new_object_id):
+    """
+    Copies the attachments of an assignment to the same assignment in the v2 project
+    :param executor: (ThrottledExecutor) The executor to make the requests through
+    :param project: (Project) The v1 project
+    :param v2_project: (Project) The v2 project
+    :param group: (Dict) The parentObjectId, parentGlobalId and attachmentInfos of the v1 assignment
+    :param new_object_id: (int) The object id of the v2 assignment, None if it was not migrated
+    """
+    logger = logging.getLogger()
+    object_id = group["parentObjectId"]
+    global_id = group["parentGlobalId"]
+    if new_object_id is None:
+        logger.info(f"Attachments not migrated, assignment {global_id} is not in the new project")
+        return
+    with tempfile.TemporaryDirectory() as dirpath:
+        for info in group["attachmentInfos"]:
+            try:
+                path = executor.call(_download_attachment, project.assignments_layer, object_id, info, dirpath)
+            except Exception as e:
+                logger.info(f"Failed to download attachment: {info['name']} from assignment: {global_id}")
+                logger.exception(e)
+                continue
+            try:
+                executor.call(v2_project.assignments_layer.attachments.add, oid=new_object_id, file_path=path)
+            except Exception as e:
+                logger.info(f"Failed to upload attachment: {path} from assignment: {global_id}")
+                logger.exception(e)
+
+
+def migrate_assignment_attachments(project, v2_project, where, max_workers, requests_per_second):
+    """
+    Copies the attachments of the v1 assignments matching the where clause to the v2 assignments with the same
+    GlobalIDs. The assignments with attachments are listed with queryAttachments and their v2 object ids found with a
+    few IN queries, so that the assignments without attachments cost no requests.
+    :param project: (Project) The v1 project
+    :param v2_project: (Project) The v2 project, with the migrated assignments
+    :param where: (string) The where clause of the migrated assignments
+    :param max_workers: (int) The number of concurrent requests
+    :param requests_per_second: (float) The number of requests that may be started per second
+    :return: (bool) True if the migrated assignments have as many attachments in the v2 project as in the v1 project
+    """
+    logger = logging.getLogger()
+    groups = query_attachments(project.assignments_layer, where=where, max_workers=max_workers,
+                               requests_per_second=requests_per_second)
+    new_object_ids = get_object_ids_by_global_id(v2_project.assignments_layer, [group["parentGlobalId"] for group in groups],
+                                                 max_workers=max_workers, requests_per_second=requests_per_second)
+    progress = RateLimitedLogger(logger)
+    with ThrottledExecutor(max_workers=max_workers, requests_per_second=requests_per_second) as executor:
+        def migrate(group):
+            migrate_attachments(executor, project, v2_project, group,
+                                new_object_ids.get(_normalize_global_id(group["parentGlobalId"]), None))
+
+        for i, _ in enumerate(executor.map_tasks(migrate, groups)):
+            progress.info("Migrated attachments for assignment %s/%s", i + 1, len(groups))
+    new_groups = []
+    if new_object_ids:
+        new_groups = query_attachments(v2_project.assignments_layer, object_ids=list(new_object_ids.values()),
+                                       max_workers=max_workers, requests_per_second=requests_per_second)
+    return sum(len(group["attachmentInfos"]) for group in groups) == sum(len(group["attachmentInfos"]) for group in new_groups)
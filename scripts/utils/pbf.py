@@ -0,0 +1,343 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Decodes feature service query results returned as protocol buffers (f=pbf)
+
+   The layout follows the FeatureCollectionPBuffer message published by Esri. Only the parts needed to read query
+   results are decoded, and the attributes are written straight into one list per field (plus x/y arrays for points)
+   rather than into a dictionary per feature.
+"""
+
+import array
+import struct
+
+# FeatureCollectionPBuffer.GeometryType
+GEOMETRY_TYPE_POINT = 0
+# FeatureCollectionPBuffer.QuantizeOriginPostion
+QUANTIZE_ORIGIN_UPPER_LEFT = 0
+
+_WIRE_VARINT = 0
+_WIRE_64BIT = 1
+_WIRE_LENGTH_DELIMITED = 2
+_WIRE_32BIT = 5
+
+_DOUBLE = struct.Struct("<d")
+_FLOAT = struct.Struct("<f")
+
+
+def _read_varint(buffer, position):
+    """
+    Reads a base 128 varint
+    :param buffer: (memoryview) The buffer to read from
+    :param position: (int) The position to start reading at
+    :return: (Tuple<int, int>) The value and the position after it
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def _zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _signed64(value):
+    return value - (1 << 64) if value & (1 << 63) else value
+
+
+def _iter_message(buffer):
+    """
+    Iterates over the fields of a message
+    :param buffer: (memoryview) The encoded message
+    :return: (Generator<Tuple<int, int, object>>) The field number, wire type and raw value of each field
+    """
+    position = 0
+    end = len(buffer)
+    while position < end:
+        key, position = _read_varint(buffer, position)
+        wire_type = key & 0x7
+        if wire_type == _WIRE_VARINT:
+            value, position = _read_varint(buffer, position)
+        elif wire_type == _WIRE_LENGTH_DELIMITED:
+            length, position = _read_varint(buffer, position)
+            value = buffer[position:position + length]
+            position += length
+        elif wire_type == _WIRE_64BIT:
+            value = buffer[position:position + 8]
+            position += 8
+        elif wire_type == _WIRE_32BIT:
+            value = buffer[position:position + 4]
+            position += 4
+        else:
+            raise ValueError("Unsupported protocol buffer wire type {}".format(wire_type))
+        yield key >> 3, wire_type, value
+
+
+def _read_packed_varints(wire_type, value):
+    """
+    Reads a repeated varint field, which may or may not be packed
+    :return: (List<int>) The values
+    """
+    if wire_type == _WIRE_VARINT:
+        return [value]
+    values = []
+    position = 0
+    end = len(value)
+    while position < end:
+        item, position = _read_varint(value, position)
+        values.append(item)
+    return values
+
+
+def _read_string(value):
+    return bytes(value).decode("utf-8")
+
+
+def _read_value(buffer):
+    """
+    Reads a FeatureCollectionPBuffer.Value
+    :param buffer: (memoryview) The encoded value
+    :return: The python value, or None for a null value
+    """
+    for number, _, value in _iter_message(buffer):
+        if number == 1:
+            return _read_string(value)
+        elif number == 2:
+            return _FLOAT.unpack(value)[0]
+        elif number == 3:
+            return _DOUBLE.unpack(value)[0]
+        elif number in (4, 8):
+            return _zigzag(value)
+        elif number in (5, 7):
+            return value
+        elif number == 6:
+            return _signed64(value)
+        elif number == 9:
+            return bool(value)
+    return None
+
+
+def _read_doubles(buffer):
+    """
+    Reads a message made only of double fields (Scale, Translate)
+    :return: (Dict<int, float>) The values by field number
+    """
+    return {number: _DOUBLE.unpack(value)[0] for number, wire_type, value in _iter_message(buffer) if wire_type == _WIRE_64BIT}
+
+
+def _read_transform(buffer):
+    """
+    Reads a FeatureCollectionPBuffer.Transform
+    :return: (Tuple<float, float, float, float>) The x scale, y scale, x translate and y translate to apply
+    """
+    origin = QUANTIZE_ORIGIN_UPPER_LEFT
+    scale = {}
+    translate = {}
+    for number, _, value in _iter_message(buffer):
+        if number == 1:
+            origin = value
+        elif number == 2:
+            scale = _read_doubles(value)
+        elif number == 3:
+            translate = _read_doubles(value)
+    y_scale = scale.get(2, 1.0)
+    # With an upper left origin, y increases downwards
+    if origin == QUANTIZE_ORIGIN_UPPER_LEFT:
+        y_scale = -y_scale
+    return scale.get(1, 1.0), y_scale, translate.get(1, 0.0), translate.get(2, 0.0)
+
+
+def _read_spatial_reference(buffer):
+    """
+    Reads a FeatureCollectionPBuffer.SpatialReference
+    :return: (Dict) The spatial reference in the same form as the JSON responses
+    """
+    spatial_reference = {}
+    for number, _, value in _iter_message(buffer):
+        if number == 1:
+            spatial_reference["wkid"] = value
+        elif number == 2:
+            spatial_reference["latestWkid"] = value
+        elif number == 5:
+            spatial_reference["wkt"] = _read_string(value)
+    return spatial_reference
+
+
+def _read_field(buffer):
+    """
+    Reads a FeatureCollectionPBuffer.Field
+    :return: (Dict) The name and type of the field
+    """
+    field = {"name": None, "type": None}
+    for number, _, value in _iter_message(buffer):
+        if number == 1:
+            field["name"] = _read_string(value)
+        elif number == 2:
+            field["type"] = value
+    return field
+
+
+def _read_geometry(buffer, transform):
+    """
+    Reads a FeatureCollectionPBuffer.Geometry, undoing the quantization and delta encoding
+    :return: (List<List<Tuple<float, float>>>) The coordinates of each part
+    """
+    lengths = []
+    coords = []
+    for number, wire_type, value in _iter_message(buffer):
+        if number == 2:
+            lengths.extend(_read_packed_varints(wire_type, value))
+        elif number == 3:
+            coords.extend(_zigzag(c) for c in _read_packed_varints(wire_type, value))
+    x_scale, y_scale, x_translate, y_translate = transform
+    if not lengths:
+        lengths = [len(coords) // 2]
+    parts = []
+    position = 0
+    x = y = 0
+    for length in lengths:
+        part = []
+        for _ in range(length):
+            x += coords[position]
+            y += coords[position + 1]
+            position += 2
+            part.append((x * x_scale + x_translate, y * y_scale + y_translate))
+        parts.append(part)
+    return parts
+
+
+def decode_feature_collection(content):
+    """
+    Decodes the response of a query made with f=pbf into columns
+    :param content: (bytes) The response body
+    :return: (Dict) With the following keys:
+        fields - (List<string>) The field names, in the order returned
+        columns - (Dict<string, List>) The values of each field
+        x, y - (array<float>) The point coordinates (NaN when a feature has no geometry), or None for other geometry types
+        geometries - (List<List<List<Tuple<float, float>>>>) The parts of each feature, for non-point geometry types
+        object_id_field - (string) The name of the object id field
+        spatial_reference - (Dict) The spatial reference of the geometries
+        exceeded_transfer_limit - (bool) Whether the server had more records than it returned
+        count - (int) The count, for returnCountOnly queries
+        object_ids - (List<int>) The object ids, for returnIdsOnly queries
+    """
+    result = {
+        "fields": [],
+        "columns": {},
+        "x": None,
+        "y": None,
+        "geometries": None,
+        "object_id_field": None,
+        "spatial_reference": None,
+        "exceeded_transfer_limit": False,
+        "count": None,
+        "object_ids": None
+    }
+    buffer = memoryview(content)
+    for number, _, value in _iter_message(buffer):
+        if number != 2:
+            continue
+        # QueryResult
+        for result_number, _, result_value in _iter_message(value):
+            if result_number == 1:
+                _decode_feature_result(result_value, result)
+            elif result_number == 2:
+                for count_number, _, count in _iter_message(result_value):
+                    if count_number == 1:
+                        result["count"] = count
+            elif result_number == 3:
+                object_ids = []
+                for ids_number, wire_type, ids_value in _iter_message(result_value):
+                    if ids_number == 1:
+                        result["object_id_field"] = _read_string(ids_value)
+                    elif ids_number == 3:
+                        object_ids.extend(_read_packed_varints(wire_type, ids_value))
+                result["object_ids"] = object_ids
+    return result
+
+
+def _decode_feature_result(buffer, result):
+    """
+    Decodes a FeatureCollectionPBuffer.FeatureResult into the result dictionary
+    :param buffer: (memoryview) The encoded feature result
+    :param result: (Dict) The result being built by decode_feature_collection
+    """
+    geometry_type = GEOMETRY_TYPE_POINT
+    transform = (1.0, 1.0, 0.0, 0.0)
+    features = []
+    for number, _, value in _iter_message(buffer):
+        if number == 1:
+            result["object_id_field"] = _read_string(value)
+        elif number == 7:
+            geometry_type = value
+        elif number == 8:
+            result["spatial_reference"] = _read_spatial_reference(value)
+        elif number == 9:
+            result["exceeded_transfer_limit"] = bool(value)
+        elif number == 12:
+            transform = _read_transform(value)
+        elif number == 13:
+            result["fields"].append(_read_field(value)["name"])
+        elif number == 15:
+            # Features are decoded once the fields and transform are known, the order of the fields is not guaranteed
+            features.append(value)
+    _decode_features(features, geometry_type, transform, result)
+
+
+def _decode_features(features, geometry_type, transform, result):
+    """
+    Decodes the FeatureCollectionPBuffer.Feature messages into the columns of the result dictionary
+    :param features: (List<memoryview>) The encoded features
+    :param geometry_type: (int) The FeatureCollectionPBuffer.GeometryType of the features
+    :param transform: (Tuple) The transform returned by _read_transform
+    :param result: (Dict) The result being built by decode_feature_collection
+    """
+    names = result["fields"]
+    columns = [[] for _ in names]
+    is_point = geometry_type == GEOMETRY_TYPE_POINT
+    xs = array.array("d")
+    ys = array.array("d")
+    geometries = []
+    for feature in features:
+        index = 0
+        parts = None
+        for number, _, value in _iter_message(feature):
+            if number == 1:
+                columns[index].append(_read_value(value))
+                index += 1
+            elif number == 2:
+                parts = _read_geometry(value, transform)
+        # Attributes that were not sent are null
+        for column in columns[index:]:
+            column.append(None)
+        if is_point:
+            if parts and parts[0]:
+                xs.append(parts[0][0][0])
+                ys.append(parts[0][0][1])
+            else:
+                xs.append(float("nan"))
+                ys.append(float("nan"))
+        else:
+            geometries.append(parts)
+    result["columns"] = dict(zip(names, columns))
+    if is_point:
+        result["x"] = xs
+        result["y"] = ys
+    else:
+        result["geometries"] = geometries
@@ -0,0 +1,166 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Queries a layer for a large set of keys with "field IN (...)" clauses
+
+   One query per key does not scale, and a single IN clause with every key can exceed what the server (or the
+   database behind it) accepts. The keys are split into IN clauses bounded by length and number of values, each
+   clause is sent as its own (POST) query, optionally concurrently, and the results are merged.
+"""
+
+import collections
+import itertools
+from .query import iter_features
+from .throttle import DEFAULT_REQUESTS_PER_SECOND, ThrottledExecutor
+
+# Conservative limits that hosted and enterprise feature services (and their databases) accept
+DEFAULT_MAX_CLAUSE_LENGTH = 4000
+DEFAULT_MAX_VALUES = 500
+
+_COUNT_FIELD = "value_count"
+
+
+def format_value(value):
+    """
+    Formats a value for a where clause
+    :param value: (string or number) The value
+    :return: (string) The SQL literal
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def plan_in_clauses(field, values, max_clause_length=DEFAULT_MAX_CLAUSE_LENGTH, max_values=DEFAULT_MAX_VALUES):
+    """
+    Splits a set of values into IN clauses
+    :param field: (string) The field to match
+    :param values: (Iterable) The values, duplicates and None are dropped
+    :param max_clause_length: (int) The maximum number of characters in a clause
+    :param max_values: (int) The maximum number of values in a clause
+    :return: (List<string>) The clauses
+    """
+    prefix = "{} IN (".format(field)
+    clauses = []
+    literals = []
+    length = len(prefix) + 1
+    for value in collections.OrderedDict.fromkeys(v for v in values if v is not None):
+        literal = format_value(value)
+        if literals and (len(literals) >= max_values or length + len(literal) + 1 > max_clause_length):
+            clauses.append(prefix + ",".join(literals) + ")")
+            literals = []
+            length = len(prefix) + 1
+        literals.append(literal)
+        length += len(literal) + 1
+    if literals:
+        clauses.append(prefix + ",".join(literals) + ")")
+    return clauses
+
+
+def _supports_statistics(layer):
+    advanced = layer.properties.get("advancedQueryCapabilities", None) or {}
+    return bool(layer.properties.get("supportsStatistics", False) or advanced.get("supportsStatistics", False))
+
+
+def _combine(where, clause):
+    return clause if not where or where == "1=1" else "({}) AND {}".format(where, clause)
+
+
+def _run(clauses, fetch, max_workers, requests_per_second):
+    """
+    Runs a query per clause, concurrently when max_workers is greater than 1
+    :return: (Generator) The result of each clause, in order
+    """
+    if max_workers and max_workers > 1 and len(clauses) > 1:
+        with ThrottledExecutor(max_workers=max_workers, requests_per_second=requests_per_second) as executor:
+            yield from executor.map(fetch, clauses)
+    else:
+        for clause in clauses:
+            yield fetch(clause)
+
+
+def query_in(layer, field, values, where="1=1", out_fields="*", return_geometry=True, out_sr=None, max_workers=1,
+             requests_per_second=DEFAULT_REQUESTS_PER_SECOND, max_clause_length=DEFAULT_MAX_CLAUSE_LENGTH,
+             max_values=DEFAULT_MAX_VALUES):
+    """
+    Queries the features whose field is one of the values
+    :param layer: (FeatureLayer) The layer to query
+    :param field: (string) The field to match
+    :param values: (Iterable) The values to match
+    :param where: (string) An additional where clause
+    :param out_fields: (string or List<string>) The fields to return
+    :param return_geometry: (bool) Whether or not to return the geometry
+    :param out_sr: (dict or int) The spatial reference to return the geometry in
+    :param max_workers: (int) The number of clauses to query concurrently
+    :param requests_per_second: (float) The number of queries that may be started per second when running concurrently
+    :param max_clause_length: (int) The maximum number of characters in an IN clause
+    :param max_values: (int) The maximum number of values in an IN clause
+    :return: (Generator<Feature>) The features
+    """
+    def fetch(clause):
+        # A clause can match more features than the server returns at once, so each one is paged
+        return list(iter_features(layer, where=_combine(where, clause), out_fields=out_fields,
+                                  return_geometry=return_geometry, out_sr=out_sr))
+
+    clauses = plan_in_clauses(field, values, max_clause_length, max_values)
+    for features in _run(clauses, fetch, max_workers, requests_per_second):
+        yield from features
+
+
+def count_key(value):
+    """
+    Normalizes a value the way count_in keys its counts, so that a value read from another layer, which can differ in
+    type, case or surrounding whitespace from the one the server returns, finds its count
+    :param value: The value
+    :return: (string) The key of the value, None for None
+    """
+    return None if value is None else str(value).strip().casefold()
+
+
+def count_in(layer, field, values, where="1=1", max_workers=1, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+             max_clause_length=DEFAULT_MAX_CLAUSE_LENGTH, max_values=DEFAULT_MAX_VALUES):
+    """
+    Counts the features for each of the values. Uses a statistics query grouped by the field when the layer
+    supports it, otherwise only the field is queried and the values are counted locally.
+    :param layer: (FeatureLayer) The layer to query
+    :param field: (string) The field to match
+    :param values: (Iterable) The values to count
+    :param where: (string) An additional where clause
+    :param max_workers: (int) The number of clauses to query concurrently
+    :param requests_per_second: (float) The number of queries that may be started per second when running concurrently
+    :param max_clause_length: (int) The maximum number of characters in an IN clause
+    :param max_values: (int) The maximum number of values in an IN clause
+    :return: (Counter) The number of features by count_key of the value, values without features are not included
+    """
+    counts = collections.Counter()
+    if _supports_statistics(layer):
+        statistics = [{"statisticType": "count", "onStatisticField": field, "outStatisticFieldName": _COUNT_FIELD}]
+
+        def fetch(clause):
+            # A clause has at most max_values groups, which fits in a single page
+            return layer.query(where=_combine(where, clause), group_by_fields_for_statistics=field,
+                               out_statistics=statistics, return_geometry=False, return_all_records=False).features
+
+        clauses = plan_in_clauses(field, values, max_clause_length, max_values)
+        for feature in itertools.chain.from_iterable(_run(clauses, fetch, max_workers, requests_per_second)):
+            attributes = feature.attributes
+            # Some services return the statistic field name in a different case
+            count = next((v for k, v in attributes.items() if k.lower() == _COUNT_FIELD), 0)
+            value = next((v for k, v in attributes.items() if k.lower() == field.lower()), None)
+            counts[count_key(value)] += count or 0
+    else:
+        for feature in query_in(layer, field, values, where=where, out_fields=field, return_geometry=False,
+                                max_workers=max_workers, requests_per_second=requests_per_second,
+                                max_clause_length=max_clause_length, max_values=max_values):
+            counts[count_key(feature.attributes.get(field, None))] += 1
+    return counts
@@ -0,0 +1,238 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Profiles the CPU time and memory of each phase of a script
+
+   Run a script with --profile and each phase named with set_phase is profiled with cProfile (on the main thread) and
+   tracemalloc. When the script exits, the profile directory (-profile-dir, ./profile by default) contains:
+
+   - <phase>.prof: the cProfile statistics of the phase, for pstats or snakeviz
+   - stacks.collapsed: the stacks of every thread, sampled every few milliseconds and prefixed with the phase, in the
+     collapsed format read by flamegraph.pl and speedscope
+   - memory.txt: the lines whose memory grew the most in each phase
+
+   and a summary with the CPU time (of the whole process), peak and net memory of each phase is printed. The peak is
+   the peak of the phase on Python 3.9+, and of the script so far on older versions.
+"""
+
+import collections
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from .tracing import add_phase_listener, get_phase, remove_phase_listener
+
+# The number of seconds between two samples of the stacks
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# The number of functions and allocation sites listed per phase
+TOP_COUNT = 10
+
+_profiler = None
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stacks of every other thread, keyed by the phase they were sampled in
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        :param interval: (float) The number of seconds between two samples
+        """
+        super(StackSampler, self).__init__(name="StackSampler", daemon=True)
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            phase = get_phase()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(phase)
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def write(self, path):
+        """
+        Writes the samples in the collapsed stack format, one "frame;frame;... count" line per stack
+        :param path: (string) The file to write
+        """
+        with open(path, "w") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write("{} {}\n".format(stack.replace(" ", "_"), count))
+
+
+class PhaseProfiler(object):
+    """
+    Profiles each phase of a script with cProfile and tracemalloc
+    """
+
+    def __init__(self, directory, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        :param directory: (string) The directory to write the profiles to
+        :param sample_interval: (float) The number of seconds between two samples of the stacks
+        """
+        self.directory = directory
+        self.phases = collections.OrderedDict()
+        self.sampler = StackSampler(sample_interval)
+        self._phase = None
+        self._profile = None
+        self._started = None
+        self._snapshot = None
+        self._memory = 0
+
+    def start(self):
+        """
+        Starts profiling the current phase
+        :return: (PhaseProfiler) The profiler
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tracemalloc.start()
+        self.sampler.start()
+        self.enter_phase(get_phase())
+        return self
+
+    def stop(self):
+        """
+        Stops profiling and writes the profiles
+        """
+        self.enter_phase(None)
+        self.sampler.stop()
+        tracemalloc.stop()
+        self.sampler.write(os.path.join(self.directory, "stacks.collapsed"))
+        with open(os.path.join(self.directory, "memory.txt"), "w") as f:
+            for phase in self.phases.values():
+                f.write("{}\n".format(phase["name"]))
+                for line in phase["allocations"]:
+                    f.write("    {}\n".format(line))
+        for phase in self.phases.values():
+            phase["stats"].dump_stats(os.path.join(self.directory, "{}.prof".format(_get_file_name(phase["name"]))))
+
+    def enter_phase(self, name):
+        """
+        Ends the profile of the current phase and starts the profile of the next one
+        :param name: (string) The name of the next phase, or None when profiling stops
+        """
+        if self._phase is not None:
+            self._profile.disable()
+            cpu_time = time.process_time() - self._started[0]
+            wall_time = time.perf_counter() - self._started[1]
+            current, peak = tracemalloc.get_traced_memory()
+            phase = self.phases.setdefault(self._phase, {"name": self._phase, "cpu_time": 0.0, "wall_time": 0.0,
+                                                         "peak_memory": 0, "net_memory": 0, "stats": None,
+                                                         "allocations": []})
+            phase["cpu_time"] += cpu_time
+            phase["wall_time"] += wall_time
+            phase["peak_memory"] = max(phase["peak_memory"], peak)
+            phase["net_memory"] += current - self._memory
+            # Comparing snapshots takes a few seconds per million allocations, outside of the timings above
+            differences = tracemalloc.take_snapshot().compare_to(self._snapshot, "lineno")
+            phase["allocations"] = ["{}: {:+.1f} KB".format(difference.traceback, difference.size_diff / 1024)
+                                    for difference in differences[:TOP_COUNT]]
+            stats = pstats.Stats(self._profile)
+            if phase["stats"] is None:
+                phase["stats"] = stats
+            else:
+                phase["stats"].add(stats)
+        self._phase = name
+        if name is not None:
+            # The peak of the phase, rather than of the script so far (Python 3.9+)
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            self._snapshot = tracemalloc.take_snapshot()
+            self._memory = tracemalloc.get_traced_memory()[0]
+            self._started = (time.process_time(), time.perf_counter())
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def format_summary(self):
+        """
+        Formats the CPU time, peak memory and most expensive functions of each phase
+        :return: (string) The summary
+        """
+        header = "{:<30} {:>10} {:>10} {:>10} {:>10}".format("phase", "wall s", "cpu s", "peak MB", "net MB")
+        lines = [header, "-" * len(header)]
+        for phase in self.phases.values():
+            lines.append("{:<30} {:>10.2f} {:>10.2f} {:>10.1f} {:>10.1f}".format(
+                phase["name"][:30], phase["wall_time"], phase["cpu_time"], phase["peak_memory"] / 1024 / 1024,
+                phase["net_memory"] / 1024 / 1024))
+        for phase in self.phases.values():
+            stream = io.StringIO()
+            phase["stats"].stream = stream
+            phase["stats"].sort_stats("cumulative").print_stats(TOP_COUNT)
+            lines.append("\n{} (main thread):".format(phase["name"]))
+            lines.append(stream.getvalue().strip())
+        return "\n".join(lines)
+
+
+def _get_file_name(phase):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", phase).strip("_") or "phase"
+
+
+def add_profile_arguments(parser):
+    """
+    Adds the profiling arguments to the parser of a script
+    :param parser: (ArgumentParser) The parser of the script
+    :return: (ArgumentParser) The parser
+    """
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help="Profile the CPU time and memory of each phase of the script")
+    parser.add_argument('-profile-dir', dest='profile_dir',
+                        help="The directory to write the profiles and collapsed stacks to, 'profile' by default "
+                             "(implies --profile)")
+    return parser
+
+
+def start_profiling(directory):
+    """
+    Starts profiling the phases of the script
+    :param directory: (string) The directory to write the profiles to
+    :return: (PhaseProfiler) The profiler
+    """
+    global _profiler
+    _profiler = PhaseProfiler(directory).start()
+    add_phase_listener(_profiler.enter_phase)
+    return _profiler
+
+
+def stop_profiling(out=None):
+    """
+    Stops profiling, writes the profiles and prints the summary
+    :param out: (File) Where to print the summary, defaults to stderr
+    :return: (PhaseProfiler) The profiler, or None if profiling was not started
+    """
+    global _profiler
+    profiler = _profiler
+    if profiler is None:
+        return None
+    _profiler = None
+    remove_phase_listener(profiler.enter_phase)
+    profiler.stop()
+    print(profiler.format_summary(), file=out or sys.stderr)
+    print("Profiles written to {}".format(os.path.abspath(profiler.directory)), file=out or sys.stderr)
+    return profiler
@@ -0,0 +1,210 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Caches the description of a Workforce project on disk
+
+   Building a workforce.Project fetches the project's item data and the properties of each of its layers before any
+   work starts. The layer urls and properties (fields, editor tracking fields, ...) rarely change, so they are saved
+   in a JSON file per project and reused as long as the project item's modified timestamp has not changed.
+
+   The cache lives in ~/.workforce-scripts/projects. Set the WORKFORCE_SCRIPTS_CACHE_DIR environment variable to use
+   another directory, or WORKFORCE_SCRIPTS_PROJECT_CACHE=off to always build projects from the server.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from urllib.parse import urlparse
+
+# Bump when the layout of the cached descriptors changes
+CACHE_VERSION = 1
+# Cached descriptors older than this are refreshed even if the item was not modified. The layers of a version 1
+# project are separate items, so their schema can change without the project item being modified.
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+
+def get_cache_root():
+    """
+    Gets the directory the scripts keep their caches in
+    :return: (string) The directory
+    """
+    default = os.path.join(os.path.expanduser("~"), ".workforce-scripts")
+    return os.environ.get("WORKFORCE_SCRIPTS_CACHE_DIR", default)
+
+
+def get_cache_dir():
+    """
+    Gets the directory the project descriptors are cached in
+    :return: (string) The directory, or None when the cache is turned off
+    """
+    if os.environ.get("WORKFORCE_SCRIPTS_PROJECT_CACHE", "").lower() in ("0", "off", "false", "no"):
+        return None
+    return os.path.join(get_cache_root(), "projects")
+
+
+def _get_layers(project):
+    """
+    Gets the layers and tables of a project that exist for its version
+    :return: (List<Tuple<string, _GISResource>>) The name of the project property and the layer
+    """
+    names = ["assignments_layer", "workers_layer", "dispatchers_layer"]
+    if project._is_v2_project:
+        names += ["assignment_types_table", "integrations_table"]
+    elif project._supports_tracks:
+        names.append("tracks_layer")
+    return [(name, getattr(project, name)) for name in names]
+
+
+def describe_project(project, item):
+    """
+    Builds the descriptor that is cached for a project
+    :param project: (Project) The project
+    :param item: (Item) The project item
+    :return: (Dict) The descriptor
+    """
+    from arcgis.features import Table
+    return {
+        "version": CACHE_VERSION,
+        "project_id": item.id,
+        "modified": item.modified,
+        "org_url": project.gis.url,
+        "cached_at": time.time(),
+        "item_data": None if project._is_v2_project else project._item_data,
+        "layers": {name: {"url": layer.url,
+                          "is_table": isinstance(layer, Table),
+                          "properties": json.loads(json.dumps(dict(layer.properties), default=dict))}
+                   for name, layer in _get_layers(project)}
+    }
+
+
+def _get_server_token(gis, url, tokens):
+    """
+    Gets the token to use for a layer, the same way the layer would when hydrating itself, but only once per server
+    """
+    host = urlparse(url).netloc
+    if host not in tokens:
+        try:
+            tokens[host] = gis._con.generate_portal_server_token(serverUrl=url)
+        except Exception:
+            tokens[host] = gis._con.token
+    return tokens[host]
+
+
+def rehydrate_project(item, descriptor):
+    """
+    Builds a project from a cached descriptor instead of fetching the item data and layer properties
+    :param item: (Item) The project item
+    :param descriptor: (Dict) The descriptor built by describe_project
+    :return: (Project) The project
+    """
+    from arcgis.apps import workforce
+    from arcgis.apps.workforce._schemas import (AssignmentSchema, AssignmentTypeSchema, DispatcherSchema,
+                                                IntegrationSchema, TrackSchema, WorkerSchema)
+    from arcgis.features import FeatureLayer, Table
+    from arcgis._impl.common._mixins import PropertyMap
+    gis = item._gis
+    project = workforce.Project.__new__(workforce.Project)
+    project.gis = gis
+    project._item = item
+    project._item_data = item.properties if project._is_v2_project else descriptor["item_data"]
+    tokens = {}
+    for name, layer in descriptor["layers"].items():
+        resource = (Table if layer["is_table"] else FeatureLayer)(layer["url"], gis)
+        resource._lazy_properties = PropertyMap(layer["properties"])
+        resource._lazy_token = _get_server_token(gis, layer["url"], tokens)
+        resource._hydrated = True
+        setattr(project, "_lazy_" + name, resource)
+    # The same steps as workforce.Project.__init__, now without a request per layer
+    project._assignment_schema = AssignmentSchema(project.assignments_layer)
+    project._track_schema = TrackSchema(project.tracks_layer) if project._supports_tracks else None
+    project._worker_schema = WorkerSchema(project.workers_layer)
+    if project._is_v2_project:
+        project._assignment_types = AssignmentTypeSchema(project.assignment_types_table)
+        project._integration_schema = IntegrationSchema(project.integrations_table)
+    project._dispatcher_schema = DispatcherSchema(project.dispatchers_layer)
+    project._update_cached_objects()
+    return project
+
+
+def _read_descriptor(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_descriptor(path, descriptor):
+    """
+    Writes a descriptor atomically so concurrent runs never read a partial file
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(descriptor, f)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def _is_fresh(descriptor, item, max_age):
+    return (descriptor is not None and
+            descriptor.get("version") == CACHE_VERSION and
+            descriptor.get("modified") == item.modified and
+            descriptor.get("org_url") == item._gis.url and
+            time.time() - descriptor.get("cached_at", 0) < max_age)
+
+
+def get_project(item, max_age=DEFAULT_MAX_AGE, reference_ttl=None):
+    """
+    Gets the workforce project of an item, using the cached descriptor of the project when it was saved for the same
+    version (modified timestamp) of the item. This replaces workforce.Project(item). The assignment types, workers and
+    dispatchers of the project are kept in a ReferenceCache.
+    :param item: (Item) The project item
+    :param max_age: (int) The number of seconds after which a cached descriptor is refreshed regardless
+    :param reference_ttl: (int) The number of seconds the assignment types, workers and dispatchers are kept for
+    :return: (Project) The project
+    """
+    from .reference_cache import get_reference_cache
+    project = _load_project(item, max_age)
+    get_reference_cache(project, reference_ttl)
+    return project
+
+
+def _load_project(item, max_age):
+    from arcgis.apps import workforce
+    cache_dir = get_cache_dir()
+    # workforce.Project raises the usual error for anything that is not a workforce project
+    if item is None or cache_dir is None or "Workforce Project" not in item.typeKeywords:
+        return workforce.Project(item)
+    logger = logging.getLogger()
+    path = os.path.join(cache_dir, "{}.json".format(item.id))
+    descriptor = _read_descriptor(path)
+    if _is_fresh(descriptor, item, max_age):
+        try:
+            project = rehydrate_project(item, descriptor)
+            logger.debug("Loaded project {} from the cache".format(item.id))
+            return project
+        except Exception as e:
+            logger.debug("Could not load project {} from the cache: {}".format(item.id, e))
+    project = workforce.Project(item)
+    try:
+        _write_descriptor(path, describe_project(project, item))
+    except Exception as e:
+        logger.debug("Could not cache project {}: {}".format(item.id, e))
+    return project
@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Builds the out_fields, returnGeometry and status filters of a query from the columns a script reads
+
+   Scripts declare the columns they read by their name on the workforce schema ("status", "work_order_id", ...) or by
+   field name for custom fields. The pseudo column "geometry" asks for the geometry, which is otherwise left out.
+"""
+
+GEOMETRY = "geometry"
+
+# The fields workforce.Assignment reads when it is built from a feature
+ASSIGNMENT_MODEL_COLUMNS = ["object_id", "global_id", "worker_id", "dispatcher_id", "assignment_type"]
+
+# The values of the status field of the assignments layer
+ASSIGNMENT_STATUSES = {"unassigned": 0, "assigned": 1, "in_progress": 2, "completed": 3, "declined": 4, "paused": 5,
+                       "canceled": 6}
+# The values of the status field of the workers layer
+WORKER_STATUSES = {"not_working": 0, "working": 1, "on_break": 2}
+
+
+def get_out_fields(schema, columns):
+    """
+    Gets the fields to request for the columns a script reads
+    :param schema: (Schema) The workforce schema of the layer, such as project._assignment_schema
+    :param columns: (List<string>) The schema attributes or field names the script reads
+    :return: (string) The comma separated field names
+    """
+    fields = []
+    for column in columns:
+        if column == GEOMETRY:
+            continue
+        field = getattr(schema, column, column)
+        # Some schema attributes only exist in one version of the project
+        if field and field not in fields:
+            fields.append(field)
+    return ",".join(fields)
+
+
+def get_projection(schema, columns):
+    """
+    Gets the query parameters for the columns a script reads
+    :param schema: (Schema) The workforce schema of the layer, such as project._assignment_schema
+    :param columns: (List<string>) The schema attributes or field names the script reads, and "geometry" if it does
+    :return: (Dict) The out_fields and return_geometry arguments of FeatureLayer.query
+    """
+    return {"out_fields": get_out_fields(schema, columns), "return_geometry": GEOMETRY in columns}
+
+
+def get_assignment_projection(project, columns):
+    """
+    Gets the query parameters for the assignment columns a script reads, including the ones needed to build a
+    workforce.Assignment from each feature
+    :param project: (Project) The workforce project
+    :param columns: (List<string>) The schema attributes or field names the script reads, and "geometry" if it does
+    :return: (Dict) The out_fields and return_geometry arguments of FeatureLayer.query
+    """
+    return get_projection(project._assignment_schema, ASSIGNMENT_MODEL_COLUMNS + list(columns))
+
+
+def get_status_where(schema, statuses, lookup=None):
+    """
+    Gets a where clause that keeps the records with one of the statuses
+    :param schema: (Schema) The workforce schema of the layer
+    :param statuses: (List<string>) The status names
+    :param lookup: (Dict) The values of the status names, defaults to ASSIGNMENT_STATUSES
+    :return: (string) The where clause
+    """
+    lookup = lookup or ASSIGNMENT_STATUSES
+    return "{} IN ({})".format(schema.status, ", ".join(str(lookup[status]) for status in statuses))
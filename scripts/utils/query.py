@@ -0,0 +1,425 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Streaming queries against feature layers
+
+   Rather than asking the server for every record at once (return_all_records=True), these generators walk the layer
+   one page at a time using the OBJECTID as a keyset. Only a single page is held in memory and callers can start
+   processing as soon as the first page arrives.
+
+   When max_workers is greater than 1, the OBJECTIDs are fetched up front (returnIdsOnly) and split into partitions
+   that are queried concurrently. Pages are still yielded in OBJECTID order.
+
+   iter_column_pages is an opt-in alternative that requests the pages as protocol buffers (f=pbf) and decodes them
+   into one list per field instead of a Feature per record.
+"""
+
+import array
+import json
+import logging
+import math
+from .pbf import decode_feature_collection
+from .projection import get_assignment_projection
+from .throttle import DEFAULT_REQUESTS_PER_SECOND, ThrottledExecutor, get_session
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_MAX_WORKERS = 4
+
+
+def _supports_pagination(layer):
+    """
+    Checks whether the layer can return a limited, ordered set of records
+    :param layer: (FeatureLayer) The layer to check
+    :return: (bool) True if resultRecordCount and orderByFields are supported
+    """
+    capabilities = layer.properties.get("advancedQueryCapabilities", None) or {}
+    return bool(capabilities.get("supportsPagination", False) and capabilities.get("supportsOrderBy", True))
+
+
+def get_page_size(layer, page_size=None):
+    """
+    Gets the number of records to request per page, capped by the layer's maxRecordCount
+    :param layer: (FeatureLayer) The layer that will be queried
+    :param page_size: (int) The requested page size. Defaults to the layer's maxRecordCount
+    :return: (int) The page size to use
+    """
+    max_record_count = layer.properties.get("maxRecordCount", None) or DEFAULT_PAGE_SIZE
+    if not page_size:
+        return max_record_count
+    return min(page_size, max_record_count)
+
+
+def get_object_id_field(layer):
+    """
+    Gets the name of the OBJECTID field of the layer
+    :param layer: (FeatureLayer) The layer
+    :return: (string) The object id field name
+    """
+    return layer.properties.get("objectIdField", None) or "OBJECTID"
+
+
+def _with_object_id_field(out_fields, object_id_field):
+    """
+    Makes sure the OBJECTID is part of the requested fields
+    :param out_fields: (string or List<string>) The fields to return
+    :param object_id_field: (string) The object id field name
+    :return: (string) The comma separated list of fields
+    """
+    if isinstance(out_fields, (list, tuple)):
+        out_fields = ",".join(out_fields)
+    if out_fields != "*" and object_id_field.lower() not in [f.strip().lower() for f in out_fields.split(",")]:
+        out_fields = "{},{}".format(out_fields, object_id_field)
+    return out_fields
+
+
+def query_object_ids(layer, where="1=1"):
+    """
+    Gets the sorted OBJECTIDs of the records matching the where clause
+    :param layer: (FeatureLayer) The layer to query
+    :param where: (string) The where clause to use
+    :return: (List<int>) The object ids
+    """
+    result = layer.query(where=where, return_ids_only=True)
+    return sorted(result.get("objectIds", None) or [])
+
+
+def _iter_partitions(object_ids, page_size, fetch, max_workers, requests_per_second):
+    """
+    Splits the OBJECTIDs into partitions and fetches them on a thread pool
+    :param object_ids: (List<int>) The sorted object ids
+    :param page_size: (int) The number of object ids per partition
+    :param fetch: (Function) Called with each partition, returns the page for it
+    :param max_workers: (int) The number of partitions to fetch concurrently
+    :param requests_per_second: (float) The number of partitions that may be requested per second
+    :return: (Generator) The pages, in the same order as the partitions
+    """
+    partitions = (object_ids[i:i + page_size] for i in range(0, len(object_ids), page_size))
+    # The executor only keeps a bounded number of partitions in flight so memory stays flat on large layers
+    with ThrottledExecutor(max_workers=max_workers, requests_per_second=requests_per_second) as executor:
+        yield from executor.map(fetch, partitions)
+
+
+def _iter_partitioned_pages(layer, where, out_fields, return_geometry, out_sr, page_size, max_workers, requests_per_second):
+    """
+    Fetches the OBJECTIDs once, then queries partitions of them concurrently
+    :return: (Generator<List<Feature>>) The pages of features, in OBJECTID order
+    """
+    object_id_field = get_object_id_field(layer)
+    out_fields = _with_object_id_field(out_fields, object_id_field)
+    page_size = get_page_size(layer, page_size)
+
+    def fetch(partition):
+        features = layer.query(object_ids=",".join(str(object_id) for object_id in partition),
+                               out_fields=out_fields,
+                               return_geometry=return_geometry,
+                               out_sr=out_sr,
+                               return_all_records=False).features
+        features.sort(key=lambda feature: feature.attributes[object_id_field])
+        return features
+
+    for features in _iter_partitions(query_object_ids(layer, where), page_size, fetch, max_workers, requests_per_second):
+        if features:
+            yield features
+
+
+def iter_pages(layer, where="1=1", out_fields="*", return_geometry=True, out_sr=None, page_size=None, max_workers=1,
+               requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+    """
+    Queries a layer one page at a time, ordered by OBJECTID
+    :param layer: (FeatureLayer) The layer to query
+    :param where: (string) The where clause to use
+    :param out_fields: (string or List<string>) The fields to return
+    :param return_geometry: (bool) Whether or not to return the geometry
+    :param out_sr: (dict or int) The spatial reference to return the geometry in
+    :param page_size: (int) The number of records per page. Defaults to the layer's maxRecordCount
+    :param max_workers: (int) The number of pages to fetch concurrently
+    :param requests_per_second: (float) The number of pages that may be requested per second when fetching concurrently
+    :return: (Generator<List<Feature>>) The pages of features
+    """
+    if max_workers and max_workers > 1:
+        yield from _iter_partitioned_pages(layer, where, out_fields, return_geometry, out_sr, page_size, max_workers,
+                                           requests_per_second)
+        return
+
+    if not _supports_pagination(layer):
+        logging.getLogger().debug("Layer {} does not support pagination, querying all records".format(layer.url))
+        features = layer.query(where=where, out_fields=out_fields, return_geometry=return_geometry, out_sr=out_sr,
+                               return_all_records=True).features
+        if features:
+            yield features
+        return
+
+    object_id_field = get_object_id_field(layer)
+    # The object id is needed to know where the next page starts
+    out_fields = _with_object_id_field(out_fields, object_id_field)
+    page_size = get_page_size(layer, page_size)
+    last_object_id = None
+    while True:
+        page_where = where
+        if last_object_id is not None:
+            page_where = "({}) AND {} > {}".format(where, object_id_field, last_object_id)
+        features = layer.query(where=page_where,
+                               out_fields=out_fields,
+                               return_geometry=return_geometry,
+                               out_sr=out_sr,
+                               order_by_fields="{} ASC".format(object_id_field),
+                               result_record_count=page_size,
+                               return_all_records=False).features
+        if not features:
+            return
+        yield features
+        if len(features) < page_size:
+            return
+        last_object_id = features[-1].attributes[object_id_field]
+
+
+def iter_features(layer, where="1=1", out_fields="*", return_geometry=True, out_sr=None, page_size=None, max_workers=1,
+                  requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+    """
+    Queries a layer page by page and yields each feature
+    :param layer: (FeatureLayer) The layer to query
+    :param where: (string) The where clause to use
+    :param out_fields: (string or List<string>) The fields to return
+    :param return_geometry: (bool) Whether or not to return the geometry
+    :param out_sr: (dict or int) The spatial reference to return the geometry in
+    :param page_size: (int) The number of records per page. Defaults to the layer's maxRecordCount
+    :param max_workers: (int) The number of pages to fetch concurrently
+    :param requests_per_second: (float) The number of pages that may be requested per second when fetching concurrently
+    :return: (Generator<Feature>) The features
+    """
+    for page in iter_pages(layer, where, out_fields, return_geometry, out_sr, page_size, max_workers, requests_per_second):
+        for feature in page:
+            yield feature
+
+
+def iter_assignments(project, where="1=1", page_size=None, max_workers=1, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                     columns=None):
+    """
+    The streaming equivalent of project.assignments.search
+    :param project: (Project) The workforce project
+    :param where: (string) The where clause to use
+    :param page_size: (int) The number of records per page. Defaults to the layer's maxRecordCount
+    :param max_workers: (int) The number of pages to fetch concurrently
+    :param requests_per_second: (float) The number of pages that may be requested per second when fetching concurrently
+    :param columns: (List<string>) The columns the caller reads (see projection.get_assignment_projection). Defaults
+        to every field and the geometry. Assignments built from fewer columns are fine to read, but not to update
+        with project.assignments.batch_update.
+    :return: (Generator<Assignment>) The assignments
+    """
+    from arcgis.apps import workforce
+    projection = get_assignment_projection(project, columns) if columns is not None else {}
+    # Like project.assignments.search, make sure the workers, dispatchers and assignment types are loaded (once per
+    # time to live of the project's ReferenceCache)
+    project._update_cached_objects()
+    for feature in iter_features(project.assignments_layer, where=where, page_size=page_size, max_workers=max_workers,
+                                 requests_per_second=requests_per_second, **projection):
+        yield workforce.Assignment(project, feature)
+
+
+def supports_query_attachments(layer):
+    """
+    Checks whether the layer can list the attachments of many features in one queryAttachments request
+    :param layer: (FeatureLayer) The layer to check
+    :return: (bool) True if queryAttachments is supported
+    """
+    capabilities = layer.properties.get("advancedQueryCapabilities", None) or {}
+    return bool(capabilities.get("supportsQueryAttachments", False))
+
+
+def query_attachments(layer, where="1=1", object_ids=None, page_size=None, max_workers=1,
+                      requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+    """
+    Lists the attachments of the features matching the where clause, or of the given features, grouped by feature.
+    Layers that support queryAttachments are asked for a partition of OBJECTIDs at a time, other layers for the
+    attachments of each feature.
+    :param layer: (FeatureLayer) The layer to query
+    :param where: (string) The where clause to use, when no object ids are given
+    :param object_ids: (List<int>) The object ids of the features
+    :param page_size: (int) The number of features per request, the maxRecordCount of the layer by default
+    :param max_workers: (int) The number of partitions to query concurrently
+    :param requests_per_second: (float) The number of partitions that may be requested per second
+    :return: (List<Dict>) The parentObjectId, parentGlobalId and attachmentInfos of each feature with attachments
+    """
+    object_ids = query_object_ids(layer, where) if object_ids is None else sorted(object_ids)
+    object_id_field = get_object_id_field(layer)
+    global_id_field = layer.properties.get("globalIdField", None)
+
+    def fetch(partition):
+        object_ids_parameter = ",".join(str(object_id) for object_id in partition)
+        if supports_query_attachments(layer):
+            result = layer._con.post(layer.url + "/queryAttachments", {"f": "json", "objectIds": object_ids_parameter})
+            return result.get("attachmentGroups", None) or []
+        features = layer.query(object_ids=object_ids_parameter, out_fields=_with_object_id_field(global_id_field or "*", object_id_field),
+                               return_geometry=False, return_all_records=False).features
+        groups = []
+        for feature in features:
+            object_id = feature.attributes[object_id_field]
+            infos = layer.attachments.get_list(object_id)
+            if infos:
+                groups.append({"parentObjectId": object_id, "attachmentInfos": infos,
+                               "parentGlobalId": feature.attributes.get(global_id_field, None) if global_id_field else None})
+        return groups
+
+    groups = []
+    for partition_groups in _iter_partitions(object_ids, get_page_size(layer, page_size), fetch, max_workers, requests_per_second):
+        groups.extend(group for group in partition_groups if group.get("attachmentInfos", None))
+    return groups
+
+
+def supports_pbf(layer):
+    """
+    Checks whether the layer can return query results as protocol buffers
+    :param layer: (FeatureLayer) The layer to check
+    :return: (bool) True if f=pbf is supported
+    """
+    formats = layer.properties.get("supportedQueryFormats", None) or ""
+    return "pbf" in [f.strip().lower() for f in formats.split(",")]
+
+
+def _post_query(layer, params):
+    """
+    Posts a query to the layer and returns the raw response body
+    :param layer: (FeatureLayer) The layer to query
+    :param params: (Dict) The query parameters
+    :return: (bytes) The response body
+    """
+    params = dict(params)
+    token = getattr(layer._con, "token", None)
+    if token:
+        params["token"] = token
+    response = get_session().post(layer.url + "/query", data=params, verify=getattr(layer._con, "_verify_cert", True))
+    response.raise_for_status()
+    # Errors are always returned as JSON, even when a protocol buffer was requested
+    if "json" in response.headers.get("Content-Type", "") or "text" in response.headers.get("Content-Type", ""):
+        raise Exception("Query failed: {}".format(response.json().get("error", response.text)))
+    return response.content
+
+
+def _features_to_columns(features, object_id_field):
+    """
+    Converts JSON features to the same columnar layout that decode_feature_collection returns
+    :param features: (List<Feature>) The features
+    :param object_id_field: (string) The name of the object id field
+    :return: (Dict) The columnar page
+    """
+    fields = list(features[0].attributes.keys()) if features else []
+    page = {
+        "fields": fields,
+        "columns": {field: [feature.attributes.get(field, None) for feature in features] for field in fields},
+        "x": array.array("d", (feature.geometry["x"] if feature.geometry else float("nan") for feature in features)),
+        "y": array.array("d", (feature.geometry["y"] if feature.geometry else float("nan") for feature in features)),
+        "geometries": None,
+        "object_id_field": object_id_field,
+        "spatial_reference": None,
+        "exceeded_transfer_limit": False,
+        "count": None,
+        "object_ids": None
+    }
+    return page
+
+
+def _sort_columns(page, object_id_field):
+    """
+    Sorts a columnar page by OBJECTID, in place
+    :param page: (Dict) The columnar page
+    :param object_id_field: (string) The name of the object id field
+    """
+    object_ids = page["columns"].get(object_id_field, None)
+    if not object_ids:
+        return
+    order = sorted(range(len(object_ids)), key=object_ids.__getitem__)
+    if order == list(range(len(object_ids))):
+        return
+    for field, column in page["columns"].items():
+        page["columns"][field] = [column[i] for i in order]
+    for key in ("x", "y"):
+        if page[key] is not None:
+            page[key] = array.array("d", (page[key][i] for i in order))
+    if page["geometries"] is not None:
+        page["geometries"] = [page["geometries"][i] for i in order]
+
+
+def page_length(page):
+    """
+    Gets the number of records in a columnar page
+    :param page: (Dict) The columnar page
+    :return: (int) The number of records
+    """
+    return len(page["columns"].get(page["object_id_field"], None) or [])
+
+
+def iter_column_pages(layer, where="1=1", out_fields="*", return_geometry=True, out_sr=None, page_size=None, max_workers=1,
+                      requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+    """
+    Queries a layer one page at a time, ordered by OBJECTID, decoding each page into columns. Protocol buffers are
+    used when the layer supports them, otherwise the JSON response is converted to the same layout.
+    :param layer: (FeatureLayer) The layer to query
+    :param where: (string) The where clause to use
+    :param out_fields: (string or List<string>) The fields to return
+    :param return_geometry: (bool) Whether or not to return the geometry
+    :param out_sr: (dict or int) The spatial reference to return the geometry in
+    :param page_size: (int) The number of records per page. Defaults to the layer's maxRecordCount
+    :param max_workers: (int) The number of pages to fetch concurrently
+    :param requests_per_second: (float) The number of pages that may be requested per second when fetching concurrently
+    :return: (Generator<Dict>) The columnar pages (see pbf.decode_feature_collection)
+    """
+    object_id_field = get_object_id_field(layer)
+    out_fields = _with_object_id_field(out_fields, object_id_field)
+    page_size = get_page_size(layer, page_size)
+    use_pbf = supports_pbf(layer)
+    if not use_pbf:
+        logging.getLogger().warning("Layer {} does not support protocol buffers, falling back to JSON".format(layer.url))
+
+    def fetch(partition):
+        object_ids = ",".join(str(object_id) for object_id in partition)
+        if use_pbf:
+            params = {
+                "objectIds": object_ids,
+                "outFields": out_fields,
+                "returnGeometry": "true" if return_geometry else "false",
+                "f": "pbf"
+            }
+            if out_sr:
+                params["outSR"] = out_sr if isinstance(out_sr, (int, str)) else json.dumps(out_sr)
+            page = decode_feature_collection(_post_query(layer, params))
+        else:
+            page = _features_to_columns(layer.query(object_ids=object_ids,
+                                                    out_fields=out_fields,
+                                                    return_geometry=return_geometry,
+                                                    out_sr=out_sr,
+                                                    return_all_records=False).features, object_id_field)
+        page["object_id_field"] = page["object_id_field"] or object_id_field
+        _sort_columns(page, page["object_id_field"])
+        return page
+
+    for page in _iter_partitions(query_object_ids(layer, where), page_size, fetch, max_workers, requests_per_second):
+        if page_length(page):
+            yield page
+
+
+def columns_to_features(page):
+    """
+    Converts a columnar page back to Features, for code that edits or copies records
+    :param page: (Dict) The columnar page
+    :return: (List<Feature>) The features
+    """
+    from arcgis.features import Feature
+    fields = page["fields"]
+    columns = [page["columns"][field] for field in fields]
+    features = []
+    for i, values in enumerate(zip(*columns)):
+        geometry = None
+        if page["x"] is not None and not math.isnan(page["x"][i]):
+            geometry = {"x": page["x"][i], "y": page["y"][i]}
+        features.append(Feature(geometry=geometry, attributes=dict(zip(fields, values))))
+    return features
@@ -0,0 +1,284 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Keeps the assignment types, workers and dispatchers of a project in memory
+
+   A workforce.Project resolves the worker, dispatcher and assignment type of each assignment from dictionaries of
+   these small tables, but it queries all three tables again (and the signed in user) before every search, add,
+   update or delete. A script polling for assignments, or updating them one at a time, spends most of its requests
+   on these tables. The ReferenceCache replaces that refresh with one that only queries the tables once they are
+   older than a time to live, or after the tables were edited, and indexes them for lookups by global id, object id,
+   user id and name.
+"""
+
+import logging
+import threading
+import time
+
+# The number of seconds the reference tables are used for before they are queried again
+DEFAULT_TTL = 5 * 60
+# A worker, dispatcher or assignment type that is not in the cache (e.g. a worker added in the web app) queries the
+# tables again, unless they were queried less than this many seconds ago
+MISS_REFRESH_INTERVAL = 30
+
+
+def _index(items, key):
+    """
+    Indexes items by a key, keeping the first item for duplicate keys
+    :param items: (List) The items to index
+    :param key: (Function) Returns the key of an item, or None if the item should not be indexed
+    :return: (Dict) The items by key
+    """
+    index = {}
+    for item in items:
+        value = key(item)
+        if value is not None:
+            index.setdefault(value, item)
+    return index
+
+
+def _upper(value):
+    return value.upper() if value else None
+
+
+def _lower(value):
+    return value.lower() if value else None
+
+
+class _RefreshOnMiss(dict):
+    """
+    The dictionaries the project resolves and validates assignments with, which query the tables again for an unknown
+    key, whether it is looked up with [] or get
+    """
+
+    def __init__(self, cache, attribute, items):
+        dict.__init__(self, items)
+        self._cache = cache
+        self._attribute = attribute
+
+    def __missing__(self, key):
+        if self._cache._refresh_on_miss():
+            current = getattr(self._cache.project, self._attribute)
+            if current is not self and key in current:
+                return current[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        # arcgis validates the workers and dispatchers of an assignment with get, which does not call __missing__
+        if key is None:
+            return default
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class ReferenceCache(object):
+    """
+    The assignment types, workers and dispatchers of a project, shared by everything that uses the project. Use
+    get_reference_cache to get the cache of a project.
+    """
+
+    def __init__(self, project, ttl=DEFAULT_TTL):
+        """
+        :param project: (Project) The project
+        :param ttl: (int) The number of seconds the tables are used for before they are queried again
+        """
+        self.project = project
+        self.ttl = ttl
+        self._loaded_at = None
+        self._indexes = {}
+        self._lock = threading.RLock()
+        self._update_cached_objects = project._update_cached_objects
+        self._update_cached_assignment_types = project._update_cached_assignment_types
+
+    def install(self):
+        """
+        Makes the project refresh its reference tables through the cache, and invalidates the cache when they are
+        edited. The tables the project already loaded are used until the time to live expires.
+        :return: (ReferenceCache) The cache
+        """
+        project = self.project
+        project._update_cached_objects = self.update
+        project._update_cached_assignment_types = self._update_assignment_types
+        layers = [project.workers_layer, project.dispatchers_layer]
+        # The assignment types of a version 1 project are a domain of the assignments layer, which arcgis reloads
+        # through _update_cached_assignment_types after editing it
+        if project._is_v2_project:
+            layers.append(project.assignment_types_table)
+        for layer in layers:
+            self._invalidate_on_edit(layer)
+        project._reference_cache = self
+        # A project loads the tables when it is built
+        if hasattr(project, "_cached_dispatcher"):
+            self._build_indexes()
+        return self
+
+    def _invalidate_on_edit(self, layer):
+        edit_features = layer.edit_features
+
+        def wrapper(*args, **kwargs):
+            try:
+                return edit_features(*args, **kwargs)
+            finally:
+                self.invalidate()
+        layer.edit_features = wrapper
+
+    def _update_assignment_types(self):
+        with self._lock:
+            self._update_cached_assignment_types()
+            if self._loaded_at is not None:
+                self._build_indexes(self._loaded_at)
+
+    def _build_indexes(self, loaded_at=None):
+        project = self.project
+        for attribute in ("_cached_assignment_types", "_cached_workers", "_cached_dispatchers"):
+            setattr(project, attribute, _RefreshOnMiss(self, attribute, getattr(project, attribute)))
+        assignment_types = list(project._cached_assignment_types.values())
+        workers = list(project._cached_workers.values())
+        dispatchers = list(project._cached_dispatchers.values())
+        indexes = {"assignment_types": assignment_types, "workers": workers, "dispatchers": dispatchers}
+        for name, items in (("assignment_type", assignment_types), ("worker", workers), ("dispatcher", dispatchers)):
+            # Version 1 assignment types are coded values rather than features
+            if name != "assignment_type" or getattr(project, "_is_v2_project", False):
+                indexes[name, "global_id"] = _index(items, lambda i: _upper(i.global_id))
+                indexes[name, "object_id"] = _index(items, lambda i: i.object_id)
+            else:
+                indexes[name, "global_id"] = indexes[name, "object_id"] = {}
+            indexes[name, "name"] = _index(items, lambda i: i.name)
+            if name == "assignment_type":
+                indexes[name, "code"] = _index(items, lambda i: i.code)
+            else:
+                indexes[name, "user_id"] = _index(items, lambda i: _lower(i.user_id))
+        self._indexes = indexes
+        self._loaded_at = time.time() if loaded_at is None else loaded_at
+
+    def is_stale(self):
+        """
+        Checks whether the tables need to be queried again
+        :return: (bool) True if the tables were never loaded, were invalidated or are older than the time to live
+        """
+        return self._loaded_at is None or time.time() - self._loaded_at >= self.ttl
+
+    def invalidate(self):
+        """
+        Queries the tables again the next time they are used, e.g. after editing them outside of the project
+        """
+        self._loaded_at = None
+
+    def refresh(self):
+        """
+        Queries the tables now
+        :return: (ReferenceCache) The cache
+        """
+        with self._lock:
+            started = time.time()
+            self._update_cached_objects()
+            self._build_indexes(started)
+            logging.getLogger().debug("Loaded {} assignment types, {} workers and {} dispatchers of {}".format(
+                len(self._indexes["assignment_types"]), len(self._indexes["workers"]),
+                len(self._indexes["dispatchers"]), self.project.id))
+        return self
+
+    def _refresh_on_miss(self):
+        with self._lock:
+            if self._loaded_at is not None and time.time() - self._loaded_at < MISS_REFRESH_INTERVAL:
+                return False
+            self.refresh()
+            return True
+
+    def update(self):
+        """
+        Queries the tables if they are stale. Replaces Project._update_cached_objects once the cache is installed.
+        """
+        if self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    self.refresh()
+
+    @property
+    def assignment_types(self):
+        """The assignment types of the project"""
+        self.update()
+        return list(self._indexes["assignment_types"])
+
+    @property
+    def workers(self):
+        """The workers of the project"""
+        self.update()
+        return list(self._indexes["workers"])
+
+    @property
+    def dispatchers(self):
+        """The dispatchers of the project"""
+        self.update()
+        return list(self._indexes["dispatchers"])
+
+    def _get(self, table, global_id, object_id, **keys):
+        self.update()
+        if global_id is not None:
+            return self._indexes[table, "global_id"].get(global_id.upper())
+        if object_id is not None:
+            return self._indexes[table, "object_id"].get(object_id)
+        for key, value in keys.items():
+            if value is not None:
+                return self._indexes[table, key].get(value)
+        return None
+
+    def get_assignment_type(self, code=None, name=None, global_id=None, object_id=None):
+        """
+        Gets an assignment type by one of its keys
+        :param code: (int) The code of the assignment type in the assignments layer
+        :param name: (string) The name of the assignment type
+        :param global_id: (string) The global id of the assignment type (version 2 projects)
+        :param object_id: (int) The object id of the assignment type (version 2 projects)
+        :return: (AssignmentType) The assignment type, or None if none matches
+        """
+        return self._get("assignment_type", global_id, object_id, code=code, name=name)
+
+    def get_worker(self, user_id=None, name=None, global_id=None, object_id=None):
+        """
+        Gets a worker by one of its keys
+        :param user_id: (string) The named user of the worker, case insensitive
+        :param name: (string) The name of the worker
+        :param global_id: (string) The global id of the worker
+        :param object_id: (int) The object id of the worker
+        :return: (Worker) The worker, or None if none matches
+        """
+        return self._get("worker", global_id, object_id, user_id=_lower(user_id), name=name)
+
+    def get_dispatcher(self, user_id=None, name=None, global_id=None, object_id=None):
+        """
+        Gets a dispatcher by one of its keys
+        :param user_id: (string) The named user of the dispatcher, case insensitive
+        :param name: (string) The name of the dispatcher
+        :param global_id: (string) The global id of the dispatcher
+        :param object_id: (int) The object id of the dispatcher
+        :return: (Dispatcher) The dispatcher, or None if none matches
+        """
+        return self._get("dispatcher", global_id, object_id, user_id=_lower(user_id), name=name)
+
+
+def get_reference_cache(project, ttl=None):
+    """
+    Gets the reference cache of a project, installing one if the project does not have one yet
+    :param project: (Project) The project
+    :param ttl: (int) The number of seconds the tables are used for before they are queried again
+    :return: (ReferenceCache) The cache
+    """
+    cache = getattr(project, "_reference_cache", None)
+    if cache is None:
+        cache = ReferenceCache(project, DEFAULT_TTL if ttl is None else ttl).install()
+    elif ttl is not None:
+        cache.ttl = ttl
+    return cache
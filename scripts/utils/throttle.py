@@ -0,0 +1,236 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Runs REST calls concurrently without getting the scripts throttled
+
+   ArcGIS Online answers with HTTP 429 (or 503) when a client sends too many requests. ThrottledExecutor caps the
+   number of calls in flight and the number of calls started per second, and retries throttled calls after the delay
+   the server asks for (Retry-After) or a jittered exponential backoff when it does not say.
+"""
+
+import collections
+import concurrent.futures
+import datetime
+import email.utils
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+from .tracing import note_retry
+
+DEFAULT_REQUESTS_PER_SECOND = 10
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1
+DEFAULT_MAX_DELAY = 60
+# The number of connections kept open per host by the shared session
+POOL_SIZE = 32
+
+# HTTP statuses that mean "slow down" rather than "this request is wrong"
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+# The ArcGIS API for Python raises plain Exceptions, so the status has to be found in the message
+_RETRYABLE_MESSAGE = re.compile(r"\b(429|502|503|504)\b|too many requests|service unavailable|timed? ?out", re.IGNORECASE)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Gets the HTTP session shared by the helpers that call the REST API directly, so connections are kept alive and
+    reused rather than opened for every request
+    :return: (requests.Session) The session
+    """
+    global _session
+    import requests
+    from requests.adapters import HTTPAdapter
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def get_retry_after(error):
+    """
+    Gets the delay a server asked for in the Retry-After header of a failed response
+    :param error: (Exception) The error raised by the call
+    :return: (float) The number of seconds to wait, or None if the server did not say
+    """
+    response = getattr(error, "response", None)
+    value = response.headers.get("Retry-After", None) if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.datetime.now(retry_at.tzinfo)).total_seconds(), 0)
+
+
+def is_retryable(error):
+    """
+    Checks whether an error means the server is throttling or temporarily unavailable
+    :param error: (Exception) The error raised by the call
+    :return: (bool) True if the call should be retried
+    """
+    import requests
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    response = getattr(error, "response", None)
+    if response is not None:
+        return response.status_code in RETRYABLE_STATUS_CODES
+    return bool(_RETRYABLE_MESSAGE.search(str(error)))
+
+
+class RateLimiter(object):
+    """
+    Spaces out the start of calls so that no more than requests_per_second are started in any second. Shared by
+    every thread of an executor, so a Retry-After received by one thread holds back the others too.
+    """
+
+    def __init__(self, requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+        """
+        :param requests_per_second: (float) The number of calls allowed per second, or None for no limit
+        """
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until the next call is allowed to start
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds):
+        """
+        Holds back every call for a number of seconds
+        :param seconds: (float) The number of seconds to wait
+        """
+        with self._lock:
+            self._next_time = max(self._next_time, time.monotonic() + seconds)
+
+
+class ThrottledExecutor(object):
+    """
+    A thread pool for REST calls that enforces a concurrency cap and a requests per second budget, and retries calls
+    that were throttled. Use it as a context manager:
+
+        with ThrottledExecutor(max_workers=8, requests_per_second=20) as executor:
+            for result in executor.map(download, items):
+                ...
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_CONCURRENCY, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        """
+        :param max_workers: (int) The number of calls that may be in flight at once
+        :param requests_per_second: (float) The number of calls that may be started per second, or None for no limit
+        :param max_retries: (int) The number of times to retry a throttled call before raising
+        :param base_delay: (float) The backoff before the first retry when the server does not send Retry-After
+        :param max_delay: (float) The longest backoff between two retries
+        """
+        self.max_workers = max(max_workers or 1, 1)
+        self.limiter = RateLimiter(requests_per_second)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Calls a function on the current thread, respecting the rate limit and retrying when throttled
+        :param fn: (Function) The function that makes the REST call
+        :return: The return value of the function
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                retry_after = get_retry_after(e)
+                if retry_after is not None:
+                    delay = min(retry_after, self.max_delay)
+                    self.limiter.pause(delay)
+                else:
+                    # Full jitter keeps threads that were throttled together from retrying together
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                attempt += 1
+                logging.getLogger().warning("Request throttled ({}), retrying in {:.1f} seconds ({}/{})".format(
+                    e, delay, attempt, self.max_retries))
+                time.sleep(delay)
+                note_retry()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules a call on the pool
+        :param fn: (Function) The function that makes the REST call
+        :return: (Future) The future for the result
+        """
+        return self._executor.submit(self.call, fn, *args, **kwargs)
+
+    def map(self, fn, items):
+        """
+        Calls a function with each item on the pool. Only a bounded number of items are scheduled ahead of the one
+        being returned, so the items can be a generator over a large layer.
+        :param fn: (Function) The function that makes the REST call
+        :param items: (Iterable) The items
+        :return: (Generator) The results, in the same order as the items
+        """
+        return self._map(self.submit, fn, items)
+
+    def map_tasks(self, fn, items):
+        """
+        Like map, but for tasks that make several REST calls each. The tasks are not throttled or retried as a whole,
+        they should make each of their calls through executor.call so that only the call that was throttled is retried.
+        :param fn: (Function) The task
+        :param items: (Iterable) The items
+        :return: (Generator) The results, in the same order as the items
+        """
+        return self._map(self._executor.submit, fn, items)
+
+    def _map(self, submit, fn, items):
+        items = iter(items)
+        pending = collections.deque(submit(fn, item) for item in itertools.islice(items, self.max_workers * 2))
+        while pending:
+            result = pending.popleft().result()
+            for item in itertools.islice(items, 1):
+                pending.append(submit(fn, item))
+            yield result
@@ -0,0 +1,347 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Records the HTTP calls a script makes, to find out where a slow run spends its time
+
+   Run a script with --trace-requests and every request sent through the requests library (by the ArcGIS API for
+   Python or by the scripts themselves) is recorded with its endpoint, operation, latency, request and response
+   bytes and whether it was a retry. Scripts name the phase they are in with set_phase, and a summary per phase,
+   operation and endpoint is printed when the script exits. -trace-json also writes every call to a JSON file.
+"""
+
+import collections
+import json
+import re
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+# The phase of the calls made before a script names one
+DEFAULT_PHASE = "startup"
+
+# Operations that are reported under a common name
+_OPERATIONS = {
+    "findaddresscandidates": "geocode",
+    "geocodeaddresses": "geocode",
+    "reversegeocode": "geocode",
+    "suggest": "geocode",
+    "addfeatures": "applyEdits",
+    "updatefeatures": "applyEdits",
+    "deletefeatures": "applyEdits",
+}
+# Services and layers are described by requesting their url
+_SERVICE_TYPES = {"featureserver", "mapserver", "naserver", "geocodeserver", "gpserver", "imageserver"}
+# Item ids and other hexadecimal ids in paths
+_ID = re.compile(r"^(\{?[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}\}?|[0-9a-fA-F]{32})$")
+
+_tracer = None
+_phase = DEFAULT_PHASE
+# Called with the name of each phase a script enters (see profiling.PhaseProfiler)
+_phase_listeners = []
+_local = threading.local()
+
+
+def add_trace_arguments(parser):
+    """
+    Adds the tracing arguments to the parser of a script
+    :param parser: (ArgumentParser) The parser of the script
+    :return: (ArgumentParser) The parser
+    """
+    parser.add_argument('--trace-requests', dest='trace_requests', action='store_true',
+                        help="Record the HTTP calls of the script and print a summary per phase when it exits")
+    parser.add_argument('-trace-json', dest='trace_json',
+                        help="Also write every recorded HTTP call to this JSON file (implies --trace-requests)")
+    return parser
+
+
+def set_phase(name):
+    """
+    Names the phase of the script that the following HTTP calls belong to, including the calls made by other threads
+    :param name: (string) The name of the phase
+    """
+    global _phase
+    _phase = name
+    for listener in list(_phase_listeners):
+        listener(name)
+
+
+def get_phase():
+    """
+    :return: (string) The name of the current phase
+    """
+    return _phase
+
+
+def add_phase_listener(listener):
+    """
+    Calls a function with the name of every phase the script enters from now on
+    :param listener: (Function) The function
+    """
+    _phase_listeners.append(listener)
+
+
+def remove_phase_listener(listener):
+    """
+    Stops calling a function added with add_phase_listener
+    :param listener: (Function) The function
+    """
+    if listener in _phase_listeners:
+        _phase_listeners.remove(listener)
+
+
+def note_retry():
+    """
+    Marks the next HTTP call of the current thread as a retry. Called by ThrottledExecutor before it retries a call.
+    """
+    _local.retrying = True
+
+
+def get_endpoint(url):
+    """
+    Gets the endpoint of a url, without the query string and with ids replaced so that calls to different features
+    or items are grouped together
+    :param url: (string) The url of the request
+    :return: (string) The host and path
+    """
+    parsed = urlparse(url)
+    segments = parsed.path.split("/")
+    for i, segment in enumerate(segments):
+        previous = segments[i - 1].lower() if i > 0 else ""
+        if _ID.match(segment) or (segment.isdigit() and (previous.isdigit() or previous == "attachments")):
+            segments[i] = "{id}"
+    return parsed.netloc + "/".join(segments)
+
+
+def get_operation(url):
+    """
+    Gets the REST operation of a url, e.g. query, applyEdits, addAttachment, solve or geocode
+    :param url: (string) The url of the request
+    :return: (string) The operation
+    """
+    segments = [s for s in urlparse(url).path.split("/") if s]
+    if not segments:
+        return "/"
+    last = segments[-1]
+    if last.isdigit() or last.lower() in _SERVICE_TYPES or _ID.match(last):
+        previous = segments[-2].lower() if len(segments) > 1 else ""
+        return "attachment" if previous == "attachments" else "describe"
+    return _OPERATIONS.get(last.lower(), last)
+
+
+def _get_request_bytes(request):
+    body = request.body
+    length = request.headers.get("Content-Length", None)
+    if length is not None:
+        body_length = int(length)
+    elif isinstance(body, (bytes, str)):
+        body_length = len(body)
+    else:
+        body_length = getattr(body, "len", 0) or 0
+    return len(request.url) + body_length
+
+
+def _get_response_bytes(response, stream):
+    if response is None:
+        return 0
+    # Reading a streamed response here would load a download in memory
+    if stream:
+        return int(response.headers.get("Content-Length", 0) or 0)
+    return len(response.content or b"")
+
+
+class RequestTracer(object):
+    """
+    Records the HTTP calls sent through requests while it is started
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.phases = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._send = None
+        self._started = None
+        self._phase = None
+        self._phase_started = None
+
+    def start(self):
+        """
+        Starts recording
+        :return: (RequestTracer) The tracer
+        """
+        import requests
+        tracer = self
+        send = requests.Session.send
+
+        def traced_send(session, request, **kwargs):
+            retry = getattr(_local, "retrying", False)
+            _local.retrying = False
+            started = time.perf_counter()
+            response = None
+            error = None
+            try:
+                response = send(session, request, **kwargs)
+                return response
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                tracer.record(request, response, time.perf_counter() - started, retry, error, kwargs.get("stream", False))
+
+        self._send = send
+        self._started = time.time()
+        self.enter_phase(_phase)
+        requests.Session.send = traced_send
+        return self
+
+    def stop(self):
+        """
+        Stops recording
+        """
+        import requests
+        if self._send is not None:
+            requests.Session.send = self._send
+            self._send = None
+        self.enter_phase(None)
+
+    def enter_phase(self, name):
+        """
+        Ends the current phase and starts the next one
+        :param name: (string) The name of the next phase, or None when tracing stops
+        """
+        now = time.time()
+        with self._lock:
+            if self._phase is not None:
+                self.phases[self._phase]["wall_time"] += now - self._phase_started
+            self._phase = name
+            self._phase_started = now
+            if name is not None:
+                self.phases.setdefault(name, {"name": name, "wall_time": 0.0})
+
+    def record(self, request, response, elapsed, retry, error, stream):
+        """
+        Records a call
+        :param request: (PreparedRequest) The request that was sent
+        :param response: (Response) The response, or None if the call raised
+        :param elapsed: (float) The number of seconds the call took
+        :param retry: (bool) Whether the call was a retry
+        :param error: (string) The name of the exception the call raised, if any
+        :param stream: (bool) Whether the response was streamed
+        """
+        call = {
+            "time": time.time() - self._started,
+            "phase": _phase,
+            "method": request.method,
+            "endpoint": get_endpoint(request.url),
+            "operation": get_operation(request.url),
+            "status": response.status_code if response is not None else None,
+            "latency_ms": round(elapsed * 1000, 3),
+            "request_bytes": _get_request_bytes(request),
+            "response_bytes": _get_response_bytes(response, stream),
+            "retry": retry,
+            "error": error,
+            "thread": threading.current_thread().name
+        }
+        with self._lock:
+            self.calls.append(call)
+
+    def summarize(self):
+        """
+        Aggregates the calls per phase, operation and endpoint
+        :return: (List<Dict>) The aggregates, in the order the phases started
+        """
+        groups = collections.OrderedDict()
+        phase_order = {name: i for i, name in enumerate(self.phases)}
+        for call in sorted(self.calls, key=lambda c: phase_order.get(c["phase"], len(phase_order))):
+            key = (call["phase"], call["operation"], call["endpoint"])
+            group = groups.setdefault(key, {"phase": key[0], "operation": key[1], "endpoint": key[2], "calls": 0,
+                                            "retries": 0, "errors": 0, "latency_ms": 0.0, "max_latency_ms": 0.0,
+                                            "request_bytes": 0, "response_bytes": 0})
+            group["calls"] += 1
+            group["retries"] += int(call["retry"])
+            group["errors"] += int(bool(call["error"]) or (call["status"] or 0) >= 400)
+            group["latency_ms"] += call["latency_ms"]
+            group["max_latency_ms"] = max(group["max_latency_ms"], call["latency_ms"])
+            group["request_bytes"] += call["request_bytes"]
+            group["response_bytes"] += call["response_bytes"]
+        return list(groups.values())
+
+    def format_summary(self):
+        """
+        Formats the summary as a table, with the total of each phase
+        :return: (string) The table
+        """
+        header = "{:<24} {:<20} {:<70} {:>6} {:>7} {:>6} {:>10} {:>9} {:>9} {:>10} {:>10}".format(
+            "phase", "operation", "endpoint", "calls", "retries", "errors", "total s", "mean ms", "max ms", "sent KB",
+            "recv KB")
+        lines = [header, "-" * len(header)]
+
+        def line(row, phase, operation, endpoint):
+            return "{:<24} {:<20} {:<70} {:>6} {:>7} {:>6} {:>10.2f} {:>9.1f} {:>9.1f} {:>10.1f} {:>10.1f}".format(
+                phase[:24], operation[:20], endpoint[-70:], row["calls"], row["retries"], row["errors"],
+                row["latency_ms"] / 1000, row["latency_ms"] / max(row["calls"], 1), row["max_latency_ms"],
+                row["request_bytes"] / 1024, row["response_bytes"] / 1024)
+
+        totals = collections.OrderedDict()
+        for row in self.summarize():
+            lines.append(line(row, row["phase"], row["operation"], row["endpoint"]))
+            total = totals.setdefault(row["phase"], dict.fromkeys(("calls", "retries", "errors", "latency_ms",
+                                                                   "max_latency_ms", "request_bytes",
+                                                                   "response_bytes"), 0))
+            for key in total:
+                total[key] = max(total[key], row[key]) if key == "max_latency_ms" else total[key] + row[key]
+        lines.append("-" * len(header))
+        for phase, total in totals.items():
+            wall_time = self.phases[phase]["wall_time"] if phase in self.phases else 0
+            lines.append(line(total, phase, "(all)", "wall time {:.2f} s".format(wall_time)))
+        return "\n".join(lines)
+
+    def to_json(self):
+        """
+        :return: (Dict) The phases, the summary and every call
+        """
+        return {"phases": [{"name": p["name"], "wall_time": p["wall_time"]} for p in self.phases.values()],
+                "summary": self.summarize(),
+                "calls": self.calls}
+
+
+def start_tracing():
+    """
+    Starts recording the HTTP calls of the process
+    :return: (RequestTracer) The tracer
+    """
+    global _tracer
+    _tracer = RequestTracer().start()
+    add_phase_listener(_tracer.enter_phase)
+    return _tracer
+
+
+def stop_tracing(json_file=None, out=None):
+    """
+    Stops recording, prints the summary and writes the calls to a JSON file
+    :param json_file: (string) The file to write the calls to, if any
+    :param out: (File) Where to print the summary, defaults to stderr
+    :return: (RequestTracer) The tracer, or None if tracing was not started
+    """
+    global _tracer
+    tracer = _tracer
+    if tracer is None:
+        return None
+    _tracer = None
+    remove_phase_listener(tracer.enter_phase)
+    tracer.stop()
+    print(tracer.format_summary(), file=out or sys.stderr)
+    if json_file:
+        with open(json_file, "w") as f:
+            json.dump(tracer.to_json(), f, indent=2)
+    return tracer
@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+"""
+   Copyright 2020 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.​
+
+   Runs any of the scripts as a command:
+
+       python workforce_scripts.py <command> [arguments of the script]
+
+   Only the script of the command is imported, and the scripts import the ArcGIS API for Python when they start
+   working rather than when they are loaded, so --help and mistyped arguments return right away.
+"""
+
+import argparse
+import importlib
+import sys
+
+# The command, the script that implements it, and what it does
+COMMANDS = [
+    ("benchmark", "benchmarks", "Benchmark the scripts against generated projects and fail on regressions"),
+    ("benchmark-kernels", "benchmarks.kernels", "Time the per-row transformations of the scripts on synthetic rows"),
+    ("check-completion-location", "check_completion_location", "Check that assignments were completed where the worker was"),
+    ("copy-assignments-to-fs", "copy_assignments_to_fs", "Copy assignments to a feature service"),
+    ("create-assignment-types", "create_assignment_types", "Create assignment types from a CSV file"),
+    ("create-assignments-from-csv", "create_assignments_from_csv", "Create assignments from a CSV file"),
+    ("create-joined-view", "create_joined_view", "Create a view joining assignments, workers and assignment types"),
+    ("create-ops-dashboard", "create_ops_dashboard", "Create the default Operations Dashboard of a project"),
+    ("delete-assignment-types", "delete_assignment_types", "Delete all assignment types"),
+    ("delete-assignments", "delete_assignments", "Delete the assignments matching a where clause"),
+    ("export-assignments-to-csv", "export_assignments_to_csv", "Export assignments to a CSV file"),
+    ("generate-project", "local_server.generator", "Generate a synthetic project of any size for the local server"),
+    ("import-dispatchers", "import_dispatchers", "Import dispatchers from a CSV file"),
+    ("import-workers", "import_workers", "Import workers from a CSV file"),
+    ("local-server", "local_server", "Serve a local stand-in for an ArcGIS organization, to run the scripts offline"),
+    ("migrate-assignments", "migrate_assignments", "Migrate assignments from a version 1 to a version 2 project"),
+    ("migrate-to-v2", "migrate_to_v2", "Migrate a version 1 project to a new version 2 project"),
+    ("report-complete-assignments-without-work-orders", "report_complete_assignments_without_work_orders",
+     "Report completed assignments without a matching work order"),
+    ("report-incomplete-assignments-with-work-orders", "report_incomplete_assignments_with_work_orders",
+     "Report incomplete assignments with a completed work order"),
+    ("reset-stale-workers", "reset_stale_workers", "Reset the status of workers that have not been updated recently"),
+]
+
+
+def get_parser():
+    commands = "\n".join("  {:50}{}".format(command, help_text) for command, _, help_text in COMMANDS)
+    parser = argparse.ArgumentParser(prog="workforce_scripts.py",
+                                     description="Runs one of the Workforce scripts",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="commands:\n{}\n\nRun '%(prog)s <command> --help' for the arguments of a "
+                                            "command".format(commands))
+    parser.add_argument('command', choices=[command for command, _, _ in COMMANDS], metavar="command",
+                        help="The script to run")
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help="The arguments of the script")
+    return parser
+
+
+def main(argv=None):
+    """
+    Parses the command, then loads and runs its script
+    :param argv: (List<string>) The command line, defaults to sys.argv
+    :return: (int) The exit code
+    """
+    arguments = get_parser().parse_args(argv)
+    script = importlib.import_module(dict((command, module) for command, module, _ in COMMANDS)[arguments.command])
+    from utils import run
+    parser = script.get_parser()
+    # The scripts pass their description as the first argument of ArgumentParser, which argparse takes as the prog
+    if parser.description is None:
+        parser.description = parser.prog
+    parser.prog = "workforce_scripts.py {}".format(arguments.command)
+    return run(script.main, parser.parse_args(arguments.arguments))
+
+
+if __name__ == "__main__":
+    sys.exit(main())